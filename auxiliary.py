@@ -49,6 +49,9 @@
 # =============================================================================
 # Import necessary modules (Febrl modules first, then Python standard modules)
 
+import array
+import bisect
+import heapq
 import logging
 import os
 import sets
@@ -170,11 +173,13 @@ def check_is_float(variable, value):
 # -----------------------------------------------------------------------------
 
 def check_is_dictionary(variable, value):
-  """Check if the type of the given value is a dictionary, if not raise an
-     exception.
+  """Check if the type of the given value is a dictionary (or a weight vector
+     store, which can be used in place of a weight vector dictionary), if not
+     raise an exception.
   """
 
-  if (not isinstance(value, dict)):
+  if ((not isinstance(value, dict)) and \
+      (not isinstance(value, WeightVectorStore))):
     logging.exception('Value of "%s" is not a dictionary: %s' % \
                       (variable, type(value)))
     raise Exception
@@ -370,3 +375,390 @@ def str_vector(vec, num_digits=4, keep_int=True):
   return vec_str[:-2]+']'
 
 # =============================================================================
+
+WEIGHT_VECTOR_SORT_RUN_SIZE = 100000  # Maximum number of rows of a weight
+                                     # vector store sorted in one run
+
+class WeightVectorStore:
+  """A compact container for weight vectors that can be used in place of a
+     weight vector dictionary (with record identifier tuples as keys and lists
+     of weights as values).
+
+     Record identifiers are interned into integer numbers, the record number
+     pairs are stored in two arrays of 32-bit integers, and all weights in one
+     flat array of 64-bit ('d', default) or 32-bit ('f') floating-point numbers
+     (i.e. a matrix with one row per record pair). This needs a fraction of
+     the memory of a dictionary of tuples and lists.
+
+     The usual dictionary methods are supported (including iteritems(),
+     popitem(), update() and 'in'), so classifiers, measurements and output
+     functions can use a weight vector store without modifications. Weight
+     vectors are returned as new lists, so modifying a returned weight vector
+     does not change the store.
+
+     New record pairs are appended at the end of the arrays. Before a record
+     pair is looked up, or the store is iterated over, the record pairs are
+     sorted (so iteration is in order of record numbers) and duplicate record
+     pairs removed (the last weight vector stored for a record pair is kept).
+     The appended rows are sorted in runs of 'WEIGHT_VECTOR_SORT_RUN_SIZE'
+     rows which are then merged (with the already sorted rows), so apart from
+     the sorted arrays only one row number per record pair is kept.
+  """
+
+  # ---------------------------------------------------------------------------
+
+  def __init__(self, num_weights, weight_type = 'd'):
+    """Constructor, the number of weights in each weight vector has to be
+       given.
+    """
+
+    check_is_integer('num_weights', num_weights)
+    check_is_positive('num_weights', num_weights)
+
+    if (weight_type not in ['d', 'f']):
+      logging.exception('Weight type must be either "d" or "f": "%s"' % \
+                        (str(weight_type)))
+      raise Exception
+
+    self.num_weights = num_weights
+    self.weight_type = weight_type
+
+    self.rec_id_list =     []  # Interned record identifiers
+    self.rec_id_num_dict = {}  # Record identifiers to their numbers
+
+    self.rec_num1 = array.array('i')  # Record number pairs
+    self.rec_num2 = array.array('i')
+    self.weights =  array.array(weight_type)  # All weights, row by row
+
+    self.num_sorted = 0  # Length of the sorted prefix (without duplicates)
+
+  # ---------------------------------------------------------------------------
+
+  def __get_rec_num__(self, rec_id):
+    """Return the number of the given record identifier, and intern it if it
+       is not known yet.
+    """
+
+    rec_num = self.rec_id_num_dict.get(rec_id, None)
+
+    if (rec_num == None):
+      rec_num = len(self.rec_id_list)
+      self.rec_id_list.append(rec_id)
+      self.rec_id_num_dict[rec_id] = rec_num
+
+    return rec_num
+
+  # ---------------------------------------------------------------------------
+
+  def __sort__(self):
+    """Sort the record pairs by their record numbers and remove duplicates, if
+       record pairs have been appended since the last sorting.
+    """
+
+    rec_num1 = self.rec_num1  # Shorthands
+    rec_num2 = self.rec_num2
+    weights =  self.weights
+    n =        self.num_weights
+
+    num_rows =   len(rec_num1)
+    num_sorted = self.num_sorted
+
+    if (num_sorted == num_rows):
+      return  # Nothing to do
+
+    # A record number pair is packed into one 64-bit key
+    #
+    def row_key(i):
+      return (rec_num1[i] << 32) | rec_num2[i]
+
+    # The sorted prefix is the first run, the appended rows are sorted in runs
+    # of which only the row numbers are kept
+    #
+    run_list = [xrange(num_sorted)]
+
+    for run_start in xrange(num_sorted, num_rows, WEIGHT_VECTOR_SORT_RUN_SIZE):
+      run_rows = range(run_start, min(num_rows,
+                                      run_start+WEIGHT_VECTOR_SORT_RUN_SIZE))
+      run_rows.sort(key = row_key)  # Stable sort
+      run_list.append(array.array('i', run_rows))
+      del run_rows
+
+    def run_iter(run_rows):
+      for i in run_rows:
+        yield (row_key(i), i)
+
+    new_rec_num1 = array.array('i')
+    new_rec_num2 = array.array('i')
+    new_weights =  array.array(self.weight_type)
+
+    def append_row(i):
+      new_rec_num1.append(rec_num1[i])
+      new_rec_num2.append(rec_num2[i])
+      new_weights.extend(weights[i*n:(i+1)*n])
+
+    # Of duplicate record pairs the one appended last (with the largest row
+    # number) is merged last and kept
+    #
+    prev_key = None
+    prev_row = None
+
+    for (key, i) in heapq.merge(*[run_iter(run_rows) for run_rows in \
+                                  run_list]):
+      if ((key != prev_key) and (prev_row != None)):
+        append_row(prev_row)
+      prev_key = key
+      prev_row = i
+
+    if (prev_row != None):
+      append_row(prev_row)
+
+    self.rec_num1 =   new_rec_num1
+    self.rec_num2 =   new_rec_num2
+    self.weights =    new_weights
+    self.num_sorted = len(new_rec_num1)
+
+  # ---------------------------------------------------------------------------
+
+  def __find_row__(self, rec_id_tuple, num_rows):
+    """Return the row of the given record identifier tuple within the first
+       'num_rows' (assumed to be sorted) rows, or -1 if it is not stored.
+    """
+
+    rec_num1 = self.rec_id_num_dict.get(rec_id_tuple[0], None)
+    rec_num2 = self.rec_id_num_dict.get(rec_id_tuple[1], None)
+
+    if ((rec_num1 == None) or (rec_num2 == None)):
+      return -1
+
+    # Find range of first record number, then second record number within it
+    #
+    lo = bisect.bisect_left(self.rec_num1, rec_num1, 0, num_rows)
+    hi = bisect.bisect_right(self.rec_num1, rec_num1, lo, num_rows)
+
+    row = bisect.bisect_left(self.rec_num2, rec_num2, lo, hi)
+
+    if ((row < hi) and (self.rec_num2[row] == rec_num2)):
+      return row
+    else:
+      return -1
+
+  # ---------------------------------------------------------------------------
+
+  def __get_row_key__(self, row):
+    """Return the record identifier tuple stored in the given row.
+    """
+
+    return (self.rec_id_list[self.rec_num1[row]],
+            self.rec_id_list[self.rec_num2[row]])
+
+  # ---------------------------------------------------------------------------
+
+  def __get_row_w_vec__(self, row):
+    """Return the weight vector stored in the given row as a list.
+    """
+
+    n = self.num_weights
+
+    return self.weights[row*n:(row+1)*n].tolist()
+
+  # ---------------------------------------------------------------------------
+
+  def __len__(self):
+
+    self.__sort__()
+
+    return len(self.rec_num1)
+
+  # ---------------------------------------------------------------------------
+
+  def __getitem__(self, rec_id_tuple):
+
+    self.__sort__()
+
+    row = self.__find_row__(rec_id_tuple, len(self.rec_num1))
+
+    if (row < 0):
+      raise KeyError(rec_id_tuple)
+
+    return self.__get_row_w_vec__(row)
+
+  # ---------------------------------------------------------------------------
+
+  def __setitem__(self, rec_id_tuple, w_vec):
+
+    if (len(w_vec) != self.num_weights):
+      logging.exception('Weight vector has %d weights, but %d are ' % \
+                        (len(w_vec), self.num_weights) + 'expected')
+      raise Exception
+
+    # Overwrite an existing record pair in the sorted part in place
+    #
+    row = self.__find_row__(rec_id_tuple, self.num_sorted)
+
+    if (row >= 0):
+      n = self.num_weights
+      self.weights[row*n:(row+1)*n] = array.array(self.weight_type, w_vec)
+
+    else:  # Append a new record pair
+      rec_num1 = self.__get_rec_num__(rec_id_tuple[0])
+      rec_num2 = self.__get_rec_num__(rec_id_tuple[1])
+
+      num_rows = len(self.rec_num1)
+
+      # Check if the record pairs are still sorted with the new pair appended
+      #
+      if (self.num_sorted == num_rows):
+        if ((num_rows == 0) or \
+            ((self.rec_num1[-1], self.rec_num2[-1]) < (rec_num1, rec_num2))):
+          self.num_sorted += 1
+
+      self.rec_num1.append(rec_num1)
+      self.rec_num2.append(rec_num2)
+      self.weights.extend(w_vec)
+
+  # ---------------------------------------------------------------------------
+
+  def __delitem__(self, rec_id_tuple):
+
+    self.__sort__()
+
+    row = self.__find_row__(rec_id_tuple, len(self.rec_num1))
+
+    if (row < 0):
+      raise KeyError(rec_id_tuple)
+
+    n = self.num_weights
+
+    del self.rec_num1[row]
+    del self.rec_num2[row]
+    del self.weights[row*n:(row+1)*n]
+    self.num_sorted -= 1
+
+  # ---------------------------------------------------------------------------
+
+  def __contains__(self, rec_id_tuple):
+
+    self.__sort__()
+
+    return (self.__find_row__(rec_id_tuple, len(self.rec_num1)) >= 0)
+
+  def has_key(self, rec_id_tuple):
+
+    return self.__contains__(rec_id_tuple)
+
+  def get(self, rec_id_tuple, default = None):
+
+    self.__sort__()
+
+    row = self.__find_row__(rec_id_tuple, len(self.rec_num1))
+
+    if (row < 0):
+      return default
+    else:
+      return self.__get_row_w_vec__(row)
+
+  # ---------------------------------------------------------------------------
+
+  def __iter__(self):
+
+    return self.iterkeys()
+
+  def iterkeys(self):
+
+    self.__sort__()
+
+    for row in xrange(len(self.rec_num1)):
+      yield self.__get_row_key__(row)
+
+  def itervalues(self):
+
+    self.__sort__()
+
+    for row in xrange(len(self.rec_num1)):
+      yield self.__get_row_w_vec__(row)
+
+  def iteritems(self):
+
+    self.__sort__()
+
+    for row in xrange(len(self.rec_num1)):
+      yield (self.__get_row_key__(row), self.__get_row_w_vec__(row))
+
+  def keys(self):
+
+    return list(self.iterkeys())
+
+  def values(self):
+
+    return list(self.itervalues())
+
+  def items(self):
+
+    return list(self.iteritems())
+
+  # ---------------------------------------------------------------------------
+
+  def popitem(self):
+    """Remove and return the record pair stored last (in sorted order).
+    """
+
+    self.__sort__()
+
+    if (len(self.rec_num1) == 0):
+      raise KeyError('popitem(): weight vector store is empty')
+
+    row = len(self.rec_num1) - 1
+    n =   self.num_weights
+
+    rec_id_tuple = self.__get_row_key__(row)
+    w_vec =        self.__get_row_w_vec__(row)
+
+    del self.rec_num1[row]
+    del self.rec_num2[row]
+    del self.weights[row*n:]
+    self.num_sorted -= 1
+
+    return (rec_id_tuple, w_vec)
+
+  # ---------------------------------------------------------------------------
+
+  def update(self, w_vec_dict):
+
+    for (rec_id_tuple, w_vec) in w_vec_dict.iteritems():
+      self[rec_id_tuple] = w_vec
+
+  def copy(self):
+
+    new_store = WeightVectorStore(self.num_weights, self.weight_type)
+    new_store.update(self)
+
+    return new_store
+
+  # ---------------------------------------------------------------------------
+
+  def __eq__(self, other):
+
+    if (not hasattr(other, 'iteritems')) or (len(self) != len(other)):
+      return False
+
+    for (rec_id_tuple, w_vec) in self.iteritems():
+      if ((rec_id_tuple not in other) or (other[rec_id_tuple] != w_vec)):
+        return False
+
+    return True
+
+  def __ne__(self, other):
+
+    return not self.__eq__(other)
+
+  # ---------------------------------------------------------------------------
+
+  def get_size(self):
+    """Return the approximate number of bytes used by the arrays of the store
+       (not counting the interned record identifiers).
+    """
+
+    return (len(self.rec_num1) + len(self.rec_num2)) * \
+           self.rec_num1.itemsize + len(self.weights)*self.weights.itemsize
+
+# =============================================================================
@@ -0,0 +1,182 @@
+# =============================================================================
+# AUSTRALIAN NATIONAL UNIVERSITY OPEN SOURCE LICENSE (ANUOS LICENSE)
+# VERSION 1.3
+# 
+# The contents of this file are subject to the ANUOS License Version 1.3
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at:
+# 
+#   https://sourceforge.net/projects/febrl/
+# 
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+# 
+# The Original Software is: "benchEditDist.py"
+# 
+# The Initial Developer of the Original Software is:
+#   Dr Peter Christen (Research School of Computer Science, The Australian
+#                      National University)
+# 
+# Copyright (C) 2002 - 2011 the Australian National University and
+# others. All Rights Reserved.
+# 
+# Contributors:
+# 
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public License Version 2 or later (the "GPL"), in
+# which case the provisions of the GPL are applicable instead of those
+# above. The GPL is available at the following URL: http://www.gnu.org/
+# If you wish to allow use of your version of this file only under the
+# terms of the GPL, and not to allow others to use your version of this
+# file under the terms of the ANUOS License, indicate your decision by
+# deleting the provisions above and replace them with the notice and
+# other provisions required by the GPL. If you do not delete the
+# provisions above, a recipient may use your version of this file under
+# the terms of any one of the ANUOS License or the GPL.
+# =============================================================================
+#
+# Freely extensible biomedical record linkage (Febrl) - Version 0.4.2
+#
+# See: http://datamining.anu.edu.au/linkage.html
+#
+# =============================================================================
+
+"""Module to benchmark the bit-parallel edit distance kernels against the
+   dynamic programming code they replace, on the names and addresses of the
+   data sets generated with dsgen.
+
+   Compares the values of each field of every record with the values of the
+   following records in the sorted list of values (similar to a sorted
+   neighbourhood window), once with the bit-parallel kernels and once with
+   the dynamic programming code (by setting stringcmp.BITPAR_MAX_LEN to -1),
+   then reports the times needed and checks that all similarities are the
+   same.
+
+   Usage:  python benchEditDist.py [data set file] [window size]
+
+   where [data set file] is a dsgen CSV file (default:
+   ./data/dedup-dsgen/dataset_A_10000.csv) and [window size] the number of
+   following values each value is compared with (default: 5).
+"""
+
+# =============================================================================
+# Imports go here
+
+import csv
+import logging
+import sys
+import time
+
+import comparison
+import stringcmp
+
+# =============================================================================
+# Various settings
+
+if (len(sys.argv) > 1):
+  data_set_file_name = sys.argv[1]
+else:
+  data_set_file_name = './data/dedup-dsgen/dataset_A_10000.csv'
+
+if (len(sys.argv) > 2):
+  window_size = int(sys.argv[2])
+else:
+  window_size = 5
+
+field_name_list = ['given_name', 'surname', 'address_1', 'suburb']
+
+threshold_list = [None, 0.5, 0.8]
+
+# =============================================================================
+# Define a project logger
+
+my_logger = logging.getLogger()  # New logger at root level
+my_logger.setLevel(logging.WARNING)
+
+# =============================================================================
+
+def get_value_pairs(file_name, field_name):
+  """Load the non-empty values of the given field from a dsgen CSV file and
+     return a list of pairs of each value with the following values in the
+     sorted list of values.
+  """
+
+  csv_file = open(file_name, 'rb')
+  csv_reader = csv.reader(csv_file)
+
+  header_list = [col_name.strip() for col_name in csv_reader.next()]
+  col_index = header_list.index(field_name)
+
+  val_list = []
+  for rec in csv_reader:
+    val = rec[col_index].strip()
+    if (val != ''):
+      val_list.append(val)
+  csv_file.close()
+
+  val_list.sort()
+
+  pair_list = []
+  for i in xrange(len(val_list)):
+    for j in xrange(i+1, min(i+1+window_size, len(val_list))):
+      pair_list.append((val_list[i], val_list[j]))
+
+  return pair_list
+
+# =============================================================================
+
+def time_function(funct, pair_list, bitpar_max_len):
+  """Calculate the similarities of all value pairs with the given function
+     and return the time needed and the list of similarities.
+  """
+
+  stringcmp.BITPAR_MAX_LEN = bitpar_max_len
+
+  start_time = time.time()
+  sim_list = [funct(val1, val2) for (val1, val2) in pair_list]
+  funct_time = time.time() - start_time
+
+  return funct_time, sim_list
+
+# =============================================================================
+
+bitpar_max_len = stringcmp.BITPAR_MAX_LEN
+
+print 'Data set: %s (window size: %d)' % (data_set_file_name, window_size)
+print
+print 'Field       Function              Threshold     Pairs   DP (sec)  ' + \
+      'Bit-par (sec)  Speed-up  Same'
+
+for field_name in field_name_list:
+
+  pair_list = get_value_pairs(data_set_file_name, field_name)
+
+  for threshold in threshold_list:
+
+    funct_list = [('editdist',
+                   lambda s1, s2: stringcmp.editdist(s1, s2, threshold)),
+                  ('mod_editdist',
+                   lambda s1, s2: stringcmp.mod_editdist(s1, s2, threshold))]
+
+    if (threshold != None):  # Field comparators always have a threshold
+      edit_dist = comparison.FieldComparatorEditDist(threshold = threshold)
+      dale_dist = comparison.FieldComparatorDaLeDist(threshold = threshold)
+
+      funct_list += [('FieldCompEditDist', edit_dist.compare),
+                     ('FieldCompDaLeDist', dale_dist.compare)]
+
+    for (funct_name, funct) in funct_list:
+
+      dp_time, dp_sim_list = time_function(funct, pair_list, -1)
+      bp_time, bp_sim_list = time_function(funct, pair_list, bitpar_max_len)
+
+      print '%-10s  %-20s  %9s  %8d  %9.3f  %13.3f  %8.2f  %4s' % \
+            (field_name, funct_name, str(threshold), len(pair_list), dp_time,
+             bp_time, dp_time / max(bp_time, 0.000001),
+             dp_sim_list == bp_sim_list)
+
+stringcmp.BITPAR_MAX_LEN = bitpar_max_len
+
+# =============================================================================
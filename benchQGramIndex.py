@@ -0,0 +1,187 @@
+# =============================================================================
+# AUSTRALIAN NATIONAL UNIVERSITY OPEN SOURCE LICENSE (ANUOS LICENSE)
+# VERSION 1.3
+# 
+# The contents of this file are subject to the ANUOS License Version 1.3
+# (the "License"); you may not use this file except in compliance with
+# the License. You may obtain a copy of the License at:
+# 
+#   https://sourceforge.net/projects/febrl/
+# 
+# Software distributed under the License is distributed on an "AS IS"
+# basis, WITHOUT WARRANTY OF ANY KIND, either express or implied. See
+# the License for the specific language governing rights and limitations
+# under the License.
+# 
+# The Original Software is: "benchQGramIndex.py"
+# 
+# The Initial Developer of the Original Software is:
+#   Dr Peter Christen (Research School of Computer Science, The Australian
+#                      National University)
+# 
+# Copyright (C) 2002 - 2011 the Australian National University and
+# others. All Rights Reserved.
+# 
+# Contributors:
+# 
+# Alternatively, the contents of this file may be used under the terms
+# of the GNU General Public License Version 2 or later (the "GPL"), in
+# which case the provisions of the GPL are applicable instead of those
+# above. The GPL is available at the following URL: http://www.gnu.org/
+# If you wish to allow use of your version of this file only under the
+# terms of the GPL, and not to allow others to use your version of this
+# file under the terms of the ANUOS License, indicate your decision by
+# deleting the provisions above and replace them with the notice and
+# other provisions required by the GPL. If you do not delete the
+# provisions above, a recipient may use your version of this file under
+# the terms of any one of the ANUOS License or the GPL.
+# =============================================================================
+#
+# Freely extensible biomedical record linkage (Febrl) - Version 0.4.2
+#
+# See: http://datamining.anu.edu.au/linkage.html
+#
+# =============================================================================
+
+"""Module to benchmark the compaction of q-gram indices (the QGramIndex and
+   the BigMatchIndex and DedupIndex with the 'qgram' block method) for
+   increasing block sizes.
+
+   Generates two memory based data sets where all records have surname values
+   that are small variations of one surname, so that the q-gram blocks contain
+   a large fraction of all records, and then reports the times needed to
+   build, compact and run the indices.
+
+   Usage:  python benchQGramIndex.py [block sizes]
+
+   where [block sizes] is an optional comma separated list of numbers of
+   records per data set (default: 250,500,1000,2000).
+"""
+
+# =============================================================================
+# Imports go here
+
+import logging
+import random
+import sys
+import time
+
+import comparison
+import dataset
+import indexing
+
+# =============================================================================
+# Various settings
+
+if (len(sys.argv) > 1):
+  block_size_list = [int(block_size) for block_size in sys.argv[1].split(',')]
+else:
+  block_size_list = [250, 500, 1000, 2000]
+
+base_surname = 'christensen'
+
+random.seed(42)
+
+# =============================================================================
+# Define a project logger
+
+my_logger = logging.getLogger()  # New logger at root level
+my_logger.setLevel(logging.WARNING)
+
+# =============================================================================
+
+def gen_data_set(ds_name, num_recs):
+  """Generate a memory based data set with the given number of records, with
+     surnames that are variations of the base surname (one character changed).
+  """
+
+  mem_ds = dataset.DataSetMemory(description = ds_name,
+                                 access_mode = 'readwrite',
+                                 field_list = [('rec_id',''),('surname','')],
+                                 rec_ident = 'rec_id')
+
+  rec_dict = {}
+
+  for rec_num in xrange(num_recs):
+    pos = random.randint(0, len(base_surname)-1)
+    surname = base_surname[:pos] + random.choice('abcdefghijklmnopqrstuvwxyz')\
+              + base_surname[pos+1:]
+
+    rec_ident = '%s-%d' % (ds_name, rec_num)
+    rec_dict[rec_ident] = [rec_ident, surname]
+
+  mem_ds.write(rec_dict)
+
+  return mem_ds
+
+# =============================================================================
+
+index_def = [[['surname','surname',False,False,None,[]]]]
+
+print 'Block size  Index                 Build (sec)  Compact (sec)  ' + \
+      'Run (sec)  Record pairs'
+
+for block_size in block_size_list:
+
+  dataset1 = gen_data_set('A', block_size)
+  dataset2 = gen_data_set('B', block_size)
+
+  for (ds2, link_type) in [(dataset2, 'link'), (dataset1, 'dedup')]:
+
+    surname_exact = comparison.FieldComparatorExactString(desc = \
+                                                          'surname_exact')
+    rec_comp = comparison.RecordComparator(dataset1, ds2,
+                                           [(surname_exact, 'surname',
+                                             'surname')])
+
+    index_list = [('QGramIndex',
+                   indexing.QGramIndex(desc = 'q-gram index',
+                                       dataset1 = dataset1,
+                                       dataset2 = ds2,
+                                       rec_comparator = rec_comp,
+                                       progress = None,
+                                       index_def = index_def,
+                                       q = 2,
+                                       padded = True,
+                                       threshold = 0.8))]
+
+    if (link_type == 'link'):
+      index_list.append(('BigMatchIndex',
+                         indexing.BigMatchIndex(desc = 'BigMatch index',
+                                                dataset1 = dataset1,
+                                                dataset2 = ds2,
+                                                rec_comparator = rec_comp,
+                                                progress = None,
+                                                index_def = index_def,
+                                                block_method = ('qgram', 2,
+                                                                True, 0.8))))
+    else:
+      index_list.append(('DedupIndex',
+                         indexing.DedupIndex(desc = 'Dedup index',
+                                             dataset1 = dataset1,
+                                             dataset2 = ds2,
+                                             rec_comparator = rec_comp,
+                                             progress = None,
+                                             index_def = index_def,
+                                             block_method = ('qgram', 2,
+                                                             True, 0.8))))
+
+    for (index_name, index) in index_list:
+
+      start_time = time.time()
+      index.build()
+      build_time = time.time() - start_time
+
+      start_time = time.time()
+      index.compact()
+      compact_time = time.time() - start_time
+
+      start_time = time.time()
+      [field_names_list, w_vec_dict] = index.run()
+      run_time = time.time() - start_time
+
+      print '%10d  %-20s  %11.3f  %13.3f  %9.3f  %12d' % \
+            (block_size, '%s (%s)' % (index_name, link_type), build_time,
+             compact_time, run_time, len(w_vec_dict))
+
+# =============================================================================
@@ -250,6 +250,12 @@ class Classifier:
     """Method to classify the given weight vector dictionary using the trained
        classifier.
 
+       Instead of a weight vector dictionary an iterator can be given that
+       yields tuples (record identifier 1, record identifier 2, weight vector),
+       such as the one returned by the iter_run() method of an index. In this
+       case the weight vectors are classified one at a time and never all kept
+       in memory.
+
        Will return three sets with record identifier pairs:
        1) match set
        2) non-match set
@@ -265,6 +271,39 @@ class Classifier:
 
   # ---------------------------------------------------------------------------
 
+  def __iter_w_vec__(self, w_vec_data):
+    """Return an iterator over (record identifier tuple, weight vector) pairs
+       for the given weight vectors, which can either be a weight vector
+       dictionary or an iterator that yields tuples (record identifier 1,
+       record identifier 2, weight vector).
+    """
+
+    if (hasattr(w_vec_data, 'iteritems')):  # A weight vector dictionary
+      return w_vec_data.iteritems()
+
+    elif (hasattr(w_vec_data, '__iter__')):  # Stream of weight vectors
+      return (((rec_id1, rec_id2), w_vec) for (rec_id1, rec_id2, w_vec) \
+              in w_vec_data)
+
+    else:
+      logging.exception('Weight vectors are neither a dictionary nor an ' + \
+                        'iterator: %s' % (type(w_vec_data)))
+      raise Exception
+
+  # ---------------------------------------------------------------------------
+
+  def __num_w_vec_str__(self, w_vec_data):
+    """Return the number of the given weight vectors as a string for logging
+       (or 'streamed' if they are given as an iterator).
+    """
+
+    if (hasattr(w_vec_data, '__len__')):
+      return '%d' % (len(w_vec_data))
+    else:
+      return 'streamed'
+
+  # ---------------------------------------------------------------------------
+
   def log(self, instance_var_list = None):
     """Write a log message with the basic classifier instance variables plus
        the instance variable provided in the given input list (assumed to
@@ -477,17 +516,17 @@ class FellegiSunter(Classifier):
        2) non-match set, and 3) possible match set
     """
 
-    auxiliary.check_is_dictionary('w_vec_dict', w_vec_dict)
+    w_vec_iter = self.__iter_w_vec__(w_vec_dict)
 
     logging.info('')
-    logging.info('Classify %d weight vectors using Fellegi and Sunter ' % \
-                 (len(w_vec_dict))+'classifier')
+    logging.info('Classify %s weight vectors using Fellegi and Sunter ' % \
+                 (self.__num_w_vec_str__(w_vec_dict))+'classifier')
 
     match_set =      set()
     non_match_set =  set()
     poss_match_set = set()
 
-    for (rec_id_tuple, w_vec) in w_vec_dict.iteritems():
+    for (rec_id_tuple, w_vec) in w_vec_iter:
       w_sum = sum(w_vec)
 
       if (w_sum > self.upper_threshold):
@@ -499,11 +538,13 @@ class FellegiSunter(Classifier):
       else:
         poss_match_set.add(rec_id_tuple)
 
-    assert (len(match_set) + len(non_match_set) + len(poss_match_set)) == \
-           len(w_vec_dict)
+    num_w_vec = len(match_set) + len(non_match_set) + len(poss_match_set)
+
+    if (hasattr(w_vec_dict, '__len__')):
+      assert num_w_vec == len(w_vec_dict)
 
     logging.info('Classified %d weight vectors: %d as matches, %d as ' % \
-                 (len(w_vec_dict), len(match_set), len(non_match_set)) + \
+                 (num_w_vec, len(match_set), len(non_match_set)) + \
                  'non-matches, and %d as possible matches' % \
                  (len(poss_match_set)))
 
@@ -997,23 +1038,19 @@ class OptimalThreshold(Classifier):
        weight vectors as either matches or non-matches.
     """
 
-    auxiliary.check_is_dictionary('w_vec_dict', w_vec_dict)
+    w_vec_iter = self.__iter_w_vec__(w_vec_dict)
 
-    # Get a random vector dictionary element to get dimensionality of vectors
-    #
-    (rec_id_tuple, w_vec) = w_vec_dict.popitem()
-    v_dim = len(w_vec)
-    w_vec_dict[rec_id_tuple] = w_vec  # Put back in
+    v_dim = len(self.opt_threshold_list)  # One threshold per dimension
 
     logging.info('')
-    logging.info('Classify %d weight vectors using optimal threshold ' % \
-                 (len(w_vec_dict))+'classifier')
+    logging.info('Classify %s weight vectors using optimal threshold ' % \
+                 (self.__num_w_vec_str__(w_vec_dict))+'classifier')
 
     match_set =      set()
     non_match_set =  set()
     poss_match_set = set()
 
-    for (rec_id_tuple, w_vec) in w_vec_dict.iteritems():
+    for (rec_id_tuple, w_vec) in w_vec_iter:
 
       w_sum = sum(w_vec)
 
@@ -1030,10 +1067,13 @@ class OptimalThreshold(Classifier):
       else:
         non_match_set.add(rec_id_tuple)
 
-    assert (len(match_set) + len(non_match_set)) == len(w_vec_dict)
+    num_w_vec = len(match_set) + len(non_match_set) + len(poss_match_set)
+
+    if (hasattr(w_vec_dict, '__len__')):
+      assert num_w_vec == len(w_vec_dict)
 
     logging.info('Classified %d weight vectors: %d as matches and %d as ' % \
-                 (len(w_vec_dict), len(match_set), len(non_match_set)) + \
+                 (num_w_vec, len(match_set), len(non_match_set)) + \
                  'non-matches')
 
     return match_set, non_match_set, poss_match_set
@@ -1569,17 +1609,17 @@ class KMeans(Classifier):
        set, otherwise the possible match set will be empty.
     """
 
-    auxiliary.check_is_dictionary('w_vec_dict', w_vec_dict)
+    w_vec_iter = self.__iter_w_vec__(w_vec_dict)
 
     logging.info('')
-    logging.info('Classify %d weight vectors using K-means classifier' % \
-                 (len(w_vec_dict)))
+    logging.info('Classify %s weight vectors using K-means classifier' % \
+                 (self.__num_w_vec_str__(w_vec_dict)))
 
     match_set =      set()
     non_match_set =  set()
     poss_match_set = set()
 
-    for (rec_id_tuple, w_vec) in w_vec_dict.iteritems():
+    for (rec_id_tuple, w_vec) in w_vec_iter:
 
       m_dist =  self.dist_measure(w_vec, self.m_centroid)
       nm_dist = self.dist_measure(w_vec, self.nm_centroid)
@@ -1600,11 +1640,13 @@ class KMeans(Classifier):
         else:
           non_match_set.add(rec_id_tuple)
 
-    assert (len(match_set) + len(non_match_set) + len(poss_match_set)) == \
-            len(w_vec_dict)
+    num_w_vec = len(match_set) + len(non_match_set) + len(poss_match_set)
+
+    if (hasattr(w_vec_dict, '__len__')):
+      assert num_w_vec == len(w_vec_dict)
 
     logging.info('Classified %d weight vectors: %d as matches, %d as ' % \
-                 (len(w_vec_dict), len(match_set), len(non_match_set)) + \
+                 (num_w_vec, len(match_set), len(non_match_set)) + \
                  'non-matches, and %d as possible matches' % \
                  (len(poss_match_set)))
 
@@ -2101,17 +2143,17 @@ class FarthestFirst(Classifier):
        set, otherwise the possible match set will be empty.
     """
 
-    auxiliary.check_is_dictionary('w_vec_dict', w_vec_dict)
+    w_vec_iter = self.__iter_w_vec__(w_vec_dict)
 
     logging.info('')
-    logging.info('Classify %d weight vectors using farthest first ' % \
-                 (len(w_vec_dict))+'classifier')
+    logging.info('Classify %s weight vectors using farthest first ' % \
+                 (self.__num_w_vec_str__(w_vec_dict))+'classifier')
 
     match_set =      set()
     non_match_set =  set()
     poss_match_set = set()
 
-    for (rec_id_tuple, w_vec) in w_vec_dict.iteritems():
+    for (rec_id_tuple, w_vec) in w_vec_iter:
 
       m_dist =  self.dist_measure(w_vec, self.m_centroid)
       nm_dist = self.dist_measure(w_vec, self.nm_centroid)
@@ -2132,11 +2174,13 @@ class FarthestFirst(Classifier):
         else:
           non_match_set.add(rec_id_tuple)
 
-    assert (len(match_set) + len(non_match_set) + len(poss_match_set)) == \
-            len(w_vec_dict)
+    num_w_vec = len(match_set) + len(non_match_set) + len(poss_match_set)
+
+    if (hasattr(w_vec_dict, '__len__')):
+      assert num_w_vec == len(w_vec_dict)
 
     logging.info('Classified %d weight vectors: %d as matches, %d as ' % \
-                 (len(w_vec_dict), len(match_set), len(non_match_set)) + \
+                 (num_w_vec, len(match_set), len(non_match_set)) + \
                  'non-matches, and %d as possible matches' % \
                  (len(poss_match_set)))
 
@@ -2578,13 +2622,13 @@ class SuppVecMachine(Classifier):
 
     svm_version = self.svm_version  # Shortcut
 
-    auxiliary.check_is_dictionary('w_vec_dict', w_vec_dict)
+    w_vec_iter = self.__iter_w_vec__(w_vec_dict)
 
     match_set =      set()
     non_match_set =  set()
     poss_match_set = set()
 
-    for (rec_id_tuple, w_vec) in w_vec_dict.iteritems():
+    for (rec_id_tuple, w_vec) in w_vec_iter:
 
       if (svm_version == 'old'):
         if (self.svm_model.predict(w_vec) == 1.0):  # Match prediction
@@ -2600,11 +2644,13 @@ class SuppVecMachine(Classifier):
         else:  # Non-match prediction
           non_match_set.add(rec_id_tuple)
 
-    assert (len(match_set) + len(non_match_set) + len(poss_match_set)) == \
-            len(w_vec_dict)
+    num_w_vec = len(match_set) + len(non_match_set) + len(poss_match_set)
+
+    if (hasattr(w_vec_dict, '__len__')):
+      assert num_w_vec == len(w_vec_dict)
 
     logging.info('Classified %d weight vectors: %d as matches, %d as ' % \
-                 (len(w_vec_dict), len(match_set), len(non_match_set)) + \
+                 (num_w_vec, len(match_set), len(non_match_set)) + \
                  'non-matches, and %d as possible matches' % \
                  (len(poss_match_set)))
 
@@ -4018,7 +4064,7 @@ class TwoStep(Classifier):
        weight vectors as either matches or non-matches.
     """
 
-    auxiliary.check_is_dictionary('w_vec_dict', w_vec_dict)
+    w_vec_iter = self.__iter_w_vec__(w_vec_dict)
 
     match_set =      set()
     non_match_set =  set()
@@ -4030,7 +4076,7 @@ class TwoStep(Classifier):
         logging.warn('SVM has not been trained, classification not possible')
         return set(), set(), set()
 
-      for (rec_id_tuple, w_vec) in w_vec_dict.iteritems():
+      for (rec_id_tuple, w_vec) in w_vec_iter:
 
         if (self.svm_version == 'old'):
           if (self.svm_model.predict(w_vec) == 1.0):  # Match prediction
@@ -4055,7 +4101,7 @@ class TwoStep(Classifier):
 
       dist_meas = self.s2_classifier[1]
 
-      for (rec_id_tuple, w_vec) in w_vec_dict.iteritems():
+      for (rec_id_tuple, w_vec) in w_vec_iter:
 
         m_dist =  dist_meas(w_vec, self.m_centroid)
         nm_dist = dist_meas(w_vec, self.nm_centroid)
@@ -4078,7 +4124,7 @@ class TwoStep(Classifier):
       dist_meas = self.s2_classifier[1]
       k =         self.s2_classifier[2]
 
-      for (rec_id_tuple, w_vec) in w_vec_dict.iteritems():
+      for (rec_id_tuple, w_vec) in w_vec_iter:
 
         this_w_vec = tuple(w_vec)  # Tuple can be used as dictionary key
 
@@ -4130,11 +4176,13 @@ class TwoStep(Classifier):
                         (str(self.s2_classifier)))
       raise Exception
 
-    assert (len(match_set) + len(non_match_set) + len(poss_match_set)) == \
-            len(w_vec_dict)
+    num_w_vec = len(match_set) + len(non_match_set) + len(poss_match_set)
+
+    if (hasattr(w_vec_dict, '__len__')):
+      assert num_w_vec == len(w_vec_dict)
 
     logging.info('Classified %d weight vectors: %d as matches, %d as ' % \
-                 (len(w_vec_dict), len(match_set), len(non_match_set)) + \
+                 (num_w_vec, len(match_set), len(non_match_set)) + \
                  'non-matches, and %d as possible matches' % \
                  (len(poss_match_set)))
 
@@ -4726,13 +4774,13 @@ class TAILOR(Classifier):
 
     svm_version = self.svm_version  # Shortcut
 
-    auxiliary.check_is_dictionary('w_vec_dict', w_vec_dict)
+    w_vec_iter = self.__iter_w_vec__(w_vec_dict)
 
     match_set =      set()
     non_match_set =  set()
     poss_match_set = set()
 
-    for (rec_id_tuple, w_vec) in w_vec_dict.iteritems():
+    for (rec_id_tuple, w_vec) in w_vec_iter:
 
       if (svm_version == 'old'):
         if (self.svm_model.predict(w_vec) == 1.0):  # Match prediction
@@ -4748,11 +4796,13 @@ class TAILOR(Classifier):
         else:  # Non-match prediction
           non_match_set.add(rec_id_tuple)
 
-    assert (len(match_set) + len(non_match_set) + len(poss_match_set)) == \
-            len(w_vec_dict)
+    num_w_vec = len(match_set) + len(non_match_set) + len(poss_match_set)
+
+    if (hasattr(w_vec_dict, '__len__')):
+      assert num_w_vec == len(w_vec_dict)
 
     logging.info('Classified %d weight vectors: %d as matches, %d as ' % \
-                 (len(w_vec_dict), len(match_set), len(non_match_set)) + \
+                 (num_w_vec, len(match_set), len(non_match_set)) + \
                  'non-matches, and %d as possible matches' % \
                  (len(poss_match_set)))
 
@@ -49,7 +49,6 @@
    used for the linkage process.
 
    TODO:
-   - improve cache: how to remove oldest count-1 pair efficiently?
    - do caching timing test -> comparisonTiming.py module
    - improve value frequency based weight calculations
 
@@ -66,7 +65,9 @@
 # =============================================================================
 # Import necessary modules (Python standard modules first, then Febrl modules)
 
+import array
 import bz2
+import collections
 import datetime
 import difflib
 import logging
@@ -77,6 +78,260 @@ import zlib
 import auxiliary
 import encode
 import mymath
+import stringcmp
+
+# =============================================================================
+
+class CachePolicy:
+  """Base class for the eviction policies of field comparator caches.
+
+     A cache policy keeps track of the keys stored in a field comparator cache
+     (a dictionary), and decides which key to evict once the cache is full. The
+     cache values themselves are stored in the field comparator cache only. All
+     operations take constant time.
+
+     The policy is bound to a cache dictionary ('cache_dict'), if the field
+     comparator cache is replaced by a new dictionary the policy has to be
+     reset with the new dictionary.
+  """
+
+  # ---------------------------------------------------------------------------
+
+  def __init__(self, max_size):
+    """Constructor, the maximum number of keys in the cache has to be given.
+    """
+
+    auxiliary.check_is_integer('max_size', max_size)
+    auxiliary.check_is_positive('max_size', max_size)
+
+    self.max_size =   max_size
+    self.cache_dict = None
+
+    self.clear()
+
+  # ---------------------------------------------------------------------------
+
+  def reset(self, cache_dict):
+    """Bind the policy to the given cache dictionary and register all keys in
+       it. Returns a list with the keys that need to be evicted from the cache
+       dictionary (if it contains more than 'max_size' keys).
+    """
+
+    self.clear()
+    self.cache_dict = cache_dict
+
+    evict_key_list = []
+
+    for key in cache_dict:
+      evict_key = self.insert(key)
+      if (evict_key != None):
+        evict_key_list.append(evict_key)
+
+    return evict_key_list
+
+  # ---------------------------------------------------------------------------
+
+  def clear(self):
+    """Remove all keys from the policy. See implementations in derived classes.
+    """
+
+    logging.exception('Override abstract method in derived class')
+    raise Exception
+
+  # ---------------------------------------------------------------------------
+
+  def access(self, key):
+    """Record a cache hit for the given key. See implementations in derived
+       classes.
+    """
+
+    logging.exception('Override abstract method in derived class')
+    raise Exception
+
+  # ---------------------------------------------------------------------------
+
+  def insert(self, key):
+    """Register a new key (not in the cache yet) and return the key that has
+       to be evicted from the cache, or None if the cache is not full. See
+       implementations in derived classes.
+    """
+
+    logging.exception('Override abstract method in derived class')
+    raise Exception
+
+# =============================================================================
+
+class CachePolicyLRU(CachePolicy):
+  """Least recently used (LRU) eviction: The key that has not been accessed
+     for the longest time is evicted.
+  """
+
+  # ---------------------------------------------------------------------------
+
+  def clear(self):
+    """Remove all keys from the policy.
+    """
+
+    self.key_dict = collections.OrderedDict()  # Oldest key first
+
+  # ---------------------------------------------------------------------------
+
+  def access(self, key):
+    """Record a cache hit for the given key.
+    """
+
+    key_dict = self.key_dict
+    del key_dict[key]
+    key_dict[key] = None  # Move to the end (most recently used)
+
+  # ---------------------------------------------------------------------------
+
+  def insert(self, key):
+    """Register a new key and return the key to be evicted (or None).
+    """
+
+    key_dict = self.key_dict
+
+    if (len(key_dict) >= self.max_size):
+      evict_key = key_dict.popitem(last=False)[0]
+    else:
+      evict_key = None
+
+    key_dict[key] = None
+    return evict_key
+
+# =============================================================================
+
+class CachePolicyLFU(CachePolicy):
+  """Least frequently used (LFU) eviction: The key with the smallest number of
+     accesses is evicted (if several keys have the same number of accesses the
+     oldest of them is evicted).
+
+     Keys are kept in one ordered dictionary per access count, so the key to be
+     evicted can be found in constant time.
+  """
+
+  # ---------------------------------------------------------------------------
+
+  def clear(self):
+    """Remove all keys from the policy.
+    """
+
+    self.key_count_dict = {}  # Access counts of keys
+    self.count_key_dict = {}  # Ordered dictionaries with keys for each count
+    self.min_count =      0
+
+  # ---------------------------------------------------------------------------
+
+  def access(self, key):
+    """Record a cache hit for the given key.
+    """
+
+    count = self.key_count_dict[key]
+    count_keys = self.count_key_dict[count]
+    del count_keys[key]
+
+    if (len(count_keys) == 0):
+      del self.count_key_dict[count]
+      if (self.min_count == count):
+        self.min_count = count+1
+
+    self.key_count_dict[key] = count+1
+
+    if (count+1 not in self.count_key_dict):
+      self.count_key_dict[count+1] = collections.OrderedDict()
+    self.count_key_dict[count+1][key] = None
+
+  # ---------------------------------------------------------------------------
+
+  def insert(self, key):
+    """Register a new key and return the key to be evicted (or None).
+    """
+
+    evict_key = None
+
+    if (len(self.key_count_dict) >= self.max_size):
+      count_keys = self.count_key_dict[self.min_count]
+      evict_key = count_keys.popitem(last=False)[0]
+      if (len(count_keys) == 0):
+        del self.count_key_dict[self.min_count]
+      del self.key_count_dict[evict_key]
+
+    self.key_count_dict[key] = 1
+    if (1 not in self.count_key_dict):
+      self.count_key_dict[1] = collections.OrderedDict()
+    self.count_key_dict[1][key] = None
+    self.min_count = 1
+
+    return evict_key
+
+# =============================================================================
+
+class CachePolicy2Q(CachePolicy):
+  """2Q eviction (T. Johnson and D. Shasha, VLDB 1994): New keys are put into
+     a first-in-first-out queue ('in queue', a quarter of the cache size). Keys
+     evicted from it are remembered (without their values) in a ghost queue of
+     half the cache size. Keys that are inserted again while in the ghost queue
+     are put into the main LRU queue. This way keys that are only used once do
+     not push frequently used keys out of the cache.
+  """
+
+  # ---------------------------------------------------------------------------
+
+  def clear(self):
+    """Remove all keys from the policy.
+    """
+
+    self.in_size =   max(1, self.max_size / 4)
+    self.out_size =  max(1, self.max_size / 2)
+
+    self.in_dict =   collections.OrderedDict()  # FIFO of new keys
+    self.out_dict =  collections.OrderedDict()  # FIFO of evicted keys (ghosts)
+    self.main_dict = collections.OrderedDict()  # LRU of frequent keys
+
+  # ---------------------------------------------------------------------------
+
+  def access(self, key):
+    """Record a cache hit for the given key.
+    """
+
+    main_dict = self.main_dict
+
+    if (key in main_dict):  # Keys in the in queue are not moved
+      del main_dict[key]
+      main_dict[key] = None
+
+  # ---------------------------------------------------------------------------
+
+  def insert(self, key):
+    """Register a new key and return the key to be evicted (or None).
+    """
+
+    evict_key = None
+
+    if (len(self.in_dict) + len(self.main_dict) >= self.max_size):
+
+      if ((len(self.in_dict) > self.in_size) or (len(self.main_dict) == 0)):
+        evict_key = self.in_dict.popitem(last=False)[0]
+        self.out_dict[evict_key] = None
+        if (len(self.out_dict) > self.out_size):
+          self.out_dict.popitem(last=False)
+      else:
+        evict_key = self.main_dict.popitem(last=False)[0]
+
+    if (key in self.out_dict):  # Seen recently, so put into main queue
+      del self.out_dict[key]
+      self.main_dict[key] = None
+    else:
+      self.in_dict[key] = None
+
+    return evict_key
+
+# =============================================================================
+
+CACHE_POLICY_DICT = {'lru':CachePolicyLRU,  # Cache policies that can be used
+                     'lfu':CachePolicyLFU,  # for field comparator caches
+                     '2q': CachePolicy2Q}
 
 # =============================================================================
 
@@ -114,6 +369,7 @@ class RecordComparator:
 
     self.field_comparator_list = field_comparator_list
     self.field_comparison_list = []  # Only compare methods and field columns
+    self.field_batch_comparison_list = []  # Same with batch compare methods
 
     # Extract field names from the two data set field name lists
     #
@@ -145,9 +401,16 @@ class RecordComparator:
       field_tuple = (field_comp.compare, field_index1, field_index2)
 
       self.field_comparison_list.append(field_tuple)
+      self.field_batch_comparison_list.append((field_comp.compare_batch,
+                                               field_index1, field_index2))
 
     assert len(self.field_comparison_list) == len(self.field_comparator_list)
 
+    # For each field comparator the number of value pairs given to and the
+    # number of distinct value pairs compared by compare_batch()
+    #
+    self.batch_stats = [[0, 0] for i in range(len(self.field_comparison_list))]
+
     # A log message - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
     #
     logging.info('')
@@ -202,11 +465,249 @@ class RecordComparator:
 
   # ---------------------------------------------------------------------------
 
+  def compare_batch(self, rec_pairs):
+    """Compare a list of record pairs, each given as a tuple (rec1, rec2), and
+       return a list with one weight vector per record pair (in the same order
+       as the record pairs).
+
+       The result is the same as calling compare() for each record pair, but
+       the field values are compared column-wise, i.e. each field comparator
+       is called only once for all record pairs (using its compare_batch()
+       method).
+
+       For each field the record pairs are grouped by their distinct pairs of
+       values (such as the same surnames or suburbs), so each distinct values
+       pair is only given once to the field comparator and its weight is then
+       copied to all record pairs with these values. The number of value pairs
+       and distinct value pairs are counted in 'batch_stats' (see
+       get_batch_stats()).
+    """
+
+    auxiliary.check_is_list('rec_pairs', rec_pairs)
+
+    if (self.field_batch_comparison_list == []):
+      return [[] for rec_pair in rec_pairs]
+
+    weight_column_list = []  # One column of weights per field comparator
+
+    num_rec_pairs = len(rec_pairs)
+
+    for j in range(len(self.field_batch_comparison_list)):
+
+      (batch_comp_method, field_index1, field_index2) = \
+                                           self.field_batch_comparison_list[j]
+
+      val_pair_dict = {}  # Distinct values pairs and their position in the
+                          # lists of values to be compared
+      val_list1 =     []
+      val_list2 =     []
+      val_pair_pos_list = []  # Position of the values pair of each record pair
+
+      for (rec1, rec2) in rec_pairs:
+
+        if (field_index1 >= len(rec1)):
+          val1 = ''
+        else:
+          val1 = rec1[field_index1].lower()
+
+        if (field_index2 >= len(rec2)):
+          val2 = ''
+        else:
+          val2 = rec2[field_index2].lower()
+
+        val_pair_pos = val_pair_dict.get((val1, val2))
+
+        if (val_pair_pos == None):  # A new distinct values pair
+          val_pair_pos = len(val_list1)
+          val_pair_dict[(val1, val2)] = val_pair_pos
+          val_list1.append(val1)
+          val_list2.append(val2)
+
+        val_pair_pos_list.append(val_pair_pos)
+
+      distinct_weights = batch_comp_method(val_list1, val_list2)
+
+      weight_column_list.append([distinct_weights[val_pair_pos] for \
+                                 val_pair_pos in val_pair_pos_list])
+
+      self.batch_stats[j][0] += num_rec_pairs
+      self.batch_stats[j][1] += len(val_list1)
+
+    return map(list, zip(*weight_column_list))  # Columns into weight vectors
+
+  # ---------------------------------------------------------------------------
+
+  def get_batch_stats(self):
+    """Log for each field comparator the number of values pairs given to the
+       compare_batch() method (since the record comparator was initialised),
+       the number of distinct values pairs that were actually compared, and
+       the resulting reduction factor.
+
+       Returns a list with one tuple (number of values pairs, number of
+       distinct values pairs) per field comparator.
+    """
+
+    logging.info('Batch comparison statistics for record comparator "%s"' % \
+                 (self.description))
+
+    batch_stats_list = []
+
+    for j in range(len(self.field_comparator_list)):
+      field_comp = self.field_comparator_list[j][0]
+      (num_val_pairs, num_distinct_val_pairs) = self.batch_stats[j]
+
+      if (num_distinct_val_pairs > 0):
+        reduction = float(num_val_pairs) / num_distinct_val_pairs
+      else:
+        reduction = 1.0
+
+      logging.info('  Field comparator "%s": %d values pairs, %d distinct ' % \
+                   (field_comp.description, num_val_pairs,
+                    num_distinct_val_pairs) + '(reduction factor %.2f)' % \
+                   (reduction))
+
+      batch_stats_list.append((num_val_pairs, num_distinct_val_pairs))
+
+    return batch_stats_list
+
+  # ---------------------------------------------------------------------------
+
+  def get_pruned_stats(self):
+    """Log for each approximate string field comparator the number of values
+       pairs that were not compared because an upper bound of their similarity
+       was below the comparator's threshold (see FieldComparatorApproxString).
+
+       Returns a list with the number of pruned values pairs for each field
+       comparator (None for field comparators that do not prune values pairs).
+    """
+
+    logging.info('Pruned values pairs for record comparator "%s"' % \
+                 (self.description))
+
+    pruned_stats_list = []
+
+    for (field_comp, field_name1, field_name2) in self.field_comparator_list:
+
+      if (isinstance(field_comp, FieldComparatorApproxString)):
+        logging.info('  Field comparator "%s": %d values pairs pruned ' % \
+                     (field_comp.description, field_comp.num_pruned) + \
+                     '(threshold %.2f)' % (field_comp.threshold))
+        pruned_stats_list.append(field_comp.num_pruned)
+      else:
+        pruned_stats_list.append(None)
+
+    return pruned_stats_list
+
+  # ---------------------------------------------------------------------------
+
+  def get_counters(self):
+    """Return a list with the counters of the record comparator and its field
+       comparators, one list per field comparator made of the number of values
+       pairs given to compare_batch(), the number of distinct values pairs
+       compared, the number of pruned values pairs (0 if the field comparator
+       does not prune), and the numbers of cache hits, misses, evictions and
+       comparisons not cached.
+
+       Used to collect the counters of worker processes, which only update
+       their own copies of the comparators (see add_counters()).
+    """
+
+    counter_list = []
+
+    for j in range(len(self.field_comparator_list)):
+      field_comp = self.field_comparator_list[j][0]
+
+      counter_list.append(self.batch_stats[j] + \
+                          [getattr(field_comp, 'num_pruned', 0),
+                           field_comp.cache_num_hits,
+                           field_comp.cache_num_misses,
+                           field_comp.cache_num_evictions,
+                           field_comp.cache_num_not_cached])
+
+    return counter_list
+
+  # ---------------------------------------------------------------------------
+
+  def add_counters(self, counter_list):
+    """Add the given counters (as returned by get_counters(), for example the
+       differences of the counters of a worker process) to the counters of the
+       record comparator and its field comparators.
+    """
+
+    field_comp_id_set = set()  # Add counters of a field comparator used for
+                               # several fields only once
+
+    for j in range(len(self.field_comparator_list)):
+      field_comp = self.field_comparator_list[j][0]
+      counters =   counter_list[j]
+
+      self.batch_stats[j][0] += counters[0]
+      self.batch_stats[j][1] += counters[1]
+
+      if (id(field_comp) in field_comp_id_set):
+        continue
+      field_comp_id_set.add(id(field_comp))
+
+      if (hasattr(field_comp, 'num_pruned')):
+        field_comp.num_pruned += counters[2]
+
+      field_comp.cache_num_hits +=       counters[3]
+      field_comp.cache_num_misses +=     counters[4]
+      field_comp.cache_num_evictions +=  counters[5]
+      field_comp.cache_num_not_cached += counters[6]
+
+  # ---------------------------------------------------------------------------
+
+  def prepare(self, recs1, recs2 = None):
+    """Prepare the field comparators for the comparison of the given records,
+       by calculating the comparison profiles of all distinct field values
+       once (see FieldComparator.prepare()).
+
+       The arguments are iterables of records from the two data sets (such as
+       the values of the record caches of an index). If 'recs2' is None the
+       records in 'recs1' are used for both data sets (for a deduplication).
+    """
+
+    num_field_comp = len(self.field_comparison_list)
+
+    val_set_list = [set() for i in range(num_field_comp)]  # Distinct values
+
+    if (recs2 == None):
+      rec_iter_list = [(recs1, [1,2])]
+    else:
+      rec_iter_list = [(recs1, [1]), (recs2, [2])]
+
+    for (rec_iter, field_index_pos_list) in rec_iter_list:
+
+      field_index_list = []  # Pairs (field comparator number, column index)
+      for i in range(num_field_comp):
+        for field_index_pos in field_index_pos_list:
+          field_index_list.append((i,
+                               self.field_comparison_list[i][field_index_pos]))
+
+      for rec in rec_iter:
+        rec_len = len(rec)
+
+        for (i, field_index) in field_index_list:
+          if (field_index < rec_len):
+            val_set_list[i].add(rec[field_index].lower())
+
+    for i in range(num_field_comp):
+      field_comp = self.field_comparator_list[i][0]
+      field_comp.prepare(val_set_list[i])
+
+  # ---------------------------------------------------------------------------
+
   def get_cache_stats(self):
     """Extract information about the cache size, maximum and average counts for
        all the field comparators that have an activated cache.
+
+       Returns a list with the cache counter dictionaries of all field
+       comparators (see FieldComparator.get_cache_stats()).
     """
 
+    cache_counter_list = []
+
     logging.info('Caching statistics for record comparator "%s"' % \
                  (self.description))
 
@@ -245,6 +746,15 @@ class RecordComparator:
         logging.info('    Maximum and average cache entry count: %d / %.2f' % \
                      (cache_max_count, cache_avrg_count))
 
+      cache_counter_dict = field_comp.get_cache_counters()
+      if (field_comp.do_caching == True):
+        logging.info('    Cache hits / misses / evictions: %d / %d / %d' % \
+                     (cache_counter_dict['hits'], cache_counter_dict['misses'],
+                      cache_counter_dict['evictions']))
+      cache_counter_list.append(cache_counter_dict)
+
+    return cache_counter_list
+
 # =============================================================================
 
 class FieldComparator:
@@ -256,6 +766,13 @@ class FieldComparator:
        description      A string describing the field comparator.
        do_caching       A flag, True or False, to enable or disable caching.
        max_cache_size   The maximum number of comparisons to be cached.
+       cache_policy     The eviction policy used once a cache with a maximum
+                        size is full. Possible are 'none' (no eviction, new
+                        comparisons are not cached anymore, default), 'lru'
+                        (least recently used), 'lfu' (least frequently used)
+                        and '2q' (see class CachePolicy2Q). Note that LRU based
+                        policies do not work well if values pairs are compared
+                        in cycles longer than the cache size.
        cache            A dictionary with cached comparisons.
        missing_values   A list of one or more strings that correspond to
                         missing values.
@@ -280,7 +797,12 @@ class FieldComparator:
     self.do_caching =           False        # Caching disabled by default
     self.max_cache_size =       None         # None - no maximum cache size
     self.cache =                {}           # Dictionary with cached values
+    self.cache_policy =         'none'       # Eviction policy of full cache
+    self.cache_policy_obj =     None         # Cache policy object (if needed)
     self.cache_num_not_cached = 0            # Number of comparisons not cached
+    self.cache_num_hits =       0            # Counters for cache statistics
+    self.cache_num_misses =     0
+    self.cache_num_evictions =  0
     self.cache_warn_counts =    [2,5,10,50]  # List of when warnings should be
                                              # given (minimum counts)
     self.missing_values =  ['']
@@ -296,6 +818,9 @@ class FieldComparator:
                                  # agreement values. If not provided it will be
                                  # set to the general agreement value
 
+    self.profile_dict = {}  # Prepared comparison profiles of field values (see
+                            # the prepare() method)
+
     # Process base keyword arguments (all data set specific keywords were
     # processed in the derived class constructor)
     #
@@ -317,6 +842,15 @@ class FieldComparator:
           auxiliary.check_is_not_negative('max_cache_size', value)
           self.max_cache_size = value
 
+      elif (keyword.startswith('cache_p')):
+        auxiliary.check_is_string('cache_policy', value)
+        if (value not in CACHE_POLICY_DICT) and (value != 'none'):
+          logging.exception('Illegal value for cache policy: %s' % (value) + \
+                            ' (possible are: %s)' % \
+                            (str(sorted(CACHE_POLICY_DICT.keys())+['none'])))
+          raise Exception
+        self.cache_policy = value
+
       elif (keyword.startswith('missing_v')):
         auxiliary.check_is_list('missing_values', value)
         self.missing_values = value
@@ -353,6 +887,14 @@ class FieldComparator:
     for i in self.cache_warn_counts:
       self.cache_warn_dict_counts[i] = 0  # No value pairs with count i so far
 
+    # Create the eviction policy for a cache with a maximum size
+    #
+    if ((self.do_caching == True) and (self.max_cache_size not in [None, 0])
+        and (self.cache_policy != 'none')):
+      cache_policy_class = CACHE_POLICY_DICT[self.cache_policy]
+      self.cache_policy_obj = cache_policy_class(self.max_cache_size)
+      self.cache_policy_obj.reset(self.cache)
+
     # If a frequency table is given calculate the sum of all counts
     #
     if (self.val_freq_table != None):
@@ -435,18 +977,30 @@ class FieldComparator:
     else:
       cache_key = (val2, val1)
 
-    if cache_key not in self.cache:  # The values pair is not in the cache
+    cache_entry = self.cache.get(cache_key)
+
+    if (cache_entry == None):  # The values pair is not in the cache
+      self.cache_num_misses += 1
       return None
 
-    # Get weight and access count from cache, increase count, and put it back
+    self.cache_num_hits += 1
+
+    # Get weight and access count from cache entry, and increase count
     #
-    (cache_weight, access_count) = self.cache[cache_key]
-    access_count += 1
-    self.cache[cache_key] = (cache_weight, access_count)
+    cache_weight = cache_entry[0]
+    access_count = cache_entry[1] + 1
+    cache_entry[1] = access_count
 
     if (self.max_cache_size == None):
       return cache_weight  # Unlimited cache size, simply return
 
+    cache_policy_obj = self.cache_policy_obj
+
+    if (cache_policy_obj != None):
+      if (cache_policy_obj.cache_dict is not self.cache):  # Cache was replaced
+        self.__reset_cache_policy__()
+      cache_policy_obj.access(cache_key)
+
     if (access_count in self.cache_warn_counts):  # Check if warning needed
 
       num_count_pairs = self.cache_warn_dict_counts[access_count]
@@ -461,11 +1015,12 @@ class FieldComparator:
   # ---------------------------------------------------------------------------
 
   def __put_into_cache__(self, val1, val2, weight):
-    """If caching is enabled and there is room in the cache put the given pair
-       of values into the cache with the given similarity weight.
+    """If caching is enabled put the given pair of values into the cache with
+       the given similarity weight.
 
-       If the cache is full don't insert values pair but increase the number of
-       non-cached comparisons.
+       If the cache is full a values pair is evicted from the cache according
+       to the cache policy. If the cache policy is 'none', the values pair is
+       not inserted but the number of non-cached comparisons is increased.
 
        If caching is disabled do nothing.
     """
@@ -473,6 +1028,32 @@ class FieldComparator:
     if (self.do_caching == False):
       return
 
+    # Comparisons have to be symmetric: Only one of the pairs (val1,val2) and
+    # (val2,val1) should be stored in the cache, so sort them
+    #
+    if (val1 < val2):
+      cache_key = (val1, val2)
+    else:
+      cache_key = (val2, val1)
+
+    cache_policy_obj = self.cache_policy_obj
+
+    if (cache_policy_obj != None):  # Evict a values pair if the cache is full
+
+      if (cache_policy_obj.cache_dict is not self.cache):  # Cache was replaced
+        self.__reset_cache_policy__()
+
+      if (cache_key in self.cache):  # Values pair is already in the cache
+        self.cache[cache_key][0] = weight
+        return
+
+      evict_key = cache_policy_obj.insert(cache_key)
+      if (evict_key != None):
+        self.__evict_from_cache__(evict_key)
+
+      self.cache[cache_key] = [weight, 1]
+      return
+
     # Check if the cache is full
     #
     if ((self.max_cache_size != None) and \
@@ -486,17 +1067,43 @@ class FieldComparator:
 
       return
 
-    # Comparisons have to be symmetric: Only one of the pairs (val1,val2) and
-    # (val2,val1) should be stored in the cache, so sort them
+    # Insert new pair into cache with a count of 1
     #
-    if (val1 < val2):
-      cache_key = (val1, val2)
-    else:
-      cache_key = (val2, val1)
+    self.cache[cache_key] = [weight, 1]
 
-    # Insert new pair into cache and list of pairs with count 1
-    #
-    self.cache[cache_key] = (weight, 1)
+  # ---------------------------------------------------------------------------
+
+  def __evict_from_cache__(self, cache_key):
+    """Remove the given values pair from the cache and update the counts of
+       cache entries used for warning messages. Should not be used from outside
+       the module.
+    """
+
+    access_count = self.cache.pop(cache_key)[1]
+
+    for i in self.cache_warn_counts:  # Entry was counted for all counts up to
+      if (1 < i <= access_count):     # its access count
+        self.cache_warn_dict_counts[i] -= 1
+
+    self.cache_num_evictions += 1
+
+  # ---------------------------------------------------------------------------
+
+  def __reset_cache_policy__(self):
+    """Reset the cache policy after the cache dictionary has been replaced
+       (for example with an empty dictionary to clear the cache). Should not
+       be used from outside the module.
+    """
+
+    for i in self.cache_warn_counts:  # Recalculate counts for warnings
+      self.cache_warn_dict_counts[i] = 0
+    for cache_entry in self.cache.itervalues():
+      for i in self.cache_warn_counts:
+        if (1 < i <= cache_entry[1]):
+          self.cache_warn_dict_counts[i] += 1
+
+    for evict_key in self.cache_policy_obj.reset(self.cache):
+      self.__evict_from_cache__(evict_key)
 
   # ---------------------------------------------------------------------------
 
@@ -624,6 +1231,168 @@ class FieldComparator:
 
   # ---------------------------------------------------------------------------
 
+  def compare_batch(self, vals1, vals2):
+    """Compare two lists of field values position-wise and return an array
+       (of type 'd') with one numerical weight per value pair, so that element
+       i of the returned array is the weight compare(vals1[i], vals2[i]).
+
+       This default implementation calls compare() in a tight loop, derived
+       classes provide faster implementations where possible.
+    """
+
+    self.__check_batch_lists__(vals1, vals2)
+
+    return array.array('d', map(self.compare, vals1, vals2))
+
+  # ---------------------------------------------------------------------------
+
+  def __check_batch_lists__(self, vals1, vals2):
+    """Check that the two lists of values given to compare_batch() are lists
+       of the same length. Should not be used from outside the module.
+    """
+
+    auxiliary.check_is_list('vals1', vals1)
+    auxiliary.check_is_list('vals2', vals2)
+
+    if (len(vals1) != len(vals2)):
+      logging.exception('The two lists of values to be compared must be of ' + \
+                        'the same length: %d / %d' % (len(vals1), len(vals2)))
+      raise Exception
+
+  # ---------------------------------------------------------------------------
+
+  def __compare_batch_distinct__(self, vals1, vals2):
+    """Batch comparison that calls compare() only once for each distinct
+       pair of values in the batch, and re-uses the weight for repeated value
+       pairs. Can be used by comparators whose weights only depend upon the two
+       values compared. Should not be used from outside the module.
+    """
+
+    self.__check_batch_lists__(vals1, vals2)
+
+    compare =     self.compare  # Shorthands to make program faster
+    weight_dict = {}  # Weights of the distinct value pairs in this batch
+
+    weight_array = array.array('d')
+
+    for val_pair in zip(vals1, vals2):
+      w = weight_dict.get(val_pair)
+      if (w == None):
+        w = compare(val_pair[0], val_pair[1])
+        weight_dict[val_pair] = w
+      weight_array.append(w)
+
+    return weight_array
+
+  # ---------------------------------------------------------------------------
+
+  def __get_float_dict__(self, vals1, vals2):
+    """Convert each distinct value in the two given lists into a floating-point
+       number and return a dictionary with the values as keys and the numbers
+       as values (None for values that are not numbers). Should not be used
+       from outside the module.
+    """
+
+    float_dict = {}
+
+    for val_list in [vals1, vals2]:
+      for val in val_list:
+        if (val not in float_dict):
+          try:
+            float_dict[val] = float(val)
+          except:
+            float_dict[val] = None
+
+    return float_dict
+
+  # ---------------------------------------------------------------------------
+
+  def prepare(self, vals):
+    """Calculate the comparison profiles (such as q-grams, token sets,
+       character histograms or phonetic encodings) of the given field values
+       once and keep them in 'profile_dict', so the compare() method does not
+       need to calculate them again for every value pair a value takes part
+       in. Missing values are skipped.
+
+       Only field comparators that implement the __calc_profile__() method use
+       profiles, for all others nothing is done. The profiles are kept until
+       clear_profiles() is called.
+    """
+
+    if (self.__calc_profile__.im_func is \
+        FieldComparator.__calc_profile__.im_func):
+      return  # This field comparator does not use profiles
+
+    calc_profile_funct = self.__calc_profile__  # Shorthands
+    profile_dict =       self.profile_dict
+    missing_val_set =    set(self.missing_values)
+
+    num_profiles = len(profile_dict)
+
+    for val in vals:
+      if (val not in profile_dict) and (val not in missing_val_set):
+        profile_dict[val] = calc_profile_funct(val)
+
+    logging.info('Field comparator "%s": Prepared %d comparison profiles ' % \
+                 (self.description, len(profile_dict)-num_profiles) + \
+                 '(%d in total)' % (len(profile_dict)))
+
+  # ---------------------------------------------------------------------------
+
+  def clear_profiles(self):
+    """Remove all prepared comparison profiles.
+    """
+
+    self.profile_dict = {}
+
+  # ---------------------------------------------------------------------------
+
+  def __calc_profile__(self, val):
+    """Calculate and return the comparison profile of a field value. See
+       implementations in derived classes for details. Should not be used from
+       outside the module.
+    """
+
+    logging.exception('Override abstract method in derived class')
+    raise Exception
+
+  # ---------------------------------------------------------------------------
+
+  def __get_profile__(self, val):
+    """Return the prepared comparison profile of the given field value, or
+       calculate it if the value has not been prepared (without adding it to
+       the prepared profiles). Should not be used from outside the module.
+    """
+
+    profile = self.profile_dict.get(val)
+
+    if (profile == None):
+      profile = self.__calc_profile__(val)
+
+    return profile
+
+  # ---------------------------------------------------------------------------
+
+  def __get_batch_profile__(self, val, batch_profile_dict):
+    """Return the prepared comparison profile of the given field value, or
+       the one calculated earlier in the same batch comparison (kept in the
+       given dictionary), or calculate it and add it to the given dictionary.
+       Should not be used from outside the module.
+    """
+
+    profile = self.profile_dict.get(val)
+
+    if (profile == None):
+      profile = batch_profile_dict.get(val)
+
+      if (profile == None):
+        profile = self.__calc_profile__(val)
+        batch_profile_dict[val] = profile
+
+    return profile
+
+  # ---------------------------------------------------------------------------
+
   def log(self, instance_var_list = None):
     """Write a log message with the basic field comparator instance variables
        plus the instance variable provided in the given input list (assumed to
@@ -635,6 +1404,7 @@ class FieldComparator:
     logging.info('  Do caching:          %s' % (str(self.do_caching)))
     if (self.max_cache_size != None):
       logging.info('  Maximum cache size:  %s' % (str(self.max_cache_size)))
+      logging.info('  Cache policy:        %s' % (self.cache_policy))
     else:
       logging.info('  Unlimited cache size')
     logging.info('    Warnings will be given once all cache entries have ' + \
@@ -665,8 +1435,24 @@ class FieldComparator:
 
   # ---------------------------------------------------------------------------
 
+  def get_cache_counters(self):
+    """Return a dictionary with the number of cache hits, misses, evictions,
+       comparisons not cached (only with cache policy 'none'), and the current
+       number of cache entries.
+    """
+
+    return {'hits':       self.cache_num_hits,
+            'misses':     self.cache_num_misses,
+            'evictions':  self.cache_num_evictions,
+            'not_cached': self.cache_num_not_cached,
+            'size':       len(self.cache)}
+
+  # ---------------------------------------------------------------------------
+
   def get_cache_stats(self):
-    """Extract information about the cache size, maximum and average counts.
+    """Extract information about the cache size, maximum and average counts,
+       and the number of cache hits, misses and evictions. The cache counters
+       are returned in a dictionary (see get_cache_counters()).
     """
 
     logging.info('Field comparator: "%s"' % (self.description))
@@ -702,10 +1488,26 @@ class FieldComparator:
       logging.info('  Maximum and average cache entry count: %d / %.2f' % \
                    (cache_max_count, cache_avrg_count))
 
+    cache_counter_dict = self.get_cache_counters()
+
+    if (self.do_caching == True):
+      logging.info('  Cache hits / misses / evictions: %d / %d / %d' % \
+                   (cache_counter_dict['hits'], cache_counter_dict['misses'],
+                    cache_counter_dict['evictions']))
+      if (self.cache_num_not_cached > 0):
+        logging.info('  Number of comparisons not cached: %d' % \
+                     (self.cache_num_not_cached))
+
+    return cache_counter_dict
+
 # =============================================================================
 
 class FieldComparatorExactString(FieldComparator):
   """A field comparator based on exact string comparison.
+
+     Comparisons are not cached (neither by compare() nor by compare_batch()),
+     as looking up a values pair in the cache is not faster than comparing the
+     two values, so the 'do_caching' argument has no effect.
   """
 
   # ---------------------------------------------------------------------------
@@ -735,6 +1537,33 @@ class FieldComparatorExactString(FieldComparator):
     else:
       return self.disagree_weight
 
+  # ---------------------------------------------------------------------------
+
+  def compare_batch(self, vals1, vals2):
+    """Compare two lists of field values position-wise using exact string
+       comparison, see compare_batch() in the base class.
+    """
+
+    self.__check_batch_lists__(vals1, vals2)
+
+    missing_set =     set(self.missing_values)  # Shorthands to make program
+    missing_weight =  self.missing_weight       # faster
+    disagree_weight = self.disagree_weight
+    freq_agree_weight = self.__calc_freq_agree_weight__
+
+    weight_array = array.array('d')
+    append_weight = weight_array.append
+
+    for (val1, val2) in zip(vals1, vals2):
+      if (val1 in missing_set) or (val2 in missing_set):
+        append_weight(missing_weight)
+      elif (val1 == val2):
+        append_weight(freq_agree_weight(val1))
+      else:
+        append_weight(disagree_weight)
+
+    return weight_array
+
 # =============================================================================
 
 class FieldComparatorContainsString(FieldComparator):
@@ -875,6 +1704,9 @@ class FieldComparatorKeyDiff(FieldComparator):
 
      If the number of different characters counted is larger than X, the
      disagreement weight will be returned.
+
+     The character-wise comparison is cheap, so comparisons are not cached
+     by compare() or compare_batch() even if 'do_caching' is set to True.
   """
 
   # ---------------------------------------------------------------------------
@@ -956,6 +1788,54 @@ class FieldComparatorKeyDiff(FieldComparator):
     return agree_weight - (float(num_err)/(self.max_key_diff+1.0)) * \
            (agree_weight + abs(self.disagree_weight))
 
+  # ---------------------------------------------------------------------------
+
+  def compare_batch(self, vals1, vals2):
+    """Compare two lists of field values position-wise using the key difference
+       field comparator, see compare_batch() in the base class.
+    """
+
+    self.__check_batch_lists__(vals1, vals2)
+
+    missing_set =     set(self.missing_values)  # Shorthands to make program
+    missing_weight =  self.missing_weight       # faster
+    disagree_weight = self.disagree_weight
+    abs_disagree_weight = abs(disagree_weight)
+    max_key_diff =    self.max_key_diff
+    freq_agree_weight = self.__calc_freq_agree_weight__
+    freq_weights =    self.__calc_freq_weights__
+
+    weight_array = array.array('d')
+    append_weight = weight_array.append
+
+    for (val1, val2) in zip(vals1, vals2):
+      if (val1 in missing_set) or (val2 in missing_set):
+        append_weight(missing_weight)
+        continue
+
+      elif (val1 == val2):
+        append_weight(freq_agree_weight(val1))
+        continue
+
+      str1 = str(val1)   # Make sure values are strings
+      str2 = str(val2)
+
+      num_err = abs(len(str1) - len(str2))
+
+      if (num_err <= max_key_diff):
+        for (char1, char2) in zip(str1, str2):
+          if (char1 != char2):
+            num_err += 1
+
+      if (num_err > max_key_diff):
+        append_weight(disagree_weight)  # Too many different characters
+      else:
+        agree_weight = freq_weights(val1, val2)
+        append_weight(agree_weight - (float(num_err)/(max_key_diff+1.0)) * \
+                      (agree_weight + abs_disagree_weight))
+
+    return weight_array
+
 # =============================================================================
 
 class FieldComparatorNumericPerc(FieldComparator):
@@ -980,6 +1860,9 @@ class FieldComparatorNumericPerc(FieldComparator):
 
        perc_diff = 100.0 *
                    abs(value_1 - value_2) / max(abs(value_1), abs(value_2))
+
+     Comparisons are not cached (in compare() as well as compare_batch()), so
+     'do_caching' has no effect for this field comparator.
   """
 
   # ---------------------------------------------------------------------------
@@ -1064,6 +1947,65 @@ class FieldComparatorNumericPerc(FieldComparator):
     return agree_weight - (perc_diff / (self.max_perc_diff+1.0)) * \
            (agree_weight + abs(self.disagree_weight))
 
+  # ---------------------------------------------------------------------------
+
+  def compare_batch(self, vals1, vals2):
+    """Compare two lists of numerical field values position-wise and tolerate
+       a percentage difference, see compare_batch() in the base class. Each
+       distinct value is only converted into a number once.
+    """
+
+    self.__check_batch_lists__(vals1, vals2)
+
+    missing_set =     set(self.missing_values)  # Shorthands to make program
+    missing_weight =  self.missing_weight       # faster
+    disagree_weight = self.disagree_weight
+    abs_disagree_weight = abs(disagree_weight)
+    max_perc_diff = self.max_perc_diff
+    freq_agree_weight = self.__calc_freq_agree_weight__
+    freq_weights =    self.__calc_freq_weights__
+
+    float_dict = self.__get_float_dict__(vals1, vals2)
+
+    weight_array = array.array('d')
+    append_weight = weight_array.append
+
+    for (val1, val2) in zip(vals1, vals2):
+      if (val1 in missing_set) or (val2 in missing_set):
+        append_weight(missing_weight)
+        continue
+
+      elif (val1 == val2):
+        append_weight(freq_agree_weight(val1))
+        continue
+
+      float_val1 = float_dict[val1]
+      float_val2 = float_dict[val2]
+
+      if (float_val1 == None) or (float_val2 == None):  # Not numbers
+        append_weight(disagree_weight)
+        continue
+
+      elif (float_val1 == float_val2):
+        append_weight(freq_agree_weight(val1))
+        continue
+
+      elif (max_perc_diff == 0.0):  # No difference tolerated
+        append_weight(disagree_weight)
+        continue
+
+      diff = 100.0 * abs(float_val1 - float_val2) / \
+                     max(abs(float_val1), abs(float_val2))
+
+      if (diff > max_perc_diff):  # Difference too large
+        append_weight(disagree_weight)
+      else:
+        agree_weight = freq_weights(val1, val2)
+        append_weight(agree_weight - (diff / (max_perc_diff+1.0)) * \
+                      (agree_weight + abs_disagree_weight))
+
+    return weight_array
+
 # =============================================================================
 
 class FieldComparatorNumericAbs(FieldComparator):
@@ -1091,6 +2033,9 @@ class FieldComparatorNumericAbs(FieldComparator):
      where the absolute difference is calculated as:
 
        abs_diff = abs(value_a - value_b)
+
+     As for the percentage difference comparator, comparisons are not cached
+     and 'do_caching' has no effect.
   """
 
   # ---------------------------------------------------------------------------
@@ -1176,6 +2121,64 @@ class FieldComparatorNumericAbs(FieldComparator):
     return agree_weight - (abs_diff / (self.max_abs_diff+1.0)) * \
            (agree_weight + abs(self.disagree_weight))
 
+  # ---------------------------------------------------------------------------
+
+  def compare_batch(self, vals1, vals2):
+    """Compare two lists of numerical field values position-wise and tolerate
+       a absolute difference, see compare_batch() in the base class. Each
+       distinct value is only converted into a number once.
+    """
+
+    self.__check_batch_lists__(vals1, vals2)
+
+    missing_set =     set(self.missing_values)  # Shorthands to make program
+    missing_weight =  self.missing_weight       # faster
+    disagree_weight = self.disagree_weight
+    abs_disagree_weight = abs(disagree_weight)
+    max_abs_diff = self.max_abs_diff
+    freq_agree_weight = self.__calc_freq_agree_weight__
+    freq_weights =    self.__calc_freq_weights__
+
+    float_dict = self.__get_float_dict__(vals1, vals2)
+
+    weight_array = array.array('d')
+    append_weight = weight_array.append
+
+    for (val1, val2) in zip(vals1, vals2):
+      if (val1 in missing_set) or (val2 in missing_set):
+        append_weight(missing_weight)
+        continue
+
+      elif (val1 == val2):
+        append_weight(freq_agree_weight(val1))
+        continue
+
+      float_val1 = float_dict[val1]
+      float_val2 = float_dict[val2]
+
+      if (float_val1 == None) or (float_val2 == None):  # Not numbers
+        append_weight(disagree_weight)
+        continue
+
+      elif (float_val1 == float_val2):
+        append_weight(freq_agree_weight(val1))
+        continue
+
+      elif (max_abs_diff == 0.0):  # No difference tolerated
+        append_weight(disagree_weight)
+        continue
+
+      diff = abs(float_val1 - float_val2)
+
+      if (diff > max_abs_diff):  # Difference too large
+        append_weight(disagree_weight)
+      else:
+        agree_weight = freq_weights(val1, val2)
+        append_weight(agree_weight - (diff / (max_abs_diff+1.0)) * \
+                      (agree_weight + abs_disagree_weight))
+
+    return weight_array
+
 # =============================================================================
 
 class FieldComparatorEncodeString(FieldComparator):
@@ -1259,6 +2262,45 @@ class FieldComparatorEncodeString(FieldComparator):
 
   # ---------------------------------------------------------------------------
 
+  def __calc_profile__(self, val):
+    """Return the phonetic encoding of a field value (possibly reversed).
+    """
+
+    if (self.reverse == True):
+      rev = list(val)
+      rev.reverse()
+      enc_str = ''.join(rev)
+    else:
+      enc_str = val
+
+    enc_str = enc_str.lower()  # Encodings assume all lowercase
+
+    max_len=self.max_code_length
+
+    if (self.encode_method == None):
+      code = enc_str[:max_len]
+    elif (self.encode_method == 'soundex'):
+      code = encode.soundex(enc_str, maxlen=max_len)
+    elif (self.encode_method == 'mod_soundex'):
+      code = encode.mod_soundex(enc_str, maxlen=max_len)
+    elif (self.encode_method == 'phonex'):
+      code = encode.phonex(enc_str, maxlen=max_len)
+    elif (self.encode_method == 'phonix'):
+      code = encode.phonix(enc_str, maxlen=max_len)
+    elif (self.encode_method == 'nysiis'):
+      code = encode.nysiis(enc_str, maxlen=max_len)
+    elif (self.encode_method == 'dmetaphone'):
+      code = encode.dmetaphone(enc_str, maxlen=max_len)
+    elif (self.encode_method == 'fuzzysoundex'):
+      code = encode.fuzzy_soundex(enc_str, maxlen=max_len)
+    else:
+      logging.exception('Illegal string encoding: %s' % (self.encode_method))
+      raise Exception
+
+    return code
+
+  # ---------------------------------------------------------------------------
+
   def compare(self, val1, val2):
     """Compare two string values using a phonetic encoding method. If the two
        strings or the encodings of the two strings are the same then return the
@@ -1280,49 +2322,8 @@ class FieldComparatorEncodeString(FieldComparator):
 
     # Compare the encodings - - - - - - - - - - - - - - - - - - - - - - - - - -
     #
-    if (self.reverse == True):
-      rev = list(val1)
-      rev.reverse()
-      str1 = ''.join(rev)
-      rev = list(val2)
-      rev.reverse()
-      str2 = ''.join(rev)
-    else:
-      str1 = val1
-      str2 = val2
-
-    str1 = str1.lower()  # Encodings assume all lowercase
-    str2 = str2.lower()
-
-    max_len=self.max_code_length
-
-    if (self.encode_method == None):
-      code1 = str1[:max_len]
-      code2 = str2[:max_len]
-    elif (self.encode_method == 'soundex'):
-      code1 = encode.soundex(str1, maxlen=max_len)
-      code2 = encode.soundex(str2, maxlen=max_len)
-    elif (self.encode_method == 'mod_soundex'):
-      code1 = encode.mod_soundex(str1, maxlen=max_len)
-      code2 = encode.mod_soundex(str2, maxlen=max_len)
-    elif (self.encode_method == 'phonex'):
-      code1 = encode.phonex(str1, maxlen=max_len)
-      code2 = encode.phonex(str2, maxlen=max_len)
-    elif (self.encode_method == 'phonix'):
-      code1 = encode.phonix(str1, maxlen=max_len)
-      code2 = encode.phonix(str2, maxlen=max_len)
-    elif (self.encode_method == 'nysiis'):
-      code1 = encode.nysiis(str1, maxlen=max_len)
-      code2 = encode.nysiis(str2, maxlen=max_len)
-    elif (self.encode_method == 'dmetaphone'):
-      code1 = encode.dmetaphone(str1, maxlen=max_len)
-      code2 = encode.dmetaphone(str2, maxlen=max_len)
-    elif (self.encode_method == 'fuzzysoundex'):
-      code1 = encode.fuzzy_soundex(str1, maxlen=max_len)
-      code2 = encode.fuzzy_soundex(str2, maxlen=max_len)
-    else:
-      logging.exception('Illegal string encoding: %s' % (self.encode_method))
-      raise Exception
+    code1 = self.__get_profile__(val1)
+    code2 = self.__get_profile__(val2)
 
     # Check if encodings are the same or different  - - - - - - - - - - - - - -
     #
@@ -1749,6 +2750,16 @@ class FieldComparatorDate(FieldComparator):
 
     return w
 
+  # ---------------------------------------------------------------------------
+
+  def compare_batch(self, vals1, vals2):
+    """Compare two lists of field values position-wise using the date
+       comparator, see compare_batch() in the base class. Values are only
+       parsed and compared once for each distinct pair of values in the batch.
+    """
+
+    return self.__compare_batch_distinct__(vals1, vals2)
+
 # =============================================================================
 
 class FieldComparatorTime(FieldComparator):
@@ -1990,6 +3001,16 @@ class FieldComparatorTime(FieldComparator):
 
     return w
 
+  # ---------------------------------------------------------------------------
+
+  def compare_batch(self, vals1, vals2):
+    """Compare two lists of field values position-wise using the time
+       comparator, see compare_batch() in the base class. Values are only
+       parsed and compared once for each distinct pair of values in the batch.
+    """
+
+    return self.__compare_batch_distinct__(vals1, vals2)
+
 # =============================================================================
 
 class FieldComparatorAge(FieldComparator):
@@ -2253,6 +3274,16 @@ class FieldComparatorAge(FieldComparator):
 
     return w
 
+  # ---------------------------------------------------------------------------
+
+  def compare_batch(self, vals1, vals2):
+    """Compare two lists of field values position-wise using the age
+       comparator, see compare_batch() in the base class. Values are only
+       parsed and compared once for each distinct pair of values in the batch.
+    """
+
+    return self.__compare_batch_distinct__(vals1, vals2)
+
 # =============================================================================
 
 # All the comparators below are approximate string comparators, and as such
@@ -2281,6 +3312,13 @@ class FieldComparatorApproxString(FieldComparator):
 
      If the approximate approximate string comparator calculates a similarity
      value less than the 'threshold' then the disagreement weight is returned.
+
+     Where possible, the approximate string comparators first calculate a
+     cheap upper bound of the similarity value (for example from the lengths
+     of the two strings, or from the number of characters or q-grams they
+     have in common). If this bound is below the 'threshold' the similarity
+     value itself is not calculated, and the disagreement weight is returned.
+     The number of values pairs pruned this way is counted in 'num_pruned'.
   """
 
   # ---------------------------------------------------------------------------
@@ -2291,6 +3329,7 @@ class FieldComparatorApproxString(FieldComparator):
     """
 
     self.threshold = None
+    self.num_pruned = 0  # Number of values pairs pruned by an upper bound
 
     # Process all keyword arguments - - - - - - - - - - - - - - - - - - - - - -
     #
@@ -2375,71 +3414,192 @@ class FieldComparatorJaro(FieldComparatorApproxString):
     """Compare two field values using the Jaro approximate string comparator.
     """
 
-    # Check if one of the values is a missing value
-    #
-    if (val1 in self.missing_values) or (val2 in self.missing_values):
-      return self.missing_weight
+    # Check if one of the values is a missing value
+    #
+    if (val1 in self.missing_values) or (val2 in self.missing_values):
+      return self.missing_weight
+
+    if (self.do_caching == True):  # Check if values pair is in the cache
+      cache_weight = self.__get_from_cache__(val1, val2)
+      if (cache_weight != None):
+        return cache_weight
+
+    if (val1 == val2):
+      return self.__calc_freq_agree_weight__(val1)
+
+    # Calculate Jaro similarity value - - - - - - - - - - - - - - - - - - - - -
+    #
+    pos1 = self.__get_profile__(val1)
+    pos2 = self.__get_profile__(val2)
+
+    if (self.threshold > 0.0) and \
+       (self.__calc_upper_bound__(val1, val2, pos1, pos2) < self.threshold):
+      self.num_pruned += 1
+      w = 0.0  # Similarity can not reach the threshold
+
+    else:
+      w = self.__do_jaro__(val1, val2, pos1, pos2)
+
+    if (w == 0.0):  # No characters in common (or pruned)
+      w = self.disagree_weight
+
+    else:
+      w = self.__calc_partagree_weight__(val1, val2, w)
+
+    if (self.do_caching == True):  # Put values pair into the cache
+      self.__put_into_cache__(val1, val2, w)
+
+    return w
+
+  # ---------------------------------------------------------------------------
+
+  def compare_batch(self, vals1, vals2):
+    """Compare two lists of field values position-wise using the Jaro
+       approximate string comparator, see compare_batch() in the base class.
+
+       Each distinct pair of values is only compared once, and the character
+       positions of each distinct value are only calculated once (unless they
+       have been prepared). Value pairs where an upper bound of the Jaro
+       similarity (calculated from the lengths of the values and the number
+       of characters they have in common) is below the threshold receive the
+       disagreement weight without being compared. If caching is enabled the
+       cache is used for the distinct pairs of values as in compare().
+    """
+
+    self.__check_batch_lists__(vals1, vals2)
+
+    missing_set =     set(self.missing_values)  # Shorthands to make program
+    missing_weight =  self.missing_weight       # faster
+    disagree_weight = self.disagree_weight
+    threshold =       self.threshold
+    freq_agree_weight = self.__calc_freq_agree_weight__
+    partagree_weight =  self.__calc_partagree_weight__
+    do_jaro =         self.__do_jaro__
+    get_profile =     self.__get_batch_profile__
+    upper_bound =     self.__calc_upper_bound__
+
+    do_caching =      self.do_caching
+    get_from_cache =  self.__get_from_cache__
+    put_into_cache =  self.__put_into_cache__
+
+    pos_dict =    {}  # Character positions of values not prepared
+    weight_dict = {}  # Weights of the distinct value pairs in this batch
+    num_pruned =  0
+
+    weight_array = array.array('d')
+    append_weight = weight_array.append
+
+    for val_pair in zip(vals1, vals2):
+      (val1, val2) = val_pair
+
+      if (val1 in missing_set) or (val2 in missing_set):
+        append_weight(missing_weight)
+        continue
+
+      w = weight_dict.get(val_pair)
+      if (w != None):
+        append_weight(w)
+        continue
+
+      if (do_caching == True):  # Check if values pair is in the cache
+        w = get_from_cache(val1, val2)
+        if (w != None):
+          weight_dict[val_pair] = w
+          append_weight(w)
+          continue
+
+      if (val1 == val2):
+        w = freq_agree_weight(val1)
+        weight_dict[val_pair] = w
+        append_weight(w)
+        continue
+
+      pos1 = get_profile(val1, pos_dict)
+      pos2 = get_profile(val2, pos_dict)
+
+      if (threshold > 0.0) and \
+         (upper_bound(val1, val2, pos1, pos2) < threshold):
+        num_pruned += 1
+        w = disagree_weight  # Similarity can not reach the threshold
+
+      else:
+        w = do_jaro(val1, val2, pos1, pos2)
+
+        if (w == 0.0):  # No characters in common
+          w = disagree_weight
+        else:
+          w = partagree_weight(val1, val2, w)
+
+      if (do_caching == True):  # Put values pair into the cache
+        put_into_cache(val1, val2, w)
+
+      weight_dict[val_pair] = w
+      append_weight(w)
+
+    self.num_pruned += num_pruned
+
+    return weight_array
+
+  # ---------------------------------------------------------------------------
+
+  def __calc_upper_bound__(self, val1, val2, pos1, pos2):
+    """Calculate an upper bound of the Jaro similarity measure for two input
+       strings from their lengths and the number of characters they have in
+       common (ignoring where the characters are in the strings), assuming no
+       transpositions.
+
+       Should not be used from outside the module.
+    """
+
+    max_common = float(stringcmp.jaro_max_common(pos1, pos2))
 
-    if (self.do_caching == True):  # Check if values pair is in the cache
-      cache_weight = self.__get_from_cache__(val1, val2)
-      if (cache_weight != None):
-        return cache_weight
+    if (max_common == 0.0):  # No characters in common
+      return 0.0
 
-    if (val1 == val2):
-      return self.__calc_freq_agree_weight__(val1)
+    return 1./3.*(max_common / len(val1) + max_common / len(val2) + 1.0)
 
-    # Calculate Jaro similarity value - - - - - - - - - - - - - - - - - - - - -
-    #
-    len1, len2 = len(val1), len(val2)
-    halflen = max(len1,len2) / 2 - 1  # Or + 1?? PC 12/03/2009
+  # ---------------------------------------------------------------------------
 
-    ass1, ass2 = '', ''  # Characters assigned in string 1 and string 2
-    workstr1, workstr2 = val1, val2  # Copies of the original strings
+  def __do_jaro__(self, val1, val2, pos1 = None, pos2 = None):
+    """Calculate the Jaro similarity measure for two input strings (given
+       their character positions as returned by stringcmp.jaro_positions(), or
+       None), or return 0.0 if they do not have any characters in common.
 
-    common1, common2 = 0.0, 0.0  # Number of common characters
+       Should not be used from outside the module.
+    """
 
-    for i in range(len1):  # Analyse the first string
-      start = max(0,i-halflen)
-      end   = min(i+halflen+1,len2)
-      index = workstr2.find(val1[i],start,end)
-      if (index > -1):  # Found common character
-        common1 += 1
-        ass1 = ass1 + val1[i]
-        workstr2 = workstr2[:index]+self.JARO_MARKER_CHAR+workstr2[index+1:]
+    (ass1, ass2, flag1, flag2) = stringcmp.jaro_assign(val1, val2, pos1, pos2)
 
-    for i in range(len2):  # Analyse the second string
-      start = max(0,i-halflen)
-      end   = min(i+halflen+1,len1)
-      index = workstr1.find(val2[i],start,end)
-      if (index > -1):  # Found common character
-        common2 += 1
-        ass2 = ass2 + val2[i]
-        workstr1 = workstr1[:index]+self.JARO_MARKER_CHAR+workstr1[index+1:]
+    assert (len(ass1) == len(ass2)), 'Jaro: Different "common" values'
 
-    assert (common1 == common2), 'Jaro: Different "common" values'
+    if (ass1 == []):  # No characters in common
+      return 0.0
 
-    if (common1 == 0.0):  # No characters in common
-      w = self.disagree_weight
+    # Compute number of transpositions  - - - - - - - - - - - - - - - - - - - -
+    #
+    transp = 0.0
+    for i in range(len(ass1)):
+      if (ass1[i] != ass2[i]):
+        transp += 0.5
 
-    else:  # Compute number of transpositions  - - - - - - - - - - - - - - - -
+    common = float(len(ass1))
 
-      transp = 0.0
-      for i in range(len(ass1)):
-        if (ass1[i] != ass2[i]):
-          transp += 0.5
+    w = 1./3.*(common / float(len(val1)) + common / float(len(val2)) + \
+        (common-transp) / common)
 
-      w = 1./3.*(common1 / float(len1) + common1 / float(len2) + \
-          (common1-transp) / common1)
+    assert (w > 0.0), 'Jaro: Weight is smaller than 0.0: %f' % (w)
+    assert (w < 1.0), 'Jaro: Weight is larger than 1.0: %f' % (w)
 
-      assert (w > 0.0), 'Jaro: Weight is smaller than 0.0: %f' % (w)
-      assert (w < 1.0), 'Jaro: Weight is larger than 1.0: %f' % (w)
+    return w
 
-      w = self.__calc_partagree_weight__(val1, val2, w)
+  # ---------------------------------------------------------------------------
 
-    if (self.do_caching == True):  # Put values pair into the cache
-      self.__put_into_cache__(val1, val2, w)
+  def __calc_profile__(self, val):
+    """Calculate the character positions of a field value. Should not be used
+       from outside the module.
+    """
 
-    return w
+    return stringcmp.jaro_positions(val)
 
 # =============================================================================
 
@@ -2556,8 +3716,10 @@ class FieldComparatorWinkler(FieldComparatorApproxString):
 
   # ---------------------------------------------------------------------------
 
-  def __do_winkler__(self, val1, val2):
-    """Calculate basic Winkler similarity measure for two input strings.
+  def __do_winkler__(self, val1, val2, pos1 = None, pos2 = None):
+    """Calculate basic Winkler similarity measure for two input strings (given
+       their character positions as returned by stringcmp.jaro_positions(), or
+       None).
 
        Should not be used from outside the module.
     """
@@ -2567,36 +3729,13 @@ class FieldComparatorWinkler(FieldComparatorApproxString):
     if (len1 < 4) or (len2 < 4):  # Both strings must be at least 4 chars long
       return self.disagree_weight
 
-    halflen = max(len1,len2) / 2 - 1  # Or + 1?? PC 12/03/2009
-
-    ass1, ass2 = '', ''  # Characters assigned in string 1 and string 2
-    workstr1, workstr2 = val1, val2  # Copies of the original strings
-
-    common1, common2 = 0.0, 0.0  # Number of common characters
-
-    # Analyse the first string  - - - - - - - - - - - - - - - - - - - - - - - -
+    # Find the common characters of the two strings - - - - - - - - - - - - - -
     #
-    for i in range(len1):
-      start = max(0,i-halflen)
-      end   = min(i+halflen+1,len2)
-      index = workstr2.find(val1[i],start,end)
-      if (index > -1):  # Found common character
-        common1 += 1
-        ass1 = ass1 + val1[i]
-        workstr2 = workstr2[:index]+self.JARO_MARKER_CHAR+workstr2[index+1:]
+    (ass1, ass2, flag1, flag2) = stringcmp.jaro_assign(val1, val2, pos1, pos2)
 
-    # Analyse the second string - - - - - - - - - - - - - - - - - - - - - - - -
-    #
-    for i in range(len2):
-      start = max(0,i-halflen)
-      end   = min(i+halflen+1,len1)
-      index = workstr1.find(val2[i],start,end)
-      if (index > -1):  # Found common character
-        common2 += 1
-        ass2 = ass2 + val2[i]
-        workstr1 = workstr1[:index]+self.JARO_MARKER_CHAR+workstr1[index+1:]
+    assert (len(ass1) == len(ass2)), 'Winkler: Different "common" values'
 
-    assert (common1 == common2), 'Winkler: Different "common" values'
+    common1 = float(len(ass1))  # Number of common characters
 
     if (common1 == 0.0):  # No characters in common
       return self.disagree_weight
@@ -2614,8 +3753,10 @@ class FieldComparatorWinkler(FieldComparatorApproxString):
 
       sim_weight = 0.0
 
-      workstr1 = workstr1.replace(self.JARO_MARKER_CHAR ,'')  # Remove assigned
-      workstr2 = workstr2.replace(self.JARO_MARKER_CHAR ,'')  # characters
+      # Only keep the characters that have not been assigned
+      #
+      workstr1 = ''.join([val1[i] for i in range(len1) if flag1[i] == 0])
+      workstr2 = ''.join([val2[i] for i in range(len2) if flag2[i] == 0])
 
       for c1 in workstr1:
         for j in range(len(workstr2)):
@@ -2739,7 +3880,16 @@ class FieldComparatorWinkler(FieldComparatorApproxString):
 
     else:  # No multi word handling or no whitespaces in values
 
-      w = self.__do_winkler__(val1, val2)
+      pos1 = self.__get_profile__(val1)
+      pos2 = self.__get_profile__(val2)
+
+      if (self.threshold > 0.0) and \
+         (self.__calc_upper_bound__(val1, val2, pos1, pos2) < self.threshold):
+        self.num_pruned += 1
+        w = 0.0  # Similarity can not reach the threshold
+
+      else:
+        w = self.__do_winkler__(val1, val2, pos1, pos2)
 
     w = self.__calc_partagree_weight__(val1, val2, w)
 
@@ -2748,6 +3898,153 @@ class FieldComparatorWinkler(FieldComparatorApproxString):
 
     return w
 
+  # ---------------------------------------------------------------------------
+
+  def compare_batch(self, vals1, vals2):
+    """Compare two lists of field values position-wise using the Winkler
+       approximate string comparator, see compare_batch() in the base class.
+
+       Each distinct pair of values is only compared once, and the character
+       positions of each distinct value are only calculated once (unless they
+       have been prepared). Value pairs where an upper bound of the Winkler
+       similarity (calculated from the lengths of the values, the number of
+       characters they have in common, and the number of same characters at
+       their beginning) is below the threshold receive the disagreement weight
+       without being compared. Values containing whitespaces are compared
+       with compare() if multi word handling is activated. If caching is
+       enabled the cache is used for the distinct pairs of values as in
+       compare().
+    """
+
+    self.__check_batch_lists__(vals1, vals2)
+
+    missing_set =     set(self.missing_values)  # Shorthands to make program
+    missing_weight =  self.missing_weight       # faster
+    disagree_weight = self.disagree_weight
+    threshold =       self.threshold
+    multi_word =      self.multi_word
+    compare =         self.compare
+    freq_agree_weight = self.__calc_freq_agree_weight__
+    partagree_weight =  self.__calc_partagree_weight__
+    do_winkler =      self.__do_winkler__
+    get_profile =     self.__get_batch_profile__
+    upper_bound =     self.__calc_upper_bound__
+
+    do_caching =      self.do_caching
+    get_from_cache =  self.__get_from_cache__
+    put_into_cache =  self.__put_into_cache__
+
+    pos_dict =    {}  # Character positions of values not prepared
+    weight_dict = {}  # Weights of the distinct value pairs in this batch
+    num_pruned =  0
+
+    weight_array = array.array('d')
+    append_weight = weight_array.append
+
+    for val_pair in zip(vals1, vals2):
+      (val1, val2) = val_pair
+
+      if (val1 in missing_set) or (val2 in missing_set):
+        append_weight(missing_weight)
+        continue
+
+      w = weight_dict.get(val_pair)
+      if (w != None):
+        append_weight(w)
+        continue
+
+      if (multi_word != None) and ((' ' in val1) or (' ' in val2)):
+        w = compare(val1, val2)  # Also uses the cache
+        weight_dict[val_pair] = w
+        append_weight(w)
+        continue
+
+      if (do_caching == True):  # Check if values pair is in the cache
+        w = get_from_cache(val1, val2)
+        if (w != None):
+          weight_dict[val_pair] = w
+          append_weight(w)
+          continue
+
+      if (val1 == val2):
+        w = freq_agree_weight(val1)
+        weight_dict[val_pair] = w
+        append_weight(w)
+        continue
+
+      pos1 = get_profile(val1, pos_dict)
+      pos2 = get_profile(val2, pos_dict)
+
+      if (threshold > 0.0) and \
+         (upper_bound(val1, val2, pos1, pos2) < threshold):
+        num_pruned += 1
+        w = disagree_weight  # Similarity can not reach the threshold
+
+      else:
+        w = do_winkler(val1, val2, pos1, pos2)
+        w = partagree_weight(val1, val2, w)
+
+      if (do_caching == True):  # Put values pair into the cache
+        put_into_cache(val1, val2, w)
+
+      weight_dict[val_pair] = w
+      append_weight(w)
+
+    self.num_pruned += num_pruned
+
+    return weight_array
+
+  # ---------------------------------------------------------------------------
+
+  def __calc_upper_bound__(self, val1, val2, pos1, pos2):
+    """Calculate an upper bound of the Winkler similarity measure for two input
+       strings from their lengths, the number of characters they have in
+       common (ignoring where the characters are in the strings), and the
+       number of same characters at their beginning. Returns 1.0 for strings
+       with less than 4 characters.
+
+       Should not be used from outside the module.
+    """
+
+    len1, len2 = len(val1), len(val2)
+
+    if (len1 < 4) or (len2 < 4):
+      return 1.0
+
+    # The number of common characters, increased by similar characters, can
+    # not be larger than the length of the shorter value
+    #
+    minlen =     min(len1, len2)
+    max_common = stringcmp.jaro_max_common(pos1, pos2)
+
+    if (self.check_sim == True):
+      max_sim_common = 0.7*max_common + 0.3*minlen
+    else:
+      max_sim_common = float(max_common)
+
+    w = 1./3.*(max_sim_common / len1 + max_sim_common / len2 + 1.0)
+
+    same_init = 0
+    if (self.check_init == True):
+      while (same_init < 4) and (val1[same_init] == val2[same_init]):
+        same_init += 1
+      w += same_init*0.1 * (1.0 - w)
+
+    if (self.check_long == True) and (same_init == 0) and (minlen > 4) and \
+       (max_common == minlen):
+      w += (1.0-w) * (minlen-1) / (float(len1)+float(len2)+2)
+
+    return w + 1.0e-09  # Allow for rounding errors
+
+  # ---------------------------------------------------------------------------
+
+  def __calc_profile__(self, val):
+    """Calculate the character positions of a field value. Should not be used
+       from outside the module.
+    """
+
+    return stringcmp.jaro_positions(val)
+
 # =============================================================================
 
 class FieldComparatorQGram(FieldComparatorApproxString):
@@ -2832,6 +4129,28 @@ class FieldComparatorQGram(FieldComparatorApproxString):
 
   # ---------------------------------------------------------------------------
 
+  def __calc_profile__(self, val):
+    """Return a dictionary with the q-grams of a field value (with padding if
+       set) as keys and their counts as values.
+    """
+
+    q = self.q  # Faster access
+
+    if (self.padded == True):
+      qgram_str = (q-1)*self.QGRAM_START_CHAR+val+(q-1)*self.QGRAM_END_CHAR
+    else:
+      qgram_str = val
+
+    qgram_dict = {}
+
+    for i in range(len(qgram_str)-(q-1)):
+      q_gram = qgram_str[i:i+q]
+      qgram_dict[q_gram] = qgram_dict.get(q_gram, 0) + 1
+
+    return qgram_dict
+
+  # ---------------------------------------------------------------------------
+
   def compare(self, val1, val2):
     """Compare two field values using the q-gram approximate string comparator.
     """
@@ -2882,41 +4201,30 @@ class FieldComparatorQGram(FieldComparatorApproxString):
       w = float(max_common_qgram) / float(divisor)    #   in common
 
       if (w  < self.threshold):  # Similariy is smaller than threshold
+        self.num_pruned += 1
         w = self.disagree_weight
 
       else:
 
-        # Add start and end characters (padding) - - - - - - - - - - - - - - -
-        #
-        if (self.padded == True):
-          qgram_str1 = (q-1)*self.QGRAM_START_CHAR+val1+(q-1)* \
-                       self.QGRAM_END_CHAR
-          qgram_str2 = (q-1)*self.QGRAM_START_CHAR+val2+(q-1)* \
-                       self.QGRAM_END_CHAR
-        else:
-          qgram_str1 = val1
-          qgram_str2 = val2
-
-        # Make a list of q-grams for both strings - - - - - - - - - - - - - - -
+        # Get the q-gram profiles of both strings - - - - - - - - - - - - - - -
         #
-        qgram_list1 = [qgram_str1[i:i+q] for i in range(len(qgram_str1)-(q-1))]
-        qgram_list2 = [qgram_str2[i:i+q] for i in range(len(qgram_str2)-(q-1))]
+        qgram_dict1 = self.__get_profile__(val1)
+        qgram_dict2 = self.__get_profile__(val2)
 
         # Get common q-grams  - - - - - - - - - - - - - - - - - - - - - - - - -
         #
         common = 0
 
         if (num_qgram1 < num_qgram2):  # Count using the shorter q-gram list
-          short_qgram_list = qgram_list1
-          long_qgram_list =  qgram_list2
+          short_qgram_dict = qgram_dict1
+          long_qgram_dict =  qgram_dict2
         else:
-          short_qgram_list = qgram_list2
-          long_qgram_list =  qgram_list1
+          short_qgram_dict = qgram_dict2
+          long_qgram_dict =  qgram_dict1
 
-        for q_gram in short_qgram_list:
-          if (q_gram in long_qgram_list):
-            common += 1
-            long_qgram_list.remove(q_gram)  # Remove the counted q-gram
+        for (q_gram, count) in short_qgram_dict.iteritems():
+          if (q_gram in long_qgram_dict):
+            common += min(count, long_qgram_dict[q_gram])
 
         w = float(common) / float(divisor)
 
@@ -3029,6 +4337,32 @@ class FieldComparatorPosQGram(FieldComparatorApproxString):
 
   # ---------------------------------------------------------------------------
 
+  def __calc_profile__(self, val):
+    """Return a dictionary with the q-grams of a field value (with padding if
+       set) as keys and sorted lists of their positions as values.
+    """
+
+    q = self.q  # Faster access
+
+    if (self.padded == True):
+      qgram_str = (q-1)*self.QGRAM_START_CHAR+val+(q-1)*self.QGRAM_END_CHAR
+    else:
+      qgram_str = val
+
+    qgram_dict = {}
+
+    for i in range(len(qgram_str)-(q-1)):
+      q_gram = qgram_str[i:i+q]
+      pos_list = qgram_dict.get(q_gram)
+      if (pos_list == None):
+        qgram_dict[q_gram] = [i]
+      else:
+        pos_list.append(i)
+
+    return qgram_dict
+
+  # ---------------------------------------------------------------------------
+
   def compare(self, val1, val2):
     """Compare two field values using the q-gram approximate string comparator.
     """
@@ -3078,51 +4412,60 @@ class FieldComparatorPosQGram(FieldComparatorApproxString):
       max_common_qgram = min(num_qgram1, num_qgram2)  # Max possible q-grams
       w = float(max_common_qgram) / float(divisor)    # ... in common
 
-      if (w  < self.threshold):  # Similariy is smaller than threshold
-        w = self.disagree_weight
-
-      else:
+      if (w >= self.threshold):
 
-        # Add start and end characters (padding) - - - - - - - - - - - - - - -
+        # Get the positional q-gram profiles of both strings  - - - - - - - - -
         #
-        if (self.padded == True):
-          qgram_str1 = (q-1)*self.QGRAM_START_CHAR+val1+(q-1)* \
-                       self.QGRAM_END_CHAR
-          qgram_str2 = (q-1)*self.QGRAM_START_CHAR+val2+(q-1)* \
-                       self.QGRAM_END_CHAR
+        qgram_dict1 = self.__get_profile__(val1)
+        qgram_dict2 = self.__get_profile__(val2)
+
+        if (num_qgram1 < num_qgram2):  # Count using the shorter q-gram list
+          short_qgram_dict = qgram_dict1
+          long_qgram_dict =  qgram_dict2
         else:
-          qgram_str1 = val1
-          qgram_str2 = val2
+          short_qgram_dict = qgram_dict2
+          long_qgram_dict =  qgram_dict1
 
-        # Make a list of q-grams for both strings - - - - - - - - - - - - - - -
+        # Use the number of common q-grams regardless of their positions to
+        # check if below threshold
         #
-        qgram_list1 = \
-                  [(qgram_str1[i:i+q],i) for i in range(len(qgram_str1)-(q-1))]
-        qgram_list2 = \
-                  [(qgram_str2[i:i+q],i) for i in range(len(qgram_str2)-(q-1))]
+        if (self.threshold > 0.0):
+          max_common_qgram = 0
+          for (q_gram, pos_list) in short_qgram_dict.iteritems():
+            if (q_gram in long_qgram_dict):
+              max_common_qgram += min(len(pos_list),
+                                      len(long_qgram_dict[q_gram]))
+
+          w = float(max_common_qgram) / float(divisor)
+
+      if (w < self.threshold):  # Similariy is smaller than threshold
+        self.num_pruned += 1
+        w = self.disagree_weight
+
+      else:
 
         # Get common q-grams  - - - - - - - - - - - - - - - - - - - - - - - - -
         #
         common = 0
+        max_dist = self.max_dist
 
-        if (num_qgram1 < num_qgram2):  # Count using the shorter q-gram list
-          short_qgram_list = qgram_list1
-          long_qgram_list =  qgram_list2
-        else:
-          short_qgram_list = qgram_list2
-          long_qgram_list =  qgram_list1
+        for (q_gram, pos_list) in short_qgram_dict.iteritems():
+          if (q_gram not in long_qgram_dict):
+            continue
 
-        for pos_q_gram in short_qgram_list:
-          (q_gram,pos) = pos_q_gram
+          long_pos_list = list(long_qgram_dict[q_gram])  # Will be modified
 
-          pos_range = range(max(pos-self.max_dist,0), pos+self.max_dist+1)
-
-          for test_pos in pos_range:
-            test_pos_q_gram = (q_gram,test_pos)
-            if (test_pos_q_gram in long_qgram_list):
-              common += 1
-              long_qgram_list.remove(test_pos_q_gram) # Remove counted q-gram
-              break
+          # Match each position with the first not yet counted position of
+          # the same q-gram within the maximum distance
+          #
+          for pos in pos_list:
+            for long_pos in long_pos_list:
+              if (long_pos > pos+max_dist):
+                break
+              if (long_pos >= pos-max_dist):
+                common += 1
+                long_pos_list.remove(long_pos)  # Remove counted q-gram
+                break
 
         w = float(common) / float(divisor)
 
@@ -3255,56 +4598,83 @@ class FieldComparatorSGram(FieldComparatorApproxString):
     len1 = len(tmp_str1)
     len2 = len(tmp_str2)
 
-    common = 0.0   # Sum number of common s-grams over gram classes
-    divisor = 0.0  # Sum of divisors over gram classes
-
-    for c in self.gram_class_list:  # Loop over all gram classes given - - - -
-
-      sgram_list1 = []
-      sgram_list2 = []
+    # Use the number of s-grams to quickly check if below threshold - - - - - -
+    #
+    max_common = 0  # Maximal number of common s-grams over gram classes
+    divisor =    0.0
 
-      for s in c:  # Skip distances
-        for i in range(0,len1-s-1):
-          sgram_list1.append(tmp_str1[i]+tmp_str1[i+s+1])
-        for i in range(0,len2-s-1):
-          sgram_list2.append(tmp_str2[i]+tmp_str2[i+s+1])
+    for c in self.gram_class_list:
+      num_sgram1 = 0
+      num_sgram2 = 0
 
-      num_sgram1 = len(sgram_list1)
-      num_sgram2 = len(sgram_list2)
+      for s in c:
+        num_sgram1 += max(len1-s-1, 0)
+        num_sgram2 += max(len2-s-1, 0)
 
       if (self.common_divisor == 'average'):
-        this_divisor = 0.5*(num_sgram1+num_sgram2)  # Average num of s-grams
+        divisor += 0.5*(num_sgram1+num_sgram2)
       elif (self.common_divisor == 'shortest'):
-        this_divisor = min(num_sgram1,num_sgram2)
+        divisor += min(num_sgram1,num_sgram2)
       else:  # Longest
-        this_divisor = max(num_sgram1,num_sgram2)
+        divisor += max(num_sgram1,num_sgram2)
 
-      if (num_sgram1 < num_sgram2):  # Count using the shorter s-gram list
-        short_sgram_list = sgram_list1
-        long_sgram_list =  sgram_list2
-      else:
-        short_sgram_list = sgram_list2
-        long_sgram_list =  sgram_list1
+      max_common += min(num_sgram1,num_sgram2)
 
-      this_common = 0  # Number of common s-grams for this gram class
+    if (divisor > 0) and (max_common / divisor < self.threshold):
+      self.num_pruned += 1
+      w = self.disagree_weight  # Similariy is smaller than threshold
 
-      for s_gram in short_sgram_list:
-        if (s_gram in long_sgram_list):
-          this_common += 1
-          long_sgram_list.remove(s_gram)  # Remove the counted s-gram
+    else:
+      common = 0.0   # Sum number of common s-grams over gram classes
+      divisor = 0.0  # Sum of divisors over gram classes
 
-      common +=  this_common
-      divisor += this_divisor
+      for c in self.gram_class_list:  # Loop over all gram classes given - -
 
-    if (divisor == 0):  # One string did not have any s-gram
-      w = 0.0
-    else:
-      w = common / divisor
+        sgram_list1 = []
+        sgram_list2 = []
 
-    assert (w >= 0.0), 'S-gram: Similarity weight < 0.0'
-    assert (w <= 1.0), 'S-gram: Similarity weight > 1.0'
+        for s in c:  # Skip distances
+          for i in range(0,len1-s-1):
+            sgram_list1.append(tmp_str1[i]+tmp_str1[i+s+1])
+          for i in range(0,len2-s-1):
+            sgram_list2.append(tmp_str2[i]+tmp_str2[i+s+1])
 
-    w = self.__calc_partagree_weight__(val1, val2, w)
+        num_sgram1 = len(sgram_list1)
+        num_sgram2 = len(sgram_list2)
+
+        if (self.common_divisor == 'average'):
+          this_divisor = 0.5*(num_sgram1+num_sgram2)  # Average num of s-grams
+        elif (self.common_divisor == 'shortest'):
+          this_divisor = min(num_sgram1,num_sgram2)
+        else:  # Longest
+          this_divisor = max(num_sgram1,num_sgram2)
+
+        if (num_sgram1 < num_sgram2):  # Count using the shorter s-gram list
+          short_sgram_list = sgram_list1
+          long_sgram_list =  sgram_list2
+        else:
+          short_sgram_list = sgram_list2
+          long_sgram_list =  sgram_list1
+
+        this_common = 0  # Number of common s-grams for this gram class
+
+        for s_gram in short_sgram_list:
+          if (s_gram in long_sgram_list):
+            this_common += 1
+            long_sgram_list.remove(s_gram)  # Remove the counted s-gram
+
+        common +=  this_common
+        divisor += this_divisor
+
+      if (divisor == 0):  # One string did not have any s-gram
+        w = 0.0
+      else:
+        w = common / divisor
+
+      assert (w >= 0.0), 'S-gram: Similarity weight < 0.0'
+      assert (w <= 1.0), 'S-gram: Similarity weight > 1.0'
+
+      w = self.__calc_partagree_weight__(val1, val2, w)
 
     if (self.do_caching == True):  # Put values pair into the cache
       self.__put_into_cache__(val1, val2, w)
@@ -3337,6 +4707,15 @@ class FieldComparatorEditDist(FieldComparatorApproxString):
 
   # ---------------------------------------------------------------------------
 
+  def __calc_profile__(self, val):
+    """Calculate the character positions of a field value (used to calculate
+       the bag distance). Should not be used from outside the module.
+    """
+
+    return stringcmp.jaro_positions(val)
+
+  # ---------------------------------------------------------------------------
+
   def compare(self, val1, val2):
     """Compare two field values using the edit-distance (or Levenshtein)
        approximate string comparator.
@@ -3362,48 +4741,66 @@ class FieldComparatorEditDist(FieldComparatorApproxString):
     max_len = max(n,m)
 
     # Quick check if edit distance is below threshold - - - - - - - - - - - - -
+    # (the bag distance, the number of characters that are not common to both
+    # strings, is never larger than the edit distance)
     #
     len_diff = abs(n-m)
     w = 1.0 - float(len_diff) / float(max_len)
 
+    if (w >= self.threshold) and (self.threshold > 0.0):
+      max_common = stringcmp.jaro_max_common(self.__get_profile__(val1),
+                                             self.__get_profile__(val2))
+      w = 1.0 - float(max_len - max_common) / float(max_len)
+
     if (w  < self.threshold):  # Similariy is smaller than threshold
+      self.num_pruned += 1
       w = self.disagree_weight
 
     else: # Calculate the maximum distance possible with this threshold
       max_dist = (1.0-self.threshold)*max_len
 
-      if (n > m):  # Make sure n <= m, to use O(min(n,m)) space
-        str1 = val2
-        str2 = val1
-        n, m = m, n
-      else:
-        str1 = val1
-        str2 = val2
+      if (min(n,m) <= stringcmp.BITPAR_MAX_LEN):  # Bit-parallel kernel
+        dist = stringcmp.bitpar_editdist(val1, val2, max_dist)
+
+        if (dist < 0):  # Distance is already too large
+          w = max(1.0 - float(max_dist+1) / float(max_len), 0.0)
+        else:
+          w = 1.0 - float(dist) / float(max_len)
 
-      current = range(n+1)
+      else:  # Long strings, use dynamic programming
 
-      w = -1  # Set weight to an illegal value (so it can be chacked later)
+        if (n > m):  # Make sure n <= m, to use O(min(n,m)) space
+          str1 = val2
+          str2 = val1
+          n, m = m, n
+        else:
+          str1 = val1
+          str2 = val2
 
-      for i in range(1, m+1):
-        previous = current
-        current =  [i]+n*[0]
-        str2char = str2[i-1]
+        current = range(n+1)
 
-        for j in range(1,n+1):
-          substitute = previous[j-1]
-          if (str1[j-1] != str2char):
-            substitute += 1
+        w = -1  # Set weight to an illegal value (so it can be chacked later)
 
-          # Get minimum of insert, delete and substitute
-          #
-          current[j] = min(previous[j]+1, current[j-1]+1, substitute)
+        for i in range(1, m+1):
+          previous = current
+          current =  [i]+n*[0]
+          str2char = str2[i-1]
 
-        if (min(current) > max_dist):  # Distance is already too large
-          w = max(1.0 - float(max_dist+1) / float(max_len), 0.0)
-          break  # Exit loop
+          for j in range(1,n+1):
+            substitute = previous[j-1]
+            if (str1[j-1] != str2char):
+              substitute += 1
+
+            # Get minimum of insert, delete and substitute
+            #
+            current[j] = min(previous[j]+1, current[j-1]+1, substitute)
+
+          if (min(current) > max_dist):  # Distance is already too large
+            w = max(1.0 - float(max_dist+1) / float(max_len), 0.0)
+            break  # Exit loop
 
-      if (w == -1):  # Weight has not been calculated
-        w = 1.0 - float(current[n]) / float(max_len)
+        if (w == -1):  # Weight has not been calculated
+          w = 1.0 - float(current[n]) / float(max_len)
 
       assert (w >= 0.0), 'Edit distance: Similarity weight < 0.0'
       assert (w <= 1.0), 'Edit distance: Similarity weight > 1.0'
@@ -3446,6 +4843,15 @@ class FieldComparatorDaLeDist(FieldComparatorApproxString):
 
   # ---------------------------------------------------------------------------
 
+  def __calc_profile__(self, val):
+    """Calculate the character positions of a field value (used to calculate
+       the bag distance). Should not be used from outside the module.
+    """
+
+    return stringcmp.jaro_positions(val)
+
+  # ---------------------------------------------------------------------------
+
   def compare(self, val1, val2):
     """Compare two field values using the Damerau-Levenshtein distance
        approximate string comparator.
@@ -3471,66 +4877,84 @@ class FieldComparatorDaLeDist(FieldComparatorApproxString):
     max_len = max(n,m)
 
     # Quick check if Damerau-Levenshtein is below threshold - - - - - - - - - -
+    # (the bag distance, the number of characters that are not common to both
+    # strings, is never larger than the edit distance)
     #
     len_diff = abs(n-m)
     w = 1.0 - float(len_diff) / float(max_len)
 
+    if (w >= self.threshold) and (self.threshold > 0.0):
+      max_common = stringcmp.jaro_max_common(self.__get_profile__(val1),
+                                             self.__get_profile__(val2))
+      w = 1.0 - float(max_len - max_common) / float(max_len)
+
     if (w  < self.threshold):  # Similariy is smaller than threshold
+      self.num_pruned += 1
       w = self.disagree_weight
 
     else: # Calculate the maximum distance possible with this threshold
       max_dist = (1.0-self.threshold)*max_len
 
-      if (n > m):  # Make sure n <= m, to use O(min(n,m)) space
-        str1 = val2
-        str2 = val1
-        n, m = m, n
-      else:
-        str1 = val1
-        str2 = val2
+      if (min(n,m) <= stringcmp.BITPAR_MAX_LEN):  # Bit-parallel kernel
+        dist = stringcmp.bitpar_editdist(val1, val2, max_dist, True)
 
-      d = []  # Table with the full distance matrix
+        if (dist < 0):  # Distance is already too large
+          w = max(1.0 - float(max_dist+1) / float(max_len), 0.0)
+        else:
+          w = 1.0 - float(dist) / float(max_len)
 
-      current = range(n+1)
-      d.append(current)
+      else:  # Long strings, use dynamic programming
 
-      w = -1  # Set weight to an illegal value (so it can be chacked later)
+        if (n > m):  # Make sure n <= m, to use O(min(n,m)) space
+          str1 = val2
+          str2 = val1
+          n, m = m, n
+        else:
+          str1 = val1
+          str2 = val2
 
-      for i in range(1,m+1):
+        d = []  # Table with the full distance matrix
 
-        previous = current
-        current =  [i]+n*[0]
-        str2char = str2[i-1]
+        current = range(n+1)
+        d.append(current)
 
-        for j in range(1,n+1):
-          substitute = previous[j-1]
-          if (str1[j-1] != str2char):
-            substitute += 1
+        w = -1  # Set weight to an illegal value (so it can be chacked later)
 
-          if (i == 1) or (j == 1):  # First characters, no transp possible
+        for i in range(1,m+1):
 
-            # Get minimum of insert, delete and substitute
-            #
-            current[j] = min(previous[j]+1, current[j-1]+1, substitute)
+          previous = current
+          current =  [i]+n*[0]
+          str2char = str2[i-1]
+
+          for j in range(1,n+1):
+            substitute = previous[j-1]
+            if (str1[j-1] != str2char):
+              substitute += 1
+
+            if (i == 1) or (j == 1):  # First characters, no transp possible
+
+              # Get minimum of insert, delete and substitute
+              #
+              current[j] = min(previous[j]+1, current[j-1]+1, substitute)
 
-          else:
-            if (str1[j-2] == str2[i-1]) and (str1[j-1] == str2[i-2]):
-              transpose = d[i-2][j-2] + 1
             else:
-              transpose = d[i-2][j-2] + 3
+              if (str1[j-2] == str2[i-1]) and (str1[j-1] == str2[i-2]):
+                transpose = d[i-2][j-2] + 1
+              else:
+                transpose = d[i-2][j-2] + 3
 
-            current[j] = min(previous[j]+1, current[j-1]+1, substitute, \
-                             transpose)
+              current[j] = min(previous[j]+1, current[j-1]+1, substitute, \
+                               transpose)
 
-        d.append(current)
+          d.append(current)
 
-        if (min(current) > max_dist):  # Distance is already too large
-          w = max(1.0 - float(max_dist+1) / float(max_len), 0.0)
-          break  # Exit loop
+          if (min(current) > max_dist):  # Distance is already too large
+            w = max(1.0 - float(max_dist+1) / float(max_len), 0.0)
+            break  # Exit loop
 
-      if (w == -1):  # Weight has not been calculated
+        if (w == -1):  # Weight has not been calculated
 
-        w = 1.0 - float(current[n]) / float(max_len)
+          w = 1.0 - float(current[n]) / float(max_len)
 
       assert (w >= 0.0), 'DaLe distance: Similarity weight < 0.0'
       assert (w <= 1.0), 'DaLe distance: Similarity weight > 1.0'
@@ -3596,25 +5020,35 @@ class FieldComparatorBagDist(FieldComparatorApproxString):
     n = len(val1)
     m = len(val2)
 
-    list1 = list(val1)
-    list2 = list(val2)
+    # Quick check if bag distance is below threshold - - - - - - - - - - - - -
+    # (the bag distance is never smaller than the difference of the lengths)
+    #
+    w = 1.0 - float(abs(n-m)) / float(max(n,m))
+
+    if (w  < self.threshold):  # Similariy is smaller than threshold
+      self.num_pruned += 1
+      w = self.disagree_weight
+
+    else:
+      list1 = list(val1)
+      list2 = list(val2)
 
-    for ch in val1:
-      if (ch in list2):
-        list2.remove(ch)
+      for ch in val1:
+        if (ch in list2):
+          list2.remove(ch)
 
-    for ch in val2:
-      if (ch in list1):
-        list1.remove(ch)
+      for ch in val2:
+        if (ch in list1):
+          list1.remove(ch)
 
-    b = max(len(list1),len(list2))
+      b = max(len(list1),len(list2))
 
-    w = 1.0 - float(b) / float(max(n,m))
+      w = 1.0 - float(b) / float(max(n,m))
 
-    assert (w >= 0.0), 'Bag distance: Similarity weight < 0.0'
-    assert (w <= 1.0), 'Bag distance: Similarity weight > 1.0'
+      assert (w >= 0.0), 'Bag distance: Similarity weight < 0.0'
+      assert (w <= 1.0), 'Bag distance: Similarity weight > 1.0'
 
-    w = self.__calc_partagree_weight__(val1, val2, w)
+      w = self.__calc_partagree_weight__(val1, val2, w)
 
     if (self.do_caching == True):  # Put values pair into the cache
       self.__put_into_cache__(val1, val2, w)
@@ -3727,57 +5161,71 @@ class FieldComparatorSWDist(FieldComparatorApproxString):
     else:  # Longest
       divisor = max(n,m)*self.match_score
 
-    best_score = 0  # Keep the best score while calculating table
+    # Quick check if below threshold - - - - - - - - - - - - - - - - - - - - -
+    # (the best score is at most the length of the shorter string times the
+    # match score)
+    #
+    if (divisor > 0):
+      w = float(min(n,m)*self.match_score) / float(divisor)
+    else:
+      w = 1.0
 
-    d = []  # Table with the full distance matrix
+    if (w  < self.threshold):  # Similariy is smaller than threshold
+      self.num_pruned += 1
+      w = self.disagree_weight
 
-    for i in range(n+1):  # Initalise table
-      d.append([0.0]*(m+1))
+    else:
+      best_score = 0  # Keep the best score while calculating table
 
-    for i in range(1,n+1):
-      vali1 = val1[i-1]
-      approx_match1 = self.approx_matches.get(vali1,-1)
+      d = []  # Table with the full distance matrix
 
-      for j in range(1,m+1):
-        valj2 = val2[j-1]
+      for i in range(n+1):  # Initalise table
+        d.append([0.0]*(m+1))
 
-        match = d[i-1][j-1]
+      for i in range(1,n+1):
+        vali1 = val1[i-1]
+        approx_match1 = self.approx_matches.get(vali1,-1)
 
-        if (vali1 == valj2):
-          match += self.match_score
-        else:
-          approx_match2 = self.approx_matches.get(valj2,-1)
+        for j in range(1,m+1):
+          valj2 = val2[j-1]
 
-          if (approx_match1 >= 0) and (approx_match2 >= 0) and \
-             (approx_match1 == approx_match2):
-            match += self.approx_score
+          match = d[i-1][j-1]
+
+          if (vali1 == valj2):
+            match += self.match_score
           else:
-            match += self.mismatch_score
+            approx_match2 = self.approx_matches.get(valj2,-1)
+
+            if (approx_match1 >= 0) and (approx_match2 >= 0) and \
+               (approx_match1 == approx_match2):
+              match += self.approx_score
+            else:
+              match += self.mismatch_score
 
-        insert = 0
-        for k in range(1,i):
-          score = d[i-k][j] - self.gap_penalty - k*self.extension_penalty
-          insert = max(insert, score)
+          insert = 0
+          for k in range(1,i):
+            score = d[i-k][j] - self.gap_penalty - k*self.extension_penalty
+            insert = max(insert, score)
 
-        delete = 0
-        for l in range(1,j):
-          score = d[i][j-l] - self.gap_penalty - l*self.extension_penalty
-          delete = max(delete, score)
+          delete = 0
+          for l in range(1,j):
+            score = d[i][j-l] - self.gap_penalty - l*self.extension_penalty
+            delete = max(delete, score)
 
-        d[i][j] = max(match, insert, delete, 0)
-        best_score = max(d[i][j], best_score)
+          d[i][j] = max(match, insert, delete, 0)
+          best_score = max(d[i][j], best_score)
 
-    # best_score can be min(len(str1),len)str2))*match_score (if one string is
-    # a sub-string of the other string)
-    #
-    # The lower best_score the less similar the sequences are.
-    #
-    w = float(best_score) / float(divisor)
+      # best_score can be min(len(str1),len)str2))*match_score (if one string
+      # is a sub-string of the other string)
+      #
+      # The lower best_score the less similar the sequences are.
+      #
+      w = float(best_score) / float(divisor)
 
-    assert (w >= 0.0), 'Smith-Waterman distance: Similarity weight < 0.0'
-    assert (w <= 1.0), 'Smith-Waterman distance: Similarity weight > 1.0'
+      assert (w >= 0.0), 'Smith-Waterman distance: Similarity weight < 0.0'
+      assert (w <= 1.0), 'Smith-Waterman distance: Similarity weight > 1.0'
 
-    w = self.__calc_partagree_weight__(val1, val2, w)
+      w = self.__calc_partagree_weight__(val1, val2, w)
 
     if (self.do_caching == True):  # Put values pair into the cache
       self.__put_into_cache__(val1, val2, w)
@@ -4054,14 +5502,26 @@ class FieldComparatorSeqMatch(FieldComparatorApproxString):
     # Calculate sequence matcher similarity value - - - - - - - - - - - - - - -
     #
     seq_matcher_1 = difflib.SequenceMatcher(None, val1, val2)
-    seq_matcher_2 = difflib.SequenceMatcher(None, val2, val1)
 
-    w = (seq_matcher_1.ratio()+seq_matcher_2.ratio()) / 2.0 # Calc average
+    # Quick check if below threshold using the upper bounds provided by the
+    # sequence matcher (first based on the lengths of the strings, then on
+    # the number of characters they have in common)
+    #
+    if (self.threshold > 0.0) and \
+       ((seq_matcher_1.real_quick_ratio() < self.threshold) or \
+        (seq_matcher_1.quick_ratio() < self.threshold)):
+      self.num_pruned += 1
+      w = self.disagree_weight  # Similariy is smaller than threshold
+
+    else:
+      seq_matcher_2 = difflib.SequenceMatcher(None, val2, val1)
+
+      w = (seq_matcher_1.ratio()+seq_matcher_2.ratio()) / 2.0 # Calc average
 
-    assert (w >= 0.0), 'Python sequence matcher: Similarity weight < 0.0'
-    assert (w <= 1.0), 'Python sequence matcher: Similarity weight > 1.0'
+      assert (w >= 0.0), 'Python sequence matcher: Similarity weight < 0.0'
+      assert (w <= 1.0), 'Python sequence matcher: Similarity weight > 1.0'
 
-    w = self.__calc_partagree_weight__(val1, val2, w)
+      w = self.__calc_partagree_weight__(val1, val2, w)
 
     if (self.do_caching == True):  # Put values pair into the cache
       self.__put_into_cache__(val1, val2, w)
@@ -4295,6 +5755,16 @@ class FieldComparatorLCS(FieldComparatorApproxString):
 
   # ---------------------------------------------------------------------------
 
+  def __calc_profile__(self, val):
+    """Calculate the character positions of a field value (used to calculate
+       the number of characters two values have in common). Should not be used
+       from outside the module.
+    """
+
+    return stringcmp.jaro_positions(val)
+
+  # ---------------------------------------------------------------------------
+
   def __do_lcs__(self, str1, str2):
     """Method to extract longest common substring from the two input strings.
        Returns the common substring, its length, and the two input strings with
@@ -4384,12 +5854,20 @@ class FieldComparatorLCS(FieldComparatorApproxString):
       divisor = max(len1,len2)
 
     # Quick check if below threshold - - - - - - - - - - - - - - - - - - - -
+    # (first using the lengths of the strings, then the number of characters
+    # they have in common)
     #
     max_common_len = min(len1,len2)
 
     w = float(max_common_len) / float(divisor)
 
+    if (w >= self.threshold) and (self.threshold > 0.0):
+      max_common_len = stringcmp.jaro_max_common(self.__get_profile__(val1),
+                                                 self.__get_profile__(val2))
+      w = float(max_common_len) / float(divisor)
+
     if (w  < self.threshold):  # Similariy is smaller than threshold
+      self.num_pruned += 1
       w = self.disagree_weight
 
     else:
@@ -4846,6 +6324,21 @@ class FieldComparatorTokenSet(FieldComparatorApproxString):
 
   # ---------------------------------------------------------------------------
 
+  def __calc_profile__(self, val):
+    """Return the set of tokens of a field value after all stop words have
+       been removed.
+    """
+
+    clean_val = val
+
+    for stop_word in self.stop_word_list:
+      if stop_word in clean_val:
+        clean_val = clean_val.replace(stop_word, '')
+
+    return frozenset(clean_val.split())  # Make the cleaned value a token set
+
+  # ---------------------------------------------------------------------------
+
   def compare(self, val1, val2):
     """Compare two field values using the token approximate string comparator.
     """
@@ -4863,19 +6356,8 @@ class FieldComparatorTokenSet(FieldComparatorApproxString):
     if (val1 == val2):
       return self.__calc_freq_agree_weight__(val1)
 
-    # Remove all stop words - - - - - - - - - - - - - - - - - - - - - - - - - -
-    #
-    clean_val1 = val1
-    clean_val2 = val2
-
-    for stop_word in self.stop_word_list:
-      if stop_word in clean_val1:
-        clean_val1 = clean_val1.replace(stop_word, '')
-      if stop_word in clean_val2:
-        clean_val2 = clean_val2.replace(stop_word, '')
-
-    set1 = set(clean_val1.split())  # Make the cleaned values a set of tokens
-    set2 = set(clean_val2.split())
+    set1 = self.__get_profile__(val1)  # Sets of tokens without stop words
+    set2 = self.__get_profile__(val2)
 
     num_token1 = len(set1)
     num_token2 = len(set2)
@@ -4930,6 +6412,30 @@ class FieldComparatorCharHistogram(FieldComparatorApproxString):
 
   # ---------------------------------------------------------------------------
 
+  def __calc_profile__(self, val):
+    """Return a tuple with the character histogram of a field value and the
+       sum of its squared counts.
+    """
+
+    histo = [0]*37
+
+    for c in val.lower():
+      if (c == ' '):
+        histo[0] += 1
+      elif ((c >= 'a') and (c <= 'z')):  # Count characters
+        histo[ord(c)-96] += 1
+      elif ((c >= '0') and (c <= '9')):  # Count digits
+        histo[ord(c)-21] += 1
+
+    vecsum = 0.0
+
+    for i in range(27):
+      vecsum += histo[i]*histo[i]
+
+    return (histo, vecsum)
+
+  # ---------------------------------------------------------------------------
+
   def compare(self, val1, val2):
     """Compare two field values using the character histogram approximate
        string comparator.
@@ -4948,35 +6454,12 @@ class FieldComparatorCharHistogram(FieldComparatorApproxString):
     if (val1 == val2):
       return self.__calc_freq_agree_weight__(val1)
 
-    histo1 = [0]*37
-    histo2 = [0]*37
-
-    workval1 = val1.lower()
-    workval2 = val2.lower()
-
-    for c in workval1:
-      if (c == ' '):
-        histo1[0] += 1
-      elif ((c >= 'a') and (c <= 'z')):  # Count characters
-        histo1[ord(c)-96] += 1
-      elif ((c >= '0') and (c <= '9')):  # Count digits
-        histo1[ord(c)-21] += 1
-
-    for c in workval2:
-      if (c == ' '):
-        histo2[0] += 1
-      elif ((c >= 'a') and (c <= 'z')):
-        histo2[ord(c)-96] += 1
-      elif ((c >= '0') and (c <= '9')):  # Count digits
-        histo2[ord(c)-21] += 1
+    (histo1, vec1sum) = self.__get_profile__(val1)
+    (histo2, vec2sum) = self.__get_profile__(val2)
 
-    vec1sum =  0.0
-    vec2sum =  0.0
     vec12sum = 0.0
 
     for i in range(27):
-      vec1sum +=  histo1[i]*histo1[i]
-      vec2sum +=  histo2[i]*histo2[i]
       vec12sum += histo1[i]*histo2[i]
 
     if (vec1sum*vec2sum == 0.0):
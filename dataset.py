@@ -138,6 +138,12 @@ class DataSet:
                       empty string. Note that leading and trailing whitespaces
                       will be removed from all strings in this missing values
                       list.
+
+     Record identifiers can be interned into dense integer record numbers
+     (0, 1, 2, ...) using the method intern_rec_ident(), and mapped back to
+     the original record identifiers using the method get_rec_ident(). This
+     is for example used by indices to store and compare record numbers rather
+     than record identifier strings.
 """
 
   # ---------------------------------------------------------------------------
@@ -158,6 +164,10 @@ class DataSet:
 
     self.num_records =  None  # To be set when a data set is initialised
 
+    self.rec_ident_list =     []  # Interned record identifiers, the list
+                                  # index of an identifier is its record number
+    self.rec_ident_num_dict = {}  # Record identifiers and their numbers
+
     # Process base keyword arguments (all data set specific keywords were
     # processed in the derived class constructor)
     #
@@ -270,6 +280,55 @@ class DataSet:
 
   # ---------------------------------------------------------------------------
 
+  def intern_rec_ident(self, rec_ident):
+    """Return the integer record number of the given record identifier. If
+       the record identifier has not been interned before it is given the next
+       free record number.
+    """
+
+    rec_num = self.rec_ident_num_dict.get(rec_ident)
+
+    if (rec_num == None):
+      rec_num = len(self.rec_ident_list)
+      self.rec_ident_list.append(rec_ident)
+      self.rec_ident_num_dict[rec_ident] = rec_num
+
+    return rec_num
+
+  # ---------------------------------------------------------------------------
+
+  def get_rec_ident(self, rec_num):
+    """Return the record identifier of the given (interned) record number.
+    """
+
+    return self.rec_ident_list[rec_num]
+
+  # ---------------------------------------------------------------------------
+
+  def set_rec_ident_list(self, rec_ident_list):
+    """Set the interned record identifiers from the given list (for example
+       as saved with an index). The current interned record identifiers must
+       be the same or a prefix of the given list, otherwise the record numbers
+       already handed out would change, and False is returned. Otherwise True
+       is returned.
+    """
+
+    auxiliary.check_is_list('rec_ident_list', rec_ident_list)
+
+    num_interned = len(self.rec_ident_list)
+
+    if (rec_ident_list[:num_interned] != self.rec_ident_list):
+      return False
+
+    for rec_num in xrange(num_interned, len(rec_ident_list)):
+      rec_ident = rec_ident_list[rec_num]
+      self.rec_ident_list.append(rec_ident)
+      self.rec_ident_num_dict[rec_ident] = rec_num
+
+    return True
+
+  # ---------------------------------------------------------------------------
+
   def analyse(self, sample, word_analysis, log_funct=None, log_num_recs=None):
     """Read the data and analyse a sample (or all) of the records in it.
 
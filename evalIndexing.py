@@ -828,6 +828,27 @@ for ds_name in experiment_name_list:
 
         ds_index_list.append(['q-gram', qgram_index])
 
+  # MinHash LSH indexing - - - - - - - - - - - - - - - - - - - - - - - - - - -
+  #
+  for q in [2,3]:
+    for (num_bands, num_rows) in [(25,4), (20,5), (15,8)]:
+
+      for this_index_def in index_def_list:
+
+        lsh_index = indexing.LSHIndex(desc = 'LSH index: q=%d, bands=%d, ' % \
+                                      (q, num_bands) + 'rows=%d' % (num_rows),
+                                      dataset1 = data_set1,
+                                      dataset2 = data_set2,
+                                      rec_comparator = rec_cmp,
+                                      progress=progress_precentage,
+                                      index_def = this_index_def,
+                                      padd = True,
+                                      q = q,
+                                      num_bands = num_bands,
+                                      num_rows = num_rows)
+
+        ds_index_list.append(['lsh', lsh_index])
+
   # Canopy indexing (threshold based) - - - - - - - - - - - - - - - - - - - - -
   #
   for q in [2,3]:
@@ -932,6 +953,29 @@ for ds_name in experiment_name_list:
 
             ds_index_list.append(['string-map-nn', strmap_index])
 
+  # StringMap indexing using a VP-tree instead of the grid - - - - - - - - - - -
+  #
+  for str_cmp_funct in [('Jaro',stringcmp.jaro),('Bigram',stringcmp.bigram),
+                        ('ED',stringcmp.editdist),('LCS',stringcmp.lcs)]:
+    for canopy_method in [('threshold', 0.95, 0.85), ('threshold', 0.9, 0.8),
+                          ('nearest', 5, 10), ('nearest', 10, 20)]:
+
+      for this_index_def in index_def_list:
+
+        strmap_index = indexing.StringMapIndex(desc='StringMap VP-tree ' + \
+                                  'index: str_cmp=%s, %s' % \
+                                  (str_cmp_funct[0], str(canopy_method)),
+                                  dataset1 = data_set1,
+                                  dataset2 = data_set2,
+                                  rec_comparator = rec_cmp,
+                                  progress=progress_precentage,
+                                  index_def = this_index_def,
+                                  canopy_engine = 'vptree',
+                                  sim_fu = str_cmp_funct[1],
+                                  canopy_m=canopy_method)
+
+        ds_index_list.append(['string-map-vp', strmap_index])
+
   # ---------------------------------------------------------------------------
   # Run experiments for this data set
   #
@@ -1051,6 +1095,12 @@ for ds_name in experiment_name_list:
 
     print '    Pairs completeness:  %.2f %%' % (pc*100.0)
 
+    if (index_name == 'lsh'):  # Estimated from the MinHash band parameters
+      lsh_sim = index_method.get_similarity_threshold()
+      print '    Estimated PC:        %.2f %% (for Jaccard similarity %.2f)' % \
+            (index_method.get_estimated_pairs_completeness(lsh_sim)*100.0,
+             lsh_sim)
+
     pq = float(m) / float(num_rec_pairs)
     print '    Pairs quality:       %.2f %%' % (pq*100.0)
 
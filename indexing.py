@@ -69,6 +69,9 @@
                              index.
      QGramIndex              Allows for fuzzy indexing with 'overlapping'
                              blocks, like clustering.
+     LSHIndex                Approximate nearest neighbour index based on
+                             MinHash locality sensitive hashing of the q-gram
+                             sets of the index variable values.
      CanopyIndex             Based on TF-IDF/Jaccard and canopy clustering.
      StringMapIndex          Based on the string-map multi-dimensional mapping
                              algorithm combined with canopy clustering.
@@ -99,6 +102,8 @@
    - compact  Make the indexing data structures more compact (more efficient
               for accessing the record pairs).
    - run      Run the comparison step (i.e. compare record pairs) on the index.
+              Alternatively, the generator method iter_run() can be used to
+              obtain the weight vectors one record pair at a time.
 
    Main bottlenecks in the implemented indices are:
    - QGramIndex:    Creating of the sub-lists (recursively), especially for
@@ -115,1230 +120,4734 @@
 # =============================================================================
 # Import necessary modules (Python standard modules first, then Febrl modules)
 
+import array
+import atexit
+import collections
+import cPickle
 import csv
+import hashlib
 import heapq
 import gc
+import itertools
 import logging
 import math
+import multiprocessing
+import os
 import random
-import shelve
+import sqlite3
+import sys
+import tempfile
 import time
+import zlib
 
 import auxiliary
 import dataset
 import encode
+import output
 
 # =============================================================================
 
-class Indexing:
-  """Base class for indexing. Handles index initialisation, as well as saving
-     and loading of indices to/from files.
+INDEX_FILE_FORMAT = 'febrl-index-1'  # Format identifier of saved index files
 
-     Indexing (or blocking as it is called in traditional record linkage) is
-     used to reduce the large number of possible record pair comparisons by
-     grouping together records into 'blocks' that are similar according to some
-     criteria.
+COMPARISON_BATCH_SIZE = 1000  # Number of record pairs compared in one batch
+                              # by the record comparator
 
-     Indices have to be defined when an index is initialised. Basically, an
-     index is specific to two fields (one per data set). An index definition is
-     made of a list containing one or more sub-lists each made of:
+NUM_SHARDS_PER_WORKER = 4  # Number of record pair shards created per worker
+                           # process in parallel comparisons (more shards give
+                           # better load balancing between workers)
 
-     1) The name of a field from data set 1 which is used for the index.
+BUILD_CHUNK_SIZE = 1000  # Number of records for which the index variable values
+                         # are calculated together by a build worker process
 
-     2) The name of a field from data set 2 which is used for the index.
+SORTED_RUN_CHUNK_SIZE = 1000  # Number of index entries pickled together into
+                              # sorted run files (and read back at once)
 
-     3) A flag, if set to True and the index value contains more than one word
-        (i.e. contains whitespace characters), then these words will be sorted
-        first (before being possibly reversed and then encoded). For example,
-        a value 'peter a. christen' would be sorted into 'a. christen peter'.
-        If set to False, no such sorting will be done.
+SUB_BLOCK_SEP_STR = chr(0)  # Separator between a block value and the values of
+                            # the sub-block definitions in the block values of
+                            # sub-blocks (sorted directly after their block)
 
-     4) A flag, if set to True the index variable (assumed to be a string) will
-        be reversed before it is used within an index definition, if set to
-        False it is not reversed.
+BLOCK_SAMPLE_SEED = 42  # Seed of the random number generator used to sample
+                        # records from blocks that are too large
 
-     5) A positive integer specifying the maximum length (in characters) of the
-        index variable; or None (no maximum length of the index variable).
+ESTIMATE_SAMPLE_SIZE = 1000  # Default number of records from data set 1 for
+                             # which estimate() counts the record pairs
 
-     6) A list made of a function and its input parameters that will be applied
-        to the data set field values to create an index variable. If this list
-        is empty (or no list is given but None instead), then the field values
-        will be taken directly as index
-        variables.
-        The function can be any function that has a string as its first input
-        argument and returns a string.
+ESTIMATE_BENCH_PAIRS = 1000  # Default number of record pairs compared by each
+                             # field comparator in the estimate() benchmark
 
-     The final index variable values are the concatenated values (possibly with
-     a separator string between as detailed below) of each of the index
-     definitions.
+ESTIMATE_SAMPLE_SEED = 42  # Seed of the random number generator used to sample
+                           # records and record pairs in estimate()
 
-     Here is an example index definition:
+DISK_STORE_BATCH_SIZE = 100000  # Number of index entries (or records) kept in
+                                # memory before they are written into a disk
+                                # based inverted index (or record cache)
 
-       index_def_1 = [['surname','sname',True,True,None,[encode.soundex]],
-                      ['postcode','zipcode',False,False,3,[]]]
+DISK_STORE_SCAN_SIZE = 10000  # Number of rows read at once when the blocks of
+                              # a disk based inverted index are scanned
 
-     For this index, index variables will be the concatenations of the Soundex
-     encoding of the sorted (if containing more than one word) reversed
-     surnames (fields 'surname' in data set 1 and field 'sname' in data set 2)
-     and the first three characters (digits) from the fields 'postcode' from
-     data set 1 and 'zipcode' from data set 2.
+_dict_entry_size = None  # Memory of one dictionary entry (see below)
 
-     So for a record ['peter','meier','2000','sydney'] in data set 1 and a
-     record ['paul','meyer','2010','sydney south'] the following two index
-     variable values will be constructed (and inserted into the index data
-     structure):
+def _get_dict_entry_size():
+  """Return the average memory (in bytes) needed by one entry of a large
+     dictionary (measured once).
+  """
 
-       ['peter','meier','2000',sydney'] ->       'r500'+'200' -> 'r500200'
-       ['paul','meyer','2010','sydney south'] -> 'r500'+'201' -> 'r500201'
+  global _dict_entry_size
 
-     So these two records will (depending upon the index implementation) likely
-     be put into different 'blocks' and therefore not being compared.
+  if (_dict_entry_size == None):
+    _dict_entry_size = sys.getsizeof(dict.fromkeys(xrange(100000))) / 100000.0
 
-     Here is another example:
+  return _dict_entry_size
 
-       index_def_2 = \
-          [['year_of_birth','yob',False,False,None,[encode.get_substring,3,5]],
-           ['locality_name','loc_name',True,True,None,[encode.dmetaphone, 4]]]
+_mp_compare_index = None  # The index whose record pairs are compared by the
+                          # worker processes (inherited when these are forked)
 
-     In this example, the third and fourth year digits extracted from the
-     fields 'year_of_birth' (from data set 1) and 'yob' (from data set 2) will
-     be concatenated with the Double-Metaphone encoding (first 4 characters of
-     the encoding only) of the sorted and reversed values from the fields
-     'locality_name' (from data set 1) and 'loc_name' (from data set 2).
+def _compare_rec_pairs_shard(shard_args):
+  """Compare the record pairs of one shard in a worker process. The argument
+     is a tuple made of the shard (a list of record numbers from data set 1
+     with positions), the normalised length filter percentage and the cut-off
+     threshold.
+  """
 
-     The final index definition given to an index when it is initialised is a
-     list of index definitions, for example:
+  (shard, length_filter_perc, cut_off_threshold) = shard_args
 
-       full_index = indexing.BlockingIndex(description = 'Example full index',
-                                           dataset1 = example_csv_data_set,
-                                           dataset2 = example_csv_data_set,
-                                           index_def = [index_def_1,
-                                                        index_def_2],
-                                           index_sep_str = ' ',
-                                           rec_comparator = example_rec_comp)
+  return _mp_compare_index.__compare_rec_pairs_shard__(shard,
+                                                       length_filter_perc,
+                                                       cut_off_threshold)
 
-     In this example, two indices will be built according to the two index
-     definitions provided.
+_mp_build_index = None  # The index whose index variable values are calculated
+                        # by the build worker processes
 
-     All index classed have the following instance variables, which can be set
-     when an index is initialised:
+def _get_index_values_chunk(chunk_args):
+  """Calculate the index variable values of a chunk of records in a build
+     worker process. The argument is a tuple made of a list of records and the
+     data set number (0 or 1).
 
-       description      A string describing the index
-       dataset1         The first data set the index is built for
-       dataset2         The second data set the index is built for
-       rec_comparator   The record comparator
-       index_def        Definitions of the indexes as described above
-       index_sep_str    A separator string which will be inserted if an index
-                        is made of more than one value. Default is the empty
-                        string ''.
-       skip_missing     A flag, if set to True records which have empty index
-                        variable values will be skipped over, if set to False a
-                        record with an empty indexing variable value will be
-                        included in the index as well. Default value is True
-       log_funct        This can be a Python function or method which will log
-                        (print or save to a file) a progress report message. It
-                        is assumed that this function or method has one input
-                        argument of type string (the message to be printed).
-                        Default is None, in which case the normal logging
-                        module will be used.
-       progress_report  Can be set to a percentage number between 1 and 50 in
-                        which case a progress report is logged during the
-                        record pair comparison stage (in the run() method)
-                        every selected percentage number. Default values is 10.
-                        If set to None no progress report will be logged.
-       weight_vec_file  If this is set to a string (assumed to be a file name)
-                        then the weight vectors will be written into this file
-                        and NOT stored in the weight_vector dictionary. Each
-                        weight vector is a comma separated line containing:
-                          rec_id1, rec_id2, weight1, weight2, ... weightN
-                        Default value is None, in which case the weight vectors
-                        will not be written into a file but returned as a
-                        dictionary.
+     Returns a tuple made of the list of index variable values of the records
+     and the numbers of index variable value cache hits and misses counted for
+     this chunk (with the same layout as the 'index_val_cache_stats' attribute
+     of the index), as a worker only updates its own copy of the counters.
+  """
 
-     Note that skip_missing cannot be set to False for certain index methods,
-     see their documentation for more details.
+  (rec_list, ds_index) = chunk_args
 
-     Both the data sets and the index definitions must be provided when a index
-     is initialised.
+  get_index_values_funct = _mp_build_index.__get_index_values__  # Shorthand
+  index_val_cache_stats =  _mp_build_index.index_val_cache_stats
+
+  for cache_stats_list in index_val_cache_stats:
+    for cache_stats in cache_stats_list:
+      if (cache_stats != None):
+        cache_stats[:] = [0, 0]  # Only count hits and misses of this chunk
+
+  index_val_list = [get_index_values_funct(rec, ds_index) for rec in rec_list]
+
+  return (index_val_list, index_val_cache_stats)
+
+def _remove_sorted_run_files(run_file_list):
+  """Remove the given sorted run files (if they still exist), registered to
+     be called when the program exits.
+  """
+
+  for run_file_name in run_file_list:
+    if (os.path.exists(run_file_name)):
+      os.remove(run_file_name)
+
+# =============================================================================
+
+class DiskStore:
+  """Base class for the disk based inverted index and record cache, which
+     keep their data in a table of an SQLite database file (so they can be
+     larger than the available main memory).
+
+     Entries are first collected in memory and then written into the database
+     in batches of 'batch_size' entries (one transaction per batch). As the
+     data is only needed while an index is used, the database file is cleared
+     when it is opened, and journaling and synchronous writes are switched
+     off.
+
+     If the process is forked (for example by the worker processes of a
+     parallel comparison), the forked process opens its own connection to the
+     database file.
   """
 
   # ---------------------------------------------------------------------------
 
-  def __init__(self, base_kwargs):
-    """Constructor
+  def __init__(self, file_name, batch_size):
+    """Constructor, open (and clear) the database file with the given name.
     """
 
-    # General attributes for all index implementations
-    #
-    self.description =     ''
-    self.dataset1 =        None
-    self.dataset2 =        None
-    self.rec_comparator =  None  # A record comparator
-    self.index_def =       None  # The index definitions
-    self.index_sep_str =   ''    # Separator string for in-between index values
-    self.skip_missing =    True
-    self.progress_report = 10
-    self.log_funct =       None
-    self.weight_vec_file = None
+    auxiliary.check_is_string('file_name', file_name)
+    auxiliary.check_is_integer('batch_size', batch_size)
+    auxiliary.check_is_positive('batch_size', batch_size)
 
-    self.index_def_proc = None        # Processed version of the index
-                                      # definition for faster access to field
-                                      # values
-    self.index1 = {}                  # The index data structure for data set 1
-    self.index2 = {}                  # The index data structure for data set 2
-    self.index1_shelve_name = None    # If the index data structure for data
-                                      # set 1 is to be file (shelve) based this
-                                      # will be it's file name
-    self.index2_shelve_name = None    # Same for data set 2
-    self.rec_cache1 = {}              # A dictionary containing all records
-                                      # from data set 1 with only the fields
-                                      # needed for field comparisons
-    self.rec_cache2 = {}              # Same for data set 2
-    self.rec_cache1_file_name = None  # If the record cache for data sets 1
-                                      # should be file (shelve) based this will
-                                      # be it's file name
-    self.rec_cache2_file_name = None  # Same for data sets 2
-    self.num_rec_pairs = None         # The number of record pairs that will be
-                                      # compared when the run() method is
-                                      # called
-    self.do_deduplication = None      # A Flag, set to True if both data sets
-                                      # are the same
-    self.comp_field_used1 = []        # A list of the fields in data set 1 as
-                                      # used by the record comparator (column
-                                      # indices)
-    self.comp_field_used2 = []        # Same for data set 2
-    self.rec_length_cache = {}        # Used in lenth filtering in run() method
+    self.file_name =  file_name
+    self.batch_size = batch_size
 
-    # Process base keyword arguments (all data set specific keywords were
-    # processed in the derived class constructor)
-    #
-    for (keyword, value) in base_kwargs.items():
+    self.conn =     None  # Connection to the database file, and the process
+    self.conn_pid = None  # that opened it
 
-      if (keyword.startswith('desc')):
-        auxiliary.check_is_string('description', value)
-        self.description = value
+    self.pending =     {}  # Entries not written into the database yet
+    self.num_pending = 0
 
-      elif (keyword == 'dataset1'):
-        auxiliary.check_is_list('Dataset 1 field list', value.field_list)
-        self.dataset1 = value
-      elif (keyword == 'dataset2'):
-        auxiliary.check_is_list('Dataset 2 field list', value.field_list)
-        self.dataset2 = value
+    conn = self.__get_conn__()
 
-      elif (keyword.startswith('index_d')):
-        auxiliary.check_is_list('index_def', value)
-        self.index_def = value
+    conn.execute('DROP TABLE IF EXISTS %s' % (self.table_name))
+    conn.execute('CREATE TABLE %s (%s)' % (self.table_name,
+                                           self.table_columns))
 
-      elif (keyword.startswith('index_sep')):
-        auxiliary.check_is_string('index_sep_str', value)
-        self.index_sep_str = value
+  # ---------------------------------------------------------------------------
 
-      elif (keyword.startswith('index1_she')):
-        auxiliary.check_is_string('index1_shelve_name', value)
-        self.index1_shelve_name = value
-      elif (keyword.startswith('index2_she')):
-        auxiliary.check_is_string('index2_shelve_name', value)
-        self.index2_shelve_name = value
+  def __get_conn__(self):
+    """Return the connection to the database file, and open it if it has not
+       been opened by this process yet.
+    """
 
-      elif (keyword.startswith('rec_cache1_f')):
-        auxiliary.check_is_string('rec_cache1_file_name', value)
-        self.rec_cache1_file_name = value
-      elif (keyword.startswith('rec_cache2_f')):
-        auxiliary.check_is_string('rec_cache2_file_name', value)
-        self.rec_cache2_file_name = value
+    if (self.conn_pid != os.getpid()):
 
-      elif (keyword.startswith('rec_com')):
-        self.rec_comparator = value
+      try:
+        conn = sqlite3.connect(self.file_name, isolation_level = None)
+      except:
+        logging.exception('Cannot open disk store file: "%s"' % \
+                          (str(self.file_name)))
+        raise IOError
 
-      elif (keyword.startswith('skip')):
-        auxiliary.check_is_flag('skip_missing', value)
-        self.skip_missing = value
+      conn.text_factory = str
+      conn.execute('PRAGMA synchronous = OFF')
+      conn.execute('PRAGMA journal_mode = OFF')
 
-      elif (keyword.startswith('progr')):
-        if (value == None):
-          self.progress_report = value
-        else:
-          auxiliary.check_is_integer('progress_report', value)
-          if ((value < 1) or (value > 50)):
-            logging.exception('Illegal value for progress report, must be ' + \
-                              'False or between 1 and 50: "%s"' % \
-                              (str(value)))
-            raise Exception
-          self.progress_report = value
+      self.conn =     conn
+      self.conn_pid = os.getpid()
 
-      elif (keyword.startswith('log_f')):
-        auxiliary.check_is_function_or_method('log_funct', value)
-        self.log_funct =  value
+    return self.conn
 
-      elif (keyword.startswith('weight_v')):
-        if (value != None):
-          auxiliary.check_is_string('weight_vec_file', value)
-        self.weight_vec_file = value
+  # ---------------------------------------------------------------------------
 
-      else:
-        logging.exception('Illegal constructor argument keyword: '+keyword)
-        raise Exception
+  def __write_rows__(self, row_list):
+    """Insert the given rows into the table in one transaction.
+    """
 
-    # Check if the needed attributes are set  - - - - - - - - - - - - - - - - -
-    #
-    auxiliary.check_is_list('index_def', self.index_def)
-    auxiliary.check_is_not_none('rec_comparator', self.rec_comparator)
-    auxiliary.check_is_not_none('Dataset 1', self.dataset1)
-    auxiliary.check_is_not_none('Dataset 2', self.dataset2)
-    auxiliary.check_is_list('Dataset 1 field list', self.dataset1.field_list)
-    auxiliary.check_is_list('Dataset 2 field list', self.dataset2.field_list)
+    conn = self.__get_conn__()
 
-    # Check if the data sets in the record comparator are the same as the ones
-    # give in the index
-    #
-    if (self.rec_comparator.dataset1 != self.dataset1):
-      logging.exception('Data set 1 in record comparator is different from' + \
-                        ' data set 1 in index: "%s" / "%s"' % \
-                        (self.rec_comparator.dataset1, self.dataset1))
-      raise Exception
-    if (self.rec_comparator.dataset2 != self.dataset2):
-      logging.exception('Data set 2 in record comparator is different from' + \
-                        ' data set 2 in index: "%s" / "%s"' % \
-                        (self.rec_comparator.dataset2, self.dataset2))
-      raise Exception
+    conn.execute('BEGIN')
+    conn.executemany('INSERT INTO %s VALUES (?, ?)' % (self.table_name),
+                     row_list)
+    conn.execute('COMMIT')
 
-    # Check if a deduplication will be done or a linkage - - - - - - - - - - -
-    #
-    if (self.dataset1 == self.dataset2):
-      self.do_deduplication = True
-    else:
-      self.do_deduplication = False
+  # ---------------------------------------------------------------------------
 
-    # If indices or record caches are file (shelve) based open these shelves -
-    #
-    if (self.index1_shelve_name != None):
-      self.index1 = self.__open_shelve_file__(self.index1_shelve_name)
-    if (self.index2_shelve_name != None):
-      self.index2 = self.__open_shelve_file__(self.index2_shelve_name)
-    if (self.rec_cache1_file_name != None):
-      self.rec_cache1 = self.__open_shelve_file__(self.rec_cache1_file_name)
-    if (self.rec_cache2_file_name != None):
-      self.rec_cache2 = self.__open_shelve_file__(self.rec_cache2_file_name)
+  def sync(self):
+    """Write all pending entries into the database file.
+    """
 
-    # Extract the field names from the two data set field name lists - - - - -
-    #
-    dataset1_field_names = []
-    dataset2_field_names = []
+    if (self.num_pending > 0):
+      self.__flush__()
 
-    for (field_name, field_data) in self.dataset1.field_list:
-      dataset1_field_names.append(field_name)
+  # ---------------------------------------------------------------------------
 
-    for (field_name, field_data) in self.dataset2.field_list:
-      dataset2_field_names.append(field_name)
+  def clear(self):
+    """Remove all entries.
+    """
 
-    # Get the column indices of the fields used in the record comparator - - -
-    #
-    for (comp,f_ind1,f_ind2) in self.rec_comparator.field_comparison_list:
-      if (f_ind1 not in self.comp_field_used1):
-        self.comp_field_used1.append(f_ind1)
-      if (f_ind2 not in self.comp_field_used2):
-        self.comp_field_used2.append(f_ind2)
-    self.comp_field_used1.sort()
-    self.comp_field_used2.sort()
-
-    # Check if definition of indices is correct and fields are in the data sets
-    #
-    self.index_def_proc = []  # Checked and processed index definitions will be
-                              # added here
+    self.pending =     {}
+    self.num_pending = 0
 
-    for index_def_list in self.index_def:
+    self.__get_conn__().execute('DELETE FROM %s' % (self.table_name))
 
-      auxiliary.check_is_list('Index definition list "%s"' % \
-                              (str(index_def_list)), index_def_list)
+  # ---------------------------------------------------------------------------
 
-      index_def_list_proc = []
+  def close(self):
+    """Write all pending entries and close the database file.
+    """
 
-      for index_def in index_def_list:
+    self.sync()
 
-        auxiliary.check_is_list('Index definition "%s"' % \
-                                (str(index_def)), index_def)
-        if (index_def == []):
-          logging.info('Empty index definition given: %s' % \
-                       (str(self.index_def)))
+    if (self.conn_pid == os.getpid()):
+      self.conn.close()
 
-        # Check the two field names
-        #
-        field_name1 = index_def[0]
-        field_name2 = index_def[1]
+    self.conn =     None
+    self.conn_pid = None
 
-        if (field_name1 not in dataset1_field_names):
-          logging.exception('Field "%s" is not in data set 1 field name ' \
-                            % (field_name1) + 'list: %s' % \
-                            (str(self.dataset1.field_list)))
-          raise Exception
-        field_index1 = dataset1_field_names.index(field_name1)
+  # ---------------------------------------------------------------------------
 
-        if (field_name2 not in dataset2_field_names):
-          logging.exception('Field "%s" is not in data set 2 field name ' \
-                            % (field_name2) + 'list: %s' % \
-                            (str(self.dataset2.field_list)))
-          raise Exception
-        field_index2 = dataset2_field_names.index(field_name2)
+  def get(self, key, default = None):
+    """Return the value of the given key, or the default if the key is not
+       stored.
+    """
 
-        index_def_proc = [field_index1,field_index2] # Processed index def.
+    try:
+      return self[key]
+    except KeyError:
+      return default
 
-        # Check if sort words flag is True or False
-        #
-        auxiliary.check_is_flag('Sort words flag', index_def[2])
-        index_def_proc.append(index_def[2])
+  # ---------------------------------------------------------------------------
 
-        # Check if reverse flag is True or False
-        #
-        auxiliary.check_is_flag('Reverse flag', index_def[3])
-        index_def_proc.append(index_def[3])
+  def pop(self, key, *default):
+    """Remove the given key and return its value (or the default if given and
+       the key is not stored).
+    """
 
-        # Check maximum length is a positive integer or None
-        #
-        if (index_def[4] == None):
-          index_def_proc.append(None)
-        else:
-          auxiliary.check_is_integer('Maximum length', index_def[4])
-          auxiliary.check_is_positive('Maximum length', index_def[4])
-          index_def_proc.append(index_def[4])
+    try:
+      value = self[key]
+    except KeyError:
+      if (default != ()):
+        return default[0]
+      raise
 
-        # Check function definition
-        #
-        if ((index_def[5] != None) and (len(index_def[5]) > 0)):
-          index_funct_def = index_def[5]
-          auxiliary.check_is_function_or_method('Function "%s"' % \
-                           (index_funct_def[0]), index_funct_def[0])
-          index_def_proc.append(index_funct_def)
-        else:
-          index_def_proc.append(None)
+    del self[key]
 
-        index_def_list_proc.append(index_def_proc)
+    return value
 
-      self.index_def_proc.append(index_def_list_proc)
+  # ---------------------------------------------------------------------------
 
-    assert len(self.index_def) == len(self.index_def_proc)
+  def update(self, other_dict):
+    """Store all the key and value pairs of the given dictionary.
+    """
 
-    self.status = 'initialised'  # Status of the index (used by save and load
-                                 # methods)
+    for (key, value) in other_dict.iteritems():
+      self[key] = value
 
   # ---------------------------------------------------------------------------
+  # Further dictionary methods based on iterkeys() and iteritems() (which are
+  # implemented in the derived classes)
 
-  def build(self):
-    """Method to build an index data structure.
-       See implementations in derived classes for details.
-    """
+  def keys(self):
+    return list(self.iterkeys())
 
-    logging.exception('Override abstract method in derived class')
-    raise Exception
+  def values(self):
+    return list(self.itervalues())
 
-  # ---------------------------------------------------------------------------
+  def items(self):
+    return list(self.iteritems())
 
-  def __records_into_inv_index__(self):
-    """Load the records from the data sets and put them into an inverted index
-       data structure.
+  def __iter__(self):
+    return self.iterkeys()
 
-       If both data sets are the same (a deduplication) only insert records
-       from one data set.
+  def itervalues(self):
+    for (key, value) in self.iteritems():
+      yield value
 
-       This method builds an inverted index (one per index definition) as a
-       Python dictionary with the keys being the indexing values (as returned
-       by the _get_index_values__() method.
-    """
+# =============================================================================
 
-    logging.info('Started to build inverted index:')
+class DiskInvertedIndex(DiskStore):
+  """An inverted index with block values as keys and lists of record numbers
+     as values, which is stored in an SQLite database file instead of a
+     dictionary. It is used by the indices if the 'index1_file_name' or
+     'index2_file_name' argument is given.
+
+     The inverted index is built by appending record numbers to the blocks
+     with the append() method. The record numbers of each block in a batch are
+     written as one row (with a binary array of the record numbers), so each
+     block is made of a few rows only. The dictionary methods used by the
+     indices are supported, and iterating over the inverted index (including
+     keys(), itervalues() and iteritems()) scans the blocks sequentially in
+     sorted order of their block values.
+
+     Record number lists returned are new lists, so to change a block the
+     changed list has to be stored again (as with a shelve). The inverted index
+     should not be changed while it is iterated over.
+  """
 
-    num_indices = len(self.index_def)
+  table_name =    'inv_index'
+  table_columns = 'block_val BLOB, rec_nums BLOB'
 
-    # Index data structure for blocks is one dictionary per index - - - - - - -
-    #
-    for i in range(num_indices):
-      self.index1[i] = {}  # Index for data set 1
-      self.index2[i] = {}  # Index for data set 2
+  # ---------------------------------------------------------------------------
 
-    get_index_values_funct = self.__get_index_values__  # Shorthands
-    skip_missing =           self.skip_missing
+  def __init__(self, file_name, batch_size = DISK_STORE_BATCH_SIZE):
+    """Constructor, open (and clear) the database file with the given name.
+    """
 
-    # A list of data structures needed for the build process:
-    # - the index data structure (dictionary)
-    # - the record cache
-    # - the data set to be read
-    # - the comparison fields which are used
-    # - a list index (0 for data set 1, 1 for data set 2)
-    #
-    build_list = [(self.index1, self.rec_cache1, self.dataset1,
-                   self.comp_field_used1, 0)] # For data set 1
+    DiskStore.__init__(self, file_name, batch_size)
 
-    if (self.do_deduplication == False):  # If linkage append data set 2
-      build_list.append((self.index2, self.rec_cache2, self.dataset2,
-                   self.comp_field_used2, 1))
+    self.has_db_index = False  # The database index on the block values is
+                               # only created once the blocks are read
 
-    # Reading loop over all records in one or both data set(s) - - - - - - - -
-    #
-    for (index,rec_cache,dataset,comp_field_used_list,ds_index) in build_list:
+  # ---------------------------------------------------------------------------
 
-      # Calculate a counter for the progress report
-      #
-      if (self.progress_report != None):
-        progress_report_cnt = max(1, int(dataset.num_records / \
-                                     (100.0 / self.progress_report)))
-      else:  # So no progress report is being logged
-        progress_report_cnt = dataset.num_records + 1
+  def append(self, block_val, rec_num):
+    """Append the given record number to the block with the given value.
+    """
 
-      start_time = time.time()
+    rec_nums = self.pending.get(block_val)
+    if (rec_nums == None):
+      rec_nums = array.array('i')
+      self.pending[block_val] = rec_nums
+    rec_nums.append(rec_num)
 
-      rec_read = 0  # Number of records read from data set
+    self.num_pending += 1
 
-      for (rec_ident, rec) in dataset.readall(): # Read all records in data set
+    if (self.num_pending >= self.batch_size):
+      self.__flush__()
 
-        # Extract record fields needed for comparisons (set all others to '')
-        #
-        comp_rec = []
+  # ---------------------------------------------------------------------------
 
-        field_ind = 0
-        for field in rec:
-          if (field_ind in comp_field_used_list):
-            comp_rec.append(field.lower())  # Make them lower case
-          else:
-            comp_rec.append('')
-          field_ind += 1
+  def __flush__(self):
+    """Write the pending record numbers of all blocks (in sorted order of the
+       block values) into the database.
+    """
 
-        rec_cache[rec_ident] = comp_rec  # Put into record cache
+    binary_funct = sqlite3.Binary  # Shorthand
 
-        # Now get the index variable values for this record - - - - - - - - - -
-        #
-        rec_index_val_list = get_index_values_funct(rec, ds_index)
+    self.__write_rows__([(binary_funct(block_val),
+                          binary_funct(rec_nums.tostring())) for \
+                        (block_val, rec_nums) in sorted(self.pending.items())])
 
-        for i in range(num_indices):  # Put record identifier into all indices
+    self.pending =     {}
+    self.num_pending = 0
 
-          this_index = index[i]  # Shorthand
+  # ---------------------------------------------------------------------------
 
-          block_val = rec_index_val_list[i]
+  def __get_read_conn__(self):
+    """Write pending entries and create the database index on the block
+       values (if not done yet) before the blocks are read, and return the
+       connection to the database file.
+    """
 
-          if ((block_val != '') or (skip_missing == False)):
-            block_val_rec_list = this_index.get(block_val, [])
-            block_val_rec_list.append(rec_ident)
-            this_index[block_val] = block_val_rec_list
+    self.sync()
 
-        rec_read += 1
+    conn = self.__get_conn__()
 
-        if ((rec_read % progress_report_cnt) == 0):
-          self.__log_build_progress__(rec_read,dataset.num_records,start_time)
+    if (self.has_db_index == False):
+      conn.execute('CREATE INDEX IF NOT EXISTS inv_index_block_val ON ' + \
+                   'inv_index (block_val)')
+      self.has_db_index = True
 
-      used_sec_str = auxiliary.time_string(time.time()-start_time)
-      rec_time_str = auxiliary.time_string((time.time()-start_time) / \
-                                           dataset.num_records)
-      logging.info('Read and indexed %d records in %s (%s per record)' % \
-                   (dataset.num_records, used_sec_str, rec_time_str))
-      logging.info('')
+    return conn
 
   # ---------------------------------------------------------------------------
-  # Get sub-list functions are used for the q-gram and BigMatch index
-
-  def __get_sublists1__(self, in_list, min_len):
-    """An iterative method to compute all combinations of sub-lists of the list
-       'in_list' of lengths down to 'min_len'.
 
-       This routine seems to be faster for larger 'min_len' values (compared to
-       length of the input list), i.e. which would correspond to less deep
-       recursive levels (that correspond to higher threshold values) compared
-       to the recursive method using sets given below.
-    """
+  def __getitem__(self, block_val):
 
-    all_list = [in_list]
-    in_len =   len(in_list)
+    rec_nums = array.array('i')
+    num_rows = 0
 
-    if (in_len > min_len):
+    for (row_rec_nums,) in self.__get_read_conn__().execute('SELECT ' + \
+        'rec_nums FROM inv_index WHERE block_val = ? ORDER BY rowid',
+        (sqlite3.Binary(block_val),)):
+      rec_nums.fromstring(str(row_rec_nums))
+      num_rows += 1
 
-      for i in xrange(in_len):
+    if (num_rows == 0):
+      raise KeyError(block_val)
 
-        sub_list = in_list[:i]+in_list[i+1:]
+    return rec_nums.tolist()
 
-        if (sub_list not in all_list):
-          all_list.append(sub_list)
+  # ---------------------------------------------------------------------------
 
-        if ((in_len-1) > min_len):
-          for sub_sub_list in self.__get_sublists1__(sub_list, min_len):
+  def __setitem__(self, block_val, rec_num_list):
 
-            if (sub_sub_list not in all_list):
-              all_list.append(sub_sub_list)
+    conn = self.__get_read_conn__()
 
-    return all_list
+    conn.execute('DELETE FROM inv_index WHERE block_val = ?',
+                 (sqlite3.Binary(block_val),))
+    self.__write_rows__([(sqlite3.Binary(block_val),
+                  sqlite3.Binary(array.array('i', rec_num_list).tostring()))])
 
   # ---------------------------------------------------------------------------
 
-  def __get_sublists2__(self, in_list, min_len):
-    """Method to recursively compute all combinations of sub-lists of the list
-       'in_list' of lengths down to 'min_len' using a Python generator.
+  def __delitem__(self, block_val):
 
-       This routine seems to be faster for deeper recursive levels (that
-       correspond to lower threshold values) compared to the iterative method
-       using sets given above.
-    """
+    cursor = self.__get_read_conn__().execute('DELETE FROM inv_index ' + \
+                        'WHERE block_val = ?', (sqlite3.Binary(block_val),))
+    if (cursor.rowcount == 0):
+      raise KeyError(block_val)
 
-    unique_combinations_funct = self.__unique_combinations2__  # Shorthand
+  # ---------------------------------------------------------------------------
 
+  def __contains__(self, block_val):
 
-    all_list = [in_list]
-    in_len =   len(in_list)
+    cursor = self.__get_read_conn__().execute('SELECT 1 FROM inv_index ' + \
+                 'WHERE block_val = ? LIMIT 1', (sqlite3.Binary(block_val),))
 
-    for i in xrange(in_len-1, min_len-1, -1):
+    return (cursor.fetchone() != None)
 
-      for sub_list in unique_combinations_funct(in_list, i):
-        if (sub_list not in all_list):
-          all_list.append(sub_list)
+  # ---------------------------------------------------------------------------
 
-    return all_list
+  def __len__(self):
 
-  # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    cursor = self.__get_read_conn__().execute('SELECT COUNT(DISTINCT ' + \
+                                              'block_val) FROM inv_index')
+    return cursor.fetchone()[0]
 
-  def __unique_combinations__(self, in_list, n):
-    """Get unique combinations of length 'n' of the given input list. Based on
-       a recipe from Activestate Python cookbook, see:
+  # ---------------------------------------------------------------------------
 
-       http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/190465
+  def iterkeys(self):
+    """Yield the block values in sorted order.
     """
 
-    unique_combinations_funct = self.__unique_combinations__  # Shorthand
+    cursor = self.__get_read_conn__().execute('SELECT DISTINCT block_val ' + \
+                                       'FROM inv_index ORDER BY block_val')
 
-    if (n == 0):
-      yield []
-    else:
-      for i in xrange(len(in_list)):
-        for sub_list in unique_combinations_funct(in_list[i+1:],n-1):
-          yield [in_list[i]]+sub_list
+    row_list = cursor.fetchmany(DISK_STORE_SCAN_SIZE)
 
-  # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+    while (row_list != []):
+      for (block_val,) in row_list:
+        yield str(block_val)
 
-  def __unique_combinations2__(self, in_list, n):
-    """Another version from Activestate Python cookbook, see:
+      row_list = cursor.fetchmany(DISK_STORE_SCAN_SIZE)
 
-       http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/66465
+  # ---------------------------------------------------------------------------
 
-       Seems to be of similar speed than the previous function.
+  def iteritems(self):
+    """Scan the blocks sequentially and yield tuples (block value, list of
+       record numbers) in sorted order of the block values.
     """
 
-    unique_combinations_funct = self.__unique_combinations2__  # Shorthand
-
-    for i in xrange(len(in_list)):
-      if (n == 1):
-        yield in_list[i]
-      else:
-        for sub_list in unique_combinations_funct(in_list[i+1:], n-1):
-          yield in_list[i] + sub_list
-
-  # ---------------------------------------------------------------------------
+    cursor = self.__get_read_conn__().execute('SELECT block_val, rec_nums ' + \
+                               'FROM inv_index ORDER BY block_val, rowid')
 
-  def compact(self):
-    """Method to compact an index data structure.
-       See implementations in derived classes for details.
-    """
+    block_val = None  # The block currently being read
+    rec_nums =  None
 
-    logging.exception('Override abstract method in derived class')
-    raise Exception
+    row_list = cursor.fetchmany(DISK_STORE_SCAN_SIZE)
 
-  # ---------------------------------------------------------------------------
+    while (row_list != []):
+      for (row_block_val, row_rec_nums) in row_list:
+        row_block_val = str(row_block_val)
 
-  def __dedup_rec_pairs__(self, rec_id_list, rec_pair_dict):
-    """Create record pairs for a deduplication using the given record
-       identifier list and insert them into the given record pair dictionary.
+        if (row_block_val != block_val):
+          if (block_val != None):
+            yield (block_val, rec_nums.tolist())
+          block_val = row_block_val
+          rec_nums =  array.array('i')
 
-       This version does not modify the input record identifier list. It does
-       create a local copy of the record identifer list which is then sorted.
-    """
+        rec_nums.fromstring(str(row_rec_nums))
 
-    rec_cnt = 1  # Counter for second record identifier
+      row_list = cursor.fetchmany(DISK_STORE_SCAN_SIZE)
 
-    this_rec_id_list = rec_id_list[:]
-    this_rec_id_list.sort()
-    for rec_ident1 in this_rec_id_list:
+    if (block_val != None):
+      yield (block_val, rec_nums.tolist())
 
-      rec_ident2_set = rec_pair_dict.get(rec_ident1, set())
+# =============================================================================
 
-      for rec_ident2 in this_rec_id_list[rec_cnt:]:
+class DiskRecordCache(DiskStore):
+  """A record cache with record numbers as keys and records (lists of field
+     values) as values, which is stored in an SQLite database file instead of
+     a dictionary. It is used by the indices if the 'rec_cache1_file_name' or
+     'rec_cache2_file_name' argument is given.
 
-        assert rec_ident1 != rec_ident2
+     New records are kept in memory (where they can also be read) until
+     'batch_size' records have been added, and are then written (pickled) in
+     one transaction.
+  """
 
-        rec_ident2_set.add(rec_ident2)
+  table_name =    'rec_cache'
+  table_columns = 'rec_num INTEGER PRIMARY KEY, rec BLOB'
 
-      rec_pair_dict[rec_ident1] = rec_ident2_set
+  # ---------------------------------------------------------------------------
 
-      rec_cnt += 1
+  def __init__(self, file_name, batch_size = DISK_STORE_BATCH_SIZE):
+    """Constructor, open (and clear) the database file with the given name.
+    """
 
-    del this_rec_id_list
+    DiskStore.__init__(self, file_name, batch_size)
 
   # ---------------------------------------------------------------------------
 
-  def __link_rec_pairs__(self, rec_id_list1, rec_id_list2, rec_pair_dict):
-    """Create record pairs for a linkage using the given two record identifier
-       lists and insert them into the given record pair dictionary.
+  def __flush__(self):
+    """Write the pending records (in order of their record numbers) into the
+       database.
     """
 
-    for rec_ident1 in rec_id_list1:
-      for rec_ident2 in rec_id_list2:
+    dumps_funct =  cPickle.dumps  # Shorthands
+    binary_funct = sqlite3.Binary
 
-        rec_ident2_set = rec_pair_dict.get(rec_ident1, set())
-        rec_ident2_set.add(rec_ident2)
-        rec_pair_dict[rec_ident1] = rec_ident2_set
+    self.__write_rows__([(rec_num, binary_funct(dumps_funct(rec,
+                          cPickle.HIGHEST_PROTOCOL))) for (rec_num, rec) in \
+                         sorted(self.pending.items())])
+
+    self.pending =     {}
+    self.num_pending = 0
 
   # ---------------------------------------------------------------------------
 
-  def run(self):
-    """Run the record pair comparison accoding to the index.
-       See implementations in derived classes for details.
+  def __write_rows__(self, row_list):
+    """Insert (or replace) the given rows in one transaction.
     """
 
-    logging.exception('Override abstract method in derived class')
-    raise Exception
+    conn = self.__get_conn__()
+
+    conn.execute('BEGIN')
+    conn.executemany('INSERT OR REPLACE INTO rec_cache VALUES (?, ?)',
+                     row_list)
+    conn.execute('COMMIT')
 
   # ---------------------------------------------------------------------------
 
-  def __get_field_names_list__(self):
-    """Returns the list of all field comparison descriptions, to be used when
-       a weight vector file is written.
-    """
-
-    field_names_list = []
-    for field_comp_tuple in self.rec_comparator.field_comparator_list:
-        field_names_list.append(field_comp_tuple[0].description)
-    return field_names_list
-
-  # ---------------------------------------------------------------------------
-
-  def __compare_rec_pairs_from_dict__(self, length_filter_perc = None,
-                                      cut_off_threshold = None):
-    """This method compares all the records pairs in the record pair dictionary
-       and puts the resulting weight vectors into a dictionary which is then
-       returned.
-
-       If the argument 'length_filter_perc' is set to a percentage value
-       between 0.0 and 100.0 the lengths of the concatenated record values in
-       the fields used for comparison will be calculated, and if the difference
-       is larger than the given percentage value the record pair will not be
-       compared. For example, if a record A has values with a total length of
-       12 characters and a record B values with a length of 16 characters, then
-       their percentage difference will be:
-
-          |12-16| / (max(12,16) = 4 / 16 = 0.25 (25%)
-
-       So if the value of 'length_filter_perc' is set to 20 this record pair
-       will be filtered out and not compared.
-
-       Default value for 'length_filter_perc' is None, which means no length
-       filtering will be performed. For more information about filtering in the
-       record linkage process please refer to:
-
-       - Adaptive Filtering for Efficient Record Linkage
-         Lifang Gu and Rohan Baxter,
-         SIAM Data Mining conference, 2004.
-
-       The second argument 'cut_off_threshold' can be set to a numerical value,
-       in which case all compared record pairs with a summed weight vector
-       value less than this threshold will not be stored in the weight vector
-       dictionary. Default value for 'cut_off_threshold' is None, which means
-       all compared record pairs will be stored in the weight vector
-       dictionary.
-    """
-
-    # Check if weight vector file should be written - - - - - - - - - - - - - -
-    #
-    if (self.weight_vec_file != None):
-      try:
-        weight_vec_fp = open(self.weight_vec_file, 'w')
-      except:
-        logging.exception('Cannot write weight vector file: %s' % \
-                          (self.weight_vec_file))
-        raise Exception
-      weight_vec_writer = csv.writer(weight_vec_fp)
-
-      # Write header line with descriptions of field comparisons
-      #
-      weight_vec_header_line = ['rec_id1', 'rec_id2'] + \
-                                self.__get_field_names_list__()
-      weight_vec_writer.writerow(weight_vec_header_line)
-
-    # Calculate a counter for the progress report - - - - - - - - - - - - - - -
-    #
-    if (self.progress_report != None):
-      progress_report_cnt = max(1, int(self.num_rec_pairs / \
-                                   (100.0 / self.progress_report)))
-    else:  # So no progress report is being logged
-      progress_report_cnt = self.num_rec_pairs + 1
-
-    weight_vec_dict = {}  # Dictionary with calculated weight vectors
-    comp_done =       0   # Number of comparisons done
-
-    rec_cache1 =       self.rec_cache1  # Shorthands to make program faster
-    rec_pair_dict =    self.rec_pair_dict
-    rec_comp =         self.rec_comparator.compare
-    rec_length_cache = self.rec_length_cache
+  def __getitem__(self, rec_num):
 
-    # Check length filter and cut-off threshold arguments - - - - - - - - - - -
-    #
-    if (length_filter_perc != None):
-      auxiliary.check_is_percentage('Length filter percentage',
-                                    length_filter_perc)
-      logging.info('  Length filtering set to %.1f%%' % (length_filter_perc))
-      length_filter_perc /= 100.0  # Normalise
-
-    if (cut_off_threshold != None):
-      auxiliary.check_is_number('Cut-off threshold', cut_off_threshold)
-      logging.info('  Cut-off threshold set to: %.2f' % (cut_off_threshold))
-
-    num_rec_pairs_filtered =    0  # Count number of removed record pairs
-    num_rec_pairs_below_thres = 0
+    rec = self.pending.get(rec_num)
 
-    # Set shorthand depending upon deduplication or linkage - - - - - - - - - -
-    #
-    if (self.do_deduplication == True):  # A deduplication run
-      rec_cache2 = self.rec_cache1
-    else:
-      rec_cache2 = self.rec_cache2
+    if (rec != None):
+      return rec
 
-    start_time = time.time()
+    row = self.__get_conn__().execute('SELECT rec FROM rec_cache WHERE ' + \
+                                      'rec_num = ?', (rec_num,)).fetchone()
+    if (row == None):
+      raise KeyError(rec_num)
 
-    for rec_ident1 in rec_pair_dict:
+    return cPickle.loads(str(row[0]))
 
-      rec1 = rec_cache1[rec_ident1]  # Get the actual first record
+  # ---------------------------------------------------------------------------
 
-      if (length_filter_perc != None):
-        rec1_len = len(''.join(rec1))  # Get length in characters for record
+  def __setitem__(self, rec_num, rec):
 
-      for rec_ident2 in rec_pair_dict[rec_ident1]:
+    if (rec_num not in self.pending):
+      self.num_pending += 1
+    self.pending[rec_num] = rec
 
-        rec2 = rec_cache2[rec_ident2]  # Get actual second record
+    if (self.num_pending >= self.batch_size):
+      self.__flush__()
 
-        do_comp = True  # Flag, specify if comparison should be done
+  # ---------------------------------------------------------------------------
 
-        if (length_filter_perc != None):
-          if (rec_ident2 in rec_length_cache):  # Length is cached
-            rec2_len = rec_length_cache[rec_ident2]
-          else:
-            rec2_len = len(''.join(rec2))
-            rec_length_cache[rec_ident2] = rec2_len
+  def __delitem__(self, rec_num):
 
-          perc_diff = float(abs(rec1_len - rec2_len)) / max(rec1_len, rec2_len)
+    self.sync()
 
-          if (perc_diff > length_filter_perc):
-            do_comp = False  # Difference too large, don't do comparison
-            num_rec_pairs_filtered += 1
+    cursor = self.__get_conn__().execute('DELETE FROM rec_cache WHERE ' + \
+                                         'rec_num = ?', (rec_num,))
+    if (cursor.rowcount == 0):
+      raise KeyError(rec_num)
 
-        if (do_comp == True):
-          w_vec = rec_comp(rec1, rec2)  # Compare them
+  # ---------------------------------------------------------------------------
 
-          if (cut_off_threshold == None) or (sum(w_vec) >= cut_off_threshold):
+  def __contains__(self, rec_num):
 
-            # Put result into weight vector dictionary
-            #
-            if (self.weight_vec_file == None):
-              weight_vec_dict[(rec_ident1, rec_ident2)] = w_vec
-            else:
-              weight_vec_writer.writerow([rec_ident1, rec_ident2]+w_vec)
+    if (rec_num in self.pending):
+      return True
 
-          else:
-            num_rec_pairs_below_thres += 1
+    cursor = self.__get_conn__().execute('SELECT 1 FROM rec_cache WHERE ' + \
+                                         'rec_num = ?', (rec_num,))
 
-        comp_done += 1  # Count all record pair comparisons (even if not done)
+    return (cursor.fetchone() != None)
 
-        if ((comp_done % progress_report_cnt) == 0):
-          self.__log_comparison_progress__(comp_done, start_time)
+  # ---------------------------------------------------------------------------
 
-    used_sec_str = auxiliary.time_string(time.time()-start_time)
-    rec_time_str = auxiliary.time_string((time.time()-start_time) / \
-                                         self.num_rec_pairs)
-    logging.info('Compared %d record pairs in %s (%s per pair)' % \
-                 (self.num_rec_pairs, used_sec_str,rec_time_str))
-    if (length_filter_perc != None):
-      logging.info('  Length filtering (set to %.1f%%) filtered %d record ' % \
-                   (length_filter_perc*100, num_rec_pairs_filtered) + 'pairs')
-    if (cut_off_threshold != None):
-      logging.info('  %d record pairs had summed weights below threshold ' % \
-                   (num_rec_pairs_below_thres) + '%.2f' % (cut_off_threshold))
+  def __len__(self):
 
-    memory_usage_str = auxiliary.get_memory_usage()
-    if (memory_usage_str != None):
-      logging.info('  '+memory_usage_str)
+    self.sync()
 
-    if (self.weight_vec_file == None):
-      return [self.__get_field_names_list__(), weight_vec_dict]
-    else:
-      weight_vec_fp.close()
-      return None
+    return self.__get_conn__().execute('SELECT COUNT(*) FROM ' + \
+                                       'rec_cache').fetchone()[0]
 
   # ---------------------------------------------------------------------------
 
-  def __find_closest__(self, sorted_list, elem):
-    """Binary search of the given element 'elem' in the given sorted list, and
-       return index of exact match or closest match (before where the element
-       would be).
-
-       Used in BigMatch and Dedup indexing methods.
+  def iterkeys(self):
+    """Yield the record numbers in sorted order.
     """
 
-    start = 0
-    end =   len(sorted_list)-1
-
-    while 1:
-      if (end < start):
-        return end  # Not found
-
-      middle = (start + end) / 2
-      middle_val = sorted_list[middle]  # Get the element from the middle
+    self.sync()
 
-      if (middle_val == elem):  # Found the key value
-        return middle
-      elif (elem < middle_val):
-        end = middle - 1
-      else:
-        start = middle + 1
+    cursor = self.__get_conn__().execute('SELECT rec_num FROM rec_cache ' + \
+                                         'ORDER BY rec_num')
 
-  # ---------------------------------------------------------------------------
+    row_list = cursor.fetchmany(DISK_STORE_SCAN_SIZE)
 
-  def load(self, index_file_name):
-    """Load a previously saved index from a binary file.
-    """
+    while (row_list != []):
+      for (rec_num,) in row_list:
+        yield rec_num
 
-    pass  # To be done
+      row_list = cursor.fetchmany(DISK_STORE_SCAN_SIZE)
 
   # ---------------------------------------------------------------------------
 
-  def save(self, index_file_name):
-    """Save an index into a binary file.
+  def iteritems(self):
+    """Yield tuples (record number, record) in order of the record numbers.
     """
 
-    pass  # To be done
+    self.sync()
 
-    # have to check that data sets are the same (have same field lists)
+    cursor = self.__get_conn__().execute('SELECT rec_num, rec FROM ' + \
+                                         'rec_cache ORDER BY rec_num')
 
-  # ---------------------------------------------------------------------------
+    row_list = cursor.fetchmany(DISK_STORE_SCAN_SIZE)
 
-  def __get_index_values__(self, rec, data_set_num):
-    """For the given record (list of fields) extract and produce the indexing
-       values. Returns a list with the indexing variable values (one per index
-       definition).
+    while (row_list != []):
+      for (rec_num, rec) in row_list:
+        yield (rec_num, cPickle.loads(str(rec)))
 
-       The data set number can be 0 (if the record is from the first data set)
-       or 1 (if it is from the second data set).
-    """
+      row_list = cursor.fetchmany(DISK_STORE_SCAN_SIZE)
 
-    index_var_values = []
+# =============================================================================
 
-    sep_str = self.index_sep_str
+class Indexing:
+  """Base class for indexing. Handles index initialisation, as well as saving
+     and loading of indices to/from files.
 
-    assert (data_set_num == 0) or (data_set_num == 1)
+     Indexing (or blocking as it is called in traditional record linkage) is
+     used to reduce the large number of possible record pair comparisons by
+     grouping together records into 'blocks' that are similar according to some
+     criteria.
 
-    # Go through the index definitions and extract and process field values - -
-    #
-    for index_def_list in self.index_def_proc:
+     Indices have to be defined when an index is initialised. Basically, an
+     index is specific to two fields (one per data set). An index definition is
+     made of a list containing one or more sub-lists each made of:
 
-      index_val_list = []
+     1) The name of a field from data set 1 which is used for the index.
 
-      for index_def in index_def_list:  # Loop over all the index' definitions
+     2) The name of a field from data set 2 which is used for the index.
 
-        field_col = index_def[data_set_num]  # Column of the field to extract
+     3) A flag, if set to True and the index value contains more than one word
+        (i.e. contains whitespace characters), then these words will be sorted
+        first (before being possibly reversed and then encoded). For example,
+        a value 'peter a. christen' would be sorted into 'a. christen peter'.
+        If set to False, no such sorting will be done.
 
-        if (field_col >= len(rec)):
-          field_val = ''
-        else:
-          field_val = rec[field_col].lower()
+     4) A flag, if set to True the index variable (assumed to be a string) will
+        be reversed before it is used within an index definition, if set to
+        False it is not reversed.
 
-        if (field_val != ''):  # Field value is not empty
+     5) A positive integer specifying the maximum length (in characters) of the
+        index variable; or None (no maximum length of the index variable).
 
-          # Check for sorting of words
-          #
-          if ((' ' in field_val) and (index_def[2] == True)):
-            word_list = field_val.split()
-            word_list.sort()
-            field_val = ' '.join(word_list)
-
-          if (index_def[3] == True):  # Reverse the index value
-            field_val = field_val[::-1]
-
-          funct_def = index_def[5]
-
-          if (funct_def != None):  # There is a function defined for this index
-            funct_call =    funct_def[0]  # The function itself
-            num_funct_arg = len(funct_def)
-
-            if (num_funct_arg == 1):  # No arguments
-              funct_val = funct_call(field_val)
-            elif (num_funct_arg == 2):  # One argument
-              funct_val = funct_call(field_val, funct_def[1])
-            elif (num_funct_arg == 3):  # Two arguments
-              funct_val = funct_call(field_val, funct_def[1], funct_def[2])
-            elif (num_funct_arg == 4):  # Three arguments
-              funct_val = funct_call(field_val, funct_def[1], funct_def[2],
-                                     funct_def[3])
-            else:
-              logging.exception('Too many arguments for function call: %s' % \
-                                (str(funct_def)))
-              raise Exception
-          else:
-           funct_val = field_val  # No function applied to the field value
+     6) A list made of a function and its input parameters that will be applied
+        to the data set field values to create an index variable. If this list
+        is empty (or no list is given but None instead), then the field values
+        will be taken directly as index
+        variables.
+        The function can be any function that has a string as its first input
+        argument and returns a string.
 
-          if (index_def[4] != None):  # There is  maximum length
-            funct_val = funct_val[:index_def[4]]
+     7) Optionally, a flag, if set to True the function (and thus the index
+        variable value) only depends upon the field value, so the processed
+        values can be cached (see argument 'index_val_cache_size' below). If
+        set to False the function is called for every record. If not given,
+        functions from the encode module are assumed to be pure (True), while
+        all other functions are not (False). Note that index definitions
+        without a function are always cached.
 
-          index_val_list.append(funct_val)
+     The final index variable values are the concatenated values (possibly with
+     a separator string between as detailed below) of each of the index
+     definitions.
 
-      # Make it a string and add to list of index values
-      #
-      index_val = sep_str.join(index_val_list)
+     Here is an example index definition:
 
-      index_var_values.append(index_val)
+       index_def_1 = [['surname','sname',True,True,None,[encode.soundex]],
+                      ['postcode','zipcode',False,False,3,[]]]
 
-    assert len(index_var_values) == len(self.index_def_proc)
+     For this index, index variables will be the concatenations of the Soundex
+     encoding of the sorted (if containing more than one word) reversed
+     surnames (fields 'surname' in data set 1 and field 'sname' in data set 2)
+     and the first three characters (digits) from the fields 'postcode' from
+     data set 1 and 'zipcode' from data set 2.
 
-    return index_var_values
+     So for a record ['peter','meier','2000','sydney'] in data set 1 and a
+     record ['paul','meyer','2010','sydney south'] the following two index
+     variable values will be constructed (and inserted into the index data
+     structure):
 
-  # ---------------------------------------------------------------------------
+       ['peter','meier','2000',sydney'] ->       'r500'+'200' -> 'r500200'
+       ['paul','meyer','2010','sydney south'] -> 'r500'+'201' -> 'r500201'
 
-  def __open_shelve_file__(self, shelve_file_name):
-    """Open a shelve with the given file name, and clear all it's content.
+     So these two records will (depending upon the index implementation) likely
+     be put into different 'blocks' and therefore not being compared.
 
-       Return the shelve.
-    """
+     Here is another example:
 
-    try:
-      this_shelve = shelve.open(shelve_file_name)
-    except:
-      logging.exception('Cannot open shelve: "%s"' % str(shelve_file_name))
-      raise Exception
+       index_def_2 = \
+          [['year_of_birth','yob',False,False,None,[encode.get_substring,3,5]],
+           ['locality_name','loc_name',True,True,None,[encode.dmetaphone, 4]]]
 
-    for rec_key in this_shelve:  # Now clear the shelve and remove all entries
+     In this example, the third and fourth year digits extracted from the
+     fields 'year_of_birth' (from data set 1) and 'yob' (from data set 2) will
+     be concatenated with the Double-Metaphone encoding (first 4 characters of
+     the encoding only) of the sorted and reversed values from the fields
+     'locality_name' (from data set 1) and 'loc_name' (from data set 2).
 
-        del this_shelve[rec_key]
+     The final index definition given to an index when it is initialised is a
+     list of index definitions, for example:
 
-    this_shelve.sync()  # And make sure the database is updated
+       full_index = indexing.BlockingIndex(description = 'Example full index',
+                                           dataset1 = example_csv_data_set,
+                                           dataset2 = example_csv_data_set,
+                                           index_def = [index_def_1,
+                                                        index_def_2],
+                                           index_sep_str = ' ',
+                                           rec_comparator = example_rec_comp)
 
-    return this_shelve
+     In this example, two indices will be built according to the two index
+     definitions provided.
 
-  # ---------------------------------------------------------------------------
+     All index classed have the following instance variables, which can be set
+     when an index is initialised:
 
-  def __log_build_progress__(self, records_read, num_records, start_time):
-    """Create a log message for the number of records read and indexed so far,
+       description      A string describing the index
+       dataset1         The first data set the index is built for
+       dataset2         The second data set the index is built for
+       rec_comparator   The record comparator
+       index_def        Definitions of the indexes as described above
+       index_sep_str    A separator string which will be inserted if an index
+                        is made of more than one value. Default is the empty
+                        string ''.
+       skip_missing     A flag, if set to True records which have empty index
+                        variable values will be skipped over, if set to False a
+                        record with an empty indexing variable value will be
+                        included in the index as well. Default value is True
+       log_funct        This can be a Python function or method which will log
+                        (print or save to a file) a progress report message. It
+                        is assumed that this function or method has one input
+                        argument of type string (the message to be printed).
+                        Default is None, in which case the normal logging
+                        module will be used.
+       progress_report  Can be set to a percentage number between 1 and 50 in
+                        which case a progress report is logged during the
+                        record pair comparison stage (in the run() method)
+                        every selected percentage number. Default values is 10.
+                        If set to None no progress report will be logged.
+       weight_vec_file  If this is set to a string (assumed to be a file name)
+                        then the weight vectors will be written into this file
+                        and NOT stored in the weight_vector dictionary. Each
+                        weight vector is a comma separated line containing:
+                          rec_id1, rec_id2, weight1, weight2, ... weightN
+                        If the file name ends with '.bin' the weight vectors
+                        are instead written into a binary file (see
+                        output.SaveWeightVectorBinaryFile for details).
+                        Default value is None, in which case the weight vectors
+                        will not be written into a file but returned as a
+                        dictionary.
+       weight_vec_store A flag, if set to True the weight vectors returned by
+                        the run() method will be stored in a compact weight
+                        vector store (see auxiliary.WeightVectorStore) instead
+                        of a dictionary. Default value is False.
+       index_val_cache_size  The maximum number of field values per index
+                        definition whose processed index variable values are
+                        kept in a cache (so the encoding functions are not
+                        called again for repeated values). Once a cache is full
+                        no more values are added to it. If set to 0 no values
+                        will be cached. Default value is 100000.
+       build_workers    The number of worker processes used to calculate the
+                        index variable values of the records (including any
+                        encoding functions) when an index is built. The data
+                        sets are still read (and the index data structures
+                        filled) by the main process, in the same record order
+                        as without workers. This is used by all indices that
+                        build an inverted index from the index variable values
+                        (such as the blocking, sorting, q-gram and suffix
+                        array indices). Default value is 1 (no workers).
+       max_block_size   The maximum number of records (from each data set) in
+                        a block. Larger blocks (for example the blocks of very
+                        common surnames, or of empty values if skip_missing is
+                        set to False) are handled according to 'block_policy'
+                        before any record pairs are generated from them. This
+                        is used by the blocking, sorting, q-gram, BigMatch and
+                        Dedup indices. Default value is None (no maximum block
+                        size).
+       block_policy     How blocks with more than 'max_block_size' records are
+                        handled. Possible values are 'cap' (the block is
+                        removed), 'sample' (a random sample of 'max_block_size'
+                        records from each data set is kept, using a fixed
+                        seed), or 'subblock' (the block is split into
+                        sub-blocks according to the values of the first
+                        sub-block definition, sub-blocks that are still too
+                        large are split according to the second definition,
+                        and so on, and sub-blocks that are still too large
+                        after the last definition are removed). Default value
+                        is 'cap'.
+       sub_block_def    A list of index definitions (each in the same format as
+                        the index definitions in 'index_def') which are used to
+                        split blocks with the 'subblock' block policy. Default
+                        is an empty list.
+       index1_file_name If set to a string (assumed to be a file name prefix),
+                        the inverted indices of data set 1 are disk based
+                        instead of dictionaries (see DiskInvertedIndex), with
+                        one SQLite database file per index definition (named
+                        with the prefix followed by '-' and the number of the
+                        index definition). This is used by all indices that
+                        build an inverted index from the index variable values
+                        (such as the blocking, sorting and q-gram indices).
+                        Default value is None (inverted indices in memory).
+       index2_file_name Same for data set 2.
+       rec_cache1_file_name  If set to a string (assumed to be a file name),
+                        the record cache of data set 1 is disk based (see
+                        DiskRecordCache) instead of a dictionary. Default value
+                        is None (record cache in memory).
+       rec_cache2_file_name  Same for data set 2.
+       prepare_comparators  A flag, if set to True the field comparators of the
+                        record comparator are prepared (see
+                        comparison.RecordComparator.prepare()) with the
+                        distinct field values of all records in the record
+                        caches before the record pairs are compared, so that
+                        comparison profiles (such as q-grams, token sets or
+                        phonetic encodings) are only calculated once per value.
+                        This is used by all indices that compare the record
+                        pairs from a compacted record pair dictionary. Default
+                        value is False.
+
+     Note that skip_missing cannot be set to False for certain index methods,
+     see their documentation for more details.
+
+     A histogram of the block sizes of each index (and the number of blocks
+     larger than 'max_block_size') is logged by the compact() method before
+     any record pairs are generated, and kept in the 'block_size_hist'
+     attribute.
+
+     After an index has been built, its estimate() method can be used to
+     estimate the number of record pairs, the memory needed and the time to
+     compare them (from a sample of records and a benchmark of the field
+     comparators), before compact() generates the record pairs.
+
+     The run() method of all indices that compare the record pairs from a
+     compacted record pair dictionary (all except FullIndex, BigMatchIndex and
+     DedupIndex) takes an optional argument 'num_workers', which if set to a
+     number larger than 1 will compare the record pairs in parallel using this
+     number of worker processes.
+
+     Both the data sets and the index definitions must be provided when a index
+     is initialised.
+  """
+
+  # ---------------------------------------------------------------------------
+
+  def __init__(self, base_kwargs):
+    """Constructor
+    """
+
+    # General attributes for all index implementations
+    #
+    self.description =     ''
+    self.dataset1 =        None
+    self.dataset2 =        None
+    self.rec_comparator =  None  # A record comparator
+    self.index_def =       None  # The index definitions
+    self.index_sep_str =   ''    # Separator string for in-between index values
+    self.skip_missing =    True
+    self.progress_report = 10
+    self.log_funct =       None
+    self.weight_vec_file = None
+    self.weight_vec_store = False
+    self.build_workers =   1
+    self.index_val_cache_size = 100000
+    self.max_block_size =  None
+    self.block_policy =    'cap'
+    self.sub_block_def =   []
+    self.prepare_comparators = False
+
+    self.index_val_funct_list = None  # For each index definition a list of
+                                      # functions that calculate the index
+                                      # variable values from field values
+    self.index_val_cache_stats = None # Number of cache hits and misses for
+                                      # each of these functions
+
+    self.index_def_proc = None        # Processed version of the index
+                                      # definition for faster access to field
+                                      # values
+    self.sub_block_def_proc = []      # Same for the sub-block definitions
+    self.sub_block_val_funct_list = []  # And their index value functions
+    self.sub_block_vals1 = {}         # For the 'subblock' block policy, the
+                                      # tuples of sub-block values of all
+                                      # records from data set 1
+    self.sub_block_vals2 = {}         # Same for data set 2
+    self.block_size_hist = {}         # Block size histograms (one per index)
+    self.block_guard_stats = [0, 0]   # Number of blocks that were too large,
+                                      # and number of (sub-)blocks removed
+    self.block_guard_random = None    # Random number generator for sampling
+    self.index1 = {}                  # The index data structure for data set 1
+    self.index2 = {}                  # The index data structure for data set 2
+    self.index1_file_name = None      # If the inverted indices for data set 1
+                                      # are to be disk based this will be their
+                                      # file name prefix
+    self.index2_file_name = None      # Same for data set 2
+    self.rec_cache1 = {}              # A dictionary containing all records
+                                      # from data set 1 with only the fields
+                                      # needed for field comparisons
+    self.rec_cache2 = {}              # Same for data set 2
+    self.rec_cache1_file_name = None  # If the record cache for data sets 1
+                                      # should be disk based (DiskRecordCache)
+                                      # this will be it's file name
+    self.rec_cache2_file_name = None  # Same for data sets 2
+    self.num_rec_pairs = None         # The number of record pairs that will be
+                                      # compared when the run() method is
+                                      # called
+    self.rec_pair_dict = None         # Record pairs to be compared, generated
+                                      # by the compact() method
+    self.do_deduplication = None      # A Flag, set to True if both data sets
+                                      # are the same
+    self.comp_field_used1 = []        # A list of the fields in data set 1 as
+                                      # used by the record comparator (column
+                                      # indices)
+    self.comp_field_used2 = []        # Same for data set 2
+    self.rec_length_cache = {}        # Used in lenth filtering in run() method
+    self.sorted_run_files = {}        # For streaming indices, lists (one per
+                                      # index) of the names of the temporary
+                                      # files containing sorted runs of index
+                                      # entries
+    self.num_sorted_entries = {}      # Number of entries in the sorted runs
+                                      # of each index
+
+    # Process base keyword arguments (all data set specific keywords were
+    # processed in the derived class constructor)
+    #
+    for (keyword, value) in base_kwargs.items():
+
+      if (keyword.startswith('desc')):
+        auxiliary.check_is_string('description', value)
+        self.description = value
+
+      elif (keyword == 'dataset1'):
+        auxiliary.check_is_list('Dataset 1 field list', value.field_list)
+        self.dataset1 = value
+      elif (keyword == 'dataset2'):
+        auxiliary.check_is_list('Dataset 2 field list', value.field_list)
+        self.dataset2 = value
+
+      elif (keyword.startswith('index_d')):
+        auxiliary.check_is_list('index_def', value)
+        self.index_def = value
+
+      elif (keyword.startswith('index_sep')):
+        auxiliary.check_is_string('index_sep_str', value)
+        self.index_sep_str = value
+
+      elif (keyword.startswith('index1_f') or \
+            keyword.startswith('index1_she')):
+        auxiliary.check_is_string('index1_file_name', value)
+        self.index1_file_name = value
+      elif (keyword.startswith('index2_f') or \
+            keyword.startswith('index2_she')):
+        auxiliary.check_is_string('index2_file_name', value)
+        self.index2_file_name = value
+
+      elif (keyword.startswith('rec_cache1_f')):
+        auxiliary.check_is_string('rec_cache1_file_name', value)
+        self.rec_cache1_file_name = value
+      elif (keyword.startswith('rec_cache2_f')):
+        auxiliary.check_is_string('rec_cache2_file_name', value)
+        self.rec_cache2_file_name = value
+
+      elif (keyword.startswith('rec_com')):
+        self.rec_comparator = value
+
+      elif (keyword.startswith('skip')):
+        auxiliary.check_is_flag('skip_missing', value)
+        self.skip_missing = value
+
+      elif (keyword.startswith('progr')):
+        if (value == None):
+          self.progress_report = value
+        else:
+          auxiliary.check_is_integer('progress_report', value)
+          if ((value < 1) or (value > 50)):
+            logging.exception('Illegal value for progress report, must be ' + \
+                              'False or between 1 and 50: "%s"' % \
+                              (str(value)))
+            raise Exception
+          self.progress_report = value
+
+      elif (keyword.startswith('log_f')):
+        auxiliary.check_is_function_or_method('log_funct', value)
+        self.log_funct =  value
+
+      elif (keyword.startswith('index_val_c')):
+        auxiliary.check_is_integer('index_val_cache_size', value)
+        auxiliary.check_is_not_negative('index_val_cache_size', value)
+        self.index_val_cache_size = value
+
+      elif (keyword.startswith('build_w')):
+        if (value == None):
+          value = 1
+        auxiliary.check_is_integer('build_workers', value)
+        auxiliary.check_is_positive('build_workers', value)
+        self.build_workers = value
+
+      elif (keyword.startswith('max_block')):
+        if (value != None):
+          auxiliary.check_is_integer('max_block_size', value)
+          auxiliary.check_is_positive('max_block_size', value)
+        self.max_block_size = value
+
+      elif (keyword.startswith('block_pol')):
+        if (value not in ['cap', 'sample', 'subblock']):
+          logging.exception('Illegal value for block policy, must be ' + \
+                            '"cap", "sample" or "subblock": "%s"' % \
+                            (str(value)))
+          raise Exception
+        self.block_policy = value
+
+      elif (keyword.startswith('sub_block_d')):
+        auxiliary.check_is_list('sub_block_def', value)
+        self.sub_block_def = value
+
+      elif (keyword.startswith('prepare_c')):
+        auxiliary.check_is_flag('prepare_comparators', value)
+        self.prepare_comparators = value
+
+      elif (keyword.startswith('weight_vec_st')):
+        auxiliary.check_is_flag('weight_vec_store', value)
+        self.weight_vec_store = value
+
+      elif (keyword.startswith('weight_v')):
+        if (value != None):
+          auxiliary.check_is_string('weight_vec_file', value)
+        self.weight_vec_file = value
+
+      else:
+        logging.exception('Illegal constructor argument keyword: '+keyword)
+        raise Exception
+
+    # Check if the needed attributes are set  - - - - - - - - - - - - - - - - -
+    #
+    auxiliary.check_is_list('index_def', self.index_def)
+    auxiliary.check_is_not_none('rec_comparator', self.rec_comparator)
+    auxiliary.check_is_not_none('Dataset 1', self.dataset1)
+    auxiliary.check_is_not_none('Dataset 2', self.dataset2)
+    auxiliary.check_is_list('Dataset 1 field list', self.dataset1.field_list)
+    auxiliary.check_is_list('Dataset 2 field list', self.dataset2.field_list)
+
+    if ((self.block_policy == 'subblock') and (self.sub_block_def == [])):
+      logging.exception('Block policy "subblock" needs at least one ' + \
+                        'sub-block definition')
+      raise Exception
+
+    # Check if the data sets in the record comparator are the same as the ones
+    # give in the index
+    #
+    if (self.rec_comparator.dataset1 != self.dataset1):
+      logging.exception('Data set 1 in record comparator is different from' + \
+                        ' data set 1 in index: "%s" / "%s"' % \
+                        (self.rec_comparator.dataset1, self.dataset1))
+      raise Exception
+    if (self.rec_comparator.dataset2 != self.dataset2):
+      logging.exception('Data set 2 in record comparator is different from' + \
+                        ' data set 2 in index: "%s" / "%s"' % \
+                        (self.rec_comparator.dataset2, self.dataset2))
+      raise Exception
+
+    # Check if a deduplication will be done or a linkage - - - - - - - - - - -
+    #
+    if (self.dataset1 == self.dataset2):
+      self.do_deduplication = True
+    else:
+      self.do_deduplication = False
+
+    # If record caches are disk based open their database files (the disk
+    # based inverted indices are opened when they are built) - - - - - - - - -
+    #
+    if (self.rec_cache1_file_name != None):
+      self.rec_cache1 = DiskRecordCache(self.rec_cache1_file_name)
+    if (self.rec_cache2_file_name != None):
+      self.rec_cache2 = DiskRecordCache(self.rec_cache2_file_name)
+
+    # Extract the field names from the two data set field name lists - - - - -
+    #
+    dataset1_field_names = []
+    dataset2_field_names = []
+
+    for (field_name, field_data) in self.dataset1.field_list:
+      dataset1_field_names.append(field_name)
+
+    for (field_name, field_data) in self.dataset2.field_list:
+      dataset2_field_names.append(field_name)
+
+    # Get the column indices of the fields used in the record comparator - - -
+    #
+    for (comp,f_ind1,f_ind2) in self.rec_comparator.field_comparison_list:
+      if (f_ind1 not in self.comp_field_used1):
+        self.comp_field_used1.append(f_ind1)
+      if (f_ind2 not in self.comp_field_used2):
+        self.comp_field_used2.append(f_ind2)
+    self.comp_field_used1.sort()
+    self.comp_field_used2.sort()
+
+    # Check if definition of indices (and of sub-blocks) is correct and fields
+    # are in the data sets
+    #
+    self.index_def_proc = []  # Checked and processed index definitions will be
+                              # added here
+
+    for index_def_list in self.index_def + self.sub_block_def:
+
+      auxiliary.check_is_list('Index definition list "%s"' % \
+                              (str(index_def_list)), index_def_list)
+
+      index_def_list_proc = []
+
+      for index_def in index_def_list:
+
+        auxiliary.check_is_list('Index definition "%s"' % \
+                                (str(index_def)), index_def)
+        if (index_def == []):
+          logging.info('Empty index definition given: %s' % \
+                       (str(self.index_def)))
+
+        # Check the two field names
+        #
+        field_name1 = index_def[0]
+        field_name2 = index_def[1]
+
+        if (field_name1 not in dataset1_field_names):
+          logging.exception('Field "%s" is not in data set 1 field name ' \
+                            % (field_name1) + 'list: %s' % \
+                            (str(self.dataset1.field_list)))
+          raise Exception
+        field_index1 = dataset1_field_names.index(field_name1)
+
+        if (field_name2 not in dataset2_field_names):
+          logging.exception('Field "%s" is not in data set 2 field name ' \
+                            % (field_name2) + 'list: %s' % \
+                            (str(self.dataset2.field_list)))
+          raise Exception
+        field_index2 = dataset2_field_names.index(field_name2)
+
+        index_def_proc = [field_index1,field_index2] # Processed index def.
+
+        # Check if sort words flag is True or False
+        #
+        auxiliary.check_is_flag('Sort words flag', index_def[2])
+        index_def_proc.append(index_def[2])
+
+        # Check if reverse flag is True or False
+        #
+        auxiliary.check_is_flag('Reverse flag', index_def[3])
+        index_def_proc.append(index_def[3])
+
+        # Check maximum length is a positive integer or None
+        #
+        if (index_def[4] == None):
+          index_def_proc.append(None)
+        else:
+          auxiliary.check_is_integer('Maximum length', index_def[4])
+          auxiliary.check_is_positive('Maximum length', index_def[4])
+          index_def_proc.append(index_def[4])
+
+        # Check function definition
+        #
+        if ((index_def[5] != None) and (len(index_def[5]) > 0)):
+          index_funct_def = index_def[5]
+          auxiliary.check_is_function_or_method('Function "%s"' % \
+                           (index_funct_def[0]), index_funct_def[0])
+          if (len(index_funct_def) > 4):
+            logging.exception('Too many arguments for function call: %s' % \
+                              (str(index_funct_def)))
+            raise Exception
+          index_def_proc.append(index_funct_def)
+        else:
+          index_def_proc.append(None)
+
+        # Check if the function is pure (index values can be cached)
+        #
+        if (len(index_def) > 6):
+          auxiliary.check_is_flag('Pure function flag', index_def[6])
+          index_def_proc.append(index_def[6])
+        elif (index_def_proc[5] == None):
+          index_def_proc.append(True)
+        else:
+          index_def_proc.append(getattr(index_def_proc[5][0], '__module__',
+                                        None) == 'encode')
+
+        index_def_list_proc.append(index_def_proc)
+
+      self.index_def_proc.append(index_def_list_proc)
+
+    self.sub_block_def_proc = self.index_def_proc[len(self.index_def):]
+    self.index_def_proc =     self.index_def_proc[:len(self.index_def)]
+
+    assert len(self.index_def) == len(self.index_def_proc)
+
+    self.__compile_index_defs__()
+
+    self.status = 'initialised'  # Status of the index (used by save and load
+                                 # methods)
+
+  # ---------------------------------------------------------------------------
+
+  def build(self):
+    """Method to build an index data structure.
+       See implementations in derived classes for details.
+    """
+
+    logging.exception('Override abstract method in derived class')
+    raise Exception
+
+  # ---------------------------------------------------------------------------
+
+  def __records_into_inv_index__(self):
+    """Load the records from the data sets and put them into an inverted index
+       data structure.
+
+       If both data sets are the same (a deduplication) only insert records
+       from one data set.
+
+       This method builds an inverted index (one per index definition) as a
+       Python dictionary with the keys being the indexing values (as returned
+       by the _get_index_values__() method.
+
+       If 'index1_file_name' (or 'index2_file_name') is set, the inverted
+       indices of data set 1 (or 2) are disk based instead (see
+       DiskInvertedIndex), in database files named with the file name followed
+       by '-' and the number of the index definition.
+    """
+
+    logging.info('Started to build inverted index:')
+
+    num_indices = len(self.index_def)
+
+    # Index data structure for blocks is one dictionary per index - - - - - - -
+    #
+    for i in range(num_indices):
+      for (index, index_file_name) in [(self.index1, self.index1_file_name),
+                                       (self.index2, self.index2_file_name)]:
+        if (isinstance(index.get(i), DiskStore)):
+          index[i].close()
+
+        if (index_file_name == None):
+          index[i] = {}
+        else:
+          index[i] = DiskInvertedIndex('%s-%d' % (index_file_name, i))
+
+    skip_missing = self.skip_missing  # Shorthand
+
+    # A list of data structures needed for the build process:
+    # - the index data structure (dictionary)
+    # - the record cache
+    # - the data set to be read
+    # - the comparison fields which are used
+    # - a list index (0 for data set 1, 1 for data set 2)
+    #
+    build_list = [(self.index1, self.rec_cache1, self.dataset1,
+                   self.comp_field_used1, 0)] # For data set 1
+
+    if (self.do_deduplication == False):  # If linkage append data set 2
+      build_list.append((self.index2, self.rec_cache2, self.dataset2,
+                   self.comp_field_used2, 1))
+
+    # Reading loop over all records in one or both data set(s) - - - - - - - -
+    #
+    for (index,rec_cache,dataset,comp_field_used_list,ds_index) in build_list:
+
+      is_disk_index = [isinstance(index[i], DiskInvertedIndex) for i in \
+                       range(num_indices)]
+
+      for (rec_ident, rec_index_val_list) in \
+          self.__iter_rec_index_values__(dataset, ds_index, rec_cache,
+                                         comp_field_used_list):
+
+        for i in range(num_indices):  # Put record identifier into all indices
+
+          this_index = index[i]  # Shorthand
+
+          block_val = rec_index_val_list[i]
+
+          if ((block_val != '') or (skip_missing == False)):
+            if (is_disk_index[i] == True):
+              this_index.append(block_val, rec_ident)
+            else:
+              block_val_rec_list = this_index.get(block_val, [])
+              block_val_rec_list.append(rec_ident)
+              this_index[block_val] = block_val_rec_list
+
+      for i in range(num_indices):  # Write remaining entries of disk indices
+        if (is_disk_index[i] == True):
+          index[i].sync()
+
+    for rec_cache in [self.rec_cache1, self.rec_cache2]:
+      if (isinstance(rec_cache, DiskStore)):
+        rec_cache.sync()
+
+    self.__log_index_val_cache_stats__()
+
+  # ---------------------------------------------------------------------------
+
+  def __iter_rec_index_values__(self, dataset, ds_index, rec_cache,
+                                comp_field_used_list):
+    """Read all records from the given data set, put them (with only the
+       fields used for comparisons) into the given record cache, and yield
+       tuples (record number, list of index variable values).
+
+       If the 'build_workers' attribute is larger than 1, the records are
+       read in chunks of 'BUILD_CHUNK_SIZE' consecutive records, and the index
+       variable values of the chunks are calculated in parallel by a pool of
+       worker processes. The tuples are yielded in the order the records were
+       read in both cases, so the resulting index does not depend upon the
+       number of workers.
+
+       For the 'subblock' block policy, the sub-block values of the records are
+       also calculated (by the main process) and kept in 'sub_block_vals1' or
+       'sub_block_vals2'.
+    """
+
+    global _mp_build_index
+
+    # Calculate a counter for the progress report
+    #
+    if (self.progress_report != None):
+      progress_report_cnt = max(1, int(dataset.num_records / \
+                                   (100.0 / self.progress_report)))
+    else:  # So no progress report is being logged
+      progress_report_cnt = dataset.num_records + 1
+
+    start_time = time.time()
+
+    rec_read = 0  # Number of records read from data set
+
+    intern_rec_ident = dataset.intern_rec_ident  # Shorthands
+    get_index_values_funct = self.__get_index_values__
+
+    if (self.block_policy == 'subblock'):
+      sub_block_vals = [self.sub_block_vals1, self.sub_block_vals2][ds_index]
+      sub_block_val_funct_list = self.sub_block_val_funct_list
+    else:
+      sub_block_vals = None
+
+    num_workers = self.build_workers
+
+    if (num_workers > 1):
+      _mp_build_index = self  # Forked workers will see this index
+
+      pool = multiprocessing.Pool(num_workers)
+
+      round_size = num_workers*NUM_SHARDS_PER_WORKER*BUILD_CHUNK_SIZE
+
+      logging.info('  Calculate index values with %d worker processes' % \
+                   (num_workers))
+
+    try:
+      rec_ident_list = []  # Records (and their numbers) of the current round
+      rec_list =       []
+
+      for (rec_ident, rec) in dataset.readall(): # Read all records in data set
+
+        rec_ident = intern_rec_ident(rec_ident)  # Use integer record number
+
+        # Extract record fields needed for comparisons (set all others to '')
+        #
+        comp_rec = []
+
+        field_ind = 0
+        for field in rec:
+          if (field_ind in comp_field_used_list):
+            comp_rec.append(field.lower())  # Make them lower case
+          else:
+            comp_rec.append('')
+          field_ind += 1
+
+        rec_cache[rec_ident] = comp_rec  # Put into record cache
+
+        if (sub_block_vals != None):
+          sub_block_vals[rec_ident] = tuple(get_index_values_funct(rec,
+                                            ds_index, sub_block_val_funct_list))
+
+        # Now get the index variable values for this record - - - - - - - - - -
+        #
+        if (num_workers > 1):
+          rec_ident_list.append(rec_ident)
+          rec_list.append(rec)
+
+          if (len(rec_list) >= round_size):
+            for rec_index_val in self.__get_index_values_parallel__(pool,
+                                             rec_ident_list, rec_list,
+                                             ds_index):
+              yield rec_index_val
+            rec_ident_list = []
+            rec_list =       []
+
+        else:
+          yield (rec_ident, get_index_values_funct(rec, ds_index))
+
+        rec_read += 1
+
+        if ((rec_read % progress_report_cnt) == 0):
+          self.__log_build_progress__(rec_read,dataset.num_records,start_time)
+
+      if (rec_list != []):  # Process the last (not full) round
+        for rec_index_val in self.__get_index_values_parallel__(pool,
+                                         rec_ident_list, rec_list, ds_index):
+          yield rec_index_val
+
+      if (num_workers > 1):
+        pool.close()
+
+    finally:
+      if (num_workers > 1):
+        pool.terminate()
+        pool.join()
+
+        _mp_build_index = None
+
+    used_sec_str = auxiliary.time_string(time.time()-start_time)
+    rec_time_str = auxiliary.time_string((time.time()-start_time) / \
+                                         dataset.num_records)
+    logging.info('Read and indexed %d records in %s (%s per record)' % \
+                 (dataset.num_records, used_sec_str, rec_time_str))
+    logging.info('')
+
+  # ---------------------------------------------------------------------------
+
+  def __get_index_values_parallel__(self, pool, rec_ident_list, rec_list,
+                                    ds_index):
+    """Split the given records into chunks of 'BUILD_CHUNK_SIZE' records,
+       calculate their index variable values using the given pool of worker
+       processes, and return a list of tuples (record number, list of index
+       variable values) in the order of the given records.
+
+       The index variable value cache hits and misses counted by the workers
+       are added to the counters in 'index_val_cache_stats'.
+    """
+
+    chunk_list = [(rec_list[j:j+BUILD_CHUNK_SIZE], ds_index) for j in \
+                  xrange(0, len(rec_list), BUILD_CHUNK_SIZE)]
+
+    rec_index_val_list = []
+
+    for (chunk_index_val_list, chunk_cache_stats) in \
+        pool.map(_get_index_values_chunk, chunk_list):
+      rec_index_val_list += chunk_index_val_list
+
+      for i in range(len(chunk_cache_stats)):
+        for j in range(len(chunk_cache_stats[i])):
+          cache_stats = self.index_val_cache_stats[i][j]
+
+          if (cache_stats != None):
+            cache_stats[0] += chunk_cache_stats[i][j][0]
+            cache_stats[1] += chunk_cache_stats[i][j][1]
+
+    assert len(rec_index_val_list) == len(rec_ident_list)
+
+    return zip(rec_ident_list, rec_index_val_list)
+
+  # ---------------------------------------------------------------------------
+
+  def __records_into_sorted_runs__(self, run_size, tmp_dir):
+    """Load the records from the data sets and write their index entries into
+       sorted runs in temporary files, instead of building an inverted index
+       in memory (for streaming sorted neighbourhood indices).
+
+       For each index definition, tuples (index variable value, data set
+       number (0 or 1), record number) are collected until 'run_size' tuples
+       are in memory, which are then sorted and written into a temporary file
+       (in directory 'tmp_dir', or the system default temporary directory if
+       None). The record caches are filled as in __records_into_inv_index__().
+
+       The sorted runs can then be merged with __iter_sorted_blocks__(). The
+       temporary files are removed when the index is built again, or when the
+       program exits.
+    """
+
+    logging.info('Started to write sorted runs of index entries:')
+
+    num_indices = len(self.index_def)
+
+    _remove_sorted_run_files(sum(self.sorted_run_files.values(), []))
+
+    self.sorted_run_files =   {}
+    self.num_sorted_entries = {}
+
+    entry_lists = []  # One list of not yet written index entries per index
+
+    for i in range(num_indices):
+      self.sorted_run_files[i] =   []
+      self.num_sorted_entries[i] = 0
+      entry_lists.append([])
+
+    skip_missing = self.skip_missing  # Shorthand
+
+    build_list = [(self.rec_cache1, self.dataset1, self.comp_field_used1, 0)]
+
+    if (self.do_deduplication == False):  # If linkage append data set 2
+      build_list.append((self.rec_cache2, self.dataset2,
+                         self.comp_field_used2, 1))
+
+    # Reading loop over all records in one or both data set(s) - - - - - - - -
+    #
+    for (rec_cache, dataset, comp_field_used_list, ds_index) in build_list:
+
+      for (rec_ident, rec_index_val_list) in \
+          self.__iter_rec_index_values__(dataset, ds_index, rec_cache,
+                                         comp_field_used_list):
+
+        for i in range(num_indices):
+
+          block_val = rec_index_val_list[i]
+
+          if ((block_val != '') or (skip_missing == False)):
+            entry_list = entry_lists[i]
+            entry_list.append((block_val, ds_index, rec_ident))
+
+            if (len(entry_list) >= run_size):  # Write a sorted run
+              self.__write_sorted_run__(i, entry_list, tmp_dir)
+              entry_lists[i] = []
+
+    for i in range(num_indices):  # Write the remaining entries
+      if (entry_lists[i] != []):
+        self.__write_sorted_run__(i, entry_lists[i], tmp_dir)
+
+      logging.info('  Index %d: Wrote %d entries into %d sorted runs' % \
+                   (i, self.num_sorted_entries[i],
+                   len(self.sorted_run_files[i])))
+
+    del entry_lists
+
+    self.__log_index_val_cache_stats__()
+
+  # ---------------------------------------------------------------------------
+
+  def __write_sorted_run__(self, i, entry_list, tmp_dir):
+    """Sort the given list of index entries and write it into a new temporary
+       file, which is added to the sorted run files of index 'i'.
+    """
+
+    entry_list.sort()
+
+    try:
+      (run_fd, run_file_name) = tempfile.mkstemp(prefix='febrl-run-',
+                                                 dir=tmp_dir)
+      run_file = os.fdopen(run_fd, 'wb')
+    except:
+      logging.exception('Cannot create sorted run file in directory: %s' % \
+                        (str(tmp_dir)))
+      raise IOError
+
+    atexit.register(_remove_sorted_run_files, [run_file_name])
+
+    for j in xrange(0, len(entry_list), SORTED_RUN_CHUNK_SIZE):
+      cPickle.dump(entry_list[j:j+SORTED_RUN_CHUNK_SIZE], run_file,
+                   cPickle.HIGHEST_PROTOCOL)
+    run_file.close()
+
+    self.sorted_run_files[i].append(run_file_name)
+    self.num_sorted_entries[i] += len(entry_list)
+
+  # ---------------------------------------------------------------------------
+
+  def __iter_sorted_run__(self, run_file_name):
+    """Generator that yields the index entries of one sorted run file.
+    """
+
+    run_file = open(run_file_name, 'rb')
+
+    while (True):
+      try:
+        entry_chunk = cPickle.load(run_file)
+      except EOFError:
+        break
+
+      for entry in entry_chunk:
+        yield entry
+
+    run_file.close()
+
+  # ---------------------------------------------------------------------------
+
+  def __iter_sorted_blocks__(self, i):
+    """Merge the sorted runs of index 'i' and yield tuples (index variable
+       value, list of record numbers from data set 1, list of record numbers
+       from data set 2) in sorted order of the index variable values. Within a
+       block the records are in the order they were read, as with the lists of
+       an inverted index built by __records_into_inv_index__().
+
+       Only the runs currently being merged (one chunk each) and the records
+       of one block are kept in memory.
+    """
+
+    run_iter_list = [self.__iter_sorted_run__(run_file_name) for \
+                     run_file_name in self.sorted_run_files[i]]
+
+    for (block_val, entry_iter) in \
+        itertools.groupby(heapq.merge(*run_iter_list), lambda e: e[0]):
+
+      block_recs1 = []
+      block_recs2 = []
+
+      for (entry_val, ds_index, rec_ident) in entry_iter:
+        if (ds_index == 0):
+          block_recs1.append(rec_ident)
+        else:
+          block_recs2.append(rec_ident)
+
+      yield (block_val, block_recs1, block_recs2)
+
+  # ---------------------------------------------------------------------------
+  # Get sub-list functions are used for the q-gram and BigMatch index
+
+  def __get_sublists1__(self, in_list, min_len):
+    """An iterative method to compute all combinations of sub-lists of the list
+       'in_list' of lengths down to 'min_len'.
+
+       This routine seems to be faster for larger 'min_len' values (compared to
+       length of the input list), i.e. which would correspond to less deep
+       recursive levels (that correspond to higher threshold values) compared
+       to the recursive method using sets given below.
+    """
+
+    all_list = [in_list]
+    in_len =   len(in_list)
+
+    if (in_len > min_len):
+
+      for i in xrange(in_len):
+
+        sub_list = in_list[:i]+in_list[i+1:]
+
+        if (sub_list not in all_list):
+          all_list.append(sub_list)
+
+        if ((in_len-1) > min_len):
+          for sub_sub_list in self.__get_sublists1__(sub_list, min_len):
+
+            if (sub_sub_list not in all_list):
+              all_list.append(sub_sub_list)
+
+    return all_list
+
+  # ---------------------------------------------------------------------------
+
+  def __get_sublists2__(self, in_list, min_len):
+    """Method to recursively compute all combinations of sub-lists of the list
+       'in_list' of lengths down to 'min_len' using a Python generator.
+
+       This routine seems to be faster for deeper recursive levels (that
+       correspond to lower threshold values) compared to the iterative method
+       using sets given above.
+    """
+
+    unique_combinations_funct = self.__unique_combinations2__  # Shorthand
+
+
+    all_list = [in_list]
+    in_len =   len(in_list)
+
+    for i in xrange(in_len-1, min_len-1, -1):
+
+      for sub_list in unique_combinations_funct(in_list, i):
+        if (sub_list not in all_list):
+          all_list.append(sub_list)
+
+    return all_list
+
+  # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+  def __unique_combinations__(self, in_list, n):
+    """Get unique combinations of length 'n' of the given input list. Based on
+       a recipe from Activestate Python cookbook, see:
+
+       http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/190465
+    """
+
+    unique_combinations_funct = self.__unique_combinations__  # Shorthand
+
+    if (n == 0):
+      yield []
+    else:
+      for i in xrange(len(in_list)):
+        for sub_list in unique_combinations_funct(in_list[i+1:],n-1):
+          yield [in_list[i]]+sub_list
+
+  # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+  def __unique_combinations2__(self, in_list, n):
+    """Another version from Activestate Python cookbook, see:
+
+       http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/66465
+
+       Seems to be of similar speed than the previous function.
+    """
+
+    unique_combinations_funct = self.__unique_combinations2__  # Shorthand
+
+    for i in xrange(len(in_list)):
+      if (n == 1):
+        yield in_list[i]
+      else:
+        for sub_list in unique_combinations_funct(in_list[i+1:], n-1):
+          yield in_list[i] + sub_list
+
+  # ---------------------------------------------------------------------------
+
+  def __build_suffix_arrays__(self):
+    """Load the records from the data sets into the basic inverted index, and
+       then build one suffix array (see class SuffixArray) per index over the
+       distinct index variable values of both data sets.
+
+       If the 'padded' attribute is True the values are padded with the
+       START_CHAR and END_CHAR characters. The suffix arrays are stored in the
+       dictionary 'suffix_array', and the (not padded) values in the order of
+       their value numbers in the suffix arrays in 'suffix_array_values'.
+    """
+
+    self.__records_into_inv_index__()  # Read records and put into index
+
+    num_indices = len(self.index_def)
+
+    self.suffix_array =        {}
+    self.suffix_array_values = {}
+
+    for i in range(num_indices):
+
+      istart_time = time.time()
+
+      value_set = set(self.index1[i].keys())
+      if (self.do_deduplication == False):
+        value_set.update(self.index2[i].keys())
+
+      value_list = sorted(value_set)
+      del value_set
+
+      if (self.padded == True):  # Add start and end characters
+        padded_value_list = ['%s%s%s' % (self.START_CHAR, val, self.END_CHAR) \
+                             for val in value_list]
+      else:
+        padded_value_list = value_list
+
+      self.suffix_array[i] =        SuffixArray(padded_value_list)
+      self.suffix_array_values[i] = value_list
+
+      if (value_list != []):
+        max_val_len = max([len(val) for val in padded_value_list])
+      else:
+        max_val_len = 0
+
+      del padded_value_list
+
+      logging.info('  Built suffix array for index %d with %d suffixes of ' % \
+                   (i, len(self.suffix_array[i].sa)) + '%d different ' % \
+                   (len(value_list)) + 'values in %s' % \
+                   (auxiliary.time_string(time.time()-istart_time)))
+      logging.info('    Longest string in this suffix array is %d characters' \
+                   % (max_val_len) + ' long')
+
+  # ---------------------------------------------------------------------------
+
+  def compact(self):
+    """Method to compact an index data structure.
+       See implementations in derived classes for details.
+    """
+
+    logging.exception('Override abstract method in derived class')
+    raise Exception
+
+  # ---------------------------------------------------------------------------
+
+  def __dedup_rec_pairs__(self, rec_id_list, rec_pair_dict):
+    """Create record pairs for a deduplication using the given record
+       identifier list and insert them into the given record pair dictionary.
+
+       This version does not modify the input record identifier list (which
+       can also be a set). It does create a local sorted copy of the record
+       identifer list.
+    """
+
+    rec_cnt = 1  # Counter for second record identifier
+
+    this_rec_id_list = sorted(rec_id_list)
+    for rec_ident1 in this_rec_id_list:
+
+      rec_ident2_set = rec_pair_dict.get(rec_ident1)
+      if (rec_ident2_set == None):
+        rec_ident2_set = set()
+        rec_pair_dict[rec_ident1] = rec_ident2_set
+
+      rec_ident2_set.update(this_rec_id_list[rec_cnt:])
+
+      rec_cnt += 1
+
+    del this_rec_id_list
+
+  # ---------------------------------------------------------------------------
+
+  def __link_rec_pairs__(self, rec_id_list1, rec_id_list2, rec_pair_dict):
+    """Create record pairs for a linkage using the given two record identifier
+       lists (or sets) and insert them into the given record pair dictionary.
+    """
+
+    if (len(rec_id_list2) == 0):
+      return
+
+    for rec_ident1 in rec_id_list1:
+
+      rec_ident2_set = rec_pair_dict.get(rec_ident1)
+      if (rec_ident2_set == None):
+        rec_ident2_set = set()
+        rec_pair_dict[rec_ident1] = rec_ident2_set
+
+      rec_ident2_set.update(rec_id_list2)
+
+  # ---------------------------------------------------------------------------
+
+  def __reset_block_guard__(self):
+    """Reset the counters of the block policy, and seed the random number
+       generator used to sample blocks (so the same records are sampled every
+       time the blocks of an index are processed).
+    """
+
+    self.block_guard_stats =  [0, 0]
+    self.block_guard_random = random.Random(BLOCK_SAMPLE_SEED)
+
+  # ---------------------------------------------------------------------------
+
+  def __log_block_size_hist__(self, i, block_size_iter):
+    """Calculate the histogram of the block sizes of index 'i' from the given
+       tuples (number of records, number of record pairs), one per block, log
+       it and keep it in 'block_size_hist[i]'.
+
+       The number of records of a block is its largest number of records from
+       one data set. The block sizes are grouped into bins of powers of two
+       (1, 2-3, 4-7, 8-15, etc.), and for each bin the number of blocks and
+       their total number of record pairs are counted.
+    """
+
+    max_block_size = self.max_block_size  # Shorthand
+
+    hist = {}  # Keys are the smallest block sizes of the bins
+
+    num_large_blocks = 0  # Number of blocks larger than the maximum size
+    num_large_pairs =  0
+
+    for (num_recs, num_pairs) in block_size_iter:
+
+      if (num_recs == 0):
+        continue
+
+      hist_bin = 1 << (num_recs.bit_length()-1)
+
+      bin_counts = hist.get(hist_bin)
+      if (bin_counts == None):
+        hist[hist_bin] = [1, num_pairs]
+      else:
+        bin_counts[0] += 1
+        bin_counts[1] += num_pairs
+
+      if ((max_block_size != None) and (num_recs > max_block_size)):
+        num_large_blocks += 1
+        num_large_pairs +=  num_pairs
+
+    self.block_size_hist[i] = hist
+
+    logging.info('  Block size histogram of index %d:' % (i))
+    logging.info('     Block size      Blocks   Record pairs')
+
+    for hist_bin in sorted(hist):
+      logging.info('    %6d-%-6d %10d %14d' % (hist_bin, 2*hist_bin-1,
+                   hist[hist_bin][0], hist[hist_bin][1]))
+
+    if (max_block_size != None):
+      logging.info('    %d blocks with more than %d records (%d record ' % \
+                   (num_large_blocks, max_block_size, num_large_pairs) + \
+                   'pairs)')
+
+  # ---------------------------------------------------------------------------
+
+  def __iter_inv_index_block_sizes__(self, i):
+    """Yield tuples (number of records, number of record pairs) for all blocks
+       of the inverted indices 'i' (as needed by __log_block_size_hist__()).
+    """
+
+    this_index1 = self.index1[i]  # Shorthands
+    this_index2 = self.index2[i]
+
+    if (self.do_deduplication == True):
+      for block_recs in this_index1.itervalues():
+        num_recs = len(block_recs)
+        yield (num_recs, num_recs*(num_recs-1)/2)
+
+    else:
+      for block_val in set(this_index1) | set(this_index2):
+        num_recs1 = len(this_index1.get(block_val, []))
+        num_recs2 = len(this_index2.get(block_val, []))
+        yield (max(num_recs1, num_recs2), num_recs1*num_recs2)
+
+  # ---------------------------------------------------------------------------
+
+  def __iter_sorted_block_sizes__(self, i):
+    """Yield tuples (number of records, number of record pairs) for all blocks
+       in the sorted runs of index 'i' (as needed by __log_block_size_hist__()).
+    """
+
+    do_dedup = self.do_deduplication  # Shorthand
+
+    for (block_val, block_recs1, block_recs2) in self.__iter_sorted_blocks__(i):
+      num_recs1 = len(block_recs1)
+
+      if (do_dedup == True):
+        yield (num_recs1, num_recs1*(num_recs1-1)/2)
+      else:
+        num_recs2 = len(block_recs2)
+        yield (max(num_recs1, num_recs2), num_recs1*num_recs2)
+
+  # ---------------------------------------------------------------------------
+
+  def __guard_block__(self, block_recs1, block_recs2, level = 0):
+    """Apply the block policy to a block with the given records from data set
+       1 and 2 (for a deduplication the records from data set 2 are None).
+
+       Returns a list of tuples (list of sub-block values, records from data
+       set 1, records from data set 2). If the block is not larger than
+       'max_block_size' only the block itself is returned (with an empty list
+       of sub-block values). Otherwise the list contains the sampled block, or
+       the sub-blocks the block was split into according to the sub-block
+       definition 'level' (which are then checked with the next sub-block
+       definition), or it is empty if the block is removed.
+    """
+
+    max_block_size = self.max_block_size  # Shorthand
+
+    if ((max_block_size == None) or ((len(block_recs1) <= max_block_size) and \
+        ((block_recs2 == None) or (len(block_recs2) <= max_block_size)))):
+      return [([], block_recs1, block_recs2)]
+
+    if (level == 0):
+      self.block_guard_stats[0] += 1
+
+    if (self.block_policy == 'sample'):
+      sample_funct = self.block_guard_random.sample
+
+      if (len(block_recs1) > max_block_size):
+        block_recs1 = sorted(sample_funct(sorted(block_recs1), max_block_size))
+      if ((block_recs2 != None) and (len(block_recs2) > max_block_size)):
+        block_recs2 = sorted(sample_funct(sorted(block_recs2), max_block_size))
+
+      return [([], block_recs1, block_recs2)]
+
+    if ((self.block_policy == 'cap') or \
+        (level == len(self.sub_block_val_funct_list))):
+      self.block_guard_stats[1] += 1
+      return []
+
+    # Split the block according to the values of sub-block definition 'level'
+    #
+    skip_missing = self.skip_missing  # Shorthand
+
+    sub_blocks = {}  # Sub-block values with lists of records 1 and 2
+
+    for (j, block_recs, sub_block_vals) in \
+        [(0, block_recs1, self.sub_block_vals1),
+         (1, block_recs2, self.sub_block_vals2)]:
+
+      if (block_recs == None):  # No records 2 for a deduplication
+        continue
+
+      for rec_ident in block_recs:
+        sub_block_val = sub_block_vals[rec_ident][level]
+
+        if ((sub_block_val != '') or (skip_missing == False)):
+          sub_block = sub_blocks.get(sub_block_val)
+          if (sub_block == None):
+            sub_block = [[], []]
+            sub_blocks[sub_block_val] = sub_block
+          sub_block[j].append(rec_ident)
+
+    guarded_block_list = []
+
+    for sub_block_val in sorted(sub_blocks):
+      [sub_block_recs1, sub_block_recs2] = sub_blocks[sub_block_val]
+
+      if (block_recs2 == None):
+        sub_block_recs2 = None
+
+      for (sub_block_val_list, guarded_recs1, guarded_recs2) in \
+          self.__guard_block__(sub_block_recs1, sub_block_recs2, level+1):
+        guarded_block_list.append(([sub_block_val]+sub_block_val_list,
+                                   guarded_recs1, guarded_recs2))
+
+    return guarded_block_list
+
+  # ---------------------------------------------------------------------------
+
+  def __guard_inv_index__(self, i):
+    """Apply the block policy to all blocks of the inverted indices 'i' (of
+       data set 1 and 2). Blocks that are too large are replaced by their
+       sampled version, or by their sub-blocks (with block values made of the
+       block value and the sub-block values separated by 'SUB_BLOCK_SEP_STR',
+       so they are sorted directly after the block value), or removed.
+    """
+
+    max_block_size = self.max_block_size  # Shorthand
+
+    if (max_block_size == None):
+      return
+
+    this_index1 = self.index1[i]
+
+    if (self.do_deduplication == True):
+      this_index2 =    None
+      block_val_list = sorted(this_index1)
+    else:
+      this_index2 =    self.index2[i]
+      block_val_list = sorted(set(this_index1) | set(this_index2))
+
+    for block_val in block_val_list:
+
+      block_recs1 = this_index1.get(block_val, [])
+
+      if (this_index2 == None):
+        block_recs2 = None
+      else:
+        block_recs2 = this_index2.get(block_val, [])
+
+      if ((len(block_recs1) <= max_block_size) and \
+          ((block_recs2 == None) or (len(block_recs2) <= max_block_size))):
+        continue
+
+      guarded_block_list = self.__guard_block__(block_recs1, block_recs2)
+
+      this_index1.pop(block_val, None)
+      if (this_index2 != None):
+        this_index2.pop(block_val, None)
+
+      for (sub_block_val_list, guarded_recs1, guarded_recs2) in \
+          guarded_block_list:
+        guarded_block_val = SUB_BLOCK_SEP_STR.join([block_val] + \
+                                                   sub_block_val_list)
+
+        if (guarded_recs1 != []):
+          this_index1[guarded_block_val] = guarded_recs1
+        if ((guarded_recs2 != None) and (guarded_recs2 != [])):
+          this_index2[guarded_block_val] = guarded_recs2
+
+  # ---------------------------------------------------------------------------
+
+  def __iter_guarded_blocks__(self, block_iter):
+    """Apply the block policy to the tuples (block value, records from data
+       set 1, records from data set 2) from the given iterator (such as
+       __iter_sorted_blocks__()), and yield the resulting blocks as tuples in
+       the same format and order (with sub-blocks following their block).
+    """
+
+    do_dedup = self.do_deduplication  # Shorthand
+
+    for (block_val, block_recs1, block_recs2) in block_iter:
+
+      if (do_dedup == True):
+        guarded_block_list = self.__guard_block__(block_recs1, None)
+      else:
+        guarded_block_list = self.__guard_block__(block_recs1, block_recs2)
+
+      for (sub_block_val_list, guarded_recs1, guarded_recs2) in \
+          guarded_block_list:
+
+        if (do_dedup == True):
+          guarded_recs2 = []
+
+        yield (SUB_BLOCK_SEP_STR.join([block_val] + sub_block_val_list),
+               guarded_recs1, guarded_recs2)
+
+  # ---------------------------------------------------------------------------
+
+  def __guard_rec_block__(self, block_recs, rec_sub_block_vals,
+                          sub_block_vals):
+    """Apply the block policy to the given records (from an index) that are in
+       the same block as a record (which is being read) with the given tuple
+       of sub-block values, as done by the BigMatch and Dedup indices. The
+       sub-block values of the records in the block are taken from the given
+       dictionary.
+
+       Returns the records the record is to be compared with, which for the
+       'subblock' policy are the records with the same sub-block values as the
+       record (for as many sub-block definitions as needed).
+    """
+
+    max_block_size = self.max_block_size  # Shorthand
+
+    if ((max_block_size == None) or (len(block_recs) <= max_block_size)):
+      return block_recs
+
+    self.block_guard_stats[0] += 1
+
+    if (self.block_policy == 'sample'):
+      return self.block_guard_random.sample(sorted(block_recs), max_block_size)
+
+    if (self.block_policy == 'subblock'):
+
+      for level in range(len(rec_sub_block_vals)):
+        sub_block_val = rec_sub_block_vals[level]
+
+        if ((sub_block_val == '') and (self.skip_missing == True)):
+          break
+
+        block_recs = [rec_ident for rec_ident in block_recs if \
+                      (sub_block_vals[rec_ident][level] == sub_block_val)]
+
+        if (len(block_recs) <= max_block_size):
+          return block_recs
+
+    self.block_guard_stats[1] += 1
+
+    return []
+
+  # ---------------------------------------------------------------------------
+
+  def __log_block_guard_stats__(self):
+    """Log how many blocks were too large and how many were removed.
+    """
+
+    if (self.max_block_size != None):
+      logging.info('  Block policy "%s" applied to %d blocks with more ' % \
+                   (self.block_policy, self.block_guard_stats[0]) + \
+                   'than %d records (%d blocks or sub-blocks removed)' % \
+                   (self.max_block_size, self.block_guard_stats[1]))
+
+  # ---------------------------------------------------------------------------
+
+  def estimate(self, sample_size = ESTIMATE_SAMPLE_SIZE,
+               num_bench_pairs = ESTIMATE_BENCH_PAIRS):
+    """Estimate the cost of an index after it has been built, before compact()
+       generates the record pairs (so expensive index definitions can be
+       rejected early).
+
+       The distinct record pairs of the records in a random sample of
+       'sample_size' records from data set 1 are counted from the blocks of the
+       index (with the block policy applied), and scaled to all records. If
+       'sample_size' is None or not smaller than the number of records, all
+       records are used and the number of record pairs is exact. No record
+       pair dictionary is generated. For a streaming sorting index, which
+       compares the record pairs of each index in a separate pass, the record
+       pairs are counted for each index and summed.
+
+       Up to 'num_bench_pairs' of the counted record pairs are then compared
+       with each field comparator of the record comparator (a micro-benchmark)
+       to calibrate the time per comparison of each field comparator, from
+       which the time needed to compare all record pairs is projected. Note
+       that field comparators with a cache will have the compared values
+       cached afterwards.
+
+       Returns a dictionary with the following keys:
+
+         num_rec_pairs      The (estimated) number of record pairs.
+         exact              True if the number of record pairs is exact.
+         block_size_hist    The block size histograms of the indices (which
+                            are also kept in the 'block_size_hist' attribute).
+         rec_pair_memory    The projected memory (in bytes) of the record pair
+                            dictionary generated by compact().
+         weight_vec_memory  The projected memory (in bytes) of the weight
+                            vectors returned by run() (0 if they are written
+                            into a file).
+         field_comp_time    A list with the time (in seconds) per comparison
+                            of each field comparator.
+         comp_time          The projected time (in seconds) needed to compare
+                            all record pairs.
+
+       The number of record pairs can be estimated for the full, blocking,
+       sorting and q-gram indices. For all other indices the record pairs are
+       only known after compact() (or run() for the BigMatch and Dedup
+       indices), and the number of record pairs, memory and comparison time
+       are None (the field comparators are benchmarked with random record
+       pairs).
+    """
+
+    logging.info('')
+    logging.info('Estimate cost of index: "%s"' % (self.description))
+
+    # Check if index has been built - - - - - - - - - - - - - - - - - - - - - -
+    #
+    if (self.status != 'built'):
+      logging.exception('Index "%s" has not been built (or has already ' % \
+                        (self.description)+'been compacted), estimating ' + \
+                        'is not possible')
+      raise Exception
+
+    if (sample_size != None):
+      auxiliary.check_is_integer('sample_size', sample_size)
+      auxiliary.check_is_positive('sample_size', sample_size)
+    auxiliary.check_is_integer('num_bench_pairs', num_bench_pairs)
+    auxiliary.check_is_positive('num_bench_pairs', num_bench_pairs)
+
+    start_time = time.time()
+
+    num_indices = len(self.index_def)
+
+    # Block size histograms - - - - - - - - - - - - - - - - - - - - - - - - - -
+    #
+    self.block_size_hist = {}
+
+    for i in range(num_indices):
+      block_size_iter = self.__iter_estimate_block_sizes__(i)
+
+      if (block_size_iter != None):
+        self.__log_block_size_hist__(i, block_size_iter)
+
+    # Count the record pairs (the block policy is applied as in compact()) - -
+    #
+    self.__reset_block_guard__()
+
+    [num_rec_pairs, is_exact, rec_pair_memory, bench_rec_pair_list] = \
+                 self.__estimate_rec_pairs__(sample_size, num_bench_pairs)
+
+    if (bench_rec_pair_list == []):  # Benchmark with random record pairs
+      rec_list1 = self.rec_cache1.values()
+      if (self.do_deduplication == True):
+        rec_list2 = rec_list1
+      else:
+        rec_list2 = self.rec_cache2.values()
+
+      if ((rec_list1 != []) and (rec_list2 != [])):
+        rand_choice_funct = random.Random(ESTIMATE_SAMPLE_SEED).choice
+
+        for j in xrange(num_bench_pairs):
+          bench_rec_pair_list.append((rand_choice_funct(rec_list1),
+                                      rand_choice_funct(rec_list2)))
+
+    # Benchmark the field comparators - - - - - - - - - - - - - - - - - - - - -
+    #
+    field_comp_time = []
+
+    for (comp_method, field_index1, field_index2) in \
+        self.rec_comparator.field_comparison_list:
+
+      if (bench_rec_pair_list == []):
+        field_comp_time.append(0.0)
+        continue
+
+      bench_start_time = time.time()
+
+      for (rec1, rec2) in bench_rec_pair_list:
+        comp_method(rec1[field_index1], rec2[field_index2])
+
+      field_comp_time.append((time.time()-bench_start_time) / \
+                             len(bench_rec_pair_list))
+
+    # Project memory and comparison time - - - - - - - - - - - - - - - - - - -
+    #
+    num_weights = len(field_comp_time)
+
+    if (num_rec_pairs == None):
+      weight_vec_memory = None
+      comp_time =         None
+
+    else:
+      if (self.weight_vec_file != None):
+        weight_vec_pair_memory = 0
+      elif (self.weight_vec_store == True):  # Two record numbers and weights
+        weight_vec_pair_memory = 2*array.array('i').itemsize + \
+                                 num_weights*array.array('d').itemsize
+      else:  # Dictionary entry, record identifier tuple and weight list
+        weight_vec_pair_memory = _get_dict_entry_size() + \
+                                 sys.getsizeof((0,0)) + \
+                                 sys.getsizeof([0.0]*num_weights) + \
+                                 num_weights*sys.getsizeof(0.0)
+
+      weight_vec_memory = num_rec_pairs*weight_vec_pair_memory
+      comp_time =         num_rec_pairs*sum(field_comp_time)
+
+    logging.info('Estimated cost of index in %s' % \
+                 (auxiliary.time_string(time.time()-start_time)))
+
+    if (num_rec_pairs == None):
+      logging.info('  Number of record pairs can only be determined by ' + \
+                   'compacting this index')
+    else:
+      if (is_exact == True):
+        logging.info('  Number of record pairs:   %d' % (num_rec_pairs))
+      else:
+        logging.info('  Estimated number of record pairs: %d (from a ' % \
+                     (num_rec_pairs)+'sample of %d records)' % (sample_size))
+      logging.info('  Projected memory of record pair dictionary: %.1f MB' % \
+                   (rec_pair_memory/1048576.0))
+      logging.info('  Projected memory of weight vectors: %.1f MB' % \
+                   (weight_vec_memory/1048576.0))
+      logging.info('  Projected comparison time: %s' % \
+                   (auxiliary.time_string(comp_time)))
+
+    logging.info('  Time per comparison of field comparators (from %d ' % \
+                 (len(bench_rec_pair_list))+'record pairs):')
+
+    for j in range(num_weights):
+      field_comp = self.rec_comparator.field_comparator_list[j][0]
+      logging.info('    %s: %s' % (field_comp.description,
+                   auxiliary.time_string(field_comp_time[j])))
+
+    return {'num_rec_pairs':num_rec_pairs,
+            'exact':is_exact,
+            'block_size_hist':self.block_size_hist,
+            'rec_pair_memory':rec_pair_memory,
+            'weight_vec_memory':weight_vec_memory,
+            'field_comp_time':field_comp_time,
+            'comp_time':comp_time}
+
+  # ---------------------------------------------------------------------------
+
+  def __estimate_rec_pairs__(self, sample_size, num_bench_pairs,
+                             index_num_list = None):
+    """Count the distinct record pairs of the records in a random sample of
+       'sample_size' records from data set 1 (or of all records if
+       'sample_size' is None or not smaller than the number of records) from
+       the blocks given by __iter_estimate_blocks__(), as needed by estimate().
+       If 'index_num_list' is given only the blocks of these indices are used
+       (otherwise the blocks of all indices).
+
+       Returns a list with the number of record pairs scaled to all records
+       (None if the index has no blocks before compact()), a flag that is True
+       if all records were used, the projected memory of the record pair
+       dictionary, and a list of up to 'num_bench_pairs' counted record pairs
+       (as tuples of records from the record caches).
+    """
+
+    do_dedup = self.do_deduplication  # Shorthand
+
+    rec_num_list = sorted(self.rec_cache1.keys())
+
+    if ((sample_size == None) or (sample_size >= len(rec_num_list))):
+      sample_rec_num_set = set(rec_num_list)
+      is_exact =           True
+    else:
+      sample_rec_num_set = set(random.Random(ESTIMATE_SAMPLE_SEED).sample(
+                                                   rec_num_list, sample_size))
+      is_exact =           False
+
+    if (index_num_list == None):
+      index_num_list = range(len(self.index_def))
+
+    rec_pair_rows = {}  # The other records of the sampled records
+
+    for i in index_num_list:
+
+      block_iter = self.__iter_estimate_blocks__(i)
+
+      if (block_iter == None):
+        return [None, False, None, []]
+
+      for (block_recs1, block_recs2) in block_iter:
+
+        for rec_num in sample_rec_num_set.intersection(block_recs1):
+          rec_pair_row = rec_pair_rows.get(rec_num)
+          if (rec_pair_row == None):
+            rec_pair_row = set()
+            rec_pair_rows[rec_num] = rec_pair_row
+          rec_pair_row.update(block_recs2)
+
+        # For a deduplication record pairs have no direction
+        #
+        if ((do_dedup == True) and (block_recs2 is not block_recs1)):
+          for rec_num in sample_rec_num_set.intersection(block_recs2):
+            rec_pair_row = rec_pair_rows.get(rec_num)
+            if (rec_pair_row == None):
+              rec_pair_row = set()
+              rec_pair_rows[rec_num] = rec_pair_row
+            rec_pair_row.update(block_recs1)
+
+    num_sample_rec_pairs = 0
+    row_memory =           0
+
+    for (rec_num, rec_pair_row) in rec_pair_rows.iteritems():
+      if (do_dedup == True):
+        rec_pair_row.discard(rec_num)  # No pairs of a record with itself
+      num_sample_rec_pairs += len(rec_pair_row)
+      row_memory +=           sys.getsizeof(rec_pair_row)
+
+    if (do_dedup == True):  # Each record pair was counted for both records
+      num_sample_rec_pairs /= 2.0
+      row_memory /=           2.0
+
+    scale = float(len(rec_num_list)) / max(1, len(sample_rec_num_set))
+
+    num_rec_pairs =   int(round(num_sample_rec_pairs*scale))
+    rec_pair_memory = int(round((row_memory + len(rec_pair_rows) * \
+                                 _get_dict_entry_size())*scale))
+
+    # Take record pairs for the benchmark evenly from the sampled records - - -
+    #
+    rec_cache1 = self.rec_cache1
+    if (do_dedup == True):
+      rec_cache2 = self.rec_cache1
+    else:
+      rec_cache2 = self.rec_cache2
+
+    bench_rec_pair_list = []
+
+    num_row_pairs = int(math.ceil(float(num_bench_pairs) / \
+                                  max(1, len(rec_pair_rows))))
+
+    for rec_num in sorted(rec_pair_rows):
+      rec1 = rec_cache1[rec_num]
+
+      for rec_num2 in sorted(rec_pair_rows[rec_num])[:num_row_pairs]:
+        bench_rec_pair_list.append((rec1, rec_cache2[rec_num2]))
+
+    return [num_rec_pairs, is_exact, rec_pair_memory,
+            bench_rec_pair_list[:num_bench_pairs]]
+
+  # ---------------------------------------------------------------------------
+
+  def __iter_estimate_blocks__(self, i):
+    """Return an iterator over tuples (records from data set 1, records from
+       data set 2) so that the record pairs of index 'i' are all the pairs of
+       a record from the first and a record from the second collection (for a
+       deduplication both collections can be the same, pairs of a record with
+       itself are ignored), or None if the record pairs of the index can only
+       be determined by compact() (the default).
+    """
+
+    return None
+
+  # ---------------------------------------------------------------------------
+
+  def __iter_estimate_block_sizes__(self, i):
+    """Return an iterator over tuples (number of records, number of record
+       pairs) for the blocks of index 'i' (as needed by
+       __log_block_size_hist__()), or None if the index has no blocks before
+       compact() (the default).
+    """
+
+    return None
+
+  # ---------------------------------------------------------------------------
+
+  def __iter_guarded_inv_index_blocks__(self, i):
+    """Yield tuples (records from data set 1, records from data set 2) for
+       the blocks of the inverted indices 'i' with the block policy applied
+       (without modifying the inverted indices, but in the same order as
+       __guard_inv_index__() so the same records are sampled), as needed by
+       __iter_estimate_blocks__().
+    """
+
+    this_index1 = self.index1[i]  # Shorthands
+    this_index2 = self.index2[i]
+
+    if (self.do_deduplication == True):
+      for block_val in sorted(this_index1):
+        for (sub_block_val_list, guarded_recs, none_recs) in \
+            self.__guard_block__(this_index1[block_val], None):
+          yield (guarded_recs, guarded_recs)
+
+    else:
+      for block_val in sorted(set(this_index1) | set(this_index2)):
+        for (sub_block_val_list, guarded_recs1, guarded_recs2) in \
+            self.__guard_block__(this_index1.get(block_val, []),
+                                 this_index2.get(block_val, [])):
+          yield (guarded_recs1, guarded_recs2)
+
+  # ---------------------------------------------------------------------------
+
+  def run(self):
+    """Run the record pair comparison accoding to the index.
+       See implementations in derived classes for details.
+    """
+
+    logging.exception('Override abstract method in derived class')
+    raise Exception
+
+  # ---------------------------------------------------------------------------
+
+  def __get_field_names_list__(self):
+    """Returns the list of all field comparison descriptions, to be used when
+       a weight vector file is written.
+    """
+
+    field_names_list = []
+    for field_comp_tuple in self.rec_comparator.field_comparator_list:
+        field_names_list.append(field_comp_tuple[0].description)
+    return field_names_list
+
+  # ---------------------------------------------------------------------------
+
+  def __compare_rec_pairs_from_dict__(self, length_filter_perc = None,
+                                      cut_off_threshold = None,
+                                      num_workers = None):
+    """This method compares all the records pairs in the record pair dictionary
+       and puts the resulting weight vectors into a dictionary which is then
+       returned.
+
+       If the argument 'length_filter_perc' is set to a percentage value
+       between 0.0 and 100.0 the lengths of the concatenated record values in
+       the fields used for comparison will be calculated, and if the difference
+       is larger than the given percentage value the record pair will not be
+       compared. For example, if a record A has values with a total length of
+       12 characters and a record B values with a length of 16 characters, then
+       their percentage difference will be:
+
+          |12-16| / (max(12,16) = 4 / 16 = 0.25 (25%)
+
+       So if the value of 'length_filter_perc' is set to 20 this record pair
+       will be filtered out and not compared.
+
+       Default value for 'length_filter_perc' is None, which means no length
+       filtering will be performed. For more information about filtering in the
+       record linkage process please refer to:
+
+       - Adaptive Filtering for Efficient Record Linkage
+         Lifang Gu and Rohan Baxter,
+         SIAM Data Mining conference, 2004.
+
+       The second argument 'cut_off_threshold' can be set to a numerical value,
+       in which case all compared record pairs with a summed weight vector
+       value less than this threshold will not be stored in the weight vector
+       dictionary. Default value for 'cut_off_threshold' is None, which means
+       all compared record pairs will be stored in the weight vector
+       dictionary.
+
+       The third argument 'num_workers' can be set to a positive integer, in
+       which case the record pairs are split into shards (made of whole
+       comparison batches) that are compared by this number of worker
+       processes. The record caches are shared with the worker processes
+       copy-on-write (as they are forked after the index has been compacted).
+       The weight vectors are merged (or written into the weight vector file)
+       in the same order as they are compared in the current process, so the
+       result (and the counters of the comparators) do not depend upon the
+       number of workers used. Default
+       value for 'num_workers' is None, which means all comparisons are done
+       in the current process. If the record pairs are generated lazily (see
+       the 'lazy_pairs' argument of the BlockingIndex) there is no record pair
+       dictionary to be split and all comparisons are done in the current
+       process.
+    """
+
+    weight_vec_writer = None
+
+    # Check if weight vector file should be written - - - - - - - - - - - - - -
+    #
+    if (self.weight_vec_file != None):
+      [weight_vec_fp, weight_vec_writer] = self.__open_weight_vec_file__()
+
+    progress_report_cnt = self.__get_progress_report_cnt__()
+
+    weight_vec_dict = self.__new_weight_vec_dict__()  # Calculated weight
+                                                      # vectors
+
+    # Check length filter and cut-off threshold arguments - - - - - - - - - - -
+    #
+    length_filter_perc = self.__check_comparison_args__(length_filter_perc,
+                                                        cut_off_threshold)
+
+    if (num_workers == None):
+      num_workers = 1
+    else:
+      auxiliary.check_is_integer('Number of workers', num_workers)
+      auxiliary.check_is_positive('Number of workers', num_workers)
+      logging.info('  Number of worker processes: %d' % (num_workers))
+
+    self.__prepare_comparators__()
+
+    comp_stats = [0, 0, 0]  # Number of comparisons done, of record pairs
+                            # removed by length filtering, and of record pairs
+                            # below the cut-off threshold
+
+    start_time = time.time()
+
+    if ((num_workers > 1) and (self.rec_pair_dict == None)):
+      logging.warn('Record pairs are generated lazily from blocks, ' + \
+                   'comparisons are done in one process')
+      num_workers = 1
+
+    if (num_workers > 1):  # Shard record pairs over worker processes - - -
+
+      self.__compare_rec_pairs_parallel__(num_workers, length_filter_perc,
+                                          cut_off_threshold, weight_vec_dict,
+                                          weight_vec_writer, comp_stats,
+                                          progress_report_cnt, start_time)
+
+    else:  # Compare all record pairs in this process - - - - - - - - - - -
+
+      for (rec_ident1, rec_ident2, w_vec) in \
+          self.__iter_compare_rec_pairs__(self.__iter_rec_pair_rows__(),
+                                          length_filter_perc,
+                                          cut_off_threshold, comp_stats,
+                                          progress_report_cnt, start_time):
+
+        # Put result into weight vector dictionary
+        #
+        if (weight_vec_writer == None):
+          weight_vec_dict[(rec_ident1, rec_ident2)] = w_vec
+        else:
+          weight_vec_writer.writerow([rec_ident1, rec_ident2]+w_vec)
+
+    self.__log_comparison_summary__(comp_stats, length_filter_perc,
+                                    cut_off_threshold, start_time)
+
+    if (self.weight_vec_file == None):
+      return [self.__get_field_names_list__(), weight_vec_dict]
+    else:
+      weight_vec_fp.close()
+      return None
+
+  # ---------------------------------------------------------------------------
+
+  def iter_run(self, length_filter_perc = None, cut_off_threshold = None):
+    """A generator version of the run() method.
+
+       Compares the record pairs as produced by the compacted index and yields
+       one tuple (record identifier 1, record identifier 2, weight vector) for
+       each compared record pair that is not removed by length filtering or
+       the cut-off threshold (see __compare_rec_pairs_from_dict__() for a
+       description of these two arguments).
+
+       Weight vectors are not kept in memory (and the weight vector file is
+       not written), so a linkage or deduplication can be run in memory that
+       does not depend upon the number of record pairs, for example:
+
+         for (rec_id1, rec_id2, w_vec) in index.iter_run():
+           ...
+
+       The iterator can be given directly to the classify() method of the
+       classifiers and the output function SaveMatchStatusFile().
+    """
+
+    logging.info('')
+    logging.info('Started iterative comparison of %d record pairs' % \
+                 (self.num_rec_pairs))
+    if (self.log_funct != None):
+      self.log_funct('Started iterative comparison of %d record pairs' % \
+                     (self.num_rec_pairs))
+
+    # Check if index has been compacted - - - - - - - - - - - - - - - - - - - -
+    #
+    if (self.status != 'compacted'):
+      logging.exception('Index "%s" has not been compacted, running ' % \
+                        (self.description)+'comparisons not possible')
+      raise Exception
+
+    progress_report_cnt = self.__get_progress_report_cnt__()
+
+    length_filter_perc = self.__check_comparison_args__(length_filter_perc,
+                                                        cut_off_threshold)
+
+    self.__prepare_comparators__()
+
+    comp_stats = [0, 0, 0]
+
+    start_time = time.time()
+
+    for rec_pair_w_vec in \
+        self.__iter_compare_rec_pairs__(self.__iter_rec_pair_rows__(),
+                                        length_filter_perc, cut_off_threshold,
+                                        comp_stats, progress_report_cnt,
+                                        start_time):
+      yield rec_pair_w_vec
+
+    self.__log_comparison_summary__(comp_stats, length_filter_perc,
+                                    cut_off_threshold, start_time)
+
+  # ---------------------------------------------------------------------------
+
+  def __iter_run_from_dict__(self, length_filter_perc, cut_off_threshold):
+    """A generator used by the iter_run() method of indices which compare
+       record pairs while reading a data set in their run() method, and thus
+       cannot provide the record pairs one at a time. The weight vector
+       dictionary returned by run() is iterated over, so memory usage is not
+       reduced for these indices.
+    """
+
+    weight_vec_file = self.weight_vec_file  # Make sure run() returns a dict
+
+    self.weight_vec_file = None
+    try:
+      [field_names_list, weight_vec_dict] = self.run(length_filter_perc,
+                                                     cut_off_threshold)
+    finally:
+      self.weight_vec_file = weight_vec_file
+
+    for ((rec_ident1, rec_ident2), w_vec) in weight_vec_dict.iteritems():
+      yield (rec_ident1, rec_ident2, w_vec)
+
+  # ---------------------------------------------------------------------------
+
+  def __open_weight_vec_file__(self):
+    """Open the weight vector file for writing and return a list with the file
+       object (to be closed once all weight vectors are written) and a writer
+       object (with a writerow() method that takes a list with two record
+       identifiers followed by the weights).
+
+       If the weight vector file name ends with '.bin' the weight vectors are
+       written in binary format (see output.BinaryWeightVectorWriter),
+       otherwise a CSV file with a header line is written.
+    """
+
+    if (self.weight_vec_file.endswith('.bin')):
+      weight_vec_writer = output.BinaryWeightVectorWriter(self.weight_vec_file,
+                                              self.__get_field_names_list__())
+      return [weight_vec_writer, weight_vec_writer]
+
+    try:
+      weight_vec_fp = open(self.weight_vec_file, 'w')
+    except:
+      logging.exception('Cannot write weight vector file: %s' % \
+                        (self.weight_vec_file))
+      raise Exception
+    weight_vec_writer = csv.writer(weight_vec_fp)
+
+    # Write header line with descriptions of field comparisons
+    #
+    weight_vec_header_line = ['rec_id1', 'rec_id2'] + \
+                              self.__get_field_names_list__()
+    weight_vec_writer.writerow(weight_vec_header_line)
+
+    return [weight_vec_fp, weight_vec_writer]
+
+  # ---------------------------------------------------------------------------
+
+  def __new_weight_vec_dict__(self):
+    """Return an empty weight vector dictionary, or an empty weight vector
+       store if the 'weight_vec_store' flag is set.
+    """
+
+    if (self.weight_vec_store == True):
+      return auxiliary.WeightVectorStore( \
+                          len(self.rec_comparator.field_comparison_list))
+    else:
+      return {}
+
+  # ---------------------------------------------------------------------------
+
+  def __get_progress_report_cnt__(self):
+    """Calculate after how many record pair comparisons a progress report is
+       to be logged.
+    """
+
+    if (self.progress_report != None):
+      return max(1, int(self.num_rec_pairs / (100.0 / self.progress_report)))
+    else:  # So no progress report is being logged
+      return self.num_rec_pairs + 1
+
+  # ---------------------------------------------------------------------------
+
+  def __check_comparison_args__(self, length_filter_perc, cut_off_threshold):
+    """Check the length filter and cut-off threshold arguments of a run, and
+       return the length filter percentage normalised into 0..1 (or None).
+    """
+
+    if (length_filter_perc != None):
+      auxiliary.check_is_percentage('Length filter percentage',
+                                    length_filter_perc)
+      logging.info('  Length filtering set to %.1f%%' % (length_filter_perc))
+      length_filter_perc /= 100.0  # Normalise
+
+    if (cut_off_threshold != None):
+      auxiliary.check_is_number('Cut-off threshold', cut_off_threshold)
+      logging.info('  Cut-off threshold set to: %.2f' % (cut_off_threshold))
+
+    return length_filter_perc
+
+  # ---------------------------------------------------------------------------
+
+  def __prepare_comparators__(self):
+    """If the 'prepare_comparators' flag is set, prepare the field comparators
+       of the record comparator with the records in the record caches.
+    """
+
+    if (self.prepare_comparators == False):
+      return
+
+    start_time = time.time()
+
+    if (self.do_deduplication == True):
+      self.rec_comparator.prepare(self.rec_cache1.itervalues())
+    else:
+      self.rec_comparator.prepare(self.rec_cache1.itervalues(),
+                                  self.rec_cache2.itervalues())
+
+    logging.info('  Prepared field comparators in %s' % \
+                 (auxiliary.time_string(time.time()-start_time)))
+
+  # ---------------------------------------------------------------------------
+
+  def __iter_rec_pair_rows__(self):
+    """Yield the record pairs to be compared as tuples (record number from
+       data set 1, collection of record numbers from data set 2). This default
+       version returns the rows of the record pair dictionary.
+    """
+
+    rec_pair_dict = self.rec_pair_dict  # Shorthand
+
+    for rec_ident1 in rec_pair_dict:
+      yield (rec_ident1, rec_pair_dict[rec_ident1])
+
+  # ---------------------------------------------------------------------------
+
+  def __iter_compare_rec_pairs__(self, rec_pair_rows,
+                                 length_filter_perc, cut_off_threshold,
+                                 comp_stats, progress_report_cnt = None,
+                                 start_time = None):
+    """Compare the record pairs given by 'rec_pair_rows', an iterable of
+       tuples (record number from data set 1, collection of record numbers from
+       data set 2) as returned by __iter_rec_pair_rows__(), and yield a tuple
+       (record identifier 1, record identifier 2, weight vector) for each
+       compared record pair that is not filtered out.
+
+       The record pairs and record caches contain the integer record numbers
+       interned by the data sets (see dataset.DataSet), which are here mapped
+       back to the original record identifiers.
+
+       Record pairs are compared in batches using the compare_batch() method
+       of the record comparator, each batch made of the record pairs (not
+       removed by the length filter) of 'COMPARISON_BATCH_SIZE' consecutive
+       record pairs. So batches only depend upon the position of the record
+       pairs, also when a shard of the record pairs is compared (see
+       __compare_rec_pairs_parallel__()).
+
+       The given list 'comp_stats' is updated with the number of record pairs
+       processed, the number of record pairs removed by the length filter
+       (which is assumed to be normalised), and the number of record pairs
+       with a summed weight below the cut-off threshold.
+
+       If a progress report counter and a start time are given, the progress
+       of the comparisons is logged.
+    """
+
+    rec_cache1 =       self.rec_cache1  # Shorthands to make program faster
+    rec_length_cache = self.rec_length_cache
+    do_dedup =         self.do_deduplication
+
+    # Record numbers are mapped back to the original record identifiers
+    #
+    rec_ident_list1 = self.dataset1.rec_ident_list
+    rec_ident_list2 = self.dataset2.rec_ident_list
+
+    # Set shorthand depending upon deduplication or linkage - - - - - - - - - -
+    #
+    if (do_dedup == True):  # A deduplication run
+      rec_cache2 = self.rec_cache1
+    else:
+      rec_cache2 = self.rec_cache2
+
+    if (progress_report_cnt == None):
+      progress_report_cnt = self.num_rec_pairs + 1
+
+    # Record pairs are collected and then compared in batches
+    #
+    rec_ident_pair_batch = []
+    rec_pair_batch =       []
+
+    num_batch_pairs = 0  # Number of record pairs (also the ones not compared)
+                         # in the current batch
+
+    for (rec_ident1, rec_ident2_list) in rec_pair_rows:
+
+      rec1 = rec_cache1[rec_ident1]  # Get the actual first record
+
+      if (length_filter_perc != None):
+        rec1_len = len(''.join(rec1))  # Get length in characters for record
+
+      for rec_ident2 in rec_ident2_list:
+
+        rec2 = rec_cache2[rec_ident2]  # Get actual second record
+
+        do_comp = True  # Flag, specify if comparison should be done
+
+        if (length_filter_perc != None):
+          if (rec_ident2 in rec_length_cache):  # Length is cached
+            rec2_len = rec_length_cache[rec_ident2]
+          else:
+            rec2_len = len(''.join(rec2))
+            rec_length_cache[rec_ident2] = rec2_len
+
+          perc_diff = float(abs(rec1_len - rec2_len)) / max(rec1_len, rec2_len)
+
+          if (perc_diff > length_filter_perc):
+            do_comp = False  # Difference too large, don't do comparison
+            comp_stats[1] += 1
+
+        if (do_comp == True):
+          orig_rec_ident1 = rec_ident_list1[rec_ident1]
+          orig_rec_ident2 = rec_ident_list2[rec_ident2]
+
+          # For deduplications make sure record identifiers are sorted
+          #
+          if (do_dedup == True) and (orig_rec_ident1 > orig_rec_ident2):
+            rec_ident_pair_batch.append((orig_rec_ident2, orig_rec_ident1))
+            rec_pair_batch.append((rec2, rec1))
+          else:
+            rec_ident_pair_batch.append((orig_rec_ident1, orig_rec_ident2))
+            rec_pair_batch.append((rec1, rec2))
+
+        num_batch_pairs += 1
+
+        if (num_batch_pairs >= COMPARISON_BATCH_SIZE):
+          if (rec_pair_batch != []):
+            for rec_pair_w_vec in self.__compare_rec_pair_batch__(
+                                          rec_ident_pair_batch, rec_pair_batch,
+                                          cut_off_threshold, comp_stats):
+              yield rec_pair_w_vec
+          rec_ident_pair_batch = []
+          rec_pair_batch =       []
+          num_batch_pairs =      0
+
+        comp_stats[0] += 1  # Count all record pair comparisons (even if not
+                            # done)
+
+        if ((comp_stats[0] % progress_report_cnt) == 0):
+          self.__log_comparison_progress__(comp_stats[0], start_time)
+
+    if (rec_pair_batch != []):  # Compare the last (not full) batch
+      for rec_pair_w_vec in self.__compare_rec_pair_batch__(
+                                    rec_ident_pair_batch, rec_pair_batch,
+                                    cut_off_threshold, comp_stats):
+        yield rec_pair_w_vec
+
+  # ---------------------------------------------------------------------------
+
+  def __compare_rec_pair_batch__(self, rec_ident_pair_batch, rec_pair_batch,
+                                 cut_off_threshold, comp_stats):
+    """Compare a batch of record pairs using the batch method of the record
+       comparator and return a list with tuples (record identifier 1, record
+       identifier 2, weight vector) for all record pairs with a summed weight
+       not below the cut-off threshold (the number of record pairs below the
+       threshold is added to 'comp_stats').
+    """
+
+    w_vec_list = self.rec_comparator.compare_batch(rec_pair_batch)
+
+    if (cut_off_threshold == None):
+      return [(rec_ident1, rec_ident2, w_vec) for ((rec_ident1, rec_ident2),
+              w_vec) in zip(rec_ident_pair_batch, w_vec_list)]
+
+    compared_rec_pair_list = []
+
+    for ((rec_ident1, rec_ident2), w_vec) in zip(rec_ident_pair_batch,
+                                                 w_vec_list):
+      if (sum(w_vec) >= cut_off_threshold):
+        compared_rec_pair_list.append((rec_ident1, rec_ident2, w_vec))
+      else:
+        comp_stats[2] += 1
+
+    return compared_rec_pair_list
+
+  # ---------------------------------------------------------------------------
+
+  def __log_comparison_summary__(self, comp_stats, length_filter_perc,
+                                 cut_off_threshold, start_time):
+    """Log the time used for comparing all record pairs, and how many record
+       pairs were filtered out.
+    """
+
+    used_sec_str = auxiliary.time_string(time.time()-start_time)
+    rec_time_str = auxiliary.time_string((time.time()-start_time) / \
+                                         max(1, self.num_rec_pairs))
+    logging.info('Compared %d record pairs in %s (%s per pair)' % \
+                 (self.num_rec_pairs, used_sec_str,rec_time_str))
+    if (length_filter_perc != None):
+      logging.info('  Length filtering (set to %.1f%%) filtered %d record ' % \
+                   (length_filter_perc*100, comp_stats[1]) + 'pairs')
+    if (cut_off_threshold != None):
+      logging.info('  %d record pairs had summed weights below threshold ' % \
+                   (comp_stats[2]) + '%.2f' % (cut_off_threshold))
+
+    num_batch_val_pairs = sum([field_batch_stats[0] for field_batch_stats in \
+                               self.rec_comparator.batch_stats])
+    if (num_batch_val_pairs > 0):  # Log number of distinct values pairs
+      self.rec_comparator.get_batch_stats()
+
+    num_pruned_val_pairs = 0
+    for (field_comp, field_name1, field_name2) in \
+        self.rec_comparator.field_comparator_list:
+      num_pruned_val_pairs += getattr(field_comp, 'num_pruned', 0)
+    if (num_pruned_val_pairs > 0):  # Log number of pruned values pairs
+      self.rec_comparator.get_pruned_stats()
+
+    memory_usage_str = auxiliary.get_memory_usage()
+    if (memory_usage_str != None):
+      logging.info('  '+memory_usage_str)
+
+  # ---------------------------------------------------------------------------
+
+  def __compare_rec_pairs_parallel__(self, num_workers, length_filter_perc,
+                                     cut_off_threshold, weight_vec_dict,
+                                     weight_vec_writer, comp_stats,
+                                     progress_report_cnt, start_time):
+    """Compare the record pairs in the record pair dictionary using a pool of
+       worker processes.
+
+       The record pairs, in the order they are compared in the current process
+       (see __iter_rec_pair_rows__()), are split into shards with roughly the
+       same number of record pairs each, and the shards are given to the
+       workers. Each shard is made of whole comparison batches (a multiple of
+       'COMPARISON_BATCH_SIZE' record pairs), so the batches and the weight
+       vectors are the same as without workers. Results are collected in shard
+       order, and the counters of the record comparator updated by the workers
+       are added to the ones of the current process.
+
+       The length filter percentage given is assumed to be normalised already
+       (between 0 and 1). The given list 'comp_stats' is updated with the
+       number of comparisons done, the number of record pairs removed by the
+       length filter and the number of record pairs with a summed weight below
+       the cut-off threshold.
+    """
+
+    global _mp_compare_index
+
+    # Split the record pairs into shards of whole batches - - - - - - - - - - -
+    #
+    num_shards =      num_workers*NUM_SHARDS_PER_WORKER
+    shard_num_pairs = max(1, self.num_rec_pairs / num_shards)
+    shard_num_pairs = COMPARISON_BATCH_SIZE * \
+                      ((shard_num_pairs+COMPARISON_BATCH_SIZE-1) / \
+                       COMPARISON_BATCH_SIZE)
+
+    shard_list = []
+    shard =      []  # Tuples (record number 1, first and last position in
+    shard_size = 0   # the collection of record numbers 2)
+
+    for (rec_ident1, rec_ident2_coll) in self.__iter_rec_pair_rows__():
+      row_start = 0
+      row_len =   len(rec_ident2_coll)
+
+      while (row_start < row_len):  # A row can be split over shards
+        row_end = min(row_len, row_start + shard_num_pairs - shard_size)
+
+        shard.append((rec_ident1, row_start, row_end))
+        shard_size += row_end - row_start
+        row_start =   row_end
+
+        if (shard_size == shard_num_pairs):
+          shard_list.append((shard, length_filter_perc, cut_off_threshold))
+          shard =      []
+          shard_size = 0
+
+    if (shard != []):
+      shard_list.append((shard, length_filter_perc, cut_off_threshold))
+
+    logging.info('  Split %d record pairs into %d shards for %d workers' % \
+                 (self.num_rec_pairs, len(shard_list), num_workers))
+
+    # Forked workers will see this index (and its record caches) - - - - - - -
+    #
+    _mp_compare_index = self
+
+    pool = multiprocessing.Pool(num_workers)
+
+    try:
+      for (w_vec_list, shard_comp_stats, shard_counter_list) in \
+          pool.imap(_compare_rec_pairs_shard, shard_list):
+
+        # Counters of the comparators are only updated in the workers
+        #
+        self.rec_comparator.add_counters(shard_counter_list)
+
+        for (rec_ident1, rec_ident2, w_vec) in w_vec_list:
+          if (weight_vec_writer == None):
+            weight_vec_dict[(rec_ident1, rec_ident2)] = w_vec
+          else:
+            weight_vec_writer.writerow([rec_ident1, rec_ident2]+w_vec)
+
+        comp_done = comp_stats[0]
+
+        comp_stats[0] += shard_comp_stats[0]
+        comp_stats[1] += shard_comp_stats[1]
+        comp_stats[2] += shard_comp_stats[2]
+
+        # Log progress whenever another report interval has been completed
+        #
+        if ((comp_stats[0] / progress_report_cnt) > \
+            (comp_done / progress_report_cnt)):
+          self.__log_comparison_progress__(comp_stats[0], start_time)
+
+      pool.close()
+
+    finally:
+      pool.terminate()
+      pool.join()
+
+      _mp_compare_index = None
+
+    assert comp_stats[0] == self.num_rec_pairs, \
+           (comp_stats[0], self.num_rec_pairs)
+
+  # ---------------------------------------------------------------------------
+
+  def __compare_rec_pairs_shard__(self, shard, length_filter_perc,
+                                  cut_off_threshold):
+    """Compare the record pairs of one shard (called by the worker
+       processes). A shard is a list of tuples (record number from data set 1,
+       first and last position), each giving a slice of the collection of
+       record numbers from data set 2 in the record pair dictionary.
+
+       Returns a list with (record identifier 1, record identifier 2, weight
+       vector) tuples in the order they were compared, and a list with the
+       number of record pairs processed, the number of record pairs removed by
+       the length filter and the number of record pairs with a summed weight
+       below the cut-off threshold. The changes of the record comparator
+       counters made by this shard are returned as well (as the worker
+       processes only update their own copies, see
+       RecordComparator.get_counters()).
+    """
+
+    comp_stats = [0, 0, 0]
+
+    start_counter_list = self.rec_comparator.get_counters()
+
+    rec_pair_dict = self.rec_pair_dict  # Shorthand
+
+    # The forked worker process iterates over the collections in the same
+    # order as the process that split the record pairs into shards
+    #
+    rec_pair_rows = [(rec_ident1,
+                      list(rec_pair_dict[rec_ident1])[row_start:row_end]) \
+                     for (rec_ident1, row_start, row_end) in shard]
+
+    w_vec_list = list(self.__iter_compare_rec_pairs__(rec_pair_rows,
+                                                      length_filter_perc,
+                                                      cut_off_threshold,
+                                                      comp_stats))
+
+    counter_list = self.rec_comparator.get_counters()
+
+    for j in range(len(counter_list)):
+      for k in range(len(counter_list[j])):
+        counter_list[j][k] -= start_counter_list[j][k]
+
+    return (w_vec_list, comp_stats, counter_list)
+
+  # ---------------------------------------------------------------------------
+
+  def __find_closest__(self, sorted_list, elem):
+    """Binary search of the given element 'elem' in the given sorted list, and
+       return index of exact match or closest match (before where the element
+       would be).
+
+       Used in BigMatch and Dedup indexing methods.
+    """
+
+    start = 0
+    end =   len(sorted_list)-1
+
+    while 1:
+      if (end < start):
+        return end  # Not found
+
+      middle = (start + end) / 2
+      middle_val = sorted_list[middle]  # Get the element from the middle
+
+      if (middle_val == elem):  # Found the key value
+        return middle
+      elif (elem < middle_val):
+        end = middle - 1
+      else:
+        start = middle + 1
+
+  # ---------------------------------------------------------------------------
+
+  def load(self, index_file_name):
+    """Load a previously saved index from a binary file.
+
+       The index has to be initialised with the same data sets, index
+       definitions and record comparator as the saved index. This is checked
+       using a fingerprint stored in the file (made of the data set field lists
+       and the sizes, modification times and MD5 hashes of the data set files,
+       the index definitions and the fields used in comparisons).
+
+       If the file does not exist or its fingerprint does not match the current
+       index nothing is loaded and False is returned (and the index has to be
+       built and compacted), otherwise True is returned.
+    """
+
+    auxiliary.check_is_string('index_file_name', index_file_name)
+
+    start_time = time.time()
+
+    if (not os.access(index_file_name, os.F_OK)):
+      logging.warn('Index file "%s" does not exist' % (index_file_name))
+      return False
+
+    try:
+      index_file = open(index_file_name, 'rb')
+    except:
+      logging.exception('Cannot open index file "%s" for reading' % \
+                        (index_file_name))
+      raise IOError
+
+    try:
+      index_header = cPickle.load(index_file)
+    except:
+      logging.exception('Cannot read index file "%s"' % (index_file_name))
+      raise IOError
+
+    if ((not isinstance(index_header, dict)) or \
+        (index_header.get('format') != INDEX_FILE_FORMAT)):
+      logging.exception('File "%s" is not a saved index' % (index_file_name))
+      raise IOError
+
+    if (index_header['index_class'] != self.__class__.__name__):
+      logging.warn('Index file "%s" contains a %s, not a %s' % \
+                   (index_file_name, index_header['index_class'],
+                    self.__class__.__name__))
+      index_file.close()
+      return False
+
+    if (not self.__check_fingerprint__(index_header['fingerprint'])):
+      logging.warn('Fingerprint of index file "%s" does not match index, ' % \
+                   (index_file_name) + 'index needs to be built')
+      index_file.close()
+      return False
+
+    index_state = cPickle.load(index_file)
+    index_file.close()
+
+    # Record numbers in the index refer to the interned record identifiers of
+    # the data sets when the index was saved, which therefore are restored
+    #
+    [rec_ident_list1, rec_ident_list2] = index_state.pop('rec_ident_lists')
+
+    if ((self.dataset1.set_rec_ident_list(rec_ident_list1) == False) or \
+        (self.dataset2.set_rec_ident_list(rec_ident_list2) == False)):
+      logging.warn('Record identifiers interned in data sets differ from ' + \
+                   'index file "%s", index needs to be built' % \
+                   (index_file_name))
+      return False
+
+    for (attr_name, attr_val) in index_state.iteritems():
+      this_attr = getattr(self, attr_name, None)
+
+      # Update dictionaries and disk stores in place, as they can be disk
+      # based or referenced by other attributes
+      #
+      if (isinstance(this_attr, (dict, DiskStore)) and \
+          isinstance(attr_val, dict)):
+        this_attr.clear()
+        this_attr.update(attr_val)
+        if (isinstance(this_attr, DiskStore)):
+          this_attr.sync()
+      else:
+        setattr(self, attr_name, attr_val)
+
+    logging.info('Loaded index from file "%s" in %s (status: %s)' % \
+                 (index_file_name, auxiliary.time_string(time.time() - \
+                 start_time), self.status))
+
+    return True
+
+  # ---------------------------------------------------------------------------
+
+  def save(self, index_file_name):
+    """Save an index into a binary file, so it can later be loaded with the
+       load() method instead of being built and compacted again.
+
+       The index data structures, record caches, record pair dictionary and
+       status of the index are saved, together with the record identifiers
+       interned by the data sets and a fingerprint of the data sets and index
+       definitions (see load() for details).
+    """
+
+    auxiliary.check_is_string('index_file_name', index_file_name)
+
+    if (self.status != 'compacted'):
+      logging.exception('Index has to be compacted before it can be saved')
+      raise Exception
+
+    if (self.sorted_run_files != {}):
+      logging.exception('Streaming indices (with sorted runs in temporary ' + \
+                        'files) cannot be saved')
+      raise Exception
+
+    start_time = time.time()
+
+    index_header = {'format':INDEX_FILE_FORMAT,
+                    'index_class':self.__class__.__name__,
+                    'fingerprint':self.__get_fingerprint__(True)}
+
+    index_state = {}
+
+    for attr_name in self.__get_state_attr_names__():
+      if (hasattr(self, attr_name)):
+        attr_val = getattr(self, attr_name)
+
+        if (isinstance(attr_val, DiskStore)):  # Save disk store content
+          attr_val = dict(attr_val.iteritems())
+
+        elif (attr_name in ['index1', 'index2']):  # Disk based indices
+          attr_val = attr_val.copy()
+          for (i, this_index) in attr_val.items():
+            if (isinstance(this_index, DiskStore)):
+              attr_val[i] = dict(this_index.iteritems())
+
+        index_state[attr_name] = attr_val
+
+    index_state['rec_ident_lists'] = [self.dataset1.rec_ident_list,
+                                      self.dataset2.rec_ident_list]
+
+    try:
+      index_file = open(index_file_name, 'wb')
+    except:
+      logging.exception('Cannot open index file "%s" for writing' % \
+                        (index_file_name))
+      raise IOError
+
+    cPickle.dump(index_header, index_file, cPickle.HIGHEST_PROTOCOL)
+    cPickle.dump(index_state, index_file, cPickle.HIGHEST_PROTOCOL)
+    index_file.close()
+
+    logging.info('Saved index into file "%s" in %s' % \
+                 (index_file_name, auxiliary.time_string(time.time() - \
+                 start_time)))
+
+  # ---------------------------------------------------------------------------
+
+  def __get_state_attr_names__(self):
+    """Return a list with the names of the attributes that contain the state
+       of a compacted index, which are saved by the save() method.
+
+       Derived classes that build additional data structures extend this list.
+    """
+
+    return ['index1', 'index2', 'rec_cache1', 'rec_cache2', 'rec_pair_dict',
+            'num_rec_pairs', 'status']
+
+  # ---------------------------------------------------------------------------
+
+  def __get_fingerprint__(self, do_hash):
+    """Return a fingerprint of the data sets and index definitions of this
+       index, as a dictionary.
+
+       For each data set its class, field list, number of records and the
+       sizes, modification times and (if 'do_hash' is set to True) MD5 hashes
+       of its files are included. If a maximum block size is set, the block
+       policy and sub-block definitions are included as well, and so are the
+       parameters of the index class (see __get_param_fingerprint__()).
+    """
+
+    dataset_fingerprint_list = []
+
+    for this_dataset in [self.dataset1, self.dataset2]:
+      file_info_list = []
+
+      for file_name in self.__get_dataset_file_names__(this_dataset):
+        file_stat = os.stat(file_name)
+
+        if (do_hash == True):
+          file_hash = self.__get_file_hash__(file_name)
+        else:
+          file_hash = None
+
+        file_info_list.append([file_name, file_stat.st_size,
+                               file_stat.st_mtime, file_hash])
+
+      dataset_fingerprint_list.append([this_dataset.__class__.__name__,
+                                       this_dataset.field_list,
+                                       this_dataset.num_records,
+                                       file_info_list])
+
+    index_def_list = []  # Index (and sub-block) definitions without the
+                         # function objects
+
+    for index_def in self.index_def + self.sub_block_def:
+      index_def_list.append([])
+
+      for field_index_def in index_def:
+        index_def_list[-1].append(list(field_index_def[:5]))
+
+        if ((len(field_index_def) > 5) and (field_index_def[5] != None) and \
+            (len(field_index_def[5]) > 0)):
+          index_funct_def = field_index_def[5]
+          index_def_list[-1][-1].append([index_funct_def[0].__name__] + \
+                                        list(index_funct_def[1:]))
+
+    fingerprint = {'datasets':dataset_fingerprint_list,
+                   'do_deduplication':self.do_deduplication,
+                   'index_def':index_def_list[:len(self.index_def)],
+                   'index_sep_str':self.index_sep_str,
+                   'skip_missing':self.skip_missing,
+                   'comp_field_used1':self.comp_field_used1,
+                   'comp_field_used2':self.comp_field_used2,
+                   'index_params':self.__get_param_fingerprint__()}
+
+    if (self.max_block_size != None):  # The block policy changes the pairs
+      fingerprint['block_guard'] = [self.max_block_size, self.block_policy,
+                                    index_def_list[len(self.index_def):]]
+
+    return fingerprint
+
+  # ---------------------------------------------------------------------------
+
+  def __get_param_fingerprint__(self):
+    """Return a dictionary with the arguments of the index class that change
+       the index data structures or record pairs of a compacted index (such as
+       a window size or a threshold). A loaded index is only used if these are
+       the same as when it was saved. Functions are given by their names.
+
+       Derived classes with such arguments override this method.
+    """
+
+    return {}
+
+  # ---------------------------------------------------------------------------
+
+  def __check_fingerprint__(self, saved_fingerprint):
+    """Check if the given saved fingerprint matches the current data sets and
+       index definitions, return True if so and False otherwise.
+
+       The MD5 hashes of data set files are only calculated if a file has the
+       same size but a different modification time as when it was saved.
+    """
+
+    this_fingerprint = self.__get_fingerprint__(False)
+
+    for key in this_fingerprint:
+      if (key == 'datasets'):
+        continue
+
+      if (this_fingerprint[key] != saved_fingerprint.get(key)):
+        logging.info('  Index fingerprint differs in "%s"' % (key))
+        return False
+
+    for (this_dataset_fp, saved_dataset_fp) in \
+        zip(this_fingerprint['datasets'], saved_fingerprint['datasets']):
+
+      if (this_dataset_fp[:3] != saved_dataset_fp[:3]) or \
+         (len(this_dataset_fp[3]) != len(saved_dataset_fp[3])):
+        logging.info('  Index fingerprint differs in data set definition')
+        return False
+
+      for (this_file_info, saved_file_info) in zip(this_dataset_fp[3],
+                                                   saved_dataset_fp[3]):
+        if (this_file_info[:2] != saved_file_info[:2]):
+          logging.info('  Index fingerprint differs in file "%s"' % \
+                       (this_file_info[0]))
+          return False
+
+        if (this_file_info[2] != saved_file_info[2]):  # Modified, check hash
+          if (self.__get_file_hash__(this_file_info[0]) != saved_file_info[3]):
+            logging.info('  Index fingerprint differs in content of file ' + \
+                         '"%s"' % (this_file_info[0]))
+            return False
+
+    return True
+
+  # ---------------------------------------------------------------------------
+
+  def __get_dataset_file_names__(self, this_dataset):
+    """Return a sorted list with the names of the existing files of the given
+       data set (an empty list for data sets that are not file based).
+    """
+
+    base_file_name = getattr(this_dataset, 'file_name', None)
+
+    if (base_file_name == None):
+      return []
+
+    file_name_list = []
+
+    # Shelve based data sets are stored in files with various extensions
+    #
+    for file_ext in ['', '.db', '.dat', '.dir', '.pag']:
+      file_name = base_file_name + file_ext
+
+      if (os.path.isfile(file_name)):
+        file_name_list.append(file_name)
+
+    return file_name_list
+
+  # ---------------------------------------------------------------------------
+
+  def __get_file_hash__(self, file_name):
+    """Return the MD5 hash (as hexadecimal string) of the given file.
+    """
+
+    md5_hash = hashlib.md5()
+
+    in_file = open(file_name, 'rb')
+    file_block = in_file.read(1048576)
+
+    while (file_block != ''):
+      md5_hash.update(file_block)
+      file_block = in_file.read(1048576)
+
+    in_file.close()
+
+    return md5_hash.hexdigest()
+
+
+  # ---------------------------------------------------------------------------
+
+  def __get_index_values__(self, rec, data_set_num,
+                           index_val_funct_list = None):
+    """For the given record (list of fields) extract and produce the indexing
+       values. Returns a list with the indexing variable values (one per index
+       definition).
+
+       The data set number can be 0 (if the record is from the first data set)
+       or 1 (if it is from the second data set).
+
+       If a list of index value functions is given (such as the one of the
+       sub-block definitions) it is used instead of the one of the index
+       definitions.
+    """
+
+    if (index_val_funct_list == None):
+      index_val_funct_list = self.index_val_funct_list
+
+    index_var_values = []
+
+    sep_str = self.index_sep_str
+
+    assert (data_set_num == 0) or (data_set_num == 1)
+
+    num_fields = len(rec)
+
+    # Go through the index definitions and extract and process field values - -
+    #
+    for field_index_val_funct_list in index_val_funct_list:
+
+      index_val_list = []
+
+      for (field_cols, index_val_funct) in field_index_val_funct_list:
+
+        field_col = field_cols[data_set_num]  # Column of the field to extract
+
+        if (field_col < num_fields):
+          field_val = rec[field_col]
+
+          if (field_val != ''):  # Field value is not empty
+            index_val_list.append(index_val_funct(field_val))
+
+      # Make it a string and add to list of index values
+      #
+      index_val = sep_str.join(index_val_list)
+
+      index_var_values.append(index_val)
+
+    assert len(index_var_values) == len(index_val_funct_list)
+
+    return index_var_values
+
+  # ---------------------------------------------------------------------------
+
+  def __compile_index_defs__(self):
+    """Convert the processed index definitions into lists of tuples ((column
+       in data set 1, column in data set 2), function), one list per index,
+       where the function calculates the index variable value from a (not
+       empty) field value. Sorting of words, reversing, the encoding function
+       (with its arguments) and the maximum length are bound into the function
+       once, instead of being checked for every field value.
+
+       For pure index definitions the function keeps a cache of field values
+       and their index variable values with at most 'index_val_cache_size'
+       entries. The number of cache hits and misses are counted in the lists
+       in 'index_val_cache_stats'.
+
+       The sub-block definitions are converted in the same way (into the
+       'sub_block_val_funct_list' attribute).
+    """
+
+    index_val_funct_lists =       []
+    index_val_cache_stats_lists = []
+
+    for index_def_list_proc in self.index_def_proc + self.sub_block_def_proc:
+
+      index_val_funct_list =  []
+      index_val_cache_stats = []
+
+      for index_def_proc in index_def_list_proc:
+
+        index_val_funct = self.__get_index_val_funct__(index_def_proc)
+
+        if ((index_def_proc[6] == True) and (self.index_val_cache_size > 0)):
+          cache_stats = [0, 0]  # Number of cache hits and misses
+          index_val_funct = self.__get_cached_index_val_funct__( \
+                                           index_val_funct, cache_stats)
+        else:
+          cache_stats = None
+
+        index_val_funct_list.append(((index_def_proc[0], index_def_proc[1]),
+                                     index_val_funct))
+        index_val_cache_stats.append(cache_stats)
+
+      index_val_funct_lists.append(index_val_funct_list)
+      index_val_cache_stats_lists.append(index_val_cache_stats)
+
+    num_indices = len(self.index_def_proc)
+
+    self.index_val_funct_list =     index_val_funct_lists[:num_indices]
+    self.index_val_cache_stats =    index_val_cache_stats_lists[:num_indices]
+    self.sub_block_val_funct_list = index_val_funct_lists[num_indices:]
+
+  # ---------------------------------------------------------------------------
+
+  def __get_index_val_funct__(self, index_def_proc):
+    """Return a function that processes a field value according to the given
+       processed index definition and returns the index variable value.
+    """
+
+    sort_words = index_def_proc[2]  # Shorthands for the function below
+    reverse =    index_def_proc[3]
+    max_len =    index_def_proc[4]
+    funct_def =  index_def_proc[5]
+
+    if (funct_def != None):
+      funct_call = funct_def[0]  # The function itself
+      funct_args = tuple(funct_def[1:])
+    else:
+      funct_call = None
+
+    def index_val_funct(field_val):
+
+      field_val = field_val.lower()
+
+      # Check for sorting of words
+      #
+      if ((sort_words == True) and (' ' in field_val)):
+        word_list = field_val.split()
+        word_list.sort()
+        field_val = ' '.join(word_list)
+
+      if (reverse == True):  # Reverse the index value
+        field_val = field_val[::-1]
+
+      if (funct_call != None):  # There is a function defined for this index
+        field_val = funct_call(field_val, *funct_args)
+
+      if (max_len != None):  # There is maximum length
+        field_val = field_val[:max_len]
+
+      return field_val
+
+    return index_val_funct
+
+  # ---------------------------------------------------------------------------
+
+  def __get_cached_index_val_funct__(self, index_val_funct, cache_stats):
+    """Return a function that caches the index variable values returned by the
+       given function for at most 'index_val_cache_size' field values, and
+       counts cache hits and misses in the given list.
+    """
+
+    index_val_cache = {}  # Field values and their index variable values
+    max_cache_size =  self.index_val_cache_size
+
+    def cached_index_val_funct(field_val):
+
+      try:
+        index_val = index_val_cache[field_val]
+        cache_stats[0] += 1
+
+      except KeyError:
+        index_val = index_val_funct(field_val)
+        cache_stats[1] += 1
+
+        if (len(index_val_cache) < max_cache_size):
+          index_val_cache[field_val] = index_val
+
+      return index_val
+
+    return cached_index_val_funct
+
+  # ---------------------------------------------------------------------------
+
+  def __log_index_val_cache_stats__(self):
+    """Log the hit rates of the index variable value caches.
+    """
+
+    for i in range(len(self.index_val_cache_stats)):
+      for j in range(len(self.index_val_cache_stats[i])):
+        cache_stats = self.index_val_cache_stats[i][j]
+
+        if ((cache_stats != None) and (sum(cache_stats) > 0)):
+          logging.info('  Index %d, definition %d: Index value cache hit ' % \
+                       (i, j) + 'rate %.1f%% (%d hits, %d misses)' % \
+                       (100.0*cache_stats[0] / sum(cache_stats),
+                       cache_stats[0], cache_stats[1]))
+
+  # ---------------------------------------------------------------------------
+
+  def __log_build_progress__(self, records_read, num_records, start_time):
+    """Create a log message for the number of records read and indexed so far,
        the time used, and an estimation of much longer it will take.
     """
 
-    used_time = time.time() - start_time
-    perc_done = 100.0 * records_read / num_records
-    rec_time  = used_time / records_read  # Time per record read and indexed
-    togo_time = (num_records - records_read) * rec_time
+    used_time = time.time() - start_time
+    perc_done = 100.0 * records_read / num_records
+    rec_time  = used_time / records_read  # Time per record read and indexed
+    togo_time = (num_records - records_read) * rec_time
+
+    used_sec_str = auxiliary.time_string(used_time)
+    rec_sec_str =  auxiliary.time_string(rec_time)
+    togo_sec_str = auxiliary.time_string(togo_time)
+
+    log_str = 'Read and indexed %d of %d records (%d%%) in %s (%s per' % \
+              (records_read, num_records, round(perc_done), used_sec_str,
+              rec_sec_str)+' record), estimated %s until finished.' % \
+              (togo_sec_str)
+    logging.info(log_str)
+
+    if (self.log_funct != None):
+      self.log_funct(log_str)
+
+    memory_usage_str = auxiliary.get_memory_usage()
+    if (memory_usage_str != None):
+      logging.info('    '+memory_usage_str)
+
+  # ---------------------------------------------------------------------------
+
+  def __log_comparison_progress__(self, comparison_count, start_time):
+    """Create a log message for the number of comparison done so far, the time
+       used, and an estimation of much longer it will take.
+    """
+
+    used_time = time.time() - start_time
+    perc_done = int(round(100.0 * comparison_count / self.num_rec_pairs))
+    rec_time  = used_time / comparison_count  # Time per record pair comparison
+    togo_time = (self.num_rec_pairs - comparison_count) * rec_time
+
+    used_sec_str = auxiliary.time_string(used_time)
+    rec_sec_str =  auxiliary.time_string(rec_time)
+    togo_sec_str = auxiliary.time_string(togo_time)
+
+    log_str = 'Compared %d of %d record pairs (%d%%) in %s (%s per ' % \
+              (comparison_count, self.num_rec_pairs, perc_done, used_sec_str,
+              rec_sec_str)+'pair), estimated %s until finished.' % \
+              (togo_sec_str)
+    logging.info(log_str)
+
+    if (self.log_funct != None):
+      self.log_funct(log_str)
+
+    memory_usage_str = auxiliary.get_memory_usage()
+    if (memory_usage_str != None):
+      logging.info('    '+memory_usage_str)
+
+  # ---------------------------------------------------------------------------
+
+  def log(self, instance_var_list = None):
+    """Write a log message with the basic index instance variables plus the
+       instance variable provided in the given input list (assumed to contain
+       pairs of names (strings) and values).
+    """
+
+    logging.info('')
+    logging.info('Index:                    "%s"' % (self.description))
+    logging.info('  Index status:           %s' % (self.status))
+    logging.info('  Data set 1:             %s' % (self.dataset1.description))
+    logging.info('  Data set 2:             %s' % (self.dataset2.description))
+    if (self.do_deduplication == True):
+      logging.info('  Data sets are the same: Deduplication')
+    else:
+      logging.info('  Data sets differ:       Linkage')
+    logging.info('  Record comparator:      %s' % \
+                 (self.rec_comparator.description))
+    logging.info('    Used fields indices from data set 1: %s' % \
+                 (str(self.comp_field_used1)))
+    logging.info('    Used fields indices from data set 2: %s' % \
+                 (str(self.comp_field_used2)))
+    logging.info('  Skip missing:           %s' % (str(self.skip_missing)))
+    logging.info('  Index separator string: "%s"' % (self.index_sep_str))
+
+    if (self.num_rec_pairs == None):
+      logging.info('  Number of record pairs: Not known yet')
+    else:
+      logging.info('  Number of record pairs: %d' % (self.num_rec_pairs))
+    if (self.progress_report == None):
+      logging.info('  No progress reported.')
+    else:
+      logging.info('  Progress report every:  %d%%' % (self.progress_report))
+    if (self.weight_vec_file != None):
+      logging.info('  Weight vectors will be written into: %s' % \
+                   (self.weight_vec_file))
+    elif (self.weight_vec_store == True):
+      logging.info('  Weight vectors will be kept in a weight vector store')
+    if (self.max_block_size != None):
+      logging.info('  Maximum block size:     %d records (block policy "%s")' \
+                   % (self.max_block_size, self.block_policy))
+      if (self.block_policy == 'subblock'):
+        logging.info('    Number of sub-block definitions: %d' % \
+                     (len(self.sub_block_def)))
+
+    if (instance_var_list != None):
+      logging.info('  Index specific variables:')
+
+      max_name_len = 0
+      for (name, value) in instance_var_list:
+        max_name_len = max(max_name_len, len(name))
+
+      for (name, value) in instance_var_list:
+        pad_spaces = (max_name_len-len(name))*' '
+        logging.info('    %s %s' % (name+':'+pad_spaces, str(value)))
+
+    if (self.index_def != []):  # Index definitions are not empty - - - - - - -
+      logging.info('  Index definitions:')
+      for i in range(len(self.index_def)):
+        logging.info('    Index %d:' % (i))
+
+        for j in range(len(self.index_def[i])):
+          index_def = self.index_def[i][j]
+          index_def_proc = self.index_def_proc[i][j]
+
+          logging.info('      Data set 1 and 2 field names: "%s" (at column' \
+                       % (index_def[0]) + ' %d) and "%s" (at column %d)' % \
+                       (index_def_proc[0], index_def[1], index_def_proc[1]))
+          logging.info('        Sort words flag set to %s' % \
+                       (str(index_def[2])))
+          logging.info('        Reverse flag set to %s' % (str(index_def[3])))
+
+          if (index_def_proc[4] == None):
+            logging.info('        No maximum length for index variable ' + \
+                         'specified')
+          else:
+            logging.info('        Maximum length for index variable: %d' % \
+                         (index_def_proc[4]))
+          if (index_def_proc[5] == None):
+            logging.info('        No function specified')
+          else:
+            funct_str = '        Function: %s' % (str(index_def_proc[5][0]))
+            param_str = ''
+            if (len(index_def_proc[5]) > 1):
+              param_str += ' with parameter(s): '
+              for p in index_def_proc[5][1:]:
+                param_str += str(p)+', '
+            logging.info(funct_str+param_str[:-2])
+          logging.info('        Pure function flag set to %s' % \
+                       (str(index_def_proc[6])))
+
+  # ---------------------------------------------------------------------------
+
+  def get_index_stats(self):
+    """Extract and log information about the index.
+    """
+
+    pass
+
+# =============================================================================
+
+class FullIndex(Indexing):
+  """Class that implements a 'full' index which does not generate an index but
+     will compare all record pairs from the two data sets.
+
+     Note this will be very very slow for large data sets. The number of record
+     pairs to be compared corresponds to the number of records in the first
+     data set times the number of records in the second data set.
+
+     Note that the index definition will be ignored, as all record pairs will
+     be compared. Neither will length filtering nor the cut-off threshold be
+     applied.
+  """
+
+  # ---------------------------------------------------------------------------
+
+  def __init__(self, **kwargs):
+    """No additional attributes needed, just call base class constructor.
+    """
+
+    Indexing.__init__(self, kwargs)  # Initialise base class
+
+    num_rec1 = self.dataset1.num_records
+    num_rec2 = self.dataset2.num_records
+
+    if (num_rec1 < num_rec2):  # Make references to small and large data sets
+      self.ds_swapped = False
+      self.small_dataset = self.dataset1
+      self.large_dataset = self.dataset2
+    else:  # This will also hold for a deduplication
+      self.ds_swapped = True
+      self.small_dataset = self.dataset2
+      self.large_dataset = self.dataset1
+
+    if (self.do_deduplication == True):
+      assert num_rec1 == num_rec2
+      self.num_rec_pairs = num_rec1*(num_rec2-1)/2
+
+    else:
+      self.num_rec_pairs = num_rec1*num_rec2
+
+    self.log()
+
+  # ---------------------------------------------------------------------------
+
+  def build(self):
+    """Method to build an index data structure.
+
+       If the smaller data set is not memory based it will be loaded into
+       memory (as a dictionary) to make the comparisons faster.
+
+       Otherwise nothing needs to be done.
+    """
+
+    logging.info('')
+    logging.info('Built full index: "%s"' % (self.description))
+
+    start_time = time.time()
+
+    small_data_set_dict = {}
+
+    # Copy all records into the memory based dictionary - - - - - - - - - - - -
+    #
+    for (rec_ident, rec_list) in self.small_dataset.readall():
+      if (rec_ident in small_data_set_dict):
+        logging.exception('Duplicate record identifier "%s" in small data ' % \
+                          (rec_ident) + 'set')
+
+      rec_list_lower = []  # Make all values lowercase
+      for rec_val in rec_list:
+        rec_list_lower.append(rec_val.lower())
+
+      small_data_set_dict[rec_ident] = rec_list_lower
+
+    # assert self.small_dataset.num_records == len(small_data_set_dict)
+
+    self.small_data_set_dict = small_data_set_dict
+
+    logging.info('Built full index in %s' % \
+                 (auxiliary.time_string(time.time()-start_time)))
+
+    memory_usage_str = auxiliary.get_memory_usage()
+    if (memory_usage_str != None):
+      logging.info('  '+memory_usage_str)
+
+    self.status = 'built'  # Update index status
+
+  # ---------------------------------------------------------------------------
+
+  def __estimate_rec_pairs__(self, sample_size, num_bench_pairs):
+    """The number of record pairs is known exactly. The record pairs for the
+       benchmark are taken from the records of the smaller data set, and no
+       record pair dictionary is generated.
+    """
+
+    small_rec_list = [small_rec for (rec_ident, small_rec) in \
+                      sorted(self.small_data_set_dict.iteritems())]
+
+    bench_rec_pair_list = []
+
+    if (small_rec_list != []):
+      rand_choice_funct = random.Random(ESTIMATE_SAMPLE_SEED).choice
+
+      for j in xrange(num_bench_pairs):
+        bench_rec_pair_list.append((rand_choice_funct(small_rec_list),
+                                    rand_choice_funct(small_rec_list)))
+
+    return [self.num_rec_pairs, True, 0, bench_rec_pair_list]
+
+  # ---------------------------------------------------------------------------
+
+  def __get_state_attr_names__(self):
+    """The records of the smaller data set are also saved.
+    """
+
+    return Indexing.__get_state_attr_names__(self) + ['small_data_set_dict']
+
+  # ---------------------------------------------------------------------------
+
+  def compact(self):
+    """Method to compact an index data structure.
+
+       Nothing needs to be done.
+    """
+
+    logging.info('')
+    logging.info('Compact full index: "%s"' % (self.description))
+    logging.info('  Nothing needs to be done.')
+
+    self.status = 'compacted'  # Update index status
+
+  # ---------------------------------------------------------------------------
+
+  def run(self, length_filter_perc = None, cut_off_threshold = None):
+    """Iterate over all blocks in the index.
+
+       Compare all record pairs (quadratic complexity), and return a weight
+       vector dictionary with keys made of a tuple (record identifier 1,
+       record identifier 2), and corresponding values the comparison weights.
+
+       Length filtering and cut-off threshold will both be ignored.
+    """
+
+    logging.info('Started comparison of %d record pairs' % \
+                 (self.num_rec_pairs))
+    if (self.log_funct != None):
+      self.log_funct('Started comparison of %d record pairs' % \
+                     (self.num_rec_pairs))
+
+    # Check if index has been compacted - - - - - - - - - - - - - - - - - - - -
+    #
+    if (self.status != 'compacted'):  # Not necessary, but keep code consistent
+      logging.exception('Index "%s" has not been compacted, running ' % \
+                        (self.description)+'comparisons not possible')
+      raise Exception
+
+    # Check if weight vector file should be written - - - - - - - - - - - - - -
+    #
+    if (self.weight_vec_file != None):
+      [weight_vec_fp, weight_vec_writer] = self.__open_weight_vec_file__()
+
+    start_time = time.time()
+
+    progress_report_cnt = self.__get_progress_report_cnt__()
+
+    weight_vec_dict = self.__new_weight_vec_dict__()  # Calculated weight
+                                                      # vectors
+
+    for (rec_ident1, rec_ident2, w_vec) in \
+        self.__iter_full_compare__(progress_report_cnt, start_time):
+
+      # Put result into weight vector dictionary
+      #
+      if (self.weight_vec_file == None):
+        weight_vec_dict[(rec_ident1, rec_ident2)] = w_vec
+      else:
+        weight_vec_writer.writerow([rec_ident1, rec_ident2]+w_vec)
+
+    used_sec_str = auxiliary.time_string(time.time()-start_time)
+    rec_time_str = auxiliary.time_string((time.time()-start_time) / \
+                                         self.num_rec_pairs)
+    logging.info('Compared %d record pairs in %s (%s per pair)' % \
+                 (self.num_rec_pairs, used_sec_str,rec_time_str))
+
+    memory_usage_str = auxiliary.get_memory_usage()
+    if (memory_usage_str != None):
+      logging.info('  '+memory_usage_str)
+
+    if (self.weight_vec_file == None):
+      return [self.__get_field_names_list__(), weight_vec_dict]
+    else:
+      weight_vec_fp.close()
+      return None
+
+  # ---------------------------------------------------------------------------
+
+  def iter_run(self, length_filter_perc = None, cut_off_threshold = None):
+    """A generator version of the run() method, which yields one tuple (record
+       identifier 1, record identifier 2, weight vector) for each compared
+       record pair.
+
+       Length filtering and cut-off threshold will both be ignored.
+    """
+
+    logging.info('')
+    logging.info('Started iterative comparison of %d record pairs' % \
+                 (self.num_rec_pairs))
+    if (self.log_funct != None):
+      self.log_funct('Started iterative comparison of %d record pairs' % \
+                     (self.num_rec_pairs))
+
+    if (self.status != 'compacted'):  # Not necessary, but keep code consistent
+      logging.exception('Index "%s" has not been compacted, running ' % \
+                        (self.description)+'comparisons not possible')
+      raise Exception
+
+    start_time = time.time()
+
+    for rec_pair_w_vec in \
+        self.__iter_full_compare__(self.__get_progress_report_cnt__(),
+                                   start_time):
+      yield rec_pair_w_vec
+
+    self.__log_comparison_summary__([self.num_rec_pairs, 0, 0], None, None,
+                                    start_time)
+
+  # ---------------------------------------------------------------------------
+
+  def __iter_full_compare__(self, progress_report_cnt, start_time):
+    """Compare all record pairs (quadratic complexity) and yield a tuple
+       (record identifier 1, record identifier 2, weight vector) for each of
+       them.
+    """
+
+    comp_done = 0  # Counter for the number of comparisons done so far
+
+    compare_funct =       self.rec_comparator.compare  # Shorthands
+    small_data_set_dict = self.small_data_set_dict
+
+    if (self.do_deduplication == True):  # A deduplication run - - - - - - - -
+
+      # Need a sorted list of all record identifiers
+      #
+      small_data_set_rec_id_list = small_data_set_dict.keys()
+      small_data_set_rec_id_list.sort()
+
+      rec_cnt = 1  # Counter for second record identifier
+
+      for rec_ident1 in small_data_set_rec_id_list:
+        rec1 = small_data_set_dict[rec_ident1]  # Get values of first record
+
+        for rec_ident2 in small_data_set_rec_id_list[rec_cnt:]:
+
+          assert rec_ident1 != rec_ident2  # Make sure they are different
+
+          rec2 = small_data_set_dict[rec_ident2]  # Get values of second record
+
+          yield (rec_ident1, rec_ident2, compare_funct(rec1, rec2))
+
+          comp_done += 1
+
+          if ((comp_done % progress_report_cnt) == 0):
+            self.__log_comparison_progress__(comp_done, start_time)
+
+        rec_cnt += 1
+
+    else: # A linkage run - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+      for (rec_ident1, rec1) in self.large_dataset.readall():
+
+        rec1_lower = []  # Make all values lowercase
+        for rec_val in rec1:
+          rec1_lower.append(rec_val.lower())
+        rec1 = rec1_lower
+
+        for (rec_ident2, rec2) in small_data_set_dict.iteritems():
+
+          w_vec = compare_funct(rec1, rec2)  # Compare them
+
+          if (self.ds_swapped == True):
+            yield (rec_ident1, rec_ident2, w_vec)
+          else:
+            yield (rec_ident2, rec_ident1, w_vec)
+
+          comp_done += 1
+
+          if ((comp_done % progress_report_cnt) == 0):
+            self.__log_comparison_progress__(comp_done, start_time)
+
+# =============================================================================
+
+class BlockingIndex(Indexing):
+  """Class that implements the 'classical' blocking used for record linkage.
+
+     Records that have the same index variable values for an index are put into
+     the same blocks, and only records within a block are then compared.
+
+     The additional argument (besides the base class arguments) which can be
+     set when this index is initialised is:
+
+       lazy_pairs  A flag (True or False), if set to True the compact() method
+                   does not generate a dictionary with all record pairs (which
+                   requires memory proportional to the number of record
+                   pairs). Instead the run() method generates the record pairs
+                   block by block while it compares them. A record pair that
+                   is in blocks of several indices is only compared for the
+                   first index that produced it. Default is False.
+  """
+
+  # ---------------------------------------------------------------------------
+
+  def __init__(self, **kwargs):
+    """Constructor. Process the 'lazy_pairs' argument first, then call the
+       base class constructor.
+
+       Note that number of record pairs will not be known after initialisation
+       (so it is left at value None).
+    """
+
+    self.lazy_pairs = False
+
+    self.rec_block_val_list1 = []  # For lazy record pair generation, lists
+    self.rec_block_val_list2 = []  # (one per index) of the block values of
+                                   # all records (indexed by record numbers)
+
+    base_kwargs = {}  # Dictionary, will contain unprocessed arguments for base
+                      # class constructor
+
+    for (keyword, value) in kwargs.items():
+
+      if (keyword.startswith('lazy')):
+        auxiliary.check_is_flag('lazy_pairs', value)
+        self.lazy_pairs = value
+
+      else:
+        base_kwargs[keyword] = value
+
+    Indexing.__init__(self, base_kwargs)  # Initialise base class
+
+    self.log([('Lazy record pairs', self.lazy_pairs)])  # Log a message
+
+  # ---------------------------------------------------------------------------
+
+  def __get_param_fingerprint__(self):
+    """Lazy record pair generation changes the saved record pairs.
+    """
+
+    return {'lazy_pairs':self.lazy_pairs}
+
+  # ---------------------------------------------------------------------------
+
+  def build(self):
+    """Method to build an index data structure.
+
+       Read all records from both files, extract blocking variables and then
+       insert records into blocks.
+    """
+
+    logging.info('')
+    logging.info('Build blocking index: "%s"' % (self.description))
+
+    start_time = time.time()
+
+    self.__records_into_inv_index__()
+
+    num_indices = len(self.index_def)
+
+    # Now calculate number of record pairs - - - - - - - - - - - - - - - - - -
+    #
+    self.num_rec_pairs = 0
+
+    largest_block_num_rec = -1  # Also keep the largest block size and value
+    largest_block_val = ''
+    largest_block_index_num = -1  # Index number of the largest block
+
+    for i in range(num_indices):
+
+      if (self.do_deduplication == True):  # A deduplication - - - - - - - - -
+
+        logging.info('  Index %d for data set 1 contains %d blocks' % \
+                     (i, len(self.index1[i])))
+
+        for block_val in self.index1[i]: # Loop over all block values in index
+          block_num_recs = len(self.index1[i][block_val])
+
+          if (block_num_recs > largest_block_num_rec):  # New largest block
+            largest_block_num_rec =   block_num_recs
+            largest_block_val =       block_val
+            largest_block_index_num = i
+
+          self.num_rec_pairs += block_num_recs*(block_num_recs-1)/2
+
+      else:  # A linkage - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+        logging.info('  Index %d for data set 1 contains %d blocks, and ' % \
+                     (i, len(self.index1[i]))+'for data set 2 contains %d' % \
+                     (len(self.index2[i]))+' blocks')
+
+        for block_val in self.index1[i]: # Loop over all block values in index
+          block_num_recs1 = len(self.index1[i][block_val])
+
+          if block_val in self.index2[i]:  # Blocking values is both data sets'
+                                           # index
+            block_num_recs2 = len(self.index2[i][block_val])
+
+            if (block_num_recs1 > largest_block_num_rec):  # New largest block
+              largest_block_num_rec =   block_num_recs1
+              largest_block_val =       block_val
+              largest_block_index_num = i
+
+            if (block_num_recs2 > largest_block_num_rec):  # New largest block
+              largest_block_num_rec =   block_num_recs2
+              largest_block_val =       block_val
+              largest_block_index_num = i
+
+            self.num_rec_pairs += block_num_recs1*block_num_recs2
+
+    logging.info('Built blocking index in %s' % \
+                 (auxiliary.time_string(time.time()-start_time)))
+
+    logging.info('  Number of record pairs: %d' % (self.num_rec_pairs))
+    logging.info('  Largest block with value "%s" contains %d records' % \
+                 (largest_block_val, largest_block_num_rec)+' (in index %d)' \
+                 % (largest_block_index_num))
+
+    memory_usage_str = auxiliary.get_memory_usage()
+    if (memory_usage_str != None):
+      logging.info('  '+memory_usage_str)
+
+    self.status = 'built'  # Update index status
+
+  # ---------------------------------------------------------------------------
+
+  def compact(self):
+    """Method to compact an index data structure.
+
+       Make a dictionary of all record pairs over all indices, which removes
+       duplicate record pairs.
+    """
+
+    NUM_BLOCK_PROGRESS_REPORT = 1000
 
-    used_sec_str = auxiliary.time_string(used_time)
-    rec_sec_str =  auxiliary.time_string(rec_time)
-    togo_sec_str = auxiliary.time_string(togo_time)
+    logging.info('')
+    logging.info('Compact blocking index: "%s"' % (self.description))
 
-    log_str = 'Read and indexed %d of %d records (%d%%) in %s (%s per' % \
-              (records_read, num_records, round(perc_done), used_sec_str,
-              rec_sec_str)+' record), estimated %s until finished.' % \
-              (togo_sec_str)
-    logging.info(log_str)
+    start_time = time.time()
 
-    if (self.log_funct != None):
-      self.log_funct(log_str)
+    num_indices = len(self.index_def)
+
+    # Check if index has been built - - - - - - - - - - - - - - - - - - - - - -
+    #
+    if (self.status != 'built'):
+      logging.exception('Index "%s" has not been built, compacting is not ' % \
+                        (self.description)+'possible')
+      raise Exception
+
+    old_num_rec_pairs = self.num_rec_pairs  # Keep old number of record pairs
+
+    # Report the block sizes and apply the block policy to the blocks - - - - -
+    #
+    self.__reset_block_guard__()
+
+    for i in range(num_indices):
+      self.__log_block_size_hist__(i, self.__iter_inv_index_block_sizes__(i))
+      self.__guard_inv_index__(i)
+
+    self.__log_block_guard_stats__()
+
+    if (self.lazy_pairs == True):
+      self.__compact_lazy__()
+
+      logging.info('Compacted blocking index in %s' % \
+                   (auxiliary.time_string(time.time()-start_time)))
+      logging.info('  Old number of record pairs: %d' % (old_num_rec_pairs))
+      logging.info('  New number of record pairs: %d' % (self.num_rec_pairs))
+
+      self.status = 'compacted'  # Update index status
+      return
+
+    rec_pair_dict = {}  # A dictionary with record identifiers from data set 1
+                        # as keys and sets of identifiers from data set 2 as
+                        # values
+
+    for i in range(num_indices):
+
+      istart_time = time.time()
+
+      num_blocks_done = 0
+
+      if (self.do_deduplication == True):  # A deduplication - - - - - - - - -
+
+        this_index = self.index1[i]  # Shorthand
+
+        for block_val in this_index: # Loop over all block values in index
+
+          block_recs = this_index[block_val]  # All records in this block
+
+          if (len(block_recs) > 1):
+
+            self.__dedup_rec_pairs__(block_recs, rec_pair_dict)
+
+          num_blocks_done += 1
+
+          # Log progress report every XXX blocks processed - - - - - - - - - -
+          #
+          if ((num_blocks_done % NUM_BLOCK_PROGRESS_REPORT) == 0):
+            logging.info('    Processed %d of %d blocks' % \
+                         (num_blocks_done, len(this_index)))
+            memory_usage_str = auxiliary.get_memory_usage()
+            if (memory_usage_str != None):
+              logging.info('      '+memory_usage_str)
+
+      else:  # A linkage - - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+        this_index1 = self.index1[i]  # Shorthands
+        this_index2 = self.index2[i]
+
+        for block_val in this_index1: # Loop over all block values in index
+
+          block_recs1 = this_index1[block_val]  # All records in this block
+                                                # from data set 1
+          if block_val in this_index2:  # Blocking values is both data sets'
+                                        # index
+
+            block_recs2 = this_index2[block_val] # All records in this block
+                                                 # from data set 2
+
+            self.__link_rec_pairs__(block_recs1, block_recs2, rec_pair_dict)
+
+          num_blocks_done += 1
+
+          # Log progress report every XXX blocks processed - - - - - - - - - -
+          #
+          if ((num_blocks_done % NUM_BLOCK_PROGRESS_REPORT) == 0):
+            logging.info('    Processed %d of %d blocks' % \
+                         (num_blocks_done, len(this_index1)))
+            memory_usage_str = auxiliary.get_memory_usage()
+            if (memory_usage_str != None):
+              logging.info('      '+memory_usage_str)
+
+      logging.info('  Compacted blocking index %d in %s' % \
+                   (i, auxiliary.time_string(time.time()-istart_time)))
+
+      self.index1[i].clear()  # Not needed anymore
+      self.index2[i].clear()
+
+      logging.info('    Explicitly run garbage collection')
+      gc.collect()
+
+      memory_usage_str = auxiliary.get_memory_usage()
+      if (memory_usage_str != None):
+        logging.info('      '+memory_usage_str)
+
+    self.rec_pair_dict = rec_pair_dict
+
+    self.num_rec_pairs = 0  # Count lengths of all record identifier sets - - -
+
+    for rec_ident2_set in self.rec_pair_dict.itervalues():
+      self.num_rec_pairs += len(rec_ident2_set)
+
+    logging.info('Compacted blocking index in %s' % \
+                 (auxiliary.time_string(time.time()-start_time)))
+    logging.info('  Old number of record pairs: %d' % (old_num_rec_pairs))
+    logging.info('  New number of record pairs: %d' % (self.num_rec_pairs))
+
+    self.status = 'compacted'  # Update index status
+
+  # ---------------------------------------------------------------------------
+
+  def __compact_lazy__(self):
+    """Prepare the index for lazy record pair generation. The blocks are kept,
+       and for each index the block values of all records are stored in a list
+       (indexed by record numbers), so that it can be checked if a record pair
+       has already been produced by a previous index. The number of unique
+       record pairs is counted (without storing them).
+    """
+
+    num_indices = len(self.index_def)
+
+    rec_block_val_lists = []
+
+    for (index, this_dataset) in [(self.index1, self.dataset1),
+                                  (self.index2, self.dataset2)]:
+      block_val_lists = []
+
+      if ((index is self.index1) or (self.do_deduplication == False)):
+        num_rec_nums = len(this_dataset.rec_ident_list)
+
+        for i in range(num_indices):
+          rec_block_val_list = [None]*num_rec_nums  # None if not in a block
+
+          for (block_val, block_recs) in index[i].iteritems():
+            for rec_num in block_recs:
+              rec_block_val_list[rec_num] = block_val
+
+          block_val_lists.append(rec_block_val_list)
+
+      rec_block_val_lists.append(block_val_lists)
+
+    [self.rec_block_val_list1, self.rec_block_val_list2] = rec_block_val_lists
+
+    if (self.do_deduplication == True):
+      self.rec_block_val_list2 = self.rec_block_val_list1
+      self.index2 = self.index1
+
+    self.rec_pair_dict = None
+
+    self.num_rec_pairs = 0
+
+    for (rec_ident1, rec_ident2_list) in self.__iter_rec_pair_rows__():
+      self.num_rec_pairs += len(rec_ident2_list)
 
     memory_usage_str = auxiliary.get_memory_usage()
     if (memory_usage_str != None):
-      logging.info('    '+memory_usage_str)
+      logging.info('  '+memory_usage_str)
 
   # ---------------------------------------------------------------------------
 
-  def __log_comparison_progress__(self, comparison_count, start_time):
-    """Create a log message for the number of comparison done so far, the time
-       used, and an estimation of much longer it will take.
+  def __iter_rec_pair_rows__(self):
+    """If record pairs are generated lazily, loop over the blocks of all
+       indices and yield tuples (record number from data set 1, list of record
+       numbers from data set 2). A record pair is only produced by the first
+       index in which both records are in the same block. Otherwise the rows
+       of the record pair dictionary are returned.
     """
 
-    used_time = time.time() - start_time
-    perc_done = int(round(100.0 * comparison_count / self.num_rec_pairs))
-    rec_time  = used_time / comparison_count  # Time per record pair comparison
-    togo_time = (self.num_rec_pairs - comparison_count) * rec_time
+    if (self.lazy_pairs == False):
+      for rec_pair_row in Indexing.__iter_rec_pair_rows__(self):
+        yield rec_pair_row
+      return
 
-    used_sec_str = auxiliary.time_string(used_time)
-    rec_sec_str =  auxiliary.time_string(rec_time)
-    togo_sec_str = auxiliary.time_string(togo_time)
+    do_dedup = self.do_deduplication
+
+    for i in range(len(self.index_def)):
+
+      this_index1 = self.index1[i]  # Shorthands
+      this_index2 = self.index2[i]
+
+      prev_block_vals1 = self.rec_block_val_list1[:i]  # Block values of the
+      prev_block_vals2 = self.rec_block_val_list2[:i]  # previous indices
+      prev_index_nums = range(i)
+
+      for block_val in this_index1:
+
+        if (block_val not in this_index2):
+          continue
+
+        if (do_dedup == True):
+          block_recs1 = sorted(this_index1[block_val])
+        else:
+          block_recs1 = this_index1[block_val]
+          block_recs2 = this_index2[block_val]
+
+        for rec_cnt in xrange(len(block_recs1)):
+
+          rec_ident1 = block_recs1[rec_cnt]
+
+          if (do_dedup == True):  # Pairs with all following records in block
+            block_recs2 = block_recs1[rec_cnt+1:]
+
+            if (block_recs2 == []):
+              continue
+
+          # Block values of the first record in the previous indices
+          #
+          rec1_block_vals = [(j, prev_block_vals1[j][rec_ident1]) for j in \
+                             prev_index_nums if \
+                             (prev_block_vals1[j][rec_ident1] != None)]
+
+          if (rec1_block_vals == []):  # Not produced by a previous index
+            yield (rec_ident1, block_recs2)
+
+          else:
+            rec_ident2_list = []
+
+            for rec_ident2 in block_recs2:
+              for (j, block_val1) in rec1_block_vals:
+                if (prev_block_vals2[j][rec_ident2] == block_val1):
+                  break  # Record pair produced by index j
+              else:
+                rec_ident2_list.append(rec_ident2)
+
+            if (rec_ident2_list != []):
+              yield (rec_ident1, rec_ident2_list)
+
+  # ---------------------------------------------------------------------------
+
+  def __iter_estimate_blocks__(self, i):
+    """The record pairs are the pairs within the (guarded) blocks.
+    """
+
+    return self.__iter_guarded_inv_index_blocks__(i)
+
+  # ---------------------------------------------------------------------------
+
+  def __iter_estimate_block_sizes__(self, i):
+    """The block sizes of the inverted indices.
+    """
+
+    return self.__iter_inv_index_block_sizes__(i)
 
-    log_str = 'Compared %d of %d record pairs (%d%%) in %s (%s per ' % \
-              (comparison_count, self.num_rec_pairs, perc_done, used_sec_str,
-              rec_sec_str)+'pair), estimated %s until finished.' % \
-              (togo_sec_str)
-    logging.info(log_str)
+  # ---------------------------------------------------------------------------
 
-    if (self.log_funct != None):
-      self.log_funct(log_str)
+  def __get_state_attr_names__(self):
+    """For lazy record pair generation the blocks and the block values of all
+       records are also saved.
+    """
 
-    memory_usage_str = auxiliary.get_memory_usage()
-    if (memory_usage_str != None):
-      logging.info('    '+memory_usage_str)
+    return Indexing.__get_state_attr_names__(self) + \
+           ['lazy_pairs', 'rec_block_val_list1', 'rec_block_val_list2']
 
   # ---------------------------------------------------------------------------
 
-  def log(self, instance_var_list = None):
-    """Write a log message with the basic index instance variables plus the
-       instance variable provided in the given input list (assumed to contain
-       pairs of names (strings) and values).
+  def run(self, length_filter_perc = None, cut_off_threshold = None,
+          num_workers = None):
+    """Iterate over all blocks in the index.
+
+       Compare the record pairs as produced by the blocking process, and return
+       a weight vector dictionary with keys made of a tuple (record identifier
+       1, record identifier 2), and corresponding values the comparison
+       weights.
     """
 
     logging.info('')
-    logging.info('Index:                    "%s"' % (self.description))
-    logging.info('  Index status:           %s' % (self.status))
-    logging.info('  Data set 1:             %s' % (self.dataset1.description))
-    logging.info('  Data set 2:             %s' % (self.dataset2.description))
-    if (self.do_deduplication == True):
-      logging.info('  Data sets are the same: Deduplication')
-    else:
-      logging.info('  Data sets differ:       Linkage')
-    logging.info('  Record comparator:      %s' % \
-                 (self.rec_comparator.description))
-    logging.info('    Used fields indices from data set 1: %s' % \
-                 (str(self.comp_field_used1)))
-    logging.info('    Used fields indices from data set 2: %s' % \
-                 (str(self.comp_field_used2)))
-    logging.info('  Skip missing:           %s' % (str(self.skip_missing)))
-    logging.info('  Index separator string: "%s"' % (self.index_sep_str))
+    logging.info('Started comparison of %d record pairs' % \
+                 (self.num_rec_pairs))
+    if (self.log_funct != None):
+      self.log_funct('Started comparison of %d record pairs' % \
+                     (self.num_rec_pairs))
 
-    if (self.num_rec_pairs == None):
-      logging.info('  Number of record pairs: Not known yet')
-    else:
-      logging.info('  Number of record pairs: %d' % (self.num_rec_pairs))
-    if (self.progress_report == None):
-      logging.info('  No progress reported.')
-    else:
-      logging.info('  Progress report every:  %d%%' % (self.progress_report))
-    if (self.weight_vec_file != None):
-      logging.info('  Weight vectors will be written into: %s' % \
-                   (self.weight_vec_file))
+    # Check if index has been compacted - - - - - - - - - - - - - - - - - - - -
+    #
+    if (self.status != 'compacted'):
+      logging.exception('Index "%s" has not been compacted, running ' % \
+                        (self.description)+'comparisons not possible')
+      raise Exception
 
-    if (instance_var_list != None):
-      logging.info('  Index specific variables:')
+    # Compare the records
+    #
+    return self.__compare_rec_pairs_from_dict__(length_filter_perc,
+                                                cut_off_threshold,
+                                                num_workers)
 
-      max_name_len = 0
-      for (name, value) in instance_var_list:
-        max_name_len = max(max_name_len, len(name))
+# =============================================================================
 
-      for (name, value) in instance_var_list:
-        pad_spaces = (max_name_len-len(name))*' '
-        logging.info('    %s %s' % (name+':'+pad_spaces, str(value)))
+class SortingIndex(Indexing):
+  """Class that implements the 'sorted neighbourhood' indexing approach based
+     on an inverted index.
 
-    if (self.index_def != []):  # Index definitions are not empty - - - - - - -
-      logging.info('  Index definitions:')
-      for i in range(len(self.index_def)):
-        logging.info('    Index %d:' % (i))
+     The index variable values are sorted alphabetically and then a window
+     (with user specified size) is moved over these sorted values. All records
+     in the blocks covered by the current window position are then compared to
+     each other.
 
-        for j in range(len(self.index_def[i])):
-          index_def = self.index_def[i][j]
-          index_def_proc = self.index_def_proc[i][j]
+     The additional argument (besides the base class arguments) which has to be
+     set when this index is initialised is:
 
-          logging.info('      Data set 1 and 2 field names: "%s" (at column' \
-                       % (index_def[0]) + ' %d) and "%s" (at column %d)' % \
-                       (index_def_proc[0], index_def[1], index_def_proc[1]))
-          logging.info('        Sort words flag set to %s' % \
-                       (str(index_def[2])))
-          logging.info('        Reverse flag set to %s' % (str(index_def[3])))
+       window_size  A positive integer that gives the size of the moving window
+                    in number of index variable values.
 
-          if (index_def_proc[4] == None):
-            logging.info('        No maximum length for index variable ' + \
-                         'specified')
-          else:
-            logging.info('        Maximum length for index variable: %d' % \
-                         (index_def_proc[4]))
-          if (index_def_proc[5] == None):
-            logging.info('        No function specified')
-          else:
-            funct_str = '        Function: %s' % (str(index_def_proc[5][0]))
-            param_str = ''
-            if (len(index_def_proc[5]) > 1):
-              param_str += ' with parameter(s): '
-              for p in index_def_proc[5][1:]:
-                param_str += str(p)+', '
-            logging.info(funct_str+param_str[:-2])
+     Note that a window_size of 1 will result in the same records being
+     compared as with the standard blocking approach (as a window of size 1
+     does not cover any neighbouring index variable values).
+
+     The following arguments can be set for a streaming (multi-pass) sorted
+     neighbourhood, where the inverted index and the record pair dictionary
+     are not kept in memory:
+
+       streaming    A flag (True or False), if set to True the build() method
+                    writes the index entries of each index into sorted runs in
+                    temporary files, and the run() method merges these runs
+                    and slides the window over the merged sorted values (one
+                    pass per index), comparing the record pairs that enter the
+                    window immediately. Memory used then depends upon the
+                    window size and the block sizes, not the number of records
+                    or record pairs (except for the record caches, which can be
+                    file based as well, see the base class arguments). Each
+                    record pair is generated once per pass it occurs in, so a
+                    record pair can be compared once per index (i.e. all
+                    passes are compared separately and the matches can be
+                    combined later, for example with a transitive closure).
+                    Default is False.
+       run_size     The maximum number of index entries kept in memory before
+                    they are sorted and written into a run file. Default is
+                    1000000.
+       tmp_dir      The directory where the run files are written. Default is
+                    None, in which case the system's temporary directory is
+                    used. The run files are removed when the program exits.
+  """
 
   # ---------------------------------------------------------------------------
 
-  def get_index_stats(self):
-    """Extract and log information about the index.
+  def __init__(self, **kwargs):
+    """Constructor. Process the 'window_size' argument first, then call the
+       base class constructor.
     """
 
-    pass
+    self.window_size = None  # Set the window size to not defined
+    self.streaming =   False
+    self.run_size =    1000000
+    self.tmp_dir =     None
 
-# =============================================================================
+    base_kwargs = {}  # Dictionary, will contain unprocessed arguments for base
+                      # class constructor
 
-class FullIndex(Indexing):
-  """Class that implements a 'full' index which does not generate an index but
-     will compare all record pairs from the two data sets.
+    for (keyword, value) in kwargs.items():
 
-     Note this will be very very slow for large data sets. The number of record
-     pairs to be compared corresponds to the number of records in the first
-     data set times the number of records in the second data set.
+      if (keyword.startswith('window')):
+        auxiliary.check_is_integer('window_size', value)
+        auxiliary.check_is_positive('window_size', value)
+        self.window_size = value
 
-     Note that the index definition will be ignored, as all record pairs will
-     be compared. Neither will length filtering nor the cut-off threshold be
-     applied.
-  """
+      elif (keyword.startswith('stream')):
+        auxiliary.check_is_flag('streaming', value)
+        self.streaming = value
 
-  # ---------------------------------------------------------------------------
+      elif (keyword.startswith('run_s')):
+        auxiliary.check_is_integer('run_size', value)
+        auxiliary.check_is_positive('run_size', value)
+        self.run_size = value
 
-  def __init__(self, **kwargs):
-    """No additional attributes needed, just call base class constructor.
-    """
+      elif (keyword.startswith('tmp_d')):
+        if (value != None):
+          auxiliary.check_is_string('tmp_dir', value)
+        self.tmp_dir = value
 
-    Indexing.__init__(self, kwargs)  # Initialise base class
+      else:
+        base_kwargs[keyword] = value
 
-    num_rec1 = self.dataset1.num_records
-    num_rec2 = self.dataset2.num_records
+    Indexing.__init__(self, base_kwargs)  # Initialise base class
 
-    if (num_rec1 < num_rec2):  # Make references to small and large data sets
-      self.ds_swapped = False
-      self.small_dataset = self.dataset1
-      self.large_dataset = self.dataset2
-    else:  # This will also hold for a deduplication
-      self.ds_swapped = True
-      self.small_dataset = self.dataset2
-      self.large_dataset = self.dataset1
+    # Make sure 'window_size' attribute is set - - - - - - - - - - - - - - - -
+    #
+    auxiliary.check_is_integer('window_size', self.window_size)
+    auxiliary.check_is_positive('window_size', self.window_size)
 
-    if (self.do_deduplication == True):
-      assert num_rec1 == num_rec2
-      self.num_rec_pairs = num_rec1*(num_rec2-1)/2
+    self.log([('Window size', self.window_size),
+              ('Streaming', self.streaming),
+              ('Run size', self.run_size),
+              ('Temporary directory', self.tmp_dir)])  # Log a message
 
-    else:
-      self.num_rec_pairs = num_rec1*num_rec2
+  # ---------------------------------------------------------------------------
 
-    self.log()
+  def __get_param_fingerprint__(self):
+    """The window size and streaming of the sorted blocks.
+    """
+
+    return {'window_size':self.window_size, 'streaming':self.streaming}
 
   # ---------------------------------------------------------------------------
 
   def build(self):
     """Method to build an index data structure.
 
-       If the smaller data set is not memory based it will be loaded into
-       memory (as a dictionary) to make the comparisons faster.
-
-       Otherwise nothing needs to be done.
+       Read all records from both files, extract blocking variables and then
+       insert records into blocks.
     """
 
     logging.info('')
-    logging.info('Built full index: "%s"' % (self.description))
+    logging.info('Build sorting index: "%s"' % (self.description))
 
     start_time = time.time()
 
-    small_data_set_dict = {}
-
-    # Copy all records into the memory based dictionary - - - - - - - - - - - -
-    #
-    for (rec_ident, rec_list) in self.small_dataset.readall():
-      if (rec_ident in small_data_set_dict):
-        logging.exception('Duplicate record identifier "%s" in small data ' % \
-                          (rec_ident) + 'set')
-
-      rec_list_lower = []  # Make all values lowercase
-      for rec_val in rec_list:
-        rec_list_lower.append(rec_val.lower())
-
-      small_data_set_dict[rec_ident] = rec_list_lower
-
-    # assert self.small_dataset.num_records == len(small_data_set_dict)
-
-    self.small_data_set_dict = small_data_set_dict
+    if (self.streaming == True):  # Write sorted runs into temporary files
+      self.__records_into_sorted_runs__(self.run_size, self.tmp_dir)
+    else:
+      self.__records_into_inv_index__()  # Read records and put into index
 
-    logging.info('Built full index in %s' % \
+    logging.info('Built sorting index in %s' % \
                  (auxiliary.time_string(time.time()-start_time)))
 
     memory_usage_str = auxiliary.get_memory_usage()
@@ -1352,384 +4861,415 @@ class FullIndex(Indexing):
   def compact(self):
     """Method to compact an index data structure.
 
-       Nothing needs to be done.
+       Make a dictionary of all record pairs over all indices, which removes
+       duplicate record pairs.
     """
 
+    NUM_BLOCK_PROGRESS_REPORT = 1000
+
     logging.info('')
-    logging.info('Compact full index: "%s"' % (self.description))
-    logging.info('  Nothing needs to be done.')
+    logging.info('Compact sorting index: "%s"' % (self.description))
 
-    self.status = 'compacted'  # Update index status
+    start_time = time.time()
 
-  # ---------------------------------------------------------------------------
+    # Check if index has been built - - - - - - - - - - - - - - - - - - - - - -
+    #
+    if (self.status != 'built'):
+      logging.exception('Index "%s" has not been built, compacting is not ' % \
+                        (self.description)+'possible')
+      raise Exception
 
-  def run(self, length_filter_perc = None, cut_off_threshold = None):
-    """Iterate over all blocks in the index.
+    num_indices = len(self.index_def)
 
-       Compare all record pairs (quadratic complexity), and return a weight
-       vector dictionary with keys made of a tuple (record identifier 1,
-       record identifier 2), and corresponding values the comparison weights.
+    # Report the block sizes and apply the block policy to the blocks (for a
+    # streaming index this is done while the sorted runs are merged) - - - - -
+    #
+    self.__reset_block_guard__()
 
-       Length filtering and cut-off threshold will both be ignored.
-    """
+    for i in range(num_indices):
+      if (self.streaming == True):
+        self.__log_block_size_hist__(i, self.__iter_sorted_block_sizes__(i))
+      else:
+        self.__log_block_size_hist__(i,
+                                     self.__iter_inv_index_block_sizes__(i))
+        self.__guard_inv_index__(i)
 
-    logging.info('Started comparison of %d record pairs' % \
-                 (self.num_rec_pairs))
-    if (self.log_funct != None):
-      self.log_funct('Started comparison of %d record pairs' % \
-                     (self.num_rec_pairs))
+    if (self.streaming == True):  # Record pairs are only generated in run()
+      self.rec_pair_dict = None
 
-    # Check if index has been compacted - - - - - - - - - - - - - - - - - - - -
-    #
-    if (self.status != 'compacted'):  # Not necessary, but keep code consistent
-      logging.exception('Index "%s" has not been compacted, running ' % \
-                        (self.description)+'comparisons not possible')
-      raise Exception
+      self.num_rec_pairs = 0
+
+      for (rec_ident1, rec_ident2_list) in self.__iter_rec_pair_rows__():
+        self.num_rec_pairs += len(rec_ident2_list)
+
+      self.__log_block_guard_stats__()
+
+      logging.info('Compacted streaming sorting index in %s' % \
+                   (auxiliary.time_string(time.time()-start_time)))
+      logging.info('  Number of record pairs: %d' % (self.num_rec_pairs))
+
+      self.status = 'compacted'  # Update index status
+      return
+
+    self.__log_block_guard_stats__()
+
+    dedup_rec_pair_funct = self.__dedup_rec_pairs__  # Shorthands
+    link_rec_pair_funct =  self.__link_rec_pairs__
+    w =                    self.window_size
+
+    rec_pair_dict = {}  # A dictionary with record identifiers from data set 1
+                        # as keys and sets of identifiers from data set 2 as
+                        # values
 
-    # Check if weight vector file should be written - - - - - - - - - - - - - -
-    #
-    if (self.weight_vec_file != None):
-      try:
-        weight_vec_fp = open(self.weight_vec_file, 'w')
-      except:
-        logging.exception('Cannot write weight vector file: %s' % \
-                          (self.weight_vec_file))
-        raise Exception
-      weight_vec_writer = csv.writer(weight_vec_fp)
+    for i in range(num_indices):
 
-      # Write header line with descriptions of field comparisons
-      #
-      weight_vec_header_line = ['rec_id1', 'rec_id2'] + \
-                                self.__get_field_names_list__()
-      weight_vec_writer.writerow(weight_vec_header_line)
+      istart_time = time.time()
 
-    start_time = time.time()
+      num_blocks_done = 0
 
-    # Calculate a counter for the progress report - - - - - - - - - - - - - - -
-    #
-    if (self.progress_report != None):
-      progress_report_cnt = max(1, int(self.num_rec_pairs / \
-                                   (100.0 / self.progress_report)))
-    else:  # So no progress report is being logged
-      progress_report_cnt = self.num_rec_pairs + 1
+      if (self.do_deduplication == True):  # A deduplication - - - - - - - - -
 
-    weight_vec_dict = {}  # Dictionary with calculated weight vectors
+        this_index = self.index1[i]  # Shorthand
 
-    comp_done = 0  # Counter for the number of comparisons done so far
+        w_block_len = [0]*w  # Counts of number of records in blocks in window
 
-    compare_funct =       self.rec_comparator.compare  # Shorthands
-    small_data_set_dict = self.small_data_set_dict
-    rec_length_cache =    self.rec_length_cache
+        curr_window_recs = []  # List of record identifiers in current window
 
-    if (self.do_deduplication == True):  # A deduplication run - - - - - - - -
+        block_val_list = this_index.keys()  # Get all blocking values
+        block_val_list.sort()
 
-      # Need a sorted list of all record identifiers
-      #
-      small_data_set_rec_id_list = small_data_set_dict.keys()
-      small_data_set_rec_id_list.sort()
+        num_block_vals = len(block_val_list)
 
-      rec_cnt = 1  # Counter for second record identifier
+        for j in xrange(num_block_vals):  # Loop over all blocks
 
-      for rec_ident1 in small_data_set_rec_id_list:
-        rec1 = small_data_set_dict[rec_ident1]  # Get values of first record
+          w_j = j % w  # Modulo window size
 
-        for rec_ident2 in small_data_set_rec_id_list[rec_cnt:]:
+          # Remove record identifiers from previous block
+          #
+          curr_window_recs = curr_window_recs[w_block_len[w_j]:]
 
-          assert rec_ident1 != rec_ident2  # Make sure they are different
+          new_window_recs = set()
 
-          rec2 = small_data_set_dict[rec_ident2]  # Get values of second record
+          # Insert record identifiers from this block that are not in yet
+          #
+          for rec_ident in this_index[block_val_list[j]]:
 
-          w_vec = compare_funct(rec1, rec2)  # Compare them
+            if (rec_ident not in curr_window_recs):
+              new_window_recs.add(rec_ident)
 
-          # Put result into weight vector dictionary
+          # Number of new records (previously not in window) from this block
           #
-          if (self.weight_vec_file == None):
-            weight_vec_dict[(rec_ident1, rec_ident2)] = w_vec
-          else:
-            weight_vec_writer.writerow([rec_ident1, rec_ident2]+w_vec)
+          w_block_len[w_j] = len(new_window_recs)
 
-          comp_done += 1
+          curr_window_recs += list(new_window_recs)
 
-          if ((comp_done % progress_report_cnt) == 0):
-            self.__log_comparison_progress__(comp_done, start_time)
+          if (len(curr_window_recs) > 1):
 
-        rec_cnt += 1
+            dedup_rec_pair_funct(curr_window_recs, rec_pair_dict)
 
-    else: # A linkage run - - - - - - - - - - - - - - - - - - - - - - - - - - -
+          num_blocks_done += 1
 
-      for (rec_ident1, rec1) in self.large_dataset.readall():
+          # Log progress report every XXX blocks processed - - - - - - - - - -
+          #
+          if ((num_blocks_done % NUM_BLOCK_PROGRESS_REPORT) == 0):
+            logging.info('    Processed %d of %d blocks' % \
+                         (num_blocks_done, num_block_vals))
+            memory_usage_str = auxiliary.get_memory_usage()
+            if (memory_usage_str != None):
+              logging.info('      '+memory_usage_str)
 
-        rec1_lower = []  # Make all values lowercase
-        for rec_val in rec1:
-          rec1_lower.append(rec_val.lower())
-        rec1 = rec1_lower
+        del curr_window_recs
 
-        for (rec_ident2, rec2) in small_data_set_dict.iteritems():
+      else:  # A linkage - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-          w_vec = compare_funct(rec1, rec2)  # Compare them
+        this_index1 = self.index1[i]  # Shorthands
+        this_index2 = self.index2[i]
 
-          # Put result into weight vector dictionary
-          #
-          if (self.weight_vec_file == None):
-            if (self.ds_swapped == True):
-              weight_vec_dict[(rec_ident1, rec_ident2)] = w_vec
-            else:
-              weight_vec_dict[(rec_ident2, rec_ident1)] = w_vec
-          else:
-            if (self.ds_swapped == True):
-              weight_vec_writer.writerow([rec_ident1, rec_ident2]+w_vec)
-            else:
-              weight_vec_writer.writerow([rec_ident2, rec_ident1]+w_vec)
+        w_block_len1 = [0]*w  # Counts of number of records in blocks in window
+        w_block_len2 = [0]*w
 
-          comp_done += 1
+        curr_window_recs1 = []  # List of record identifiers in current window
+        curr_window_recs2 = []
 
-          if ((comp_done % progress_report_cnt) == 0):
-            self.__log_comparison_progress__(comp_done, start_time)
+        block_val_list1 = this_index1.keys()  # Get all blocking values
+        block_val_list1.sort()
 
-    used_sec_str = auxiliary.time_string(time.time()-start_time)
-    rec_time_str = auxiliary.time_string((time.time()-start_time) / \
-                                         self.num_rec_pairs)
-    logging.info('Compared %d record pairs in %s (%s per pair)' % \
-                 (self.num_rec_pairs, used_sec_str,rec_time_str))
+        block_val_list2 = this_index2.keys()
+        block_val_list2.sort()
 
-    memory_usage_str = auxiliary.get_memory_usage()
-    if (memory_usage_str != None):
-      logging.info('  '+memory_usage_str)
+        num_block_vals1 = len(block_val_list1)
+        num_block_vals2 = len(block_val_list2)
 
-    if (self.weight_vec_file == None):
-      return [self.__get_field_names_list__(), weight_vec_dict]
-    else:
-      weight_vec_fp.close()
-      return None
+        # Create a sorted combined list of all blocking values
+        #
+        comb_block_values = list(set(block_val_list1+block_val_list2))
+        comb_block_values.sort()
 
-# =============================================================================
+        j = 0  # Iteration counters in block values 1 and 2
+        k = 0
 
-class BlockingIndex(Indexing):
-  """Class that implements the 'classical' blocking used for record linkage.
+        do_delete1 = False  # Flags, signalling if current window block
+        do_delete2 = False
 
-     Records that have the same index variable values for an index are put into
-     the same blocks, and only records within a block are then compared.
-  """
+        # Loop over combined list of block values - - - - - - - - - - - - - - -
+        #
+        for block_val in comb_block_values:
 
-  # ---------------------------------------------------------------------------
+          if (block_val in block_val_list1):  # Advance window for data set 1
 
-  def __init__(self, **kwargs):
-    """No additional attributes needed, just call base class constructor.
+            w_j = j % w  # Modulo window size
 
-       Note that number of record pairs will not be known after initialisation
-       (so it is left at value None).
-    """
+            # Remove record identifiers from previous block
+            #
+            curr_window_recs1 = curr_window_recs1[w_block_len1[w_j]:]
 
-    Indexing.__init__(self, kwargs)  # Initialise base class
+            new_window_recs = set()
 
-    self.log()  # Log a message
+            # Insert record identifiers from this block that are not in yet
+            #
+            for rec_ident in this_index1[block_val]:
 
-  # ---------------------------------------------------------------------------
+              if (rec_ident not in curr_window_recs1):
+                new_window_recs.add(rec_ident)
 
-  def build(self):
-    """Method to build an index data structure.
+            # Number of new records (previously not in window) from this block
+            #
+            w_block_len1[w_j] = len(new_window_recs)
 
-       Read all records from both files, extract blocking variables and then
-       insert records into blocks.
-    """
+            curr_window_recs1 += list(new_window_recs)
 
-    logging.info('')
-    logging.info('Build blocking index: "%s"' % (self.description))
+            j += 1  # Advance pointer into data set 1 blocks
 
-    start_time = time.time()
+          if (block_val in block_val_list2):  # Advance window for data set 2 -
 
-    self.__records_into_inv_index__()
+            w_k = k % w  # Modulo window size
 
-    num_indices = len(self.index_def)
+            # Remove record identifiers from previous block
+            #
+            curr_window_recs2 = curr_window_recs2[w_block_len2[w_k]:]
 
-    # Now calculate number of record pairs - - - - - - - - - - - - - - - - - -
-    #
-    self.num_rec_pairs = 0
+            new_window_recs = set()
 
-    largest_block_num_rec = -1  # Also keep the largest block size and value
-    largest_block_val = ''
-    largest_block_index_num = -1  # Index number of the largest block
+            # Insert record identifiers from this block that are not in yet
+            #
+            for rec_ident in this_index2[block_val]:
 
-    for i in range(num_indices):
+              if (rec_ident not in curr_window_recs2):
+                new_window_recs.add(rec_ident)
 
-      if (self.do_deduplication == True):  # A deduplication - - - - - - - - -
+            # Number of new records (previously not in window) from this block
+            #
+            w_block_len2[w_k] = len(new_window_recs)
 
-        logging.info('  Index %d for data set 1 contains %d blocks' % \
-                     (i, len(self.index1[i])))
+            curr_window_recs2 += list(new_window_recs)
 
-        for block_val in self.index1[i]: # Loop over all block values in index
-          block_num_recs = len(self.index1[i][block_val])
+            k += 1  # Advance pointer into data set 2 blocks
 
-          if (block_num_recs > largest_block_num_rec):  # New largest block
-            largest_block_num_rec =   block_num_recs
-            largest_block_val =       block_val
-            largest_block_index_num = i
+          link_rec_pair_funct(curr_window_recs1, curr_window_recs2,
+                              rec_pair_dict)
 
-          self.num_rec_pairs += block_num_recs*(block_num_recs-1)/2
+          num_blocks_done += 1
 
-      else:  # A linkage - - - - - - - - - - - - - - - - - - - - - - - - - - -
+          # Log progress report every XXX blocks processed - - - - - - - - - -
+          #
+          if ((num_blocks_done % NUM_BLOCK_PROGRESS_REPORT) == 0):
+            logging.info('    Processed %d of %d blocks' % \
+                         (num_blocks_done, len(comb_block_values)))
+            memory_usage_str = auxiliary.get_memory_usage()
+            if (memory_usage_str != None):
+              logging.info('      '+memory_usage_str)
 
-        logging.info('  Index %d for data set 1 contains %d blocks, and ' % \
-                     (i, len(self.index1[i]))+'for data set 2 contains %d' % \
-                     (len(self.index2[i]))+' blocks')
+        del curr_window_recs1
+        del curr_window_recs2
 
-        for block_val in self.index1[i]: # Loop over all block values in index
-          block_num_recs1 = len(self.index1[i][block_val])
+      logging.info('  Compacted sorting index %d in %s' % \
+                   (i, auxiliary.time_string(time.time()-istart_time)))
 
-          if block_val in self.index2[i]:  # Blocking values is both data sets'
-                                           # index
-            block_num_recs2 = len(self.index2[i][block_val])
+      self.index1[i].clear()  # Not needed anymore
+      self.index2[i].clear()
 
-            if (block_num_recs1 > largest_block_num_rec):  # New largest block
-              largest_block_num_rec =   block_num_recs1
-              largest_block_val =       block_val
-              largest_block_index_num = i
+      logging.info('    Explicitly run garbage collection')
+      gc.collect()
 
-            if (block_num_recs2 > largest_block_num_rec):  # New largest block
-              largest_block_num_rec =   block_num_recs2
-              largest_block_val =       block_val
-              largest_block_index_num = i
+      memory_usage_str = auxiliary.get_memory_usage()
+      if (memory_usage_str != None):
+        logging.info('      '+memory_usage_str)
 
-            self.num_rec_pairs += block_num_recs1*block_num_recs2
+    self.rec_pair_dict = rec_pair_dict
 
-    logging.info('Built blocking index in %s' % \
-                 (auxiliary.time_string(time.time()-start_time)))
+    self.num_rec_pairs = 0  # Count lengths of all record identifier sets - - -
 
+    for rec_ident2_set in self.rec_pair_dict.itervalues():
+      self.num_rec_pairs += len(rec_ident2_set)
+
+    logging.info('Compacted sorting index in %s' % \
+                 (auxiliary.time_string(time.time()-start_time)))
     logging.info('  Number of record pairs: %d' % (self.num_rec_pairs))
-    logging.info('  Largest block with value "%s" contains %d records' % \
-                 (largest_block_val, largest_block_num_rec)+' (in index %d)' \
-                 % (largest_block_index_num))
 
-    memory_usage_str = auxiliary.get_memory_usage()
-    if (memory_usage_str != None):
-      logging.info('  '+memory_usage_str)
+    self.status = 'compacted'  # Update index status
+
+  # ---------------------------------------------------------------------------
+
+  def __iter_rec_pair_rows__(self):
+    """For a streaming index, merge the sorted runs of each index and move the
+       window over the sorted index variable values (see
+       __iter_window_pair_rows__()). Otherwise the rows of the record pair
+       dictionary are returned.
+    """
+
+    if (self.streaming == False):
+      for rec_pair_row in Indexing.__iter_rec_pair_rows__(self):
+        yield rec_pair_row
+      return
+
+    self.__reset_block_guard__()  # Sample the same records in every pass
+
+    for i in range(len(self.index_def)):
 
-    self.status = 'built'  # Update index status
+      block_iter = self.__iter_guarded_blocks__(self.__iter_sorted_blocks__(i))
 
-  # ---------------------------------------------------------------------------
+      for rec_pair_row in self.__iter_window_pair_rows__(block_iter):
+        yield rec_pair_row
 
-  def compact(self):
-    """Method to compact an index data structure.
+  # ---------------------------------------------------------------------------
 
-       Make a dictionary of all record pairs over all indices, which removes
-       duplicate record pairs.
+  def __iter_window_pair_rows__(self, block_iter):
+    """Move the window over the tuples (block value, records from data set 1,
+       records from data set 2) from the given iterator (in sorted order of
+       the block values), yielding tuples (record number from data set 1, list
+       of record numbers from data set 2) for the record pairs that include a
+       record of the block that has just entered the window (all other record
+       pairs in the window have been generated before).
     """
 
-    NUM_BLOCK_PROGRESS_REPORT = 1000
+    w = self.window_size  # Shorthand
 
-    logging.info('')
-    logging.info('Compact blocking index: "%s"' % (self.description))
+    w_block_len1 = [0]*w  # Counts of number of records in blocks in window
+    w_block_len2 = [0]*w
 
-    start_time = time.time()
+    curr_window_recs1 = []  # List of record identifiers in current window
+    curr_window_recs2 = []
 
-    num_indices = len(self.index_def)
+    j = 0  # Number of blocks from data set 1 and 2 so far
+    k = 0
 
-    # Check if index has been built - - - - - - - - - - - - - - - - - - - - - -
-    #
-    if (self.status != 'built'):
-      logging.exception('Index "%s" has not been built, compacting is not ' % \
-                        (self.description)+'possible')
-      raise Exception
+    for (block_val, block_recs1, block_recs2) in block_iter:
 
-    old_num_rec_pairs = self.num_rec_pairs  # Keep old number of record pairs
+      if (block_recs1 != []):  # Advance window for data set 1
 
-    rec_pair_dict = {}  # A dictionary with record identifiers from data set 1
-                        # as keys and sets of identifiers from data set 2 as
-                        # values
+        w_j = j % w  # Modulo window size
 
-    for i in range(num_indices):
+        # Remove record identifiers from previous block, and add new ones
+        #
+        curr_window_recs1 = curr_window_recs1[w_block_len1[w_j]:]
+        num_old_recs1 = len(curr_window_recs1)
+        curr_window_recs1 += block_recs1
+        w_block_len1[w_j] = len(block_recs1)
 
-      istart_time = time.time()
+        j += 1
 
-      num_blocks_done = 0
+      else:
+        num_old_recs1 = len(curr_window_recs1)
 
-      if (self.do_deduplication == True):  # A deduplication - - - - - - - - -
+      if (self.do_deduplication == True):  # Pairs with new records - - - - - -
 
-        this_index = self.index1[i]  # Shorthand
+        for rec_cnt in xrange(max(1, num_old_recs1),
+                              len(curr_window_recs1)):
+          yield (curr_window_recs1[rec_cnt], curr_window_recs1[:rec_cnt])
 
-        for block_val in this_index: # Loop over all block values in index
+        continue
 
-          block_recs = this_index[block_val]  # All records in this block
+      if (block_recs2 != []):  # Advance window for data set 2 - - - - - - - -
 
-          if (len(block_recs) > 1):
+        w_k = k % w  # Modulo window size
 
-            self.__dedup_rec_pairs__(block_recs, rec_pair_dict)
+        curr_window_recs2 = curr_window_recs2[w_block_len2[w_k]:]
+        curr_window_recs2 += block_recs2
+        w_block_len2[w_k] = len(block_recs2)
 
-          num_blocks_done += 1
+        k += 1
 
-          # Log progress report every XXX blocks processed - - - - - - - - - -
-          #
-          if ((num_blocks_done % NUM_BLOCK_PROGRESS_REPORT) == 0):
-            logging.info('    Processed %d of %d blocks' % \
-                         (num_blocks_done, len(this_index)))
-            memory_usage_str = auxiliary.get_memory_usage()
-            if (memory_usage_str != None):
-              logging.info('      '+memory_usage_str)
+      if (block_recs2 != []):  # New records 2 with old records 1
+        for rec_ident1 in curr_window_recs1[:num_old_recs1]:
+          yield (rec_ident1, block_recs2)
 
-      else:  # A linkage - - - - - - - - - - - - - - - - - - - - - - - - - - -
+      if (curr_window_recs2 != []):  # New records 1 with all records 2
+        for rec_ident1 in block_recs1:
+          yield (rec_ident1, curr_window_recs2[:])
 
-        this_index1 = self.index1[i]  # Shorthands
-        this_index2 = self.index2[i]
+  # ---------------------------------------------------------------------------
 
-        for block_val in this_index1: # Loop over all block values in index
+  def __estimate_rec_pairs__(self, sample_size, num_bench_pairs):
+    """A streaming index compares the record pairs of each index in a
+       separate pass (see __iter_rec_pair_rows__()), so a record pair in the
+       windows of several indices is compared several times. The record pairs
+       are therefore counted for each index and summed (as in compact()), and
+       no record pair dictionary is generated.
+    """
 
-          block_recs1 = this_index1[block_val]  # All records in this block
-                                                # from data set 1
-          if block_val in this_index2:  # Blocking values is both data sets'
-                                        # index
+    if (self.streaming == False):
+      return Indexing.__estimate_rec_pairs__(self, sample_size,
+                                             num_bench_pairs)
 
-            block_recs2 = this_index2[block_val] # All records in this block
-                                                 # from data set 2
+    num_rec_pairs =       0
+    bench_rec_pair_list = []
 
-            self.__link_rec_pairs__(block_recs1, block_recs2, rec_pair_dict)
+    for i in range(len(self.index_def)):
+      [index_num_rec_pairs, is_exact, index_rec_pair_memory,
+       index_bench_rec_pair_list] = \
+                        Indexing.__estimate_rec_pairs__(self, sample_size,
+                                                        num_bench_pairs, [i])
 
-          num_blocks_done += 1
+      num_rec_pairs +=       index_num_rec_pairs
+      bench_rec_pair_list += index_bench_rec_pair_list
 
-          # Log progress report every XXX blocks processed - - - - - - - - - -
-          #
-          if ((num_blocks_done % NUM_BLOCK_PROGRESS_REPORT) == 0):
-            logging.info('    Processed %d of %d blocks' % \
-                         (num_blocks_done, len(this_index1)))
-            memory_usage_str = auxiliary.get_memory_usage()
-            if (memory_usage_str != None):
-              logging.info('      '+memory_usage_str)
+    return [num_rec_pairs, is_exact, 0, bench_rec_pair_list[:num_bench_pairs]]
 
-      logging.info('  Compacted blocking index %d in %s' % \
-                   (i, auxiliary.time_string(time.time()-istart_time)))
+  # ---------------------------------------------------------------------------
 
-      self.index1[i].clear()  # Not needed anymore
-      self.index2[i].clear()
+  def __iter_estimate_blocks__(self, i):
+    """The record pairs are the rows of the window moved over the sorted
+       (guarded) blocks, from the sorted runs or the inverted indices.
+    """
 
-      logging.info('    Explicitly run garbage collection')
-      gc.collect()
+    if (self.streaming == True):
+      block_iter = self.__iter_sorted_blocks__(i)
 
-      memory_usage_str = auxiliary.get_memory_usage()
-      if (memory_usage_str != None):
-        logging.info('      '+memory_usage_str)
+    else:
+      this_index1 = self.index1[i]  # Shorthands
+      this_index2 = self.index2[i]
 
-    self.rec_pair_dict = rec_pair_dict
+      block_iter = [(block_val, this_index1.get(block_val, []),
+                     this_index2.get(block_val, [])) for block_val in \
+                    sorted(set(this_index1) | set(this_index2))]
 
-    self.num_rec_pairs = 0  # Count lengths of all record identifier sets - - -
+    block_iter = self.__iter_guarded_blocks__(block_iter)
 
-    for rec_ident2_set in self.rec_pair_dict.itervalues():
-      self.num_rec_pairs += len(rec_ident2_set)
+    for (rec_ident1, rec_ident2_list) in \
+        self.__iter_window_pair_rows__(block_iter):
+      yield ([rec_ident1], rec_ident2_list)
 
-    logging.info('Compacted blocking index in %s' % \
-                 (auxiliary.time_string(time.time()-start_time)))
-    logging.info('  Old number of record pairs: %d' % (old_num_rec_pairs))
-    logging.info('  New number of record pairs: %d' % (self.num_rec_pairs))
+  # ---------------------------------------------------------------------------
 
-    self.status = 'compacted'  # Update index status
+  def __iter_estimate_block_sizes__(self, i):
+    """The block sizes of the sorted runs or the inverted indices.
+    """
+
+    if (self.streaming == True):
+      return self.__iter_sorted_block_sizes__(i)
+    else:
+      return self.__iter_inv_index_block_sizes__(i)
 
   # ---------------------------------------------------------------------------
 
-  def run(self, length_filter_perc = None, cut_off_threshold = None):
+  def run(self, length_filter_perc = None, cut_off_threshold = None,
+          num_workers = None):
     """Iterate over all blocks in the index.
 
-       Compare the record pairs as produced by the blocking process, and return
-       a weight vector dictionary with keys made of a tuple (record identifier
-       1, record identifier 2), and corresponding values the comparison
-       weights.
+       Compare the record pairs as produced by the sorting indexing process,
+       and return a weight vector dictionary with keys made of a tuple (record
+       identifier 1, record identifier 2), and corresponding values the
+       comparison weights.
     """
 
     logging.info('')
@@ -1749,13 +5289,15 @@ class BlockingIndex(Indexing):
     # Compare the records
     #
     return self.__compare_rec_pairs_from_dict__(length_filter_perc,
-                                                cut_off_threshold)
+                                                cut_off_threshold,
+                                                num_workers)
+
 
 # =============================================================================
 
-class SortingIndex(Indexing):
+class SortingArrayIndex(Indexing):
   """Class that implements the 'sorted neighbourhood' indexing approach based
-     on an inverted index.
+     on a sorted array.
 
      The index variable values are sorted alphabetically and then a window
      (with user specified size) is moved over these sorted values. All records
@@ -1768,9 +5310,27 @@ class SortingIndex(Indexing):
        window_size  A positive integer that gives the size of the moving window
                     in number of index variable values.
 
-     Note that a window_size of 1 will result in the same records being
-     compared as with the standard blocking approach (as a window of size 1
-     does not cover any neighbouring index variable values).
+     Note that a window_size of 1 will result in no records being compared with
+     each other (this is different from the previous SortingIndex above).
+
+     As with the SortingIndex, the following arguments can be set for a
+     streaming (multi-pass) sorted neighbourhood:
+
+       streaming    A flag (True or False), if set to True the build() method
+                    writes the index entries of each index into sorted runs in
+                    temporary files, and the run() method merges these runs
+                    and slides the window over the merged sorted records (one
+                    pass per index), comparing each record that enters the
+                    window with the other records in the window immediately.
+                    Only the window (and the records of one block) are kept in
+                    memory. Each record pair is generated once per pass it
+                    occurs in. Default is False.
+       run_size     The maximum number of index entries kept in memory before
+                    they are sorted and written into a run file. Default is
+                    1000000.
+       tmp_dir      The directory where the run files are written. Default is
+                    None, in which case the system's temporary directory is
+                    used. The run files are removed when the program exits.
   """
 
   # ---------------------------------------------------------------------------
@@ -1781,6 +5341,9 @@ class SortingIndex(Indexing):
     """
 
     self.window_size = None  # Set the window size to not defined
+    self.streaming =   False
+    self.run_size =    1000000
+    self.tmp_dir =     None
 
     base_kwargs = {}  # Dictionary, will contain unprocessed arguments for base
                       # class constructor
@@ -1790,8 +5353,26 @@ class SortingIndex(Indexing):
       if (keyword.startswith('window')):
         auxiliary.check_is_integer('window_size', value)
         auxiliary.check_is_positive('window_size', value)
+        if (value == 1):
+          logging.exception('Window size must be larger than 1.')
+          raise Exception
+
         self.window_size = value
 
+      elif (keyword.startswith('stream')):
+        auxiliary.check_is_flag('streaming', value)
+        self.streaming = value
+
+      elif (keyword.startswith('run_s')):
+        auxiliary.check_is_integer('run_size', value)
+        auxiliary.check_is_positive('run_size', value)
+        self.run_size = value
+
+      elif (keyword.startswith('tmp_d')):
+        if (value != None):
+          auxiliary.check_is_string('tmp_dir', value)
+        self.tmp_dir = value
+
       else:
         base_kwargs[keyword] = value
 
@@ -1802,7 +5383,18 @@ class SortingIndex(Indexing):
     auxiliary.check_is_integer('window_size', self.window_size)
     auxiliary.check_is_positive('window_size', self.window_size)
 
-    self.log([('Window size', self.window_size)])  # Log a message
+    self.log([('Window size', self.window_size),
+              ('Streaming', self.streaming),
+              ('Run size', self.run_size),
+              ('Temporary directory', self.tmp_dir)])  # Log a message
+
+  # ---------------------------------------------------------------------------
+
+  def __get_param_fingerprint__(self):
+    """The window size and streaming of the sorted array.
+    """
+
+    return {'window_size':self.window_size, 'streaming':self.streaming}
 
   # ---------------------------------------------------------------------------
 
@@ -1814,13 +5406,16 @@ class SortingIndex(Indexing):
     """
 
     logging.info('')
-    logging.info('Build sorting index: "%s"' % (self.description))
+    logging.info('Build sorted array index: "%s"' % (self.description))
 
     start_time = time.time()
 
-    self.__records_into_inv_index__()  # Read records and put into index
+    if (self.streaming == True):  # Write sorted runs into temporary files
+      self.__records_into_sorted_runs__(self.run_size, self.tmp_dir)
+    else:
+      self.__records_into_inv_index__()  # Read records and put into index
 
-    logging.info('Built sorting index in %s' % \
+    logging.info('Built sorted array index in %s' % \
                  (auxiliary.time_string(time.time()-start_time)))
 
     memory_usage_str = auxiliary.get_memory_usage()
@@ -1841,7 +5436,7 @@ class SortingIndex(Indexing):
     NUM_BLOCK_PROGRESS_REPORT = 1000
 
     logging.info('')
-    logging.info('Compact sorting index: "%s"' % (self.description))
+    logging.info('Compact sorted array index: "%s"' % (self.description))
 
     start_time = time.time()
 
@@ -1852,6 +5447,21 @@ class SortingIndex(Indexing):
                         (self.description)+'possible')
       raise Exception
 
+    if (self.streaming == True):  # Record pairs are only generated in run()
+      self.rec_pair_dict = None
+
+      self.num_rec_pairs = 0
+
+      for (rec_ident1, rec_ident2_list) in self.__iter_rec_pair_rows__():
+        self.num_rec_pairs += len(rec_ident2_list)
+
+      logging.info('Compacted streaming sorted array index in %s' % \
+                   (auxiliary.time_string(time.time()-start_time)))
+      logging.info('  Number of record pairs: %d' % (self.num_rec_pairs))
+
+      self.status = 'compacted'  # Update index status
+      return
+
     num_indices = len(self.index_def)
 
     dedup_rec_pair_funct = self.__dedup_rec_pairs__  # Shorthands
@@ -1872,41 +5482,48 @@ class SortingIndex(Indexing):
 
         this_index = self.index1[i]  # Shorthand
 
-        w_block_len = [0]*w  # Counts of number of records in blocks in window
-
-        curr_window_recs = []  # List of record identifiers in current window
+        rec_sorted_array = []  # The sorted array with the record identifiers
+                               # of all records
 
+        # Sorting the unique blocking key values is faster than sorting all
+        # values once they are in the sorted array
+        #
         block_val_list = this_index.keys()  # Get all blocking values
         block_val_list.sort()
 
         num_block_vals = len(block_val_list)
 
-        for j in xrange(num_block_vals):  # Loop over all blocks
-
-          w_j = j % w  # Modulo window size
-
-          # Remove record identifiers from previous block
-          #
-          curr_window_recs = curr_window_recs[w_block_len[w_j]:]
+        # Loop over all blocks in the inverted index
+        #
+        for block_key_val in block_val_list:
 
-          new_window_recs = set()
+          rec_id_list = this_index[block_key_val]
+          rec_sorted_array += rec_id_list
 
-          # Insert record identifiers from this block that are not in yet
-          #
-          for rec_ident in this_index[block_val_list[j]]:
+        # Can be shorter if empty blocking key values occur that
+        #
+        assert len(rec_sorted_array) <= self.dataset1.num_records
 
-            if (rec_ident not in curr_window_recs):
-              new_window_recs.add(rec_ident)
+        # Now generate record pairs from the sliding window
+        #
+        for j in range(0, len(rec_sorted_array)-w+1):
 
-          # Number of new records (previously not in window) from this block
+          # Get record identifiers in the current window
           #
-          w_block_len[w_j] = len(new_window_recs)
-
-          curr_window_recs += list(new_window_recs)
-
-          if (len(curr_window_recs) > 1):
+          win_rec_id_list = rec_sorted_array[j:j+w][:]
+          assert len(win_rec_id_list) == w, \
+                 (j,w,self.dataset1.num_records,win_rec_id_list)
+          win_rec_id_list.sort()
 
-            dedup_rec_pair_funct(curr_window_recs, rec_pair_dict)
+          ## Possibly improvement: Win pos 1 and all others separate code
+          rec_cnt = 1
+          for rec_ident1 in win_rec_id_list:
+            rec_ident2_set = rec_pair_dict.get(rec_ident1, set())
+            for rec_ident2 in win_rec_id_list[rec_cnt:]:
+              assert rec_ident1 != rec_ident2
+              rec_ident2_set.add(rec_ident2)
+            rec_pair_dict[rec_ident1] = rec_ident2_set
+            rec_cnt += 1
 
           num_blocks_done += 1
 
@@ -1919,95 +5536,68 @@ class SortingIndex(Indexing):
             if (memory_usage_str != None):
               logging.info('      '+memory_usage_str)
 
-        del curr_window_recs
+        del rec_sorted_array
 
       else:  # A linkage - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
         this_index1 = self.index1[i]  # Shorthands
         this_index2 = self.index2[i]
 
-        w_block_len1 = [0]*w  # Counts of number of records in blocks in window
-        w_block_len2 = [0]*w
-
-        curr_window_recs1 = []  # List of record identifiers in current window
-        curr_window_recs2 = []
-
-        block_val_list1 = this_index1.keys()  # Get all blocking values
-        block_val_list1.sort()
-
-        block_val_list2 = this_index2.keys()
-        block_val_list2.sort()
-
-        num_block_vals1 = len(block_val_list1)
-        num_block_vals2 = len(block_val_list2)
+        rec_sorted_array = []  # The sorted array with the record identifiers
+                               # of all records
 
-        # Create a sorted combined list of all blocking values
+        # Get all unique blocking key values from both indices
         #
-        comb_block_values = list(set(block_val_list1+block_val_list2))
-        comb_block_values.sort()
-
-        j = 0  # Iteration counters in block values 1 and 2
-        k = 0
+        block_val_set = set(this_index1.keys()+this_index2.keys())
+        block_val_list = list(block_val_set)
+        block_val_list.sort()
 
-        do_delete1 = False  # Flags, signalling if current window block
-        do_delete2 = False
+        num_block_vals = len(block_val_list)
 
-        # Loop over combined list of block values - - - - - - - - - - - - - - -
+        # Loop over all blocks in the inverted indices
         #
-        for block_val in comb_block_values:
-
-          if (block_val in block_val_list1):  # Advance window for data set 1
-
-            w_j = j % w  # Modulo window size
-
-            # Remove record identifiers from previous block
-            #
-            curr_window_recs1 = curr_window_recs1[w_block_len1[w_j]:]
-
-            new_window_recs = set()
-
-            # Insert record identifiers from this block that are not in yet
-            #
-            for rec_ident in this_index1[block_val]:
-
-              if (rec_ident not in curr_window_recs1):
-                new_window_recs.add(rec_ident)
-
-            # Number of new records (previously not in window) from this block
-            #
-            w_block_len1[w_j] = len(new_window_recs)
-
-            curr_window_recs1 += list(new_window_recs)
-
-            j += 1  # Advance pointer into data set 1 blocks
-
-          if (block_val in block_val_list2):  # Advance window for data set 2 -
+        for block_key_val in block_val_list:
 
-            w_k = k % w  # Modulo window size
+          rec_id_list1 = this_index1.get(block_key_val, [])
+          rec_id_list2 = this_index2.get(block_key_val, [])
 
-            # Remove record identifiers from previous block
-            #
-            curr_window_recs2 = curr_window_recs2[w_block_len2[w_k]:]
+          # Merge lists of record identifiers
+          #
+          rec_sorted_array += self.__merge_block_rec_lists__(rec_id_list1,
+                                                             rec_id_list2)
 
-            new_window_recs = set()
+        # Can be shorter if empty blocking key values occur
+        #
+        assert len(rec_sorted_array) <= (self.dataset1.num_records + \
+                                         self.dataset2.num_records), \
+          (len(rec_sorted_array), (self.dataset1.num_records + \
+                                         self.dataset2.num_records))
 
-            # Insert record identifiers from this block that are not in yet
-            #
-            for rec_ident in this_index2[block_val]:
+        # Now generate record pairs from the sliding window
+        #
+        for j in range(0, len(rec_sorted_array)-w+1):
 
-              if (rec_ident not in curr_window_recs2):
-                new_window_recs.add(rec_ident)
+          # Get record identifiers in the current window
+          #
+          win_rec_id_list = rec_sorted_array[j:j+w][:]
+          assert len(win_rec_id_list) == w, \
+                 (j,w,self.dataset1.num_records,win_rec_id_list)
 
-            # Number of new records (previously not in window) from this block
-            #
-            w_block_len2[w_k] = len(new_window_recs)
+          rec_id_list1 = []  # Record identifiers from index 1
+          rec_id_list2 = []  # Record identifiers from index 2
 
-            curr_window_recs2 += list(new_window_recs)
+          for (rec_ident, source_index) in win_rec_id_list:
+            if (source_index == '1'):
+              rec_id_list1.append(rec_ident)
+            else:
+              rec_id_list2.append(rec_ident)
 
-            k += 1  # Advance pointer into data set 2 blocks
+          for rec_ident1 in rec_id_list1:
+            for rec_ident2 in rec_id_list2:
 
-          link_rec_pair_funct(curr_window_recs1, curr_window_recs2,
-                              rec_pair_dict)
+              rec_ident2_set = rec_pair_dict.get(rec_ident1, set())
+              rec_ident2_set.add(rec_ident2)
+              rec_pair_dict[rec_ident1] = rec_ident2_set
 
           num_blocks_done += 1
 
@@ -2015,13 +5605,12 @@ class SortingIndex(Indexing):
           #
           if ((num_blocks_done % NUM_BLOCK_PROGRESS_REPORT) == 0):
             logging.info('    Processed %d of %d blocks' % \
-                         (num_blocks_done, len(comb_block_values)))
+                         (num_blocks_done, num_block_vals))
             memory_usage_str = auxiliary.get_memory_usage()
             if (memory_usage_str != None):
               logging.info('      '+memory_usage_str)
 
-        del curr_window_recs1
-        del curr_window_recs2
+        del rec_sorted_array
 
       logging.info('  Compacted sorting index %d in %s' % \
                    (i, auxiliary.time_string(time.time()-istart_time)))
@@ -2051,7 +5640,117 @@ class SortingIndex(Indexing):
 
   # ---------------------------------------------------------------------------
 
-  def run(self, length_filter_perc = None, cut_off_threshold = None):
+  def __merge_block_rec_lists__(self, rec_id_list1, rec_id_list2):
+    """Merge the record identifiers from data sets 1 and 2 in a block (with
+       the same index variable value) into one list of tuples (record
+       identifier, source index '1' or '2').
+    """
+
+    if (rec_id_list1 == []):
+      return [(rec_ident, '2') for rec_ident in rec_id_list2]  # From index 2
+
+    elif (rec_id_list2 == []):
+      return [(rec_ident, '1') for rec_ident in rec_id_list1]  # From index 1
+
+    # Split 0-1 into equal intervals and give each record a corresponding
+    # floating point number, then sort. For example:
+    # rec_id_list1=[a,b,c,d,e]
+    #   => [(0.167,a), (0.333,b), (0.5,c), (0.663,d), (0.833,e)]
+    # rec_id_list2=[x,y,z]
+    #   => [(0.25,x), (0.5,y), (0.75,z)]
+    # Merged list: [(0.167,a), (0.25,x), (0.333,b), (0.5,y), (0.5,c),
+    #               (0.663,d), (0.75,z), (0.833,e)]
+    #
+    # Ties are broken by the original record identifiers (not the interned
+    # record numbers), so the merged order does not depend upon the order in
+    # which records were interned.
+
+    orig_rec_ident_list1 = self.dataset1.rec_ident_list  # Shorthands
+    orig_rec_ident_list2 = self.dataset2.rec_ident_list
+
+    merge_list = []
+
+    interval1 = 1.0 / (len(rec_id_list1)+1.0)
+    j = 1
+    for rec_ident in rec_id_list1:
+      merge_list.append((j*interval1, orig_rec_ident_list1[rec_ident],
+                         rec_ident, '1'))
+      assert j*interval1 > 0 and j*interval1 < 1
+      j += 1
+    interval2 = 1.0 / (len(rec_id_list2)+1.0)
+    j = 1
+    for rec_ident in rec_id_list2:
+      merge_list.append((j*interval2, orig_rec_ident_list2[rec_ident],
+                         rec_ident, '2'))
+      assert j*interval2 > 0 and j*interval2 < 1
+      j += 1
+
+    merge_list.sort()
+
+    assert len(merge_list) == len(rec_id_list1)+len(rec_id_list2)
+
+    return [(rec_ident, src_index) for (val, orig_rec_ident, rec_ident,
+            src_index) in merge_list]
+
+  # ---------------------------------------------------------------------------
+
+  def __iter_rec_pair_rows__(self):
+    """For a streaming index, merge the sorted runs of each index and slide
+       the window over the sorted records, yielding tuples (record number from
+       data set 1, list of record numbers from data set 2) for the record
+       pairs made of the record that enters the window and the other records
+       in the window. As with the compact() method no record pairs are
+       generated for an index with less records than the window size.
+       Otherwise the rows of the record pair dictionary are returned.
+    """
+
+    if (self.streaming == False):
+      for rec_pair_row in Indexing.__iter_rec_pair_rows__(self):
+        yield rec_pair_row
+      return
+
+    w = self.window_size  # Shorthand
+
+    for i in range(len(self.index_def)):
+
+      if (self.num_sorted_entries[i] < w):  # Not a single full window
+        continue
+
+      window = collections.deque(maxlen = w-1)  # The previous w-1 records
+
+      for (block_val, block_recs1, block_recs2) in \
+          self.__iter_sorted_blocks__(i):
+
+        if (self.do_deduplication == True):  # A deduplication - - - - - - - -
+
+          for rec_ident in block_recs1:
+            if (len(window) > 0):
+              yield (rec_ident, list(window))
+            window.append(rec_ident)
+
+        else:  # A linkage - - - - - - - - - - - - - - - - - - - - - - - - - -
+
+          for (rec_ident, src_index) in \
+              self.__merge_block_rec_lists__(block_recs1, block_recs2):
+
+            if (src_index == '1'):
+              rec_ident2_list = [win_rec_ident for (win_rec_ident, \
+                                 win_src_index) in window if \
+                                 (win_src_index == '2')]
+              if (rec_ident2_list != []):
+                yield (rec_ident, rec_ident2_list)
+
+            else:
+              for (win_rec_ident, win_src_index) in window:
+                if (win_src_index == '1'):
+                  yield (win_rec_ident, [rec_ident])
+
+            window.append((rec_ident, src_index))
+
+  # ---------------------------------------------------------------------------
+
+  def run(self, length_filter_perc = None, cut_off_threshold = None,
+          num_workers = None):
     """Iterate over all blocks in the index.
 
        Compare the record pairs as produced by the sorting indexing process,
@@ -2077,64 +5776,87 @@ class SortingIndex(Indexing):
     # Compare the records
     #
     return self.__compare_rec_pairs_from_dict__(length_filter_perc,
-                                                cut_off_threshold)
-
+                                                cut_off_threshold,
+                                                num_workers)
 
 # =============================================================================
 
-class SortingArrayIndex(Indexing):
-  """Class that implements the 'sorted neighbourhood' indexing approach based
-     on a sorted array.
+class AdaptSortingIndex(Indexing):
+  """Class that implements the adaptive sorted neighbourhood indexing approach
+     based on an inverted index and an adaptive construction of blocks based on
+     the similarities of neighbouring index key values.
 
-     The index variable values are sorted alphabetically and then a window
-     (with user specified size) is moved over these sorted values. All records
-     in the blocks covered by the current window position are then compared to
-     each other.
+     For details see the following paper:
+
+     - Adaptive sorted neighborhood methods for efficient record linkage
+       S Yan, D Lee, M.Y Kan and L.C Giles.
+       Proceedings of the 7th ACM/IEEE-CS joint conference on Digital libraries
+       2007.
+
+     The index variable values are sorted alphabetically first, then a search
+     algorithm with adaptive window sizes is moved over the sorted index key
+     values, and blocks are generated where two adjacent values have an
+     approximate string similarity below a given threshold.
+
+     The initial implementation is a simplified  version of the above
+     description that compares all adjacent index key values in a liner fashion.
 
      The additional argument (besides the base class arguments) which has to be
      set when this index is initialised is:
 
-       window_size  A positive integer that gives the size of the moving window
-                    in number of index variable values.
-
-     Note that a window_size of 1 will result in no records being compared with
-     each other (this is different from the previous SortingIndex above).
+       str_cmp_funct  A function to compare two strings (as implemented in the
+                      stringcmp module).
+       str_cmp_thres  The threshold for the string comparison function, must
+                      be in (0..1).
   """
 
   # ---------------------------------------------------------------------------
 
   def __init__(self, **kwargs):
-    """Constructor. Process the 'window_size' argument first, then call the
+    """Constructor. Process the index specific arguments first, then call the
        base class constructor.
     """
 
-    self.window_size = None  # Set the window size to not defined
+    self.str_cmp_funct = None
+    self.str_cmp_thres = None
 
     base_kwargs = {}  # Dictionary, will contain unprocessed arguments for base
                       # class constructor
 
     for (keyword, value) in kwargs.items():
 
-      if (keyword.startswith('window')):
-        auxiliary.check_is_integer('window_size', value)
-        auxiliary.check_is_positive('window_size', value)
-        if (value == 1):
-          logging.exception('Window size must be larger than 1.')
-          raise Exception
+      if (keyword.startswith('str_cmp_f')):
+        auxiliary.check_is_function_or_method('str_cmp_funct', value)
+        self.str_cmp_funct = value
 
-        self.window_size = value
+      elif (keyword.startswith('str_cmp_t')):
+        auxiliary.check_is_normalised('str_cmp_thres', value)
+        self.str_cmp_thres = value
 
       else:
         base_kwargs[keyword] = value
 
     Indexing.__init__(self, base_kwargs)  # Initialise base class
 
-    # Make sure 'window_size' attribute is set - - - - - - - - - - - - - - - -
+    # Make sure parameters have been set - - - - - - - - - - - - - - - - - - -
     #
-    auxiliary.check_is_integer('window_size', self.window_size)
-    auxiliary.check_is_positive('window_size', self.window_size)
+    auxiliary.check_is_function_or_method('str_cmp_funct', self.str_cmp_funct)
+    auxiliary.check_is_normalised('str_cmp_thres', self.str_cmp_thres)
+
+    # A log a message
+    #
+    self.log([('String comparison function',  self.str_cmp_funct),
+              ('String comparison threshold', self.str_cmp_thres)])
+
+  # ---------------------------------------------------------------------------
+
+  def __get_param_fingerprint__(self):
+    """The string comparison function and threshold used to form
+       the adaptive blocks.
+    """
 
-    self.log([('Window size', self.window_size)])  # Log a message
+    return {'str_cmp_funct':self.str_cmp_funct.__name__,
+            'str_cmp_thres':self.str_cmp_thres}
 
   # ---------------------------------------------------------------------------
 
@@ -2146,13 +5868,14 @@ class SortingArrayIndex(Indexing):
     """
 
     logging.info('')
-    logging.info('Build sorted array index: "%s"' % (self.description))
+    logging.info('Build adaptive sorted index: "%s"' % \
+                 (self.description))
 
     start_time = time.time()
 
     self.__records_into_inv_index__()  # Read records and put into index
 
-    logging.info('Built sorted array index in %s' % \
+    logging.info('Built adaptive sorted index in %s' % \
                  (auxiliary.time_string(time.time()-start_time)))
 
     memory_usage_str = auxiliary.get_memory_usage()
@@ -2166,6 +5889,8 @@ class SortingArrayIndex(Indexing):
   def compact(self):
     """Method to compact an index data structure.
 
+       Adaptively generate blocks according to the sorted index key values.
+
        Make a dictionary of all record pairs over all indices, which removes
        duplicate record pairs.
     """
@@ -2173,7 +5898,8 @@ class SortingArrayIndex(Indexing):
     NUM_BLOCK_PROGRESS_REPORT = 1000
 
     logging.info('')
-    logging.info('Compact sorted array index: "%s"' % (self.description))
+    logging.info('Compact adaptive sorted index: "%s"' % \
+                 (self.description))
 
     start_time = time.time()
 
@@ -2188,7 +5914,9 @@ class SortingArrayIndex(Indexing):
 
     dedup_rec_pair_funct = self.__dedup_rec_pairs__  # Shorthands
     link_rec_pair_funct =  self.__link_rec_pairs__
-    w =                    self.window_size
+
+    str_cmp_funct =  self.str_cmp_funct
+    str_cmp_thres =  self.str_cmp_thres
 
     rec_pair_dict = {}  # A dictionary with record identifiers from data set 1
                         # as keys and sets of identifiers from data set 2 as
@@ -2204,175 +5932,282 @@ class SortingArrayIndex(Indexing):
 
         this_index = self.index1[i]  # Shorthand
 
-        rec_sorted_array = []  # The sorted array with the record identifiers
-                               # of all records
+        index_val_list = this_index.keys()  # Sort all unique index key values
+        index_val_list.sort()
 
-        # Sorting the unique blocking key values is faster than sorting all
-        # values once they are in the sorted array
-        #
-        block_val_list = this_index.keys()  # Get all blocking values
-        block_val_list.sort()
+        num_index_vals = len(index_val_list)
 
-        num_block_vals = len(block_val_list)
+#        win_start_index = 0  # Position in the index key value list of the
+#                             # start of the current window
+#        win_end_index =   0  # Make sure it works even if there is one index
+#                             # key value only
+#
+#        while (win_end_index < num_index_vals):
+#
+#          first_val = index_val_list[win_start_index]
+#          last_val =  index_val_list[win_end_index]
+#
+#          # Increase window size as long as index values are similar
+#          #
+#          while ((str_cmp_funct(first_val, last_val) > str_cmp_thres) and \
+#                 (win_end_index < num_index_vals-1)):
+#            win_end_index += 1
+#            last_val =  index_val_list[win_end_index]
+#
+#          # Generate the list of record identifiers from this window
+#          #
+#          curr_win_record_set = set()
+#          for this_val in index_val_list[win_start_index:win_end_index+1]:
+#
+#            curr_rec_id_list = this_index[this_val]
+#
+#            curr_win_record_set = \
+#                               curr_win_record_set.union(set(curr_rec_id_list))
+#
+#          if (len(curr_win_record_set) > 1):
+#
+#            dedup_rec_pair_funct(list(curr_win_record_set), rec_pair_dict)
+#
+#          win_end_index += 1
+#          win_start_index = win_end_index
 
-        # Loop over all blocks in the inverted index
+        # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+        # The code below follows algorithm 2 from the above mentioned paper. It
+        # is more efficient than the above simple linear scan.
         #
-        for block_key_val in block_val_list:
+        # The notation given in this algorithm will be used as much as possible.
+        #
+        block_start_index = 0
 
-          rec_id_list = this_index[block_key_val]
-          rec_sorted_array += rec_id_list
+        while (block_start_index < num_index_vals):
+
+          w_first = block_start_index
+          w = 1  # To make sure this works even with one single index key value
+          w_last = w_first + w
+
+          # Get the first and last index key values in the current window
+          #
+          first_val = index_val_list[w_first]
+          last_val =  index_val_list[w_last-1]
+
+          # Enlargement phase: Move the window forward as long as index key
+          # values are similar
+          #
+          while ((str_cmp_funct(first_val, last_val) > str_cmp_thres) and
+                 (w_last < num_index_vals)):
+            w_first = w_last-1  # Make sure the windows overlap
+            w *= 2              # Geometric increase in the window size
+            w_last += w-1       # Adjust for overlap
+            if (w_last > num_index_vals):
+              w_last = num_index_vals  # Reached end of array
+
+            first_val = last_val
+            last_val =  index_val_list[w_last-1]
+
+          # Retrenchment phase: Find the boundary pair (use simple linear scan)
+          # (the retrenchment phase as described in the above mentioned paper is
+          # yet to be implementd)
+          #
+          tmp_pos = block_start_index
+
+          # Take care of special case where last block is 1 index key value only
+          #
+          if (tmp_pos+1 == num_index_vals):
+            block_end_index = tmp_pos+1
+
+          else:
+            first_val =  index_val_list[tmp_pos]
+            second_val = index_val_list[tmp_pos+1]
 
-        # Can be shorter if empty blocking key values occur that
-        #
-        assert len(rec_sorted_array) <= self.dataset1.num_records
+            while ((str_cmp_funct(first_val, second_val) > str_cmp_thres) and
+                   ((tmp_pos+1) < num_index_vals)):
+              tmp_pos += 1
+              first_val =  second_val
+              second_val = index_val_list[tmp_pos]
 
-        # Now generate record pairs from the sliding window
-        #
-        for j in range(0, len(rec_sorted_array)-w+1):
+            block_end_index = tmp_pos+1
 
-          # Get record identifiers in the current window
+          # Generate the list of record identifiers from this block
           #
-          win_rec_id_list = rec_sorted_array[j:j+w][:]
-          assert len(win_rec_id_list) == w, \
-                 (j,w,self.dataset1.num_records,win_rec_id_list)
-          win_rec_id_list.sort()
+          curr_win_record_set = set()
+          for this_val in index_val_list[block_start_index:block_end_index]:
+            curr_rec_id_list = this_index[this_val]
 
-          ## Possibly improvement: Win pos 1 and all others separate code
-          rec_cnt = 1
-          for rec_ident1 in win_rec_id_list:
-            rec_ident2_set = rec_pair_dict.get(rec_ident1, set())
-            for rec_ident2 in win_rec_id_list[rec_cnt:]:
-              assert rec_ident1 != rec_ident2
-              rec_ident2_set.add(rec_ident2)
-            rec_pair_dict[rec_ident1] = rec_ident2_set
-            rec_cnt += 1
+            curr_win_record_set = \
+                                curr_win_record_set.union(set(curr_rec_id_list))
+
+          if (len(curr_win_record_set) > 1):
+            dedup_rec_pair_funct(list(curr_win_record_set), rec_pair_dict)
+
+          block_start_index = block_end_index
 
           num_blocks_done += 1
 
+          del curr_win_record_set
+
           # Log progress report every XXX blocks processed - - - - - - - - - -
           #
           if ((num_blocks_done % NUM_BLOCK_PROGRESS_REPORT) == 0):
             logging.info('    Processed %d of %d blocks' % \
-                         (num_blocks_done, num_block_vals))
+                         (num_blocks_done, num_index_vals))
             memory_usage_str = auxiliary.get_memory_usage()
             if (memory_usage_str != None):
               logging.info('      '+memory_usage_str)
 
-        del rec_sorted_array
-
       else:  # A linkage - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
         this_index1 = self.index1[i]  # Shorthands
         this_index2 = self.index2[i]
 
-        rec_sorted_array = []  # The sorted array with the record identifiers
-                               # of all records
-
-        # Get all unique blocking key values from both indices
+        # Get and sort all unique index key values from both indices
         #
-        block_val_set = set(this_index1.keys()+this_index2.keys())
-        block_val_list = list(block_val_set)
-        block_val_list.sort()
+        index_val_set = set(this_index1.keys()+this_index2.keys())
+        index_val_list = list(index_val_set)
+        index_val_list.sort()
 
-        num_block_vals = len(block_val_list)
+        num_index_vals = len(index_val_list)
 
-        # Loop over all blocks in the inverted indices
+#        win_start_index = 0  # Position in the index key value list of the
+#                             # start of the current window
+#        win_end_index =   0  # Make sure it works even if there is one index
+#                             # key value only
+#
+#        while (win_end_index < num_index_vals):
+#
+#          first_val = index_val_list[win_start_index]
+#          last_val =  index_val_list[win_end_index]
+#
+#          # Increase window size as long as index values are similar
+#          #
+#          while ((str_cmp_funct(first_val, last_val) > str_cmp_thres) and \
+#                 (win_end_index < num_index_vals-1)):
+#            win_end_index += 1
+#            last_val =  index_val_list[win_end_index]
+#
+#          # Generate the lists of record identifiers from this window
+#          #
+#          curr_win_record_set1 = set()
+#          curr_win_record_set2 = set()
+#
+#          for this_val in index_val_list[win_start_index:win_end_index+1]:
+#
+#            if (this_val in this_index1):
+#              curr_rec_id_list1 = this_index1[this_val]
+#
+#              curr_win_record_set1 = \
+#                             curr_win_record_set1.union(set(curr_rec_id_list1))
+#
+#            if (this_val in this_index2):
+#              curr_rec_id_list2 = this_index2[this_val]
+#
+#              curr_win_record_set2 = \
+#                             curr_win_record_set2.union(set(curr_rec_id_list2))
+#
+#          if ((len(curr_win_record_set1) > 0) and \
+#              (len(curr_win_record_set2) > 0)):
+#
+#            link_rec_pair_funct(list(curr_win_record_set1),
+#                                list(curr_win_record_set2), rec_pair_dict)
+#
+#          win_end_index += 1
+#          win_start_index = win_end_index
+
+        # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+        # The code below follows algorithm 2 from the above mentioned paper. It
+        # is more efficient than the above simple linear scan.
         #
-        for block_key_val in block_val_list:
+        # The notation given in this algorithm will be used as much as possible.
+        #
+        block_start_index = 0
 
-          rec_id_list1 = this_index1.get(block_key_val, [])
-          rec_id_list2 = this_index2.get(block_key_val, [])
+        while (block_start_index < num_index_vals):
 
-          # Merge lists of record identifiers
+          w_first = block_start_index
+          w = 1  # To make sure this works even with one single index key value
+          w_last = w_first + w
+
+          # Get the first and last index key values in the current window
           #
-          if (rec_id_list1 != []) and (rec_id_list2 != []):
-
-            # Split 0-1 into equal intervals and give each record a
-            # corresponding floating point number, then sort.
-            # For example:
-            # rec_id_list1=[a,b,c,d,e]
-            #   => [(0.167,a), (0.333,b), (0.5,c), (0.663,d), (0.833,e)]
-            # rec_id_list2=[x,y,z]
-            #   => [(0.25,x), (0.5,y), (0.75,z)]
-            # Merged list: [(0.167,a), (0.25,x), (0.333,b), (0.5,y), (0.5,c),
-            #               (0.663,d), (0.75,z), (0.833,e)]
-
-            merge_list = []
-
-            interval1 = 1.0 / (len(rec_id_list1)+1.0)
-            j = 1
-            for rec_ident in rec_id_list1:
-              merge_list.append((j*interval1, rec_ident, '1'))
-              assert j*interval1 > 0 and j*interval1 < 1
-              j += 1
-            interval2 = 1.0 / (len(rec_id_list2)+1.0)
-            j = 1
-            for rec_ident in rec_id_list2:
-              merge_list.append((j*interval2, rec_ident, '2'))
-              assert j*interval2 > 0 and j*interval2 < 1
-              j += 1
-
-            merge_list.sort()
-
-            assert len(merge_list) == len(rec_id_list1)+len(rec_id_list2)
-
-            for (val, rec_ident, src_index) in merge_list:
-              rec_sorted_array.append((rec_ident, src_index))
-
-          elif (rec_id_list1 == []):
-            for rec_ident in rec_id_list2:
-              rec_sorted_array.append((rec_ident, '2'))  # From index 2
-
-          elif (rec_id_list2 == []):
-            for rec_ident in rec_id_list1:
-              rec_sorted_array.append((rec_ident, '1'))  # From index 1
+          first_val = index_val_list[w_first]
+          last_val =  index_val_list[w_last-1]
 
-        # Can be shorter if empty blocking key values occur
-        #
-        assert len(rec_sorted_array) <= (self.dataset1.num_records + \
-                                         self.dataset2.num_records), \
-          (len(rec_sorted_array), (self.dataset1.num_records + \
-                                         self.dataset2.num_records))
+          # Enlargement phase: Move the window forward as long as index key
+          # values are similar
+          #
+          while ((str_cmp_funct(first_val, last_val) > str_cmp_thres) and
+                 (w_last < num_index_vals)):
+            w_first = w_last-1  # Make sure the windows overlap
+            w *= 2              # Geometric increase in the window size
+            w_last += w-1       # Adjust for overlap
+            if (w_last > num_index_vals):
+              w_last = num_index_vals  # Reached end of array
 
-        # Now generate record pairs from the sliding window
-        #
-        for j in range(0, len(rec_sorted_array)-w+1):
+            first_val = last_val
+            last_val =  index_val_list[w_last-1]
 
-          # Get record identifiers in the current window
+          # Retrenchment phase: Find the boundary pair (use simple linear scan)
+          # (the retrenchment phase as described in the above mentioned paper is
+          # yet to be implementd)
           #
-          win_rec_id_list = rec_sorted_array[j:j+w][:]
-          assert len(win_rec_id_list) == w, \
-                 (j,w,self.dataset1.num_records,win_rec_id_list)
+          #
+          tmp_pos = block_start_index
 
-          rec_id_list1 = []  # Record identifiers from index 1
-          rec_id_list2 = []  # Record identifiers from index 2
+          # Take care of special case where last block is 1 index key value only
+          #
+          if (tmp_pos+1 == num_index_vals):
+            block_end_index = tmp_pos+1
 
-          for (rec_ident, source_index) in win_rec_id_list:
-            if (source_index == '1'):
-              rec_id_list1.append(rec_ident)
-            else:
-              rec_id_list2.append(rec_ident)
+          else:
+            first_val =  index_val_list[tmp_pos]
+            second_val = index_val_list[tmp_pos+1]
 
-          for rec_ident1 in rec_id_list1:
-            for rec_ident2 in rec_id_list2:
+            while ((str_cmp_funct(first_val, second_val) > str_cmp_thres) and
+                   ((tmp_pos+1) < num_index_vals)):
+              tmp_pos += 1
+              first_val =  second_val
+              second_val = index_val_list[tmp_pos]
 
-              rec_ident2_set = rec_pair_dict.get(rec_ident1, set())
-              rec_ident2_set.add(rec_ident2)
-              rec_pair_dict[rec_ident1] = rec_ident2_set
+            block_end_index = tmp_pos+1
+
+          # Generate the list of record identifiers from this block
+          #
+          curr_win_record_set1 = set()
+          curr_win_record_set2 = set()
+
+          for this_val in index_val_list[block_start_index:block_end_index]:
+
+            if (this_val in this_index1):
+              curr_rec_id_list1 = this_index1[this_val]
+
+              curr_win_record_set1 = \
+                             curr_win_record_set1.union(set(curr_rec_id_list1))
+
+            if (this_val in this_index2):
+              curr_rec_id_list2 = this_index2[this_val]
+
+              curr_win_record_set2 = \
+                             curr_win_record_set2.union(set(curr_rec_id_list2))
+
+          if ((len(curr_win_record_set1) > 0) and \
+              (len(curr_win_record_set2) > 0)):
+            link_rec_pair_funct(list(curr_win_record_set1),
+                                list(curr_win_record_set2), rec_pair_dict)
+
+          block_start_index = block_end_index
 
           num_blocks_done += 1
 
+          del curr_win_record_set1, curr_win_record_set2
+
           # Log progress report every XXX blocks processed - - - - - - - - - -
           #
           if ((num_blocks_done % NUM_BLOCK_PROGRESS_REPORT) == 0):
             logging.info('    Processed %d of %d blocks' % \
-                         (num_blocks_done, num_block_vals))
+                         (num_blocks_done, num_index_vals))
             memory_usage_str = auxiliary.get_memory_usage()
             if (memory_usage_str != None):
               logging.info('      '+memory_usage_str)
 
-        del rec_sorted_array
-
       logging.info('  Compacted sorting index %d in %s' % \
                    (i, auxiliary.time_string(time.time()-istart_time)))
 
@@ -2401,7 +6236,8 @@ class SortingArrayIndex(Indexing):
 
   # ---------------------------------------------------------------------------
 
-  def run(self, length_filter_perc = None, cut_off_threshold = None):
+  def run(self, length_filter_perc = None, cut_off_threshold = None,
+          num_workers = None):
     """Iterate over all blocks in the index.
 
        Compare the record pairs as produced by the sorting indexing process,
@@ -2427,76 +6263,119 @@ class SortingArrayIndex(Indexing):
     # Compare the records
     #
     return self.__compare_rec_pairs_from_dict__(length_filter_perc,
-                                                cut_off_threshold)
+                                                cut_off_threshold,
+                                                num_workers)
+
+
+
+
+
 
 # =============================================================================
 
-class AdaptSortingIndex(Indexing):
-  """Class that implements the adaptive sorted neighbourhood indexing approach
-     based on an inverted index and an adaptive construction of blocks based on
-     the similarities of neighbouring index key values.
+class QGramIndex(Indexing):
+  """Class that implements an indexing structure based on q-grams and allows
+     for fuzzy 'blocking'.
 
-     For details see the following paper:
+     This index implements a data structure based on q-grams (sub-strings of
+     length q, e.g. bigrams (q=2): 'peter' -> 'pe','et','te','er') and allows
+     for fuzzy blocking.
 
-     - Adaptive sorted neighborhood methods for efficient record linkage
-       S Yan, D Lee, M.Y Kan and L.C Giles.
-       Proceedings of the 7th ACM/IEEE-CS joint conference on Digital libraries
-       2007.
+     The basic idea is that the index variable values will be converted into a
+     list of q-grams, and sub-lists will be built using a user provided
+     threshold (a number between 0.0 and 1.0) of all possible combinations.
+     The resulting q-gram sub-lists will be inserted into an inverted index,
+     i.e. record identifiers in the blocks will be inserted into Python
+     dictionaries for each q-gram sub-list. This inverted index will then be
+     used to retrieve the blocks.
 
-     The index variable values are sorted alphabetically first, then a search
-     algorithm with adaptive window sizes is moved over the sorted index key
-     values, and blocks are generated where two adjacent values have an
-     approximate string similarity below a given threshold.
+     The additional argument (besides the base class arguments) which has to be
+     set when this index is initialised is:
+
+       q               The length of the q-grams to be used (must be at least
+                       1). The default value is 2 (i.e. bigrams)
+       padded          If set to True (default), the beginning and end of the
+                       strings will be padded with (q-1) special characters, if
+                       False no padding will be done.
+       threshold       A number between 0.0 (not included) and 1.0, according
+                       to which the q-gram sub-lists will be calculated.
+
+     For example, assume an indexing definition contains:
+
+       index_def_1 = [['surname','sname',None,[]], ... ]
 
-     The initial implementation is a simplified  version of the above
-     description that compares all adjacent index key values in a liner fashion.
+     and with q=2 and the threshold set to 0.8. If a record value 'peter' is
+     given in the 'surname' field, the corresponding q-gram list will be
+     ['pe','et','te','er'] with four elements. With a threshold of 0.8, 4*0.8 =
+     3.2, rounded to 3, all sub-list combinations of length 3 are calculated.
+     For the given example they are:
 
-     The additional argument (besides the base class arguments) which has to be
-     set when this index is initialised is:
+       ['pe','et','te']
+       ['pe','et','er']
+       ['pe','te','er']
+       ['et','te','er']
 
-       str_cmp_funct  A function to compare two strings (as implemented in the
-                      stringcmp module).
-       str_cmp_thres  The threshold for the string comparison function, must
-                      be in (0..1).
+     Converted back into strings, the all records with a given name value
+     'peter' will be inserted into the inverted index blocks with keys
+     'peette', 'peeter', 'peteer', and 'etteer'.
+
+     The lower the threshold, the shorter the sub-lists, but also the more
+     sub-lists there will be per field value, resulting in more (smaller
+     blocks) in the inverted index.
   """
 
   # ---------------------------------------------------------------------------
 
   def __init__(self, **kwargs):
-    """Constructor. Process the index specific arguments first, then call the
-       base class constructor.
+    """Constructor. Process the 'q', padded' and 'threshold' arguments first,
+       then call the base class constructor.
     """
 
-    self.str_cmp_funct = None
-    self.str_cmp_thres = None
+    self.padded =    True
+    self.q =         2
+    self.threshold = None
 
     base_kwargs = {}  # Dictionary, will contain unprocessed arguments for base
                       # class constructor
 
     for (keyword, value) in kwargs.items():
 
-      if (keyword.startswith('str_cmp_f')):
-        auxiliary.check_is_function_or_method('str_cmp_funct', value)
-        self.str_cmp_funct = value
+      if (keyword.startswith('padd')):
+        auxiliary.check_is_flag('padded', value)
+        self.padded = value
 
-      elif (keyword.startswith('str_cmp_t')):
-        auxiliary.check_is_normalised('str_cmp_thres', value)
-        self.str_cmp_thres = value
+      elif (keyword == 'q'):
+        auxiliary.check_is_integer('q', value)
+        auxiliary.check_is_positive('q', value)
+        self.q = value
+
+      elif (keyword.startswith('thres')):
+        auxiliary.check_is_normalised('threshold', value)
+        self.threshold = value
 
       else:
         base_kwargs[keyword] = value
 
     Indexing.__init__(self, base_kwargs)  # Initialise base class
 
-    # Make sure parameters have been set - - - - - - - - - - - - - - - - - - -
+    # Make sure 'threshold' attribute is set - - - - - - - - - - - - - - - - -
     #
-    auxiliary.check_is_function_or_method('str_cmp_funct', self.str_cmp_funct)
-    auxiliary.check_is_normalised('str_cmp_thres', self.str_cmp_thres)
+    auxiliary.check_is_normalised('threshold', self.threshold)
 
-    # A log a message
-    #
-    self.log([('String comparison function',  self.str_cmp_funct),
-              ('String comparison threshold', self.str_cmp_thres)])
+    self.log([('Threshold', self.threshold),
+              ('q', self.q),
+              ('Padded flag', self.padded)])  # Log a message
+
+    self.QGRAM_START_CHAR = chr(1)
+    self.QGRAM_END_CHAR =   chr(2)
+
+  # ---------------------------------------------------------------------------
+
+  def __get_param_fingerprint__(self):
+    """The q-gram length, padding and threshold of the sub-lists.
+    """
+
+    return {'q':self.q, 'padded':self.padded, 'threshold':self.threshold}
 
   # ---------------------------------------------------------------------------
 
@@ -2508,15 +6387,102 @@ class AdaptSortingIndex(Indexing):
     """
 
     logging.info('')
-    logging.info('Build adaptive sorted index: "%s"' % \
-                 (self.description))
+    logging.info('Build %d-gram index: "%s"' % (self.q, self.description))
 
     start_time = time.time()
 
+    # First build the basic (blocking) inverted index
+    #
     self.__records_into_inv_index__()  # Read records and put into index
 
-    logging.info('Built adaptive sorted index in %s' % \
-                 (auxiliary.time_string(time.time()-start_time)))
+    num_indices = len(self.index_def)
+
+    # Next create an index with keys being q-gram sub-list values - - - - - - -
+    #
+    self.qgram_index1 = {}
+    self.qgram_index2 = {}
+
+    for i in range(num_indices):  # Similar to basic index
+      self.qgram_index1[i] = {}  # Index for data set 1
+      self.qgram_index2[i] = {}  # Index for data set 2
+
+    q = self.q  # Shorthands
+    padded = self.padded
+    threshold = self.threshold
+
+    if (padded == True):  # More shorthands
+      start_str = (q-1)*self.QGRAM_START_CHAR
+      end_str =   (q-1)*self.QGRAM_END_CHAR
+
+    # Depending upon threshold values use one of two sub-list methods
+    # (the switch value of 0.75 was found experimentally)
+    #
+    if (self.threshold > 0.75):
+      qgram_sublist_funct = self.__get_sublists1__
+    else:
+      qgram_sublist_funct = self.__get_sublists2__
+
+    logging.info('Convert basic inverted index into %d-gram index' % (q))
+
+    num_blocks =       0
+    num_qgram_blocks = 0
+
+    for i in range(num_indices):
+
+      # Build a list of data structures needed for the build process
+      #
+      index_list = [(self.index1[i], self.qgram_index1[i],0)]  # For data set 1
+
+      if (self.do_deduplication == False):  # If linkage append data set 2
+        index_list.append((self.index2[i], self.qgram_index2[i],1))
+
+      for (basic_index, qgram_index, ds_index) in index_list:
+
+        qstart_time = time.time()
+
+        num_blocks += len(basic_index)
+
+        for index_val in basic_index:  # Loop over all the values in this index
+
+          if (padded == True):
+            qgram_str = '%s%s%s' % (start_str, index_val, end_str)
+          else:
+            qgram_str = index_val
+
+          # Create the q-gram list
+          #
+          qgram_list= [qgram_str[j:j+q] for j in xrange(len(qgram_str)-(q-1))]
+
+          # Calculate length of sub-lists needed and then create them
+          #
+          num_qgrams = len(qgram_list)
+
+          min_num_qgrams = max(1, int(num_qgrams*threshold))
+
+          qgram_sublists = qgram_sublist_funct(qgram_list, min_num_qgrams)
+
+          # Convert q-gram sub-lists into strings and insert into q-gram index
+          #
+          for qgram_sublist in qgram_sublists:
+
+            qgram_substr = ''.join(qgram_sublist)
+
+            qgram_index_set = qgram_index.get(qgram_substr, set())
+            qgram_index_set.add(index_val)
+            qgram_index[qgram_substr] = qgram_index_set
+
+        num_qgram_blocks += len(qgram_index)
+
+        logging.info('  Built %d-gram index %d for data set %d in %s' % \
+               (q,i,ds_index+1,auxiliary.time_string(time.time()-qstart_time)))
+
+    logging.info('Built %d-gram index in %s' % \
+                 (q, auxiliary.time_string(time.time()-start_time)))
+
+    logging.info('  Number of basic index blocks (number of different ' + \
+                 'index variable values): %d' % (num_blocks))
+    logging.info('  Number of %d-gram index blocks (number of different ' % \
+                 (q) + '%d-gram index values):  %d' % (q, num_qgram_blocks))
 
     memory_usage_str = auxiliary.get_memory_usage()
     if (memory_usage_str != None):
@@ -2529,20 +6495,21 @@ class AdaptSortingIndex(Indexing):
   def compact(self):
     """Method to compact an index data structure.
 
-       Adaptively generate blocks according to the sorted index key values.
-
        Make a dictionary of all record pairs over all indices, which removes
        duplicate record pairs.
+
+       Finally calculate the total number of record pairs.
     """
 
-    NUM_BLOCK_PROGRESS_REPORT = 1000
+    NUM_QGRAM_BLOCK_PROGRESS_REPORT = 1000
 
     logging.info('')
-    logging.info('Compact adaptive sorted index: "%s"' % \
-                 (self.description))
+    logging.info('Compact %d-gram index: "%s"' % (self.q, self.description))
 
     start_time = time.time()
 
+    num_indices = len(self.index_def)
+
     # Check if index has been built - - - - - - - - - - - - - - - - - - - - - -
     #
     if (self.status != 'built'):
@@ -2550,337 +6517,215 @@ class AdaptSortingIndex(Indexing):
                         (self.description)+'possible')
       raise Exception
 
-    num_indices = len(self.index_def)
-
-    dedup_rec_pair_funct = self.__dedup_rec_pairs__  # Shorthands
-    link_rec_pair_funct =  self.__link_rec_pairs__
-
-    str_cmp_funct =  self.str_cmp_funct
-    str_cmp_thres =  self.str_cmp_thres
-
-    rec_pair_dict = {}  # A dictionary with record identifiers from data set 1
-                        # as keys and sets of identifiers from data set 2 as
-                        # values
-
-    for i in range(num_indices):
-
-      istart_time = time.time()
-
-      num_blocks_done = 0
-
-      if (self.do_deduplication == True):  # A deduplication - - - - - - - - -
-
-        this_index = self.index1[i]  # Shorthand
-
-        index_val_list = this_index.keys()  # Sort all unique index key values
-        index_val_list.sort()
-
-        num_index_vals = len(index_val_list)
-
-#        win_start_index = 0  # Position in the index key value list of the
-#                             # start of the current window
-#        win_end_index =   0  # Make sure it works even if there is one index
-#                             # key value only
-#
-#        while (win_end_index < num_index_vals):
-#
-#          first_val = index_val_list[win_start_index]
-#          last_val =  index_val_list[win_end_index]
-#
-#          # Increase window size as long as index values are similar
-#          #
-#          while ((str_cmp_funct(first_val, last_val) > str_cmp_thres) and \
-#                 (win_end_index < num_index_vals-1)):
-#            win_end_index += 1
-#            last_val =  index_val_list[win_end_index]
-#
-#          # Generate the list of record identifiers from this window
-#          #
-#          curr_win_record_set = set()
-#          for this_val in index_val_list[win_start_index:win_end_index+1]:
-#
-#            curr_rec_id_list = this_index[this_val]
-#
-#            curr_win_record_set = \
-#                               curr_win_record_set.union(set(curr_rec_id_list))
-#
-#          if (len(curr_win_record_set) > 1):
-#
-#            dedup_rec_pair_funct(list(curr_win_record_set), rec_pair_dict)
-#
-#          win_end_index += 1
-#          win_start_index = win_end_index
-
-        # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-        # The code below follows algorithm 2 from the above mentioned paper. It
-        # is more efficient than the above simple linear scan.
-        #
-        # The notation given in this algorithm will be used as much as possible.
-        #
-        block_start_index = 0
-
-        while (block_start_index < num_index_vals):
-
-          w_first = block_start_index
-          w = 1  # To make sure this works even with one single index key value
-          w_last = w_first + w
-
-          # Get the first and last index key values in the current window
-          #
-          first_val = index_val_list[w_first]
-          last_val =  index_val_list[w_last-1]
+    # Report the block sizes of the q-gram blocks - - - - - - - - - - - - - - -
+    #
+    self.__reset_block_guard__()
 
-          # Enlargement phase: Move the window forward as long as index key
-          # values are similar
-          #
-          while ((str_cmp_funct(first_val, last_val) > str_cmp_thres) and
-                 (w_last < num_index_vals)):
-            w_first = w_last-1  # Make sure the windows overlap
-            w *= 2              # Geometric increase in the window size
-            w_last += w-1       # Adjust for overlap
-            if (w_last > num_index_vals):
-              w_last = num_index_vals  # Reached end of array
+    for i in range(num_indices):
+      self.__log_block_size_hist__(i, self.__iter_qgram_block_sizes__(i))
 
-            first_val = last_val
-            last_val =  index_val_list[w_last-1]
+    rec_pair_dict = {}  # A dictionary with record identifiers from data set 1
+                        # as keys and sets of identifiers from data set 2 as
+                        # values
 
-          # Retrenchment phase: Find the boundary pair (use simple linear scan)
-          # (the retrenchment phase as described in the above mentioned paper is
-          # yet to be implementd)
-          #
-          tmp_pos = block_start_index
+    for i in range(num_indices):
 
-          # Take care of special case where last block is 1 index key value only
-          #
-          if (tmp_pos+1 == num_index_vals):
-            block_end_index = tmp_pos+1
+      istart_time = time.time()
 
-          else:
-            first_val =  index_val_list[tmp_pos]
-            second_val = index_val_list[tmp_pos+1]
+      num_qgram_blocks_done = 0
 
-            while ((str_cmp_funct(first_val, second_val) > str_cmp_thres) and
-                   ((tmp_pos+1) < num_index_vals)):
-              tmp_pos += 1
-              first_val =  second_val
-              second_val = index_val_list[tmp_pos]
+      if (self.do_deduplication == True):  # A deduplication - - - - - - - - -
 
-            block_end_index = tmp_pos+1
+        this_qgram_index = self.qgram_index1[i]
+        this_index =       self.index1[i]
 
-          # Generate the list of record identifiers from this block
+        for qgram_val in this_qgram_index:  # Loop over all q-gram values
+
+          block_recs = set()  # Combined set of all record identifiers
+
+          # All record identifiers from the basic index for this q-gram value
           #
-          curr_win_record_set = set()
-          for this_val in index_val_list[block_start_index:block_end_index]:
-            curr_rec_id_list = this_index[this_val]
+          index_val_set = this_qgram_index[qgram_val]
 
-            curr_win_record_set = \
-                                curr_win_record_set.union(set(curr_rec_id_list))
+          # Get all the indexing variable values for this gqram value
+          #
+          for index_val in index_val_set:
+            block_recs.update(this_index[index_val])
 
-          if (len(curr_win_record_set) > 1):
-            dedup_rec_pair_funct(list(curr_win_record_set), rec_pair_dict)
+          # Apply the block policy to the q-gram block
+          #
+          for (sub_block_val_list, guarded_recs, none_recs) in \
+              self.__guard_block__(block_recs, None):
 
-          block_start_index = block_end_index
+            if (len(guarded_recs) > 1):
 
-          num_blocks_done += 1
+              self.__dedup_rec_pairs__(guarded_recs, rec_pair_dict)
 
-          del curr_win_record_set
+          num_qgram_blocks_done += 1
 
-          # Log progress report every XXX blocks processed - - - - - - - - - -
+          # Log progress report every XXX q-gram blocks processed
           #
-          if ((num_blocks_done % NUM_BLOCK_PROGRESS_REPORT) == 0):
-            logging.info('    Processed %d of %d blocks' % \
-                         (num_blocks_done, num_index_vals))
+          if ((num_qgram_blocks_done % NUM_QGRAM_BLOCK_PROGRESS_REPORT) == 0):
+            logging.info('    Processed %d of %d %d-gram blocks' % \
+                         (num_qgram_blocks_done, len(this_qgram_index),
+                         self.q))
             memory_usage_str = auxiliary.get_memory_usage()
             if (memory_usage_str != None):
               logging.info('      '+memory_usage_str)
 
       else:  # A linkage - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-        this_index1 = self.index1[i]  # Shorthands
-        this_index2 = self.index2[i]
+        this_qgram_index1 = self.qgram_index1[i]
+        this_qgram_index2 = self.qgram_index2[i]
+        this_index1 =       self.index1[i]
+        this_index2 =       self.index2[i]
 
-        # Get and sort all unique index key values from both indices
-        #
-        index_val_set = set(this_index1.keys()+this_index2.keys())
-        index_val_list = list(index_val_set)
-        index_val_list.sort()
+        for qgram_val in this_qgram_index1:  # Loop over all q-gram values
 
-        num_index_vals = len(index_val_list)
+          if (qgram_val in this_qgram_index2):  # A matching q-gram value
 
-#        win_start_index = 0  # Position in the index key value list of the
-#                             # start of the current window
-#        win_end_index =   0  # Make sure it works even if there is one index
-#                             # key value only
-#
-#        while (win_end_index < num_index_vals):
-#
-#          first_val = index_val_list[win_start_index]
-#          last_val =  index_val_list[win_end_index]
-#
-#          # Increase window size as long as index values are similar
-#          #
-#          while ((str_cmp_funct(first_val, last_val) > str_cmp_thres) and \
-#                 (win_end_index < num_index_vals-1)):
-#            win_end_index += 1
-#            last_val =  index_val_list[win_end_index]
-#
-#          # Generate the lists of record identifiers from this window
-#          #
-#          curr_win_record_set1 = set()
-#          curr_win_record_set2 = set()
-#
-#          for this_val in index_val_list[win_start_index:win_end_index+1]:
-#
-#            if (this_val in this_index1):
-#              curr_rec_id_list1 = this_index1[this_val]
-#
-#              curr_win_record_set1 = \
-#                             curr_win_record_set1.union(set(curr_rec_id_list1))
-#
-#            if (this_val in this_index2):
-#              curr_rec_id_list2 = this_index2[this_val]
-#
-#              curr_win_record_set2 = \
-#                             curr_win_record_set2.union(set(curr_rec_id_list2))
-#
-#          if ((len(curr_win_record_set1) > 0) and \
-#              (len(curr_win_record_set2) > 0)):
-#
-#            link_rec_pair_funct(list(curr_win_record_set1),
-#                                list(curr_win_record_set2), rec_pair_dict)
-#
-#          win_end_index += 1
-#          win_start_index = win_end_index
+            block_recs1 = set()  # Combined sets of all record identifiers
+            block_recs2 = set()
 
-        # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-        # The code below follows algorithm 2 from the above mentioned paper. It
-        # is more efficient than the above simple linear scan.
-        #
-        # The notation given in this algorithm will be used as much as possible.
-        #
-        block_start_index = 0
+            # All record identifiers from the basic indices for this q-gram
+            #
+            index_val_set1 = this_qgram_index1[qgram_val]
 
-        while (block_start_index < num_index_vals):
+            # Get all the indexing variable values for this gqram value
+            #
+            for index_val1 in index_val_set1:
+              block_recs1.update(this_index1[index_val1])
 
-          w_first = block_start_index
-          w = 1  # To make sure this works even with one single index key value
-          w_last = w_first + w
+            index_val_set2 = this_qgram_index2[qgram_val]
 
-          # Get the first and last index key values in the current window
-          #
-          first_val = index_val_list[w_first]
-          last_val =  index_val_list[w_last-1]
+            for index_val2 in index_val_set2:
+              block_recs2.update(this_index2[index_val2])
 
-          # Enlargement phase: Move the window forward as long as index key
-          # values are similar
-          #
-          while ((str_cmp_funct(first_val, last_val) > str_cmp_thres) and
-                 (w_last < num_index_vals)):
-            w_first = w_last-1  # Make sure the windows overlap
-            w *= 2              # Geometric increase in the window size
-            w_last += w-1       # Adjust for overlap
-            if (w_last > num_index_vals):
-              w_last = num_index_vals  # Reached end of array
+            for (sub_block_val_list, guarded_recs1, guarded_recs2) in \
+                self.__guard_block__(block_recs1, block_recs2):
 
-            first_val = last_val
-            last_val =  index_val_list[w_last-1]
+              self.__link_rec_pairs__(guarded_recs1, guarded_recs2,
+                                      rec_pair_dict)
 
-          # Retrenchment phase: Find the boundary pair (use simple linear scan)
-          # (the retrenchment phase as described in the above mentioned paper is
-          # yet to be implementd)
-          #
-          #
-          tmp_pos = block_start_index
+          num_qgram_blocks_done += 1
 
-          # Take care of special case where last block is 1 index key value only
+          # Log progress report every XXX q-gram blocks processed
           #
-          if (tmp_pos+1 == num_index_vals):
-            block_end_index = tmp_pos+1
+          if ((num_qgram_blocks_done % NUM_QGRAM_BLOCK_PROGRESS_REPORT) == 0):
+            logging.info('    Processed %d of %d %d-gram blocks' % \
+                         (num_qgram_blocks_done, len(self.qgram_index1[i]),
+                         self.q))
+            memory_usage_str = auxiliary.get_memory_usage()
+            if (memory_usage_str != None):
+              logging.info('      '+memory_usage_str)
 
-          else:
-            first_val =  index_val_list[tmp_pos]
-            second_val = index_val_list[tmp_pos+1]
+      logging.info('  Compacted %d-gram index %d in %s' % \
+                   (self.q, i, auxiliary.time_string(time.time()-istart_time)))
 
-            while ((str_cmp_funct(first_val, second_val) > str_cmp_thres) and
-                   ((tmp_pos+1) < num_index_vals)):
-              tmp_pos += 1
-              first_val =  second_val
-              second_val = index_val_list[tmp_pos]
+      self.qgram_index1[i].clear()  # Not needed anymore
+      self.qgram_index2[i].clear()
+      self.index1[i].clear()
+      self.index2[i].clear()
 
-            block_end_index = tmp_pos+1
+      logging.info('    Explicitly run garbage collection')
+      gc.collect()
 
-          # Generate the list of record identifiers from this block
-          #
-          curr_win_record_set1 = set()
-          curr_win_record_set2 = set()
+      memory_usage_str = auxiliary.get_memory_usage()
+      if (memory_usage_str != None):
+        logging.info('    '+memory_usage_str)
 
-          for this_val in index_val_list[block_start_index:block_end_index]:
+    self.__log_block_guard_stats__()
 
-            if (this_val in this_index1):
-              curr_rec_id_list1 = this_index1[this_val]
+    self.rec_pair_dict = rec_pair_dict
 
-              curr_win_record_set1 = \
-                             curr_win_record_set1.union(set(curr_rec_id_list1))
+    self.num_rec_pairs = 0  # Count lengths of all record identifier sets - - -
 
-            if (this_val in this_index2):
-              curr_rec_id_list2 = this_index2[this_val]
+    for rec_ident2_set in self.rec_pair_dict.itervalues():
+      self.num_rec_pairs += len(rec_ident2_set)
 
-              curr_win_record_set2 = \
-                             curr_win_record_set2.union(set(curr_rec_id_list2))
+    logging.info('Compacted %d-gram index in %s' % \
+                 (self.q, auxiliary.time_string(time.time()-start_time)))
+    logging.info('  Number of record pairs: %d' % (self.num_rec_pairs))
 
-          if ((len(curr_win_record_set1) > 0) and \
-              (len(curr_win_record_set2) > 0)):
-            link_rec_pair_funct(list(curr_win_record_set1),
-                                list(curr_win_record_set2), rec_pair_dict)
+    self.status = 'compacted'  # Update index status
 
-          block_start_index = block_end_index
+  # ---------------------------------------------------------------------------
 
-          num_blocks_done += 1
+  def __iter_qgram_blocks__(self, i):
+    """Yield tuples (set of records from data set 1, set of records from data
+       set 2) for all q-gram blocks of index 'i' (for a deduplication the
+       records from data set 2 are None, for a linkage only q-gram blocks with
+       records from both data sets are returned).
+    """
 
-          del curr_win_record_set1, curr_win_record_set2
+    this_qgram_index1 = self.qgram_index1[i]  # Shorthands
+    this_qgram_index2 = self.qgram_index2[i]
+    this_index1 =       self.index1[i]
+    this_index2 =       self.index2[i]
 
-          # Log progress report every XXX blocks processed - - - - - - - - - -
-          #
-          if ((num_blocks_done % NUM_BLOCK_PROGRESS_REPORT) == 0):
-            logging.info('    Processed %d of %d blocks' % \
-                         (num_blocks_done, num_index_vals))
-            memory_usage_str = auxiliary.get_memory_usage()
-            if (memory_usage_str != None):
-              logging.info('      '+memory_usage_str)
+    for qgram_val in this_qgram_index1:
 
-      logging.info('  Compacted sorting index %d in %s' % \
-                   (i, auxiliary.time_string(time.time()-istart_time)))
+      block_recs1 = set()
+      for index_val1 in this_qgram_index1[qgram_val]:
+        block_recs1.update(this_index1[index_val1])
 
-      self.index1[i].clear()  # Not needed anymore
-      self.index2[i].clear()
+      if (self.do_deduplication == True):
+        yield (block_recs1, None)
 
-      logging.info('    Explicitly run garbage collection')
-      gc.collect()
+      elif (qgram_val in this_qgram_index2):
+        block_recs2 = set()
+        for index_val2 in this_qgram_index2[qgram_val]:
+          block_recs2.update(this_index2[index_val2])
+
+        yield (block_recs1, block_recs2)
+
+  # ---------------------------------------------------------------------------
+
+  def __iter_qgram_block_sizes__(self, i):
+    """Yield tuples (number of records, number of record pairs) for all q-gram
+       blocks of index 'i' (as needed by __log_block_size_hist__()).
+    """
+
+    for (block_recs1, block_recs2) in self.__iter_qgram_blocks__(i):
+      num_recs1 = len(block_recs1)
+
+      if (block_recs2 == None):
+        yield (num_recs1, num_recs1*(num_recs1-1)/2)
+      else:
+        num_recs2 = len(block_recs2)
+        yield (max(num_recs1, num_recs2), num_recs1*num_recs2)
+
+  # ---------------------------------------------------------------------------
 
-      memory_usage_str = auxiliary.get_memory_usage()
-      if (memory_usage_str != None):
-        logging.info('      '+memory_usage_str)
+  def __iter_estimate_blocks__(self, i):
+    """The record pairs are the pairs within the (guarded) q-gram blocks.
+    """
 
-    self.rec_pair_dict = rec_pair_dict
+    for (block_recs1, block_recs2) in self.__iter_qgram_blocks__(i):
+      for (sub_block_val_list, guarded_recs1, guarded_recs2) in \
+          self.__guard_block__(block_recs1, block_recs2):
 
-    self.num_rec_pairs = 0  # Count lengths of all record identifier sets - - -
+        if (guarded_recs2 == None):
+          yield (guarded_recs1, guarded_recs1)
+        else:
+          yield (guarded_recs1, guarded_recs2)
 
-    for rec_ident2_set in self.rec_pair_dict.itervalues():
-      self.num_rec_pairs += len(rec_ident2_set)
+  # ---------------------------------------------------------------------------
 
-    logging.info('Compacted sorting index in %s' % \
-                 (auxiliary.time_string(time.time()-start_time)))
-    logging.info('  Number of record pairs: %d' % (self.num_rec_pairs))
+  def __iter_estimate_block_sizes__(self, i):
+    """The block sizes of the q-gram blocks.
+    """
 
-    self.status = 'compacted'  # Update index status
+    return self.__iter_qgram_block_sizes__(i)
 
   # ---------------------------------------------------------------------------
 
-  def run(self, length_filter_perc = None, cut_off_threshold = None):
+  def run(self, length_filter_perc = None, cut_off_threshold = None,
+          num_workers = None):
     """Iterate over all blocks in the index.
 
-       Compare the record pairs as produced by the sorting indexing process,
-       and return a weight vector dictionary with keys made of a tuple (record
+       Compare the record pairs as produced by the q-gram indexing process, and
+       return a weight vector dictionary with keys made of a tuple (record
        identifier 1, record identifier 2), and corresponding values the
        comparison weights.
     """
@@ -2902,76 +6747,64 @@ class AdaptSortingIndex(Indexing):
     # Compare the records
     #
     return self.__compare_rec_pairs_from_dict__(length_filter_perc,
-                                                cut_off_threshold)
-
-
-
-
-
+                                                cut_off_threshold,
+                                                num_workers)
 
 # =============================================================================
 
-class QGramIndex(Indexing):
-  """Class that implements an indexing structure based on q-grams and allows
-     for fuzzy 'blocking'.
-
-     This index implements a data structure based on q-grams (sub-strings of
-     length q, e.g. bigrams (q=2): 'peter' -> 'pe','et','te','er') and allows
-     for fuzzy blocking.
-
-     The basic idea is that the index variable values will be converted into a
-     list of q-grams, and sub-lists will be built using a user provided
-     threshold (a number between 0.0 and 1.0) of all possible combinations.
-     The resulting q-gram sub-lists will be inserted into an inverted index,
-     i.e. record identifiers in the blocks will be inserted into Python
-     dictionaries for each q-gram sub-list. This inverted index will then be
-     used to retrieve the blocks.
-
-     The additional argument (besides the base class arguments) which has to be
-     set when this index is initialised is:
-
-       q               The length of the q-grams to be used (must be at least
-                       1). The default value is 2 (i.e. bigrams)
-       padded          If set to True (default), the beginning and end of the
-                       strings will be padded with (q-1) special characters, if
-                       False no padding will be done.
-       threshold       A number between 0.0 (not included) and 1.0, according
-                       to which the q-gram sub-lists will be calculated.
-
-     For example, assume an indexing definition contains:
-
-       index_def_1 = [['surname','sname',None,[]], ... ]
-
-     and with q=2 and the threshold set to 0.8. If a record value 'peter' is
-     given in the 'surname' field, the corresponding q-gram list will be
-     ['pe','et','te','er'] with four elements. With a threshold of 0.8, 4*0.8 =
-     3.2, rounded to 3, all sub-list combinations of length 3 are calculated.
-     For the given example they are:
-
-       ['pe','et','te']
-       ['pe','et','er']
-       ['pe','te','er']
-       ['et','te','er']
-
-     Converted back into strings, the all records with a given name value
-     'peter' will be inserted into the inverted index blocks with keys
-     'peette', 'peeter', 'peteer', and 'etteer'.
-
-     The lower the threshold, the shorter the sub-lists, but also the more
-     sub-lists there will be per field value, resulting in more (smaller
-     blocks) in the inverted index.
+class LSHIndex(Indexing):
+  """Class that implements an approximate nearest neighbour index based on
+     MinHash locality sensitive hashing (LSH) of q-gram sets.
+
+     Each index variable value is converted into its set of q-grams, and a
+     MinHash signature made of (num_bands * num_rows) hash values is
+     calculated for this set. The signature is split into 'num_bands' bands
+     of 'num_rows' hash values each, and every band is inserted as a key into
+     an inverted index. All records whose index values collide in at least
+     one band become candidate record pairs.
+
+     Two values with a Jaccard similarity s of their q-gram sets have the same
+     band with a probability of s^r (r being the number of rows), and they
+     become a candidate pair with a probability of 1-(1-s^r)^b (b being the
+     number of bands). The similarity at which this probability is roughly
+     0.5 is about (1/b)^(1/r). More bands increase the pairs completeness,
+     while more rows increase the pairs quality. Values that are the same
+     always have the same signature and are therefore always paired.
+
+     The additional arguments (besides the base class arguments) which can be
+     set when this index is initialised are:
+
+       q            The length of the q-grams to be used (must be at least
+                    1). The default value is 2 (i.e. bigrams)
+       padded       If set to True (default), the beginning and end of the
+                    strings will be padded with (q-1) special characters, if
+                    False no padding will be done.
+       num_bands    The number of bands the MinHash signatures are split into.
+                    Default value is 20.
+       num_rows     The number of hash values in each band. Default value is
+                    5.
+       random_seed  The seed used to generate the MinHash functions, so the
+                    same parameters always result in the same index. Default
+                    value is 42.
+
+     The method get_estimated_pairs_completeness() returns the probability
+     that a pair of values with a given Jaccard similarity becomes a
+     candidate record pair, i.e. the estimated pairs completeness for true
+     matches with this similarity.
   """
 
   # ---------------------------------------------------------------------------
 
   def __init__(self, **kwargs):
-    """Constructor. Process the 'q', padded' and 'threshold' arguments first,
-       then call the base class constructor.
+    """Constructor. Process the 'q', 'padded', 'num_bands', 'num_rows' and
+       'random_seed' arguments first, then call the base class constructor.
     """
 
-    self.padded =    True
-    self.q =         2
-    self.threshold = None
+    self.padded =      True
+    self.q =           2
+    self.num_bands =   20
+    self.num_rows =    5
+    self.random_seed = 42
 
     base_kwargs = {}  # Dictionary, will contain unprocessed arguments for base
                       # class constructor
@@ -2987,37 +6820,130 @@ class QGramIndex(Indexing):
         auxiliary.check_is_positive('q', value)
         self.q = value
 
-      elif (keyword.startswith('thres')):
-        auxiliary.check_is_normalised('threshold', value)
-        self.threshold = value
+      elif (keyword.startswith('num_b')):
+        auxiliary.check_is_integer('num_bands', value)
+        auxiliary.check_is_positive('num_bands', value)
+        self.num_bands = value
+
+      elif (keyword.startswith('num_r')):
+        auxiliary.check_is_integer('num_rows', value)
+        auxiliary.check_is_positive('num_rows', value)
+        self.num_rows = value
+
+      elif (keyword.startswith('random')):
+        auxiliary.check_is_integer('random_seed', value)
+        self.random_seed = value
 
       else:
         base_kwargs[keyword] = value
 
     Indexing.__init__(self, base_kwargs)  # Initialise base class
 
-    # Make sure 'threshold' attribute is set - - - - - - - - - - - - - - - - -
-    #
-    auxiliary.check_is_normalised('threshold', self.threshold)
+    self.log([('q', self.q),
+              ('Padded flag', self.padded),
+              ('Number of bands', self.num_bands),
+              ('Number of rows', self.num_rows),
+              ('Random seed', self.random_seed)])  # Log a message
 
-    self.log([('Threshold', self.threshold),
-              ('q', self.q),
-              ('Padded flag', self.padded)])  # Log a message
+    logging.info('  Approximate Jaccard similarity threshold: %.3f' % \
+                 (self.get_similarity_threshold()))
+    for sim in [0.5, 0.6, 0.7, 0.8, 0.9]:
+      logging.info('  Estimated pairs completeness for Jaccard similarity ' + \
+                   '%.1f: %.2f %%' % \
+                   (sim, 100.0*self.get_estimated_pairs_completeness(sim)))
 
     self.QGRAM_START_CHAR = chr(1)
     self.QGRAM_END_CHAR =   chr(2)
 
+    # Parameters of the MinHash functions h(x) = (a*x + c) mod p, with p being
+    # the Mersenne prime 2^61-1
+    #
+    self.MINHASH_PRIME = (1 << 61) - 1
+
+    rand_gen = random.Random(self.random_seed)
+
+    self.minhash_param_list = []
+    for k in xrange(self.num_bands*self.num_rows):
+      self.minhash_param_list.append((rand_gen.randint(1,self.MINHASH_PRIME-1),
+                                      rand_gen.randint(0,self.MINHASH_PRIME-1)))
+
+  # ---------------------------------------------------------------------------
+
+  def __get_param_fingerprint__(self):
+    """The q-grams, the banding of the MinHash signatures and the
+       random seed of the hash functions.
+    """
+
+    return {'q':self.q, 'padded':self.padded, 'num_bands':self.num_bands,
+            'num_rows':self.num_rows, 'random_seed':self.random_seed}
+
+  # ---------------------------------------------------------------------------
+
+  def get_similarity_threshold(self):
+    """Return the approximate Jaccard similarity at which two values become a
+       candidate pair with a probability of about 0.5, i.e. (1/b)^(1/r).
+    """
+
+    return (1.0 / self.num_bands)**(1.0 / self.num_rows)
+
+  # ---------------------------------------------------------------------------
+
+  def get_estimated_pairs_completeness(self, jaccard_sim):
+    """Return the probability that two values with the given Jaccard
+       similarity of their q-gram sets collide in at least one band, i.e.
+       1-(1-s^r)^b.
+    """
+
+    auxiliary.check_is_normalised('jaccard_sim', jaccard_sim)
+
+    return 1.0 - (1.0 - jaccard_sim**self.num_rows)**self.num_bands
+
+  # ---------------------------------------------------------------------------
+
+  def __get_minhash_band_keys__(self, index_val):
+    """Calculate the MinHash signature of the q-gram set of the given value
+       and return a list with one key for each of its bands.
+    """
+
+    q = self.q
+
+    if (self.padded == True):
+      qgram_str = '%s%s%s' % ((q-1)*self.QGRAM_START_CHAR, index_val,
+                              (q-1)*self.QGRAM_END_CHAR)
+    else:
+      qgram_str = index_val
+
+    qgram_set = set([qgram_str[j:j+q] for j in xrange(len(qgram_str)-(q-1))])
+
+    if (len(qgram_set) == 0):  # Value is shorter than q
+      qgram_set.add(qgram_str)
+
+    qgram_hash_list = [zlib.crc32(qgram) & 0xffffffff for qgram in qgram_set]
+
+    p = self.MINHASH_PRIME
+
+    signature = [min([(a*x + c) % p for x in qgram_hash_list]) \
+                 for (a, c) in self.minhash_param_list]
+
+    num_rows = self.num_rows
+
+    # Band number is included in the key so bands do not collide
+    #
+    return [(b,) + tuple(signature[b*num_rows:(b+1)*num_rows]) \
+            for b in xrange(self.num_bands)]
+
   # ---------------------------------------------------------------------------
 
   def build(self):
     """Method to build an index data structure.
 
        Read all records from both files, extract blocking variables and then
-       insert records into blocks.
+       insert the index values into the band buckets of their MinHash
+       signatures.
     """
 
     logging.info('')
-    logging.info('Build %d-gram index: "%s"' % (self.q, self.description))
+    logging.info('Build LSH index: "%s"' % (self.description))
 
     start_time = time.time()
 
@@ -3027,92 +6953,70 @@ class QGramIndex(Indexing):
 
     num_indices = len(self.index_def)
 
-    # Next create an index with keys being q-gram sub-list values - - - - - - -
+    # Next create an index with keys being MinHash band values - - - - - - - -
     #
-    self.qgram_index1 = {}
-    self.qgram_index2 = {}
+    self.band_index1 = {}
+    self.band_index2 = {}
 
     for i in range(num_indices):  # Similar to basic index
-      self.qgram_index1[i] = {}  # Index for data set 1
-      self.qgram_index2[i] = {}  # Index for data set 2
-
-    q = self.q  # Shorthands
-    padded = self.padded
-    threshold = self.threshold
-
-    if (padded == True):  # More shorthands
-      start_str = (q-1)*self.QGRAM_START_CHAR
-      end_str =   (q-1)*self.QGRAM_END_CHAR
+      self.band_index1[i] = {}  # Index for data set 1
+      self.band_index2[i] = {}  # Index for data set 2
 
-    # Depending upon threshold values use one of two sub-list methods
-    # (the switch value of 0.75 was found experimentally)
-    #
-    if (self.threshold > 0.75):
-      qgram_sublist_funct = self.__get_sublists1__
-    else:
-      qgram_sublist_funct = self.__get_sublists2__
+    get_band_keys_funct = self.__get_minhash_band_keys__  # Shorthand
 
-    logging.info('Convert basic inverted index into %d-gram index' % (q))
+    logging.info('Convert basic inverted index into LSH index')
 
-    num_blocks =       0
-    num_qgram_blocks = 0
+    num_blocks =      0
+    num_band_blocks = 0
 
     for i in range(num_indices):
 
+      # Band keys of values which occur in both data sets are only calculated
+      # once
+      #
+      band_keys_cache = {}
+
       # Build a list of data structures needed for the build process
       #
-      index_list = [(self.index1[i], self.qgram_index1[i],0)]  # For data set 1
+      index_list = [(self.index1[i], self.band_index1[i], 0)]  # Data set 1
 
       if (self.do_deduplication == False):  # If linkage append data set 2
-        index_list.append((self.index2[i], self.qgram_index2[i],1))
+        index_list.append((self.index2[i], self.band_index2[i], 1))
 
-      for (basic_index, qgram_index, ds_index) in index_list:
+      for (basic_index, band_index, ds_index) in index_list:
 
-        qstart_time = time.time()
+        bstart_time = time.time()
 
         num_blocks += len(basic_index)
 
         for index_val in basic_index:  # Loop over all the values in this index
 
-          if (padded == True):
-            qgram_str = '%s%s%s' % (start_str, index_val, end_str)
-          else:
-            qgram_str = index_val
-
-          # Create the q-gram list
-          #
-          qgram_list= [qgram_str[j:j+q] for j in xrange(len(qgram_str)-(q-1))]
-
-          # Calculate length of sub-lists needed and then create them
-          #
-          num_qgrams = len(qgram_list)
-
-          min_num_qgrams = max(1, int(num_qgrams*threshold))
+          band_key_list = band_keys_cache.get(index_val, None)
 
-          qgram_sublists = qgram_sublist_funct(qgram_list, min_num_qgrams)
+          if (band_key_list == None):
+            band_key_list = get_band_keys_funct(index_val)
 
-          # Convert q-gram sub-lists into strings and insert into q-gram index
-          #
-          for qgram_sublist in qgram_sublists:
+            if (self.do_deduplication == False):
+              band_keys_cache[index_val] = band_key_list
 
-            qgram_substr = ''.join(qgram_sublist)
+          for band_key in band_key_list:
+            band_index_set = band_index.get(band_key, set())
+            band_index_set.add(index_val)
+            band_index[band_key] = band_index_set
 
-            qgram_index_set = qgram_index.get(qgram_substr, set())
-            qgram_index_set.add(index_val)
-            qgram_index[qgram_substr] = qgram_index_set
+        num_band_blocks += len(band_index)
 
-        num_qgram_blocks += len(qgram_index)
+        logging.info('  Built LSH index %d for data set %d in %s' % \
+               (i,ds_index+1,auxiliary.time_string(time.time()-bstart_time)))
 
-        logging.info('  Built %d-gram index %d for data set %d in %s' % \
-               (q,i,ds_index+1,auxiliary.time_string(time.time()-qstart_time)))
+      band_keys_cache.clear()
 
-    logging.info('Built %d-gram index in %s' % \
-                 (q, auxiliary.time_string(time.time()-start_time)))
+    logging.info('Built LSH index in %s' % \
+                 (auxiliary.time_string(time.time()-start_time)))
 
     logging.info('  Number of basic index blocks (number of different ' + \
                  'index variable values): %d' % (num_blocks))
-    logging.info('  Number of %d-gram index blocks (number of different ' % \
-                 (q) + '%d-gram index values):  %d' % (q, num_qgram_blocks))
+    logging.info('  Number of LSH band blocks: %d' % (num_band_blocks))
 
     memory_usage_str = auxiliary.get_memory_usage()
     if (memory_usage_str != None):
@@ -3131,10 +7035,10 @@ class QGramIndex(Indexing):
        Finally calculate the total number of record pairs.
     """
 
-    NUM_QGRAM_BLOCK_PROGRESS_REPORT = 1000
+    NUM_BAND_BLOCK_PROGRESS_REPORT = 10000
 
     logging.info('')
-    logging.info('Compact %d-gram index: "%s"' % (self.q, self.description))
+    logging.info('Compact LSH index: "%s"' % (self.description))
 
     start_time = time.time()
 
@@ -3155,98 +7059,54 @@ class QGramIndex(Indexing):
 
       istart_time = time.time()
 
-      num_qgram_blocks_done = 0
-
-      if (self.do_deduplication == True):  # A deduplication - - - - - - - - -
-
-        this_qgram_index = self.qgram_index1[i]
-        this_index =       self.index1[i]
+      num_band_blocks_done = 0
 
-        for qgram_val in this_qgram_index:  # Loop over all q-gram values
+      this_band_index1 = self.band_index1[i]
+      this_band_index2 = self.band_index2[i]
+      this_index1 =      self.index1[i]
+      this_index2 =      self.index2[i]
 
-          block_recs = []  # Combined list of all record identifiers
+      for (band_key, index_val_set1) in this_band_index1.iteritems():
 
-          # All record identifiers from the basic index for this q-gram value
-          #
-          index_val_set = this_qgram_index[qgram_val]
+        if (self.do_deduplication == True):  # A deduplication - - - - - - - -
 
-          # Get all the indexing variable values for this gqram value
-          #
-          for index_val in index_val_set:
+          block_recs = set()  # Combined set of all record identifiers
 
-            for block_rec in this_index[index_val]:
-              if (block_rec not in block_recs):
-                block_recs.append(block_rec)
+          for index_val in index_val_set1:
+            block_recs.update(this_index1[index_val])
 
           if (len(block_recs) > 1):
-
             self.__dedup_rec_pairs__(block_recs, rec_pair_dict)
 
-          num_qgram_blocks_done += 1
-
-          # Log progress report every XXX q-gram blocks processed
-          #
-          if ((num_qgram_blocks_done % NUM_QGRAM_BLOCK_PROGRESS_REPORT) == 0):
-            logging.info('    Processed %d of %d %d-gram blocks' % \
-                         (num_qgram_blocks_done, len(this_qgram_index),
-                         self.q))
-            memory_usage_str = auxiliary.get_memory_usage()
-            if (memory_usage_str != None):
-              logging.info('      '+memory_usage_str)
-
-      else:  # A linkage - - - - - - - - - - - - - - - - - - - - - - - - - - -
-
-        this_qgram_index1 = self.qgram_index1[i]
-        this_qgram_index2 = self.qgram_index2[i]
-        this_index1 =       self.index1[i]
-        this_index2 =       self.index2[i]
-
-        for qgram_val in this_qgram_index1:  # Loop over all q-gram values
-
-          if (qgram_val in this_qgram_index2):  # A matching q-gram value
-
-            block_recs1 = []  # Combined list of all record identifiers
-            block_recs2 = []
-
-            # All record identifiers from the basic indices for this q-gram
-            #
-            index_val_set1 = this_qgram_index1[qgram_val]
-
-            # Get all the indexing variable values for this gqram value
-            #
-            for index_val1 in index_val_set1:
-
-              for block_rec in this_index1[index_val1]:
-                if (block_rec not in block_recs1):
-                  block_recs1.append(block_rec)
-
-            index_val_set2 = this_qgram_index2[qgram_val]
-
-            for index_val2 in index_val_set2:
-
-              for block_rec in this_index2[index_val2]:
-                if (block_rec not in block_recs2):
-                  block_recs2.append(block_rec)
-
-            self.__link_rec_pairs__(block_recs1, block_recs2, rec_pair_dict)
-
-          num_qgram_blocks_done += 1
-
-          # Log progress report every XXX q-gram blocks processed
-          #
-          if ((num_qgram_blocks_done % NUM_QGRAM_BLOCK_PROGRESS_REPORT) == 0):
-            logging.info('    Processed %d of %d %d-gram blocks' % \
-                         (num_qgram_blocks_done, len(self.qgram_index1[i]),
-                         self.q))
-            memory_usage_str = auxiliary.get_memory_usage()
-            if (memory_usage_str != None):
-              logging.info('      '+memory_usage_str)
-
-      logging.info('  Compacted %d-gram index %d in %s' % \
-                   (self.q, i, auxiliary.time_string(time.time()-istart_time)))
+        elif (band_key in this_band_index2):  # A linkage with matching band
 
-      self.qgram_index1[i].clear()  # Not needed anymore
-      self.qgram_index2[i].clear()
+          block_recs1 = set()  # Combined sets of all record identifiers
+          block_recs2 = set()
+
+          for index_val1 in index_val_set1:
+            block_recs1.update(this_index1[index_val1])
+
+          for index_val2 in this_band_index2[band_key]:
+            block_recs2.update(this_index2[index_val2])
+
+          self.__link_rec_pairs__(block_recs1, block_recs2, rec_pair_dict)
+
+        num_band_blocks_done += 1
+
+        # Log progress report every XXX band blocks processed
+        #
+        if ((num_band_blocks_done % NUM_BAND_BLOCK_PROGRESS_REPORT) == 0):
+          logging.info('    Processed %d of %d LSH band blocks' % \
+                       (num_band_blocks_done, len(this_band_index1)))
+          memory_usage_str = auxiliary.get_memory_usage()
+          if (memory_usage_str != None):
+            logging.info('      '+memory_usage_str)
+
+      logging.info('  Compacted LSH index %d in %s' % \
+                   (i, auxiliary.time_string(time.time()-istart_time)))
+
+      self.band_index1[i].clear()  # Not needed anymore
+      self.band_index2[i].clear()
       self.index1[i].clear()
       self.index2[i].clear()
 
@@ -3264,18 +7124,23 @@ class QGramIndex(Indexing):
     for rec_ident2_set in self.rec_pair_dict.itervalues():
       self.num_rec_pairs += len(rec_ident2_set)
 
-    logging.info('Compacted %d-gram index in %s' % \
-                 (self.q, auxiliary.time_string(time.time()-start_time)))
+    logging.info('Compacted LSH index in %s' % \
+                 (auxiliary.time_string(time.time()-start_time)))
     logging.info('  Number of record pairs: %d' % (self.num_rec_pairs))
+    logging.info('  Estimated pairs completeness for Jaccard similarity ' + \
+                 '%.3f: %.2f %%' % (self.get_similarity_threshold(), 100.0 * \
+                 self.get_estimated_pairs_completeness( \
+                 self.get_similarity_threshold())))
 
     self.status = 'compacted'  # Update index status
 
   # ---------------------------------------------------------------------------
 
-  def run(self, length_filter_perc = None, cut_off_threshold = None):
+  def run(self, length_filter_perc = None, cut_off_threshold = None,
+          num_workers = None):
     """Iterate over all blocks in the index.
 
-       Compare the record pairs as produced by the q-gram indexing process, and
+       Compare the record pairs as produced by the LSH indexing process, and
        return a weight vector dictionary with keys made of a tuple (record
        identifier 1, record identifier 2), and corresponding values the
        comparison weights.
@@ -3298,7 +7163,186 @@ class QGramIndex(Indexing):
     # Compare the records
     #
     return self.__compare_rec_pairs_from_dict__(length_filter_perc,
-                                                cut_off_threshold)
+                                                cut_off_threshold,
+                                                num_workers)
+
+# =============================================================================
+
+class CanopyQGramMatrix:
+  """A sparse q-gram by index value matrix in compressed sparse row (CSR)
+     format, used by the 'sparse' engine of the canopy index.
+
+     The matrix is built once from the inverted index of a canopy index (with
+     q-grams as keys and dictionaries of record identifiers and their
+     normalised q-gram counts as values). Each row corresponds to a q-gram and
+     each column to a distinct index value (records with the same index value
+     share a column, as their similarities to a canopy center are the same).
+     The rows are stored in three flat arrays: the column numbers, the
+     normalised q-gram counts, and the start and end position of each row.
+
+     Records are not deleted from the matrix when they are removed from the
+     pool of records. Instead the number of remaining records is kept for each
+     column and each q-gram, and a bitmap marks the columns that still have
+     records. Empty columns are skipped, and removed from a row once more than
+     half of its columns are empty.
+  """
+
+  # ---------------------------------------------------------------------------
+
+  def __init__(self, index, index_val_cache, qgram_inv_doc_freq_cache,
+               index_val_num_qgram):
+    """Constructor, build the matrix from the given inverted index, the index
+       value of each record, the q-gram IDF values (empty for the Jaccard
+       method) and the number of q-grams in each record (empty for the TF-IDF
+       method).
+    """
+
+    # Columns: Distinct index values, their records and number of q-grams
+    #
+    self.val_col_dict =  {}  # Index values as keys, column numbers as values
+    self.col_rec_list =  []  # Sets with records in each column
+    self.col_num_qgram = array.array('l')
+
+    for (rec_ident, index_val) in index_val_cache.iteritems():
+      col = self.val_col_dict.get(index_val)
+      if (col == None):
+        col = len(self.col_rec_list)
+        self.val_col_dict[index_val] = col
+        self.col_rec_list.append(set())
+        self.col_num_qgram.append(index_val_num_qgram.get(rec_ident, 0))
+      self.col_rec_list[col].add(rec_ident)
+
+    self.col_num_rec = array.array('l', [len(col_rec_set) for col_rec_set in
+                                         self.col_rec_list])
+    self.col_live = bytearray('\x01'*len(self.col_rec_list))  # Bitmap
+
+    # Dense accumulator for similarities (re-used for every canopy), and a
+    # bitmap with the columns that have been set in the accumulator
+    #
+    self.col_sim_list = [0.0]*len(self.col_rec_list)
+    self.col_touched =  bytearray(len(self.col_rec_list))
+
+    # Rows: The q-grams, with their IDF and number of remaining records
+    #
+    self.qgram_row_dict = {}  # Q-grams as keys, row numbers as values
+    self.row_idf =        array.array('d')
+    self.row_num_rec =    array.array('l')
+    self.row_num_col =    array.array('l')  # Number of non-empty columns
+    self.row_start =      array.array('l')
+    self.row_end =        array.array('l')
+
+    self.row_col =  array.array('l')  # The matrix elements
+    self.row_data = array.array('d')
+
+    col_row_list = [[] for col in xrange(len(self.col_rec_list))]
+
+    for (qgram, qgram_rec_dict) in index.iteritems():
+      row = len(self.row_start)
+      self.qgram_row_dict[qgram] = row
+
+      self.row_idf.append(qgram_inv_doc_freq_cache.get(qgram, 0.0))
+      self.row_num_rec.append(len(qgram_rec_dict))
+      self.row_start.append(len(self.row_col))
+
+      row_col_dict = {}  # Records with the same index value have same counts
+      for (rec_ident, rec_qgram_count) in qgram_rec_dict.iteritems():
+        col = self.val_col_dict[index_val_cache[rec_ident]]
+        row_col_dict[col] = rec_qgram_count
+
+      for (col, rec_qgram_count) in row_col_dict.iteritems():
+        self.row_col.append(col)
+        self.row_data.append(rec_qgram_count)
+        col_row_list[col].append(row)
+
+      self.row_end.append(len(self.row_col))
+      self.row_num_col.append(len(row_col_dict))
+
+    self.col_row_list = [array.array('l', col_rows) for col_rows in
+                         col_row_list]
+
+    self.num_qgrams = len(self.qgram_row_dict)  # Q-grams with records left
+
+  # ---------------------------------------------------------------------------
+
+  def get_row(self, qgram):
+    """Return the row number of the given q-gram if it has remaining records,
+       or None otherwise.
+    """
+
+    row = self.qgram_row_dict.get(qgram)
+
+    if (row == None) or (self.row_num_rec[row] == 0):
+      return None
+
+    return row
+
+  # ---------------------------------------------------------------------------
+
+  def get_row_cols(self, row):
+    """Return an array with the column numbers in the given row. This might
+       include empty columns, which have to be skipped using the bitmap
+       'col_live'.
+    """
+
+    return self.row_col[self.row_start[row]:self.row_end[row]]
+
+  # ---------------------------------------------------------------------------
+
+  def get_row_data(self, row):
+    """Return an array with the normalised q-gram counts in the given row (in
+       the same order as the columns returned by get_row_cols()).
+    """
+
+    return self.row_data[self.row_start[row]:self.row_end[row]]
+
+  # ---------------------------------------------------------------------------
+
+  def remove_record(self, rec_ident, index_val):
+    """Remove the given record (with the given index value) from the pool of
+       records.
+    """
+
+    col = self.val_col_dict[index_val]
+    self.col_rec_list[col].remove(rec_ident)
+
+    col_num_rec = self.col_num_rec[col] - 1
+    self.col_num_rec[col] = col_num_rec
+
+    row_num_rec = self.row_num_rec  # Shorthands
+    row_num_col = self.row_num_col
+
+    for row in self.col_row_list[col]:
+      row_num_rec[row] -= 1
+      if (row_num_rec[row] == 0):
+        self.num_qgrams -= 1
+
+      if (col_num_rec == 0):  # Column is now empty
+        self.col_live[col] = 0
+        row_num_col[row] -= 1
+        if (2*row_num_col[row] < self.row_end[row] - self.row_start[row]):
+          self.__compact_row__(row)
+
+  # ---------------------------------------------------------------------------
+
+  def __compact_row__(self, row):
+    """Remove the empty columns from the given row (in place).
+    """
+
+    start = self.row_start[row]
+    pos =   start
+
+    row_col =  self.row_col  # Shorthands
+    row_data = self.row_data
+    col_live = self.col_live
+
+    for j in xrange(start, self.row_end[row]):
+      col = row_col[j]
+      if (col_live[col]):
+        row_col[pos] =  col
+        row_data[pos] = row_data[j]
+        pos += 1
+
+    self.row_end[row] = pos
 
 # =============================================================================
 
@@ -3364,19 +7408,30 @@ class CanopyIndex(Indexing):
        delete_perc       Threshold for deleting common q-grams (if they appear
                          in more than this percentage of all records). Default
                          is None, in which case no q-grams will be deleted.
+       canopy_engine     The data structure used to extract canopies, either
+                         'dict' (default), in which case the inverted index
+                         dictionaries are searched and records are deleted from
+                         them, or 'sparse', in which case a sparse q-gram by
+                         index value matrix (see class CanopyQGramMatrix) is
+                         built at the end of build(). With the 'sparse' engine
+                         records that have the same index value are only
+                         processed once, and removing records from the pool is
+                         cheap. Both engines produce the same canopies.
   """
 
   # ---------------------------------------------------------------------------
 
   def __init__(self, **kwargs):
-    """Constructor. Process the arguments 'canopy_method', 'q', 'padded' and
-       'delete_perc' first, then call the base class constructor.
+    """Constructor. Process the arguments 'canopy_method', 'q', 'padded',
+       'delete_perc' and 'canopy_engine' first, then call the base class
+       constructor.
     """
 
     self.canopy_method =  None
     self.q =              2
     self.padded =         True
     self.delete_perc =    None
+    self.canopy_engine =  'dict'
 
     base_kwargs = {}  # Dictionary, will contain unprocessed arguments for base
                       # class constructor
@@ -3387,6 +7442,14 @@ class CanopyIndex(Indexing):
         auxiliary.check_is_tuple('canopy_method', value)
         self.canopy_method = value
 
+      elif (keyword.startswith('canopy_e')):
+        auxiliary.check_is_string('canopy_engine', value)
+        if (value not in ['dict', 'sparse']):
+          logging.exception('Illegal canopy engine given (must be "dict" ' + \
+                            'or "sparse"): %s' % (value))
+          raise Exception
+        self.canopy_engine = value
+
       elif (keyword.startswith('padd')):
         auxiliary.check_is_flag('padded', value)
         self.padded = value
@@ -3459,7 +7522,8 @@ class CanopyIndex(Indexing):
     self.log([('Canopy method', self.canopy_method),
               ('q', self.q),
               ('Padded flag', self.padded),
-              ('Delete percentage', self.delete_perc)])  # Log a message
+              ('Delete percentage', self.delete_perc),
+              ('Canopy engine', self.canopy_engine)])  # Log a message
 
     self.QGRAM_START_CHAR = chr(1)
     self.QGRAM_END_CHAR =   chr(2)
@@ -3473,6 +7537,17 @@ class CanopyIndex(Indexing):
 
   # ---------------------------------------------------------------------------
 
+  def __get_param_fingerprint__(self):
+    """The canopy method, q-grams, delete percentage and canopy
+       engine.
+    """
+
+    return {'canopy_method':self.canopy_method, 'q':self.q,
+            'padded':self.padded, 'delete_perc':self.delete_perc,
+            'canopy_engine':self.canopy_engine}
+
+  # ---------------------------------------------------------------------------
+
   def build(self):
     """Method to build an index data structure.
 
@@ -3567,7 +7642,11 @@ class CanopyIndex(Indexing):
 
       rstart_time = time.time()  # Start time reading data set
 
-      for (rec_ident, rec) in dataset.readall(): # Read all records in data set
+      intern_rec_ident = dataset.intern_rec_ident  # Shorthand
+
+      for (orig_rec_ident, rec) in dataset.readall(): # Read all records
+
+        rec_ident = intern_rec_ident(orig_rec_ident)  # Integer record number
 
         # Extract record fields needed for comparisons - - - - - - - - - - - -
         #
@@ -3587,10 +7666,15 @@ class CanopyIndex(Indexing):
         #
         rec_index_val_list = get_index_values_funct(rec, ds_index)
 
+        # The q-gram index and values cache use the original record
+        # identifiers, as canopy centers are selected in the (arbitrary)
+        # order of the values cache, which should not depend upon the order
+        # in which records were interned (see compact())
+        #
         if (do_dedup == False):
-          ds_rec_ident = str(ds_index)+rec_ident  # Add data set identifier
+          ds_rec_ident = str(ds_index)+orig_rec_ident  # Add data set number
         else:
-          ds_rec_ident = rec_ident  # Not needed for deduplication
+          ds_rec_ident = orig_rec_ident  # Not needed for deduplication
 
         for i in range(num_indices):  # Put record identifier into all indices
 
@@ -3810,6 +7894,25 @@ class CanopyIndex(Indexing):
                      (self.delete_perc))
         logging.info('        %s' % (str(delete_qgram_list)))
 
+    # Step 3: Convert inverted indices into sparse matrices - - - - - - - - - -
+    #
+    self.qgram_matrix = {}
+
+    if (self.canopy_engine == 'sparse'):
+
+      for i in range(num_indices):
+        self.qgram_matrix[i] = CanopyQGramMatrix(index[i], index_val_cache[i],
+                                                qgram_inv_doc_freq_cache[i],
+                                                index_val_num_qgram[i])
+        logging.info('  Built sparse matrix for index %d with %d %d-grams ' % \
+                     (i, len(self.qgram_matrix[i].qgram_row_dict), self.q) + \
+                     'and %d different index values' % \
+                     (len(self.qgram_matrix[i].col_rec_list)))
+
+        index[i].clear()  # Inverted index and caches are not needed anymore
+        qgram_inv_doc_freq_cache[i].clear()
+        index_val_num_qgram[i].clear()
+
     logging.info('Built canopy index in %s' % \
                  (auxiliary.time_string(time.time()-start_time)))
 
@@ -3882,7 +7985,10 @@ class CanopyIndex(Indexing):
     dedup_rec_pairs_funct = self.__dedup_rec_pairs__  # Shorthands
     link_rec_pair_funct =   self.__link_rec_pairs__
     tfidf_canopy_funct =    self.__tfidf_canopy__
+    rec_ident_num_dict1 =   self.dataset1.rec_ident_num_dict
+    rec_ident_num_dict2 =   self.dataset2.rec_ident_num_dict
     jaccard_canopy_funct =  self.__jaccard_canopy__
+    do_sparse =             (self.canopy_engine == 'sparse')
 
     # Check if index has been built - - - - - - - - - - - - - - - - - - - - - -
     #
@@ -3920,8 +8026,8 @@ class CanopyIndex(Indexing):
       total_num_rec = float(len(this_index_val_cache))
 
       logging.info('  Compacting index %d containing %d records and %d ' % \
-                   (i, total_num_rec, len(self.index1[i]))+'%d-grams' % \
-                   (self.q))
+                   (i, total_num_rec, self.__get_num_qgrams__(i))+'%d-grams' \
+                   % (self.q))
 
       # Loop over all values, extract canopies and delete records from values
       # cache that are within the tight threshold of a canopy
@@ -3935,7 +8041,11 @@ class CanopyIndex(Indexing):
 
         # Get all records in this canopy - - - - - - - - - - - - - - - - - - -
         #
-        if (do_tfidf == True):
+        if (do_sparse == True):
+          canopy_recs = self.__sparse_canopy__(self.qgram_matrix[i], index_val,
+                                               this_index_val_cache,
+                                               self.max_qgram_count[i])
+        elif (do_tfidf == True):
           canopy_recs = tfidf_canopy_funct(self.index1[i], index_val,
                                           this_index_val_cache,
                                           self.qgram_inv_doc_freq_cache[i],
@@ -3965,22 +8075,25 @@ class CanopyIndex(Indexing):
 
           if (num_canopy_rec > 1):  # For deduplication at least two records
 
-            # Build record pairs from record identifiers in this canopy
+            # Build record pairs from record numbers in this canopy
             #
-            dedup_rec_pairs_funct(canopy_recs, rec_pair_dict)
+            canopy_recs1 = [rec_ident_num_dict1[rec_ident] for rec_ident in \
+                            canopy_recs]
+            dedup_rec_pairs_funct(canopy_recs1, rec_pair_dict)
+            del canopy_recs1
 
         else:  # A linkage - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-          canopy_recs1 = []  # Need to separate records
-          canopy_recs2 = []
+          canopy_recs1 = []  # Need to separate records (and get their
+          canopy_recs2 = []  # record numbers)
 
           for ds_rec_ident in canopy_recs:
             if (ds_rec_ident[0] == '0'):
-              canopy_recs1.append(ds_rec_ident[1:])
+              canopy_recs1.append(rec_ident_num_dict1[ds_rec_ident[1:]])
             else:
-              canopy_recs2.append(ds_rec_ident[1:])
+              canopy_recs2.append(rec_ident_num_dict2[ds_rec_ident[1:]])
 
-            link_rec_pair_funct(canopy_recs1, canopy_recs2, rec_pair_dict)
+          link_rec_pair_funct(canopy_recs1, canopy_recs2, rec_pair_dict)
           del canopy_recs1
           del canopy_recs2
 
@@ -3991,7 +8104,8 @@ class CanopyIndex(Indexing):
         if ((num_canopies % NUM_CANOPY_PROGRESS_REPORT) == 0):
           logging.info('    Created %d canopies; %d records and ' % \
                        (num_canopies, len(self.index_val_cache[i])) + \
-                       '%d %d-grams' % (len(self.index1[i]), self.q)+' left')
+                       '%d %d-grams' % (self.__get_num_qgrams__(i), self.q) + \
+                       ' left')
           memory_usage_str = auxiliary.get_memory_usage()
           if (memory_usage_str != None):
             logging.info('      '+memory_usage_str)
@@ -4001,6 +8115,8 @@ class CanopyIndex(Indexing):
       self.index1[i].clear()  # Not needed anymore
       this_index_val_cache.clear()
       self.qgram_inv_doc_freq_cache[i].clear()
+      if (do_sparse == True):
+        del self.qgram_matrix[i]
 
       logging.info('  Compacted canopy index %d in %s' % \
                    (i, auxiliary.time_string(time.time()-istart_time)))
@@ -4201,28 +8317,8 @@ class CanopyIndex(Indexing):
         sim_rec_ident_list.append(rec_ident)
         sim_dict[round_cos_sim] = sim_rec_ident_list
 
-      sim_values = sim_dict.keys()
-      sim_values.sort(reverse=True)  # Largest values first
-
-      for sim_val in sim_values:
-        sim_val_rec_list = sim_dict[sim_val]
-
-        if ((len(return_list) + len(sim_val_rec_list)) <= cluster_nearest):
-          return_list += sim_val_rec_list
-
-          if ((len(delete_list) + len(sim_val_rec_list)) <= remove_nearest) \
-             or (delete_list == []):  # Make sure delete is not empty
-            delete_list += sim_val_rec_list
-
-        else:
-          if (return_list == []):  # Make sure at least nearest neighbours are
-                                   # returned and deleted
-            return_list += sim_val_rec_list
-            delete_list += sim_val_rec_list
-
-          break  # Exit loop, enough nearest neighbours found
-
-      del sim_values
+      (return_list, delete_list) = self.__get_nearest_canopy_recs__(sim_dict,
+                                                remove_nearest, cluster_nearest)
       del sim_dict
 
     cos_sim_dict.clear()
@@ -4352,120 +8448,367 @@ class CanopyIndex(Indexing):
           rec_count = qgram_rec_count_dict.get(rec_ident, 0) + 1
           qgram_rec_count_dict[rec_ident] = rec_count
 
-          if (do_threshold == False):
-            qgram_count_dict[rec_count] = qgram_count_dict[rec_count] + 1
+          if (do_threshold == False):
+            qgram_count_dict[rec_count] = qgram_count_dict[rec_count] + 1
+
+        # For nearest neighbor, need to check if we can switch the phase
+        #
+        if (do_threshold == False):
+
+          if ((i+1) > len(qgram_len_list)/2):
+
+            # Switch if there are enough q-grams with large count
+            #
+            if (qgram_count_dict[i+1] > cluster_nearest):  ### PC 23/01: i->i+1
+              phase_switch_threshold = i
+
+      # Don't consider new record identifiers as they won't reach the cluster
+      # threshold or become nearest neighbours
+      #
+      else:
+        for rec_ident in qgram_rec_count_dict:
+
+          if (rec_ident in qgram_rec_dict):
+            rec_ident_count = qgram_rec_count_dict[rec_ident] + 1
+            qgram_rec_count_dict[rec_ident] = rec_ident_count
+
+      i += 1
+
+    return_list = []  # Record identifiers to be returned
+    delete_list = []  # Record identifiers to be deleted
+
+    # Calculate final thresholds and put into corresponding lists - - - - - - -
+    #
+    for (rec_ident, rec_ident_count) in qgram_rec_count_dict.iteritems():
+      rec_index_val_num_qgrams = index_val_num_qgram[rec_ident]
+
+      # Calculate the Jaccard similarity:
+      # - intersection is: rec_ident_count (number of q-grams in common)
+      # - union is: |q-grams in index val| + |q-grams in record index val| -
+      #             |q-grams in common|
+      qgram_union = rec_index_val_num_qgrams + num_qgrams - rec_ident_count
+
+      jacc_sim = float(rec_ident_count) / qgram_union
+
+##        print ' -> ', jacc_sim, index_val_cache[rec_ident], rec_ident
+##        print '    ', rec_ident_count, rec_index_val_num_qgrams, num_qgrams
+
+      if (do_threshold == True):
+
+        if (jacc_sim >= cluster_threshold):
+          return_list.append(rec_ident)
+
+          if (jacc_sim >= remove_threshold):
+           delete_list.append(rec_ident)
+
+      else:  # Nearest, put into a similarity dictionary (sim. values as keys)
+
+        rec_ident_list = jacc_sim_dict.get(jacc_sim, [])
+        rec_ident_list.append(rec_ident)
+        jacc_sim_dict[jacc_sim] = rec_ident_list
+
+    if (do_threshold == False):  # Extract nearest from similariy dictionary -
+
+      (return_list, delete_list) = self.__get_nearest_canopy_recs__(
+                                                jacc_sim_dict, remove_nearest,
+                                                cluster_nearest)
+      del jacc_sim_dict
+
+    # Delete records in the delete list - - - - - - - - - - - - - - - - - - - -
+    #
+    for rec_ident in delete_list:
+
+      del_index_val = index_val_cache[rec_ident]  # Get value of this record
+
+      # Delete the record in the inverted index for all q-grams of its value
+      #
+      del_qgram_list = get_qgram_list_funct(del_index_val)
+
+      for qgram in del_qgram_list:
+        if (qgram in index):
+          if (rec_ident in index[qgram]):
+            del index[qgram][rec_ident]
+
+            if (len(index[qgram]) == 0):
+              del index[qgram]  # Not needed anymore
+
+      # Delete the record identifier in indexing values cache
+      #
+      index_val_cache.pop(rec_ident)
+
+    del delete_list
+
+    return return_list
+
+  # ---------------------------------------------------------------------------
+
+  def __get_num_qgrams__(self, i):
+    """Return the number of q-grams (with records left) in index 'i'.
+    """
+
+    if (self.canopy_engine == 'sparse') and (i in self.qgram_matrix):
+      return self.qgram_matrix[i].num_qgrams
+    else:
+      return len(self.index1[i])
+
+  # ---------------------------------------------------------------------------
+
+  def __get_nearest_canopy_recs__(self, sim_dict, remove_nearest,
+                                  cluster_nearest):
+    """Returns a tuple (return_list, delete_list) with the 'cluster_nearest'
+       records to be put into a canopy and the 'remove_nearest' records to be
+       removed from the pool of records, taken from the given dictionary with
+       similarity values as keys and lists of record identifiers as values.
+       Records with the same similarity are either all taken or not at all.
+    """
+
+    return_list = []
+    delete_list = []
+
+    sim_values = sim_dict.keys()
+    sim_values.sort(reverse=True)  # Largest values first
+
+    for sim_val in sim_values:
+      sim_val_rec_list = sim_dict[sim_val]
+
+      if ((len(return_list) + len(sim_val_rec_list)) <= cluster_nearest):
+        return_list += sim_val_rec_list
+
+        if ((len(delete_list) + len(sim_val_rec_list)) <= remove_nearest) \
+           or (delete_list == []):  # Make sure delete is not empty
+          delete_list += sim_val_rec_list
+
+      else:
+        if (return_list == []):  # Make sure at least nearest neighbours are
+                                 # returned and deleted
+          return_list += sim_val_rec_list
+          delete_list += sim_val_rec_list
+
+        break  # Exit loop, enough nearest neighbours found
+
+    return (return_list, delete_list)
+
+  # ---------------------------------------------------------------------------
+
+  def __sparse_canopy__(self, qgram_matrix, index_val, index_val_cache,
+                        max_qgram_count):
+    """Returns a list of record identifiers according to the canopy method,
+       using the given sparse q-gram matrix (see class CanopyQGramMatrix).
+
+       The similarities are calculated in the same way as in __tfidf_canopy__()
+       and __jaccard_canopy__(), but for each index value (matrix column) only
+       once. Records to be removed from the pool of records are removed from
+       the index values cache and marked as removed in the matrix.
+    """
+
+    get_row =          qgram_matrix.get_row  # Shorthands
+    get_row_cols =     qgram_matrix.get_row_cols
+    col_live =         qgram_matrix.col_live
+    col_rec_list =     qgram_matrix.col_rec_list
+
+    qgram_list = self.__get_qgram_list__(index_val)
+
+    return_list = []  # Record identifiers to be returned
+    delete_list = []  # Record identifers to be deleted
+
+    if (self.canopy_method[0] == 'tfidf'):  # TF-IDF canopy - - - - - - - - - -
+
+      qgram_dict = self.__qgram_list_to_dict__(qgram_list)
+
+      row_idf =      qgram_matrix.row_idf
+      col_sim_list = qgram_matrix.col_sim_list  # Sums of W_qt*W_dt for index
+      col_touched =  qgram_matrix.col_touched   # values
+      touched_cols = []
+
+      W_q = 0.0
+
+      # Sparse matrix - vector product of the matrix with the index value
+      # q-gram vector (only using q-grams that have records left)
+      #
+      for (qgram, qgram_count) in qgram_dict.iteritems():
+        row = get_row(qgram)
+
+        if (row != None):
+          inv_doc_freq = row_idf[row]
+
+          W_qt = inv_doc_freq * qgram_count / max_qgram_count
+          W_q += W_qt*W_qt
+
+          for (col, col_qgram_count) in itertools.izip(get_row_cols(row),
+                                              qgram_matrix.get_row_data(row)):
+            if (col_live[col]):  # Skip index values without records left
+              W_dt = inv_doc_freq * col_qgram_count
+              if (col_touched[col]):
+                col_sim_list[col] += W_qt*W_dt
+              else:
+                col_sim_list[col] = 0.0 + W_qt*W_dt
+                col_touched[col] = 1
+                touched_cols.append(col)
+
+      W_q = math.sqrt(W_q)
+
+      col_sim_dict = {}  # Similarities of all index values with q-grams in
+                         # common with the canopy center
+      for col in touched_cols:
+        col_sim_dict[col] = col_sim_list[col]
+        col_touched[col] =  0  # Reset for next canopy
+
+      if (self.canopy_method[1] == 'threshold'):
+
+        t_tight = self.canopy_method[2]*W_q
+        t_loose = self.canopy_method[3]*W_q
+
+        max_cos_val =     -1
+        max_cos_val_col = None
+
+        for (col, cos_sim) in col_sim_dict.iteritems():
+
+          assert cos_sim / W_q >= -0.000000001, (cos_sim / W_q, index_val)
+          assert cos_sim / W_q <=  1.000000001, (cos_sim / W_q, index_val)
+
+          if (cos_sim >= t_loose):  # Within loose threshold, so keep them
+            return_list.extend(col_rec_list[col])
+
+            if (cos_sim >= t_tight):  # Within tight threshold
+              delete_list.extend(col_rec_list[col])
+
+          if (cos_sim > max_cos_val):
+            max_cos_val =     cos_sim
+            max_cos_val_col = col
+
+        # If return list is empty make sure at least a record with the highest
+        # similarity is returned
+        #
+        if (return_list == []) and (max_cos_val_col != None):
+          return_list.append(min(col_rec_list[max_cos_val_col]))
+
+      else:  # TF-IDF nearest, similarities rounded as in __tfidf_canopy__()
+
+        sim_dict = {}
+
+        for (col, cos_sim) in col_sim_dict.iteritems():
+          round_cos_sim = round(cos_sim,10)
+
+          sim_rec_ident_list = sim_dict.get(round_cos_sim, [])
+          sim_rec_ident_list.extend(col_rec_list[col])
+          sim_dict[round_cos_sim] = sim_rec_ident_list
+
+        (return_list, delete_list) = self.__get_nearest_canopy_recs__(sim_dict,
+                                                self.canopy_method[2],
+                                                self.canopy_method[3])
+
+    else:  # Jaccard canopy, same two phase approach as __jaccard_canopy__()
+
+      qgram_row_dict = qgram_matrix.qgram_row_dict
+      row_num_rec =    qgram_matrix.row_num_rec
+      col_num_rec =    qgram_matrix.col_num_rec
+      col_num_qgram =  qgram_matrix.col_num_qgram
+
+      qgram_set = set()
 
-        # For nearest neighbor, need to check if we can switch the phase
-        #
-        if (do_threshold == False):
+      for qgram in qgram_list:
+        if (get_row(qgram) != None):
+          qgram_set.add(qgram)
 
-          if ((i+1) > len(qgram_len_list)/2):
+      num_qgrams = len(qgram_set)
 
-            # Switch if there are enough q-grams with large count
-            #
-            if (qgram_count_dict[i+1] > cluster_nearest):  ### PC 23/01: i->i+1
-              phase_switch_threshold = i
+      qgram_len_list = []
 
-      # Don't consider new record identifiers as they won't reach the cluster
-      # threshold or become nearest neighbours
-      #
-      else:
-        for rec_ident in qgram_rec_count_dict:
+      for qgram in qgram_set:
+        qgram_len_list.append((row_num_rec[qgram_row_dict[qgram]], qgram))
 
-          if (rec_ident in qgram_rec_dict):
-            rec_ident_count = qgram_rec_count_dict[rec_ident] + 1
-            qgram_rec_count_dict[rec_ident] = rec_ident_count
+      qgram_len_list.sort()  # Sort so fewest q-gram numbers come first in list
 
-      i += 1
+      if (self.canopy_method[1] == 'threshold'):
+        do_threshold = True
 
-    return_list = []  # Record identifiers to be returned
-    delete_list = []  # Record identifiers to be deleted
+        remove_threshold =  self.canopy_method[2]
+        cluster_threshold = self.canopy_method[3]
 
-    # Calculate final thresholds and put into corresponding lists - - - - - - -
-    #
-    for (rec_ident, rec_ident_count) in qgram_rec_count_dict.iteritems():
-      rec_index_val_num_qgrams = index_val_num_qgram[rec_ident]
+        phase_switch_threshold = max(1,
+                                   1+int((1.0-cluster_threshold)*num_qgrams))
 
-      # Calculate the Jaccard similarity:
-      # - intersection is: rec_ident_count (number of q-grams in common)
-      # - union is: |q-grams in index val| + |q-grams in record index val| -
-      #             |q-grams in common|
-      qgram_union = rec_index_val_num_qgrams + num_qgrams - rec_ident_count
+      else:  # Jaccard nearest
+        do_threshold = False
 
-      jacc_sim = float(rec_ident_count) / qgram_union
+        cluster_nearest = self.canopy_method[3]
 
-##        print ' -> ', jacc_sim, index_val_cache[rec_ident], rec_ident
-##        print '    ', rec_ident_count, rec_index_val_num_qgrams, num_qgrams
+        qgram_count_dict = {}  # Number of records having q-grams in common
 
-      if (do_threshold == True):
+        for j in range(1,len(qgram_len_list)+1):
+          qgram_count_dict[j] = 0
 
-        if (jacc_sim >= cluster_threshold):
-          return_list.append(rec_ident)
+        phase_switch_threshold = len(qgram_len_list)
 
-          if (jacc_sim >= remove_threshold):
-           delete_list.append(rec_ident)
+        jacc_sim_dict = {}
 
-      else:  # Nearest, put into a similarity dictionary (sim. values as keys)
+      col_count_dict = {}  # Number of q-grams in common for index values
 
-        rec_ident_list = jacc_sim_dict.get(jacc_sim, [])
-        rec_ident_list.append(rec_ident)
-        jacc_sim_dict[jacc_sim] = rec_ident_list
+      j = 0  # Count number of q-grams processed
 
-    if (do_threshold == False):  # Extract nearest from similariy dictionary -
+      for (qgram_count, qgram) in qgram_len_list:
+        row_cols = get_row_cols(qgram_row_dict[qgram])
 
-      sim_values = jacc_sim_dict.keys()
-      sim_values.sort(reverse=True)  # Largest values first
+        if (j < phase_switch_threshold):  # Consider new index values
 
-      for sim_val in sim_values:
-        sim_val_rec_list = jacc_sim_dict[sim_val]
+          for col in row_cols:
+            if (col_live[col]):
+              col_count = col_count_dict.get(col, 0) + 1
+              col_count_dict[col] = col_count
 
-        if ((len(return_list) + len(sim_val_rec_list)) <= cluster_nearest):
-          return_list += sim_val_rec_list
+              if (do_threshold == False):  # Count records, not index values
+                qgram_count_dict[col_count] += col_num_rec[col]
 
-          if ((len(delete_list) + len(sim_val_rec_list)) <= remove_nearest) \
-             or (delete_list == []):  # Make sure delete is not empty
-            delete_list += sim_val_rec_list
+          if (do_threshold == False):
+            if ((j+1) > len(qgram_len_list)/2):
+              if (qgram_count_dict[j+1] > cluster_nearest):
+                phase_switch_threshold = j
 
-        else:
-          if (return_list == []):  # Make sure at least nearest neighbours are
-                                   # returned and deleted
-            return_list += sim_val_rec_list
-            delete_list += sim_val_rec_list
+        else:  # Only update counts of index values already considered
+          for col in row_cols:
+            if (col in col_count_dict) and (col_live[col]):
+              col_count_dict[col] += 1
 
-          break  # Exit loop, enough nearest neighbours found
+        j += 1
 
-      del jacc_sim_dict
-      del sim_values
+      for (col, col_count) in col_count_dict.iteritems():
 
-    # Delete records in the delete list - - - - - - - - - - - - - - - - - - - -
-    #
-    for rec_ident in delete_list:
+        qgram_union = col_num_qgram[col] + num_qgrams - col_count
 
-      del_index_val = index_val_cache[rec_ident]  # Get value of this record
+        jacc_sim = float(col_count) / qgram_union
 
-      # Delete the record in the inverted index for all q-grams of its value
-      #
-      del_qgram_list = get_qgram_list_funct(del_index_val)
+        if (do_threshold == True):
 
-      for qgram in del_qgram_list:
-        if (qgram in index):
-          if (rec_ident in index[qgram]):
-            del index[qgram][rec_ident]
+          if (jacc_sim >= cluster_threshold):
+            return_list.extend(col_rec_list[col])
 
-            if (len(index[qgram]) == 0):
-              del index[qgram]  # Not needed anymore
+            if (jacc_sim >= remove_threshold):
+              delete_list.extend(col_rec_list[col])
 
-      # Delete the record identifier in indexing values cache
-      #
-      index_val_cache.pop(rec_ident)
+        else:
+          rec_ident_list = jacc_sim_dict.get(jacc_sim, [])
+          rec_ident_list.extend(col_rec_list[col])
+          jacc_sim_dict[jacc_sim] = rec_ident_list
 
-    del delete_list
+      if (do_threshold == False):
+        (return_list, delete_list) = self.__get_nearest_canopy_recs__(
+                                                jacc_sim_dict,
+                                                self.canopy_method[2],
+                                                cluster_nearest)
+
+    assert len(return_list) >= len(delete_list)
+
+    # Remove records in the delete list from the pool of records - - - - - - -
+    #
+    for rec_ident in delete_list:
+      qgram_matrix.remove_record(rec_ident, index_val_cache.pop(rec_ident))
 
     return return_list
 
   # ---------------------------------------------------------------------------
 
-  def run(self, length_filter_perc = None, cut_off_threshold = None):
+  def run(self, length_filter_perc = None, cut_off_threshold = None,
+          num_workers = None):
     """Iterate over all blocks in the index.
 
        Compare the record pairs as produced by the canopy clustering indexing
@@ -4491,7 +8834,8 @@ class CanopyIndex(Indexing):
     # Compare the records
     #
     return self.__compare_rec_pairs_from_dict__(length_filter_perc,
-                                                cut_off_threshold)
+                                                cut_off_threshold,
+                                                num_workers)
 
 # =============================================================================
 
@@ -4577,13 +8921,31 @@ class StringMapIndex(Indexing):
                                             be a positive integer and larger
                                             than or equal to the value of
                                             remove nearest.
+       canopy_engine    The data structure used to find the nearest strings,
+                        either 'grid' (default), in which case strings are
+                        mapped into a 'dim' dimensional space and stored in an
+                        inverted grid index as described above, or 'vptree',
+                        in which case a vantage point tree is built over the
+                        distinct index values. The VP-tree answers threshold
+                        and nearest queries directly on the string distances
+                        (1.0-similarity), and it only calculates distances to
+                        strings that cannot be pruned using the triangle
+                        inequality. This is exact for similarity functions
+                        whose distances form a metric (like edit distance).
+                        The arguments 'dim', 'sub_dim' and 'grid_resolution'
+                        are not used by the 'vptree' engine.
+       dist_cache_size  The maximum number of distance calculations that will
+                        be cached (if 'cache_dist' is True). Once the cache is
+                        full no more distances will be added to it. Default
+                        value is 1,000,000.
   """
 
   # ---------------------------------------------------------------------------
 
   def __init__(self, **kwargs):
-    """Constructor. Process the 'dim', 'sub_dim', 'sim_funct', 'cache_dist' and
-       'grid_resolution' arguments first, then call the base class constructor.
+    """Constructor. Process the 'dim', 'sub_dim', 'sim_funct', 'cache_dist',
+       'grid_resolution', 'canopy_engine' and 'dist_cache_size' arguments
+       first, then call the base class constructor.
     """
 
     self.dim =              None
@@ -4592,6 +8954,8 @@ class StringMapIndex(Indexing):
     self.cache_dist =       True
     self.grid_resolution =  None
     self.canopy_method =    None
+    self.canopy_engine =    'grid'
+    self.dist_cache_size =  1000000
 
     base_kwargs = {}  # Dictionary, will contain unprocessed arguments for base
                       # class constructor
@@ -4625,6 +8989,19 @@ class StringMapIndex(Indexing):
         auxiliary.check_is_tuple('canopy_method', value)
         self.canopy_method = value
 
+      elif (keyword.startswith('canopy_e')):
+        auxiliary.check_is_string('canopy_engine', value)
+        if (value not in ['grid', 'vptree']):
+          logging.exception('Illegal canopy engine given (must be "grid" ' + \
+                            'or "vptree"): %s' % (value))
+          raise Exception
+        self.canopy_engine = value
+
+      elif (keyword.startswith('dist_c')):
+        auxiliary.check_is_integer('dist_cache_size', value)
+        auxiliary.check_is_positive('dist_cache_size', value)
+        self.dist_cache_size = value
+
       else:
         base_kwargs[keyword] = value
 
@@ -4632,6 +9009,14 @@ class StringMapIndex(Indexing):
 
     # Make sure necessary attributes are set - - - - - - - - - - - - - - - - -
     #
+    if (self.canopy_engine == 'vptree'):  # Dimensions and grid are not used
+      if (self.dim == None):
+        self.dim = 1
+      if (self.sub_dim == None):
+        self.sub_dim = 1
+      if (self.grid_resolution == None):
+        self.grid_resolution = 10
+
     auxiliary.check_is_positive('dim', self.dim)
     auxiliary.check_is_positive('sub_dim', self.sub_dim)
     if (self.sub_dim > self.dim):
@@ -4673,99 +9058,433 @@ class StringMapIndex(Indexing):
                                              self.canopy_method[2]))
         raise Exception
 
-    else:  # Is 'nearest'
-      auxiliary.check_is_integer('remove_nearest',   self.canopy_method[1])
-      auxiliary.check_is_positive('remove_nearest',  self.canopy_method[1])
-      auxiliary.check_is_integer('cluster_nearest',  self.canopy_method[2])
-      auxiliary.check_is_positive('cluster_nearest', self.canopy_method[2])
+    else:  # Is 'nearest'
+      auxiliary.check_is_integer('remove_nearest',   self.canopy_method[1])
+      auxiliary.check_is_positive('remove_nearest',  self.canopy_method[1])
+      auxiliary.check_is_integer('cluster_nearest',  self.canopy_method[2])
+      auxiliary.check_is_positive('cluster_nearest', self.canopy_method[2])
+
+      if (self.canopy_method[1] > self.canopy_method[2]):
+        logging.exception('Remove nearest is larger than cluster nearest:' \
+                          + '%d / %d' % (self.canopy_method[1],
+                                         self.canopy_method[2]))
+        raise Exception
+
+    # Create necessary data structures (one per data set) - - - - - - - - - - -
+    #
+    self.string_list = {}  # Dictionary with lists with strings from data sets
+    self.coord =       {}  # String object coordinates, dim x (num. of strings)
+    self.grid_index =  {}
+    self.vp_tree =     {}  # VP-trees and their distance caches ('vptree' only)
+
+    self.dist_calc_stats = {}  # Number of distance calculations per index
+
+    self.m = 5  # Number of iterations in __choose_pivot__() to get two strings
+
+    self.log([('Dimension', self.dim),
+              ('Sub-space dimension', self.sub_dim),
+              ('Cache distance calculations', self.cache_dist),
+              ('Inverted grid resolution', self.grid_resolution),
+              ('Canopy method', self.canopy_method),
+              ('Canopy engine', self.canopy_engine),
+              ('Distance cache size', self.dist_cache_size),
+              ('Similarity function', self.sim_funct)])  # Log a message
+
+  # ---------------------------------------------------------------------------
+
+  def __get_param_fingerprint__(self):
+    """The mapping dimensions, similarity function, grid and
+       canopy method and engine.
+    """
+
+    return {'dim':self.dim, 'sub_dim':self.sub_dim,
+            'sim_funct':self.sim_funct.__name__,
+            'grid_resolution':self.grid_resolution,
+            'canopy_method':self.canopy_method,
+            'canopy_engine':self.canopy_engine}
+
+  # ---------------------------------------------------------------------------
+
+  def __choose_pivot__(self, h, num_string, string_list, coord):
+    """Method to choose two pivot strings on the h-th dimension.
+       Returns the indices of the two pivots in the string list.
+    """
+
+    get_distance_funct = self.__get_distance__  # Shorthand
+
+    # ind_a = random.randrange(num_string)
+    ind_a = 0  # Simply take first
+
+    for i in xrange(self.m):
+
+      max_dist = -1
+      ind_b =    -1  # Index of string at maximum distance from str_a
+
+      for j in xrange(num_string):  # Calculate distance to all other strings
+        dist = get_distance_funct(h, num_string, string_list, ind_a, j, coord)
+
+        if (dist > max_dist):
+          max_dist = dist
+          ind_b =    j
+
+      max_dist = -1
+      ind_a =    -1
+
+      for j in xrange(num_string):  # Calculate distance to all other strings
+        dist = get_distance_funct(h, num_string, string_list, ind_b, j, coord)
+        if (dist > max_dist):
+          max_dist = dist
+          ind_a =    j
+
+    return (ind_a, ind_b)
+
+  # ---------------------------------------------------------------------------
+
+  def __get_distance__(self, h, num_string, string_list, ind1, ind2, coord):
+    """Get distance of the two given strings (after strings have been projected
+       onto the first h-1 axis).
+    """
+
+    self.num_dist_calc += 1
+
+    if ((self.cache_dist == True) and ((h,ind1,ind2) in self.comp_dist_cache)):
+      dist = self.comp_dist_cache[(h,ind1,ind2)]
+
+    else:
+
+      str1 = string_list[ind1]
+      str2 = string_list[ind2]
+
+      dist = 1.0 - self.sim_funct(str1, str2)  # Calculate string distance
+
+      num_str_count = 0
+      for i in xrange(h):
+##        w = coord[i*num_string+ind1] - coord[i*num_string+ind2]
+        w = coord[num_str_count + ind1] - coord[num_str_count + ind2]
+        num_str_count += num_string
+
+        dist = math.sqrt(abs(dist*dist - w*w))
+
+      if ((self.cache_dist == True) and \
+          (len(self.comp_dist_cache) < self.dist_cache_size)):
+        self.comp_dist_cache[(h,ind1,ind2)] = dist  # Save into cache
+
+    return dist
+
+  # ---------------------------------------------------------------------------
+
+  def __get_vp_distance__(self, string_list, dist_cache, dist_stats, ind1,
+                          ind2):
+    """Get distance (1.0-similarity) of the two given strings for the VP-tree
+       engine, using the given bounded distance cache.
+
+       The first two elements of the 'dist_stats' list count the number of
+       distance calculations done and the number of distances taken from the
+       cache.
+    """
+
+    if (ind1 > ind2):  # Distances are symmetric
+      dist_key = (ind2, ind1)
+    else:
+      dist_key = (ind1, ind2)
+
+    dist = dist_cache.get(dist_key, None)
+
+    if (dist != None):
+      dist_stats[1] += 1
+      return dist
+
+    dist_stats[0] += 1
+
+    dist = 1.0 - self.sim_funct(string_list[ind1], string_list[ind2])
+
+    if ((self.cache_dist == True) and \
+        (len(dist_cache) < self.dist_cache_size)):
+      dist_cache[dist_key] = dist  # Save into cache
+
+    return dist
+
+  # ---------------------------------------------------------------------------
+
+  def __build_vp_tree__(self, string_list, dist_cache, dist_stats):
+    """Build a vantage point tree over the given list of strings.
+
+       Each node of the tree holds one string (its vantage point), the median
+       distance (the radius) of all strings in its sub-tree to the vantage
+       point, and two child nodes with the strings within and outside of this
+       radius.
+
+       Returns a list with the node lists (vantage point string index, radius,
+       inside child, outside child, parent and number of not yet removed
+       strings in the sub-tree), the node of each string and a flag for each
+       string that is set to 0 once the string is removed.
+    """
+
+    get_distance_funct = self.__get_vp_distance__  # Shorthand
+
+    num_string = len(string_list)
+
+    vp_str =     []  # String index of the vantage point of each node
+    vp_radius =  []
+    vp_inside =  []  # Child nodes (-1 if there is no child)
+    vp_outside = []
+    vp_parent =  []
+    vp_live =    []
+
+    str_node = [-1]*num_string
+
+    # Stack with lists of string indices to be inserted into a sub-tree, their
+    # parent node and a flag if it is the inside child of the parent
+    #
+    build_stack = [(range(num_string), -1, True)]
+
+    while (build_stack != []):
+
+      (str_ind_list, parent_node, is_inside) = build_stack.pop()
+
+      node = len(vp_str)
+      vp_ind = str_ind_list[0]  # Simply take first
+
+      dist_list = [(get_distance_funct(string_list, dist_cache, dist_stats,
+                                       vp_ind, j), j) for j in str_ind_list[1:]]
+
+      if (dist_list != []):
+        dist_list.sort()
+        radius = dist_list[(len(dist_list)-1)/2][0]  # Median distance
+      else:
+        radius = 0.0
+
+      vp_str.append(vp_ind)
+      vp_radius.append(radius)
+      vp_inside.append(-1)
+      vp_outside.append(-1)
+      vp_parent.append(parent_node)
+      vp_live.append(len(str_ind_list))
+
+      str_node[vp_ind] = node
+
+      if (parent_node >= 0):
+        if (is_inside == True):
+          vp_inside[parent_node] = node
+        else:
+          vp_outside[parent_node] = node
+
+      inside_list =  [j for (dist, j) in dist_list if dist <= radius]
+      outside_list = [j for (dist, j) in dist_list if dist > radius]
+
+      if (outside_list != []):
+        build_stack.append((outside_list, node, False))
+      if (inside_list != []):
+        build_stack.append((inside_list, node, True))
+
+    str_alive = bytearray('\x01'*num_string)
+
+    return [vp_str, vp_radius, vp_inside, vp_outside, vp_parent, vp_live,
+            str_node, str_alive]
+
+  # ---------------------------------------------------------------------------
+
+  def __iter_vp_tree_nearest__(self, string_list, vp_tree, dist_cache,
+                               dist_stats, query_ind):
+    """Generator that returns (distance, string index) pairs of all strings in
+       the given VP-tree that have not been removed, in increasing distance to
+       the query string.
+
+       Nodes are kept in a heap with a lower bound of the distances of the
+       strings in their sub-trees (based on the triangle inequality), so a
+       sub-tree is only searched once all closer strings have been returned.
+    """
+
+    (vp_str, vp_radius, vp_inside, vp_outside, vp_parent, vp_live, str_node,
+     str_alive) = vp_tree
+
+    get_distance_funct = self.__get_vp_distance__  # Shorthand
+
+    node_heap = [(0.0, 1, 0)]  # Entries are (distance or lower bound, 0 for
+                               # a string or 1 for a node, index)
+
+    while (node_heap != []):
+
+      (dist, is_node, ind) = heapq.heappop(node_heap)
+
+      if (is_node == 0):
+        if (str_alive[ind] == 1):
+          yield (dist, ind)
+        continue
+
+      if (vp_live[ind] == 0):  # All strings in this sub-tree have been removed
+        continue
+
+      vp_ind = vp_str[ind]
+
+      if (str_alive[vp_ind] == 1):
+        vp_dist = get_distance_funct(string_list, dist_cache, dist_stats,
+                                     query_ind, vp_ind)
+        heapq.heappush(node_heap, (vp_dist, 0, vp_ind))
+
+      else:  # Only use distance to a removed vantage point if it is cached
+        if (query_ind > vp_ind):
+          vp_dist = dist_cache.get((vp_ind, query_ind), None)
+        else:
+          vp_dist = dist_cache.get((query_ind, vp_ind), None)
+
+      if (vp_dist == None):  # Sub-trees keep the bound of this node
+        inside_bound =  dist
+        outside_bound = dist
+      else:
+        inside_bound =  max(dist, vp_dist - vp_radius[ind])
+        outside_bound = max(dist, vp_radius[ind] - vp_dist)
+
+      child_node = vp_inside[ind]
+      if ((child_node >= 0) and (vp_live[child_node] > 0)):
+        heapq.heappush(node_heap, (inside_bound, 1, child_node))
+
+      child_node = vp_outside[ind]
+      if ((child_node >= 0) and (vp_live[child_node] > 0)):
+        heapq.heappush(node_heap, (outside_bound, 1, child_node))
+
+  # ---------------------------------------------------------------------------
+
+  def __vp_tree_canopies__(self, i, rec_pair_dict):
+    """Extract canopies from the VP-tree of the given index and insert their
+       record pairs into the given record pair dictionary.
+
+       Returns the number of canopies created as well as the sizes and center
+       values of the smallest and largest canopies.
+    """
+
+    (vp_tree, dist_cache, dist_stats) = self.vp_tree[i]
+
+    string_list = self.string_list[i]
+
+    iter_nearest_funct = self.__iter_vp_tree_nearest__  # Shorthands
+    dedup_rec_pairs_funct = self.__dedup_rec_pairs__
+    link_rec_pair_funct =   self.__link_rec_pairs__
+    do_dedup =              self.do_deduplication
+
+    this_index1 = self.index1[i]
+    this_index2 = self.index2[i]
+
+    if (self.canopy_method[0] == 'nearest'):  # Shorthands
+      do_nearest = True
+      remove_nearest =  self.canopy_method[1]
+      cluster_nearest = self.canopy_method[2]
+
+    else:  # Make similarity thresholds distances
+      do_nearest = False
+      tight_threshold = 1.0-self.canopy_method[1]
+      loose_threshold = 1.0-self.canopy_method[2]
+
+    num_canopies = 0  # Count the number of canopies created
+
+    smallest_canopy_size =   999999
+    smallest_canopy_center = ''
+    largest_canopy_size =    -99999
+    largest_canopy_center =  ''
+
+    for center_ind in xrange(len(string_list)):
+
+      (vp_str, vp_radius, vp_inside, vp_outside, vp_parent, vp_live, str_node,
+       str_alive) = vp_tree
+
+      if (str_alive[center_ind] == 0):  # String is already in a canopy
+        continue
 
-      if (self.canopy_method[1] > self.canopy_method[2]):
-        logging.exception('Remove nearest is larger than cluster nearest:' \
-                          + '%d / %d' % (self.canopy_method[1],
-                                         self.canopy_method[2]))
-        raise Exception
+      # Without the tree the center would be compared with all other strings
+      #
+      dist_stats[2] += vp_live[0] - 1
 
-    # Create necessary data structures (one per data set) - - - - - - - - - - -
-    #
-    self.string_list = {}  # Dictionary with lists with strings from data sets
-    self.coord =       {}  # String object coordinates, dim x (num. of strings)
-    self.grid_index =  {}
+      center_str_val = string_list[center_ind]
 
-    self.m = 5  # Number of iterations in __choose_pivot__() to get two strings
+      canopy_recs1 = list(this_index1.get(center_str_val, []))
+      canopy_recs2 = list(this_index2.get(center_str_val, []))
 
-    self.log([('Dimension', self.dim),
-              ('Sub-space dimension', self.sub_dim),
-              ('Cache distance calculations', self.cache_dist),
-              ('Inverted grid resolution', self.grid_resolution),
-              ('Canopy method', self.canopy_method),
-              ('Similarity function', self.sim_funct)])  # Log a message
+      remove_str_list = [center_ind]  # Center string is always removed
 
-  # ---------------------------------------------------------------------------
+      for (dist, str_ind) in iter_nearest_funct(string_list, vp_tree,
+                                                dist_cache, dist_stats,
+                                                center_ind):
+        if (str_ind == center_ind):
+          continue
 
-  def __choose_pivot__(self, h, num_string, string_list, coord):
-    """Method to choose two pivot strings on the h-th dimension.
-       Returns the indices of the two pivots in the string list.
-    """
+        str_val = string_list[str_ind]
 
-    get_distance_funct = self.__get_distance__  # Shorthand
+        this_str_val_recs1 = this_index1.get(str_val, [])
+        this_str_val_recs2 = this_index2.get(str_val, [])
 
-    # ind_a = random.randrange(num_string)
-    ind_a = 0  # Simply take first
+        if (do_nearest == True):
 
-    for i in xrange(self.m):
+          comb_list_len = len(canopy_recs1) + len(canopy_recs2) + \
+                          len(this_str_val_recs1) + len(this_str_val_recs2)
 
-      max_dist = -1
-      ind_b =    -1  # Index of string at maximum distance from str_a
+          if (comb_list_len > cluster_nearest):
+            break
 
-      for j in xrange(num_string):  # Calculate distance to all other strings
-        dist = get_distance_funct(h, num_string, string_list, ind_a, j, coord)
+          canopy_recs1 += this_str_val_recs1
+          canopy_recs2 += this_str_val_recs2
 
-        if (dist > max_dist):
-          max_dist = dist
-          ind_b =    j
+          if (comb_list_len <= remove_nearest):
+            remove_str_list.append(str_ind)
 
-      max_dist = -1
-      ind_a =    -1
+        else:  # Thresholds - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-      for j in xrange(num_string):  # Calculate distance to all other strings
-        dist = get_distance_funct(h, num_string, string_list, ind_b, j, coord)
-        if (dist > max_dist):
-          max_dist = dist
-          ind_a =    j
+          if (dist > loose_threshold):
+            break  # Leave loop as threshold is reached
 
-    return (ind_a, ind_b)
+          canopy_recs1 += this_str_val_recs1
+          canopy_recs2 += this_str_val_recs2
 
-  # ---------------------------------------------------------------------------
+          if (dist <= tight_threshold):
+            remove_str_list.append(str_ind)
 
-  def __get_distance__(self, h, num_string, string_list, ind1, ind2, coord):
-    """Get distance of the two given strings (after strings have been projected
-       onto the first h-1 axis).
-    """
+      # Remove strings from the VP-tree - - - - - - - - - - - - - - - - - - - -
+      #
+      for str_ind in remove_str_list:
+        str_alive[str_ind] = 0
 
-    self.num_dist_calc += 1
+        node = str_node[str_ind]
+        while (node >= 0):
+          vp_live[node] -= 1
+          node = vp_parent[node]
 
-    if ((self.cache_dist == True) and ((h,ind1,ind2) in self.comp_dist_cache)):
-      dist = self.comp_dist_cache[(h,ind1,ind2)]
+      num_canopy_rec = len(canopy_recs1+canopy_recs2)
+      num_canopies += 1
 
-    else:
+      if (num_canopy_rec < smallest_canopy_size):
+        smallest_canopy_size =   num_canopy_rec
+        smallest_canopy_center = center_str_val
+      elif (num_canopy_rec > largest_canopy_size):
+        largest_canopy_size =   num_canopy_rec
+        largest_canopy_center = center_str_val
 
-      str1 = string_list[ind1]
-      str2 = string_list[ind2]
+      # Build record pairs from record identifiers in this canopy - - - - - - -
+      #
+      if (do_dedup == True):
+        if (len(canopy_recs1) > 1):  # For deduplication at least two records
+          dedup_rec_pairs_funct(canopy_recs1, rec_pair_dict)
 
-      dist = 1.0 - self.sim_funct(str1, str2)  # Calculate string distance
+      else:  # A linkage
+        if ((len(canopy_recs1) > 0) and (len(canopy_recs2) > 0)):
+          link_rec_pair_funct(canopy_recs1, canopy_recs2, rec_pair_dict)
 
-      num_str_count = 0
-      for i in xrange(h):
-##        w = coord[i*num_string+ind1] - coord[i*num_string+ind2]
-        w = coord[num_str_count + ind1] - coord[num_str_count + ind2]
-        num_str_count += num_string
+    num_dist_saved = dist_stats[2] - dist_stats[0]
 
-        dist = math.sqrt(abs(dist*dist - w*w))
+    self.dist_calc_stats[i] = {'num_dist_calc':dist_stats[0],
+                               'num_cache_hits':dist_stats[1],
+                               'num_brute_force':dist_stats[2],
+                               'num_saved':num_dist_saved}
 
-      if (self.cache_dist == True):
-        self.comp_dist_cache[(h,ind1,ind2)] = dist  # Save into cache
+    logging.info('    Number of distance calculations done (VP-tree build ' + \
+                 'and canopies): %d (plus %d taken from cache)' % \
+                 (dist_stats[0], dist_stats[1]))
+    if (dist_stats[2] > 0):
+      logging.info('    Distance calculations saved compared to brute ' + \
+                   'force canopy clustering: %d of %d (%.2f %%)' % \
+                   (num_dist_saved, dist_stats[2],
+                    100.0*num_dist_saved/dist_stats[2]))
 
-    return dist
+    return (num_canopies, smallest_canopy_size, smallest_canopy_center,
+            largest_canopy_size, largest_canopy_center)
 
   # ---------------------------------------------------------------------------
 
@@ -4823,6 +9542,28 @@ class StringMapIndex(Indexing):
 
       num_string = len(string_list)  # Number of strings in this index
 
+      if (self.canopy_engine == 'vptree'):  # Build a VP-tree instead - - - - -
+
+        dist_cache = {}     # Cache of calculated distances
+        dist_stats = [0,0,0]  # Number of distance calculations, cache hits
+                              # and distance calculations without the tree
+
+        logging.info('  Build VP-tree for index %d containing %d string ' % \
+                     (i, num_string) + 'values')
+
+        if (num_string > 0):
+          vp_tree = self.__build_vp_tree__(string_list, dist_cache, dist_stats)
+        else:
+          vp_tree = None
+
+        self.vp_tree[i] = [vp_tree, dist_cache, dist_stats]
+
+        logging.info('  Built VP-tree index %d in %s' % \
+                     (i, auxiliary.time_string(time.time()-istart_time)))
+        logging.info('    Number of distance calculations done: %d' % \
+                     (dist_stats[0]))
+        continue
+
       coord = self.coord[i]  # Shorthand
 
       self.comp_dist_cache = {}  # Cache of calculated distances
@@ -4999,11 +9740,21 @@ class StringMapIndex(Indexing):
 
       # Total number of strings in this index
       #
-      total_num_str = len(str_val_list)
+      total_num_str = len(self.string_list[i])
 
       logging.info('  Compacting index %d containing %d strings' % \
                    (i, total_num_str))
 
+      # With the VP-tree engine canopies are extracted from the tree (the
+      # string coordinates dictionary is empty in this case)
+      #
+      if (self.canopy_engine == 'vptree'):
+        (num_canopies, smallest_canopy_size, smallest_canopy_center,
+         largest_canopy_size, largest_canopy_center) = \
+          self.__vp_tree_canopies__(i, rec_pair_dict)
+
+        del self.vp_tree[i]  # Not needed anymore
+
       # Loop over all string values, extract canopies and delete strings from
       # string dicionary
       #
@@ -5347,7 +10098,8 @@ class StringMapIndex(Indexing):
 
   # ---------------------------------------------------------------------------
 
-  def run(self, length_filter_perc = None, cut_off_threshold = None):
+  def run(self, length_filter_perc = None, cut_off_threshold = None,
+          num_workers = None):
     """Iterate over all blocks in the index.
 
        Compare the record pairs as produced by the string map canopy clustering
@@ -5373,7 +10125,207 @@ class StringMapIndex(Indexing):
     # Compare the records
     #
     return self.__compare_rec_pairs_from_dict__(length_filter_perc,
-                                                cut_off_threshold)
+                                                cut_off_threshold,
+                                                num_workers)
+
+# =============================================================================
+
+class SuffixArray:
+  """Class that implements a generalised suffix array with a longest common
+     prefix (LCP) array over a list of string values.
+
+     All values are concatenated into one text buffer, each followed by a
+     separator character. The suffix array contains the integer offsets (into
+     this buffer) of all suffixes in sorted order, and the LCP array contains
+     for each suffix the length of the longest common prefix with the suffix
+     before it in the suffix array.
+
+     Each separator is ranked smaller than all other characters and different
+     from all other separators. The suffixes are therefore sorted in the same
+     way as the suffix strings (each up to the end of its value) would be
+     sorted, and common prefixes never extend over the end of a value.
+
+     The suffix array is built with the prefix doubling method, where in each
+     round the suffixes are sorted according to integer ranks of their first 2^k
+     characters. As separators are unique the number of rounds only depends
+     upon the length of the longest value. The LCP array is calculated with the
+     linear time algorithm described in:
+
+     - Linear-time longest-common-prefix computation in suffix arrays and its
+       applications
+       Toru Kasai, Gunho Lee, Hiroki Arimura, Setsuo Arikawa and Kunsoo Park,
+       12th Annual Symposium on Combinatorial Pattern Matching (CPM), 2001.
+  """
+
+  # ---------------------------------------------------------------------------
+
+  def __init__(self, value_list):
+    """Constructor. Build the suffix and LCP arrays for the given list of
+       string values (which should not contain any chr(0) characters).
+    """
+
+    num_values = len(value_list)
+
+    self.num_values = num_values
+
+    # Build the text buffer and the initial ranks of all positions - - - - - -
+    #
+    self.text = ''.join(['%s%s' % (val, chr(0)) for val in value_list])
+
+    text_len = len(self.text)
+
+    rank =      [0]*text_len
+    pos_value = [0]*text_len  # The value number for each position
+
+    self.value_start = array.array('l')
+    self.value_end =   array.array('l')  # Positions of the separators
+
+    offset = 0
+    for val_num in xrange(num_values):
+      val = value_list[val_num]
+      val_len = len(val)
+
+      self.value_start.append(offset)
+      self.value_end.append(offset+val_len)
+
+      rank[offset:offset+val_len] = [num_values+ord(c) for c in val]
+      rank[offset+val_len] = val_num  # Unique rank of separator
+
+      pos_value[offset:offset+val_len+1] = [val_num]*(val_len+1)
+
+      offset += val_len+1
+
+    self.pos_value = array.array('l', pos_value)
+    del pos_value
+
+    # Sort the suffixes using prefix doubling - - - - - - - - - - - - - - - - -
+    #
+    suffix_array = range(text_len)
+
+    k = 1
+    max_rank = num_values+256
+
+    while (text_len > 0):
+
+      rank_mult = max_rank+2
+
+      sort_key = [rank[j]*rank_mult + rank[j+k]+1 for j in xrange(text_len-k)]
+      sort_key += [rank[j]*rank_mult for j in xrange(max(0,text_len-k),
+                                                      text_len)]
+
+      suffix_array.sort(key = sort_key.__getitem__)
+
+      new_rank = 0
+      prev_key = sort_key[suffix_array[0]]
+
+      for j in suffix_array:
+        this_key = sort_key[j]
+        if (this_key != prev_key):
+          new_rank += 1
+          prev_key = this_key
+        rank[j] = new_rank
+
+      del sort_key
+
+      if (new_rank == text_len-1):  # All suffixes have different ranks
+        break
+
+      max_rank = new_rank
+      k *= 2
+
+    self.sa = array.array('l', suffix_array)
+    del suffix_array
+
+    # Calculate the LCP array (rank now is the inverse suffix array) - - - - -
+    #
+    text =      self.text  # Shorthands
+    sa =        self.sa
+    value_end = self.value_end
+    pos_value = self.pos_value
+
+    lcp = array.array('l', [0])*text_len
+
+    h = 0
+    for j in xrange(text_len):
+      r = rank[j]
+
+      if (r > 0):
+        prev_j = sa[r-1]
+
+        max_h = min(value_end[pos_value[j]]-j,
+                    value_end[pos_value[prev_j]]-prev_j)
+
+        while ((h < max_h) and (text[j+h] == text[prev_j+h])):
+          h += 1
+        lcp[r] = h
+
+        if (h > 0):
+          h -= 1
+      else:
+        h = 0
+
+    self.lcp = lcp
+
+  # ---------------------------------------------------------------------------
+
+  def get_value(self, val_num):
+    """Return the value with the given number.
+    """
+
+    return self.text[self.value_start[val_num]:self.value_end[val_num]]
+
+  # ---------------------------------------------------------------------------
+
+  def get_suffix(self, pos):
+    """Return the suffix string starting at the given position (up to the end
+       of its value).
+    """
+
+    return self.text[pos:self.value_end[self.pos_value[pos]]]
+
+  # ---------------------------------------------------------------------------
+
+  def iter_suffix_groups(self, min_len):
+    """Generator that scans the LCP array and returns one tuple (position,
+       value number list) for each group of equal suffixes, in sorted order.
+
+       The position is the start of one of the suffixes in the group. Only
+       suffixes with at least 'min_len' characters are included in the value
+       number list, as are the whole values (which can be shorter). Groups
+       with an empty value number list are not returned.
+    """
+
+    sa =          self.sa  # Shorthands
+    lcp =         self.lcp
+    pos_value =   self.pos_value
+    value_start = self.value_start
+    value_end =   self.value_end
+
+    group_pos =      -1
+    group_val_list = []
+    prev_len =       -1
+
+    for r in xrange(len(sa)):
+      pos = sa[r]
+      val_num = pos_value[pos]
+      suffix_len = value_end[val_num]-pos
+
+      # Suffix is different from previous one unless the common prefix covers
+      # both of them completely
+      #
+      if ((lcp[r] != suffix_len) or (suffix_len != prev_len) or (r == 0)):
+        if (group_val_list != []):
+          yield (group_pos, group_val_list)
+        group_pos =      pos
+        group_val_list = []
+
+      prev_len = suffix_len
+
+      if ((suffix_len >= min_len) or (pos == value_start[val_num])):
+        group_val_list.append(val_num)
+
+    if (group_val_list != []):
+      yield (group_pos, group_val_list)
 
 # =============================================================================
 
@@ -5480,11 +10432,21 @@ class SuffixArrayIndex(Indexing):
 
   # ---------------------------------------------------------------------------
 
+  def __get_param_fingerprint__(self):
+    """The block method, padding and suffix method.
+    """
+
+    return {'block_method':self.block_method, 'padded':self.padded,
+            'suffix_method':self.suffix_method}
+
+  # ---------------------------------------------------------------------------
+
   def build(self):
     """Method to build an index data structure.
 
-       Read the data set(s) from file(s) and insert into suffix arrays (one per
-       index defintion), then remove unneeded suffix array entries.
+       Read the data set(s) from file(s) and build one suffix array (with the
+       integer offsets of all suffixes of the distinct index values) per index
+       definition.
     """
 
     logging.info('')
@@ -5492,249 +10454,140 @@ class SuffixArrayIndex(Indexing):
 
     start_time = time.time()
 
-    num_indices = len(self.index_def)
-
-    # Index data structure for blocks is one dictionary per index - - - - - - -
-    # (a suffix array, with suffix strings as keys and record
-    # identifiers as lists)
-    #
-    for i in range(num_indices):
-      self.index1[i] = {}  # Index for data set 1
-      self.index2[i] = {}  # Index for data set 2
-
-    get_index_values_funct = self.__get_index_values__  # Shorthands
-    skip_missing =           self.skip_missing
-    start_char =             self.START_CHAR
-    end_char =               self.END_CHAR
-    padded =                 self.padded
-    min_suffix_len =         self.block_method[0]
-    max_block_size =         self.block_method[1]
-
-    # Set a flag for the way suffix array values are generated
-    #
-    if (self.suffix_method == 'allsubstr'):
-      do_all_suffix_str = True
-    else:
-      do_all_suffix_str = False
-
-    max_suff_str_len = [0]*num_indices  # Record longest suffix strings
-
-    # A list of data structures needed for the build process:
-    # - the index data structure (dictionary)
-    # - the record cache
-    # - the data set to be read
-    # - the comparison fields which are used
-    # - a list index (0 for data set 1, 1 for data set 2)
-    #
-    build_list = [(self.index1, self.rec_cache1, self.dataset1,
-                   self.comp_field_used1, 0)] # For data set 1
-
-    if (self.do_deduplication == False):  # If linkage append data set 2
-      build_list.append((self.index2, self.rec_cache2, self.dataset2,
-                   self.comp_field_used2, 1))
-
-    # Reading loop over all records in one or both data set(s) - - - - - - - -
-    #
-    for (index,rec_cache,dataset,comp_field_used_list,ds_index) in build_list:
-
-      # Calculate a counter for the progress report
-      #
-      if (self.progress_report != None):
-        progress_report_cnt = max(1, int(dataset.num_records / \
-                                     (100.0 / self.progress_report)))
-      else:  # So no progress report is being logged
-        progress_report_cnt = dataset.num_records + 1
-
-      istart_time = time.time()
-
-      rec_read = 0  # Number of records read from data set
-
-      for (rec_ident, rec) in dataset.readall(): # Read all records in data set
-
-        # Extract record fields needed for comparisons (set all others to '')
-        #
-        comp_rec = []
-
-        field_ind = 0
-        for field in rec:
-          if (field_ind in comp_field_used_list):
-            comp_rec.append(field.lower())
-          else:
-            comp_rec.append('')
-          field_ind += 1
-
-        rec_cache[rec_ident] = comp_rec  # Put into record cache
-
-        # Now get the index variable values for this record - - - - - - - - - -
-        #
-        rec_index_val_list = get_index_values_funct(rec, ds_index)
-
-        for i in range(num_indices):  # Put record identifier into all indices
-
-          this_index = index[i]  # Shorthand
-
-          index_val = rec_index_val_list[i]
-
-          if ((index_val != '') or (skip_missing == False)):
-
-            if (padded == True):  # Add start and end characters
-              index_val = '%s%s%s' % (start_char, index_val, end_char)
-
-            index_val_len = len(index_val)
+    self.__build_suffix_arrays__()
 
-            max_suff_str_len[i] = max(max_suff_str_len[i], index_val_len)
-
-            # Create all suffix strings (up to minimum length) and insert them
-            # into the index
-
-            # A set of all suffix string values for this index value
-            #
-            this_suffix_str_set = set()
-            this_suffix_str_set.add(index_val)  # Even if shorter than min_len
-
-            if (do_all_suffix_str == True):  # Create all sub-string
-
-              # According to Akiko Aizawa (e-mail 8/03/2007) not only suffix
-              # strings are generated in their approach, but all sub-strings
-              # down to length min_suffix_len
-
-              # Outer loop over all sub-string length
-              #
-              #for s1 in range(index_val_len-1, min_suffix_len-1, -1):
-              for s1 in range(min_suffix_len, index_val_len+1):
-                # Inner loop over all possible sub-strings with this length
-                #
-                for s2 in range(index_val_len-s1+1):
-                  this_suffix_str = index_val[s2:s2+s1]
-                  this_suffix_str_set.add(this_suffix_str)
-            else:  # Only create the true suffixes of the index value string
-
-              for s in range(index_val_len-min_suffix_len+1):
-                this_suffix_str = index_val[s:]
-                this_suffix_str_set.add(this_suffix_str)
-
-            # Now insert all suffix strings into index
-            #
-            for this_suffix_str in this_suffix_str_set:
-
-              suffix_str_rec_list = this_index.get(this_suffix_str, [])
-
-              if (suffix_str_rec_list != -1):  # Not too many records yet
-
-                # Check if max_block records had this string value before
-                #
-                if (len(suffix_str_rec_list) < max_block_size):
-                  suffix_str_rec_list.append(rec_ident)
-                  this_index[this_suffix_str] = suffix_str_rec_list
-                else:  # Too many records have this value
-                  this_index[this_suffix_str] = -1 # Mark as being too frequent
-
-            del this_suffix_str_set
+    logging.info('Built suffix array index in %s' % \
+                 (auxiliary.time_string(time.time()-start_time)))
 
-        rec_read += 1
+    memory_usage_str = auxiliary.get_memory_usage()
+    if (memory_usage_str != None):
+      logging.info('  '+memory_usage_str)
 
-        if ((rec_read % progress_report_cnt) == 0):
-          self.__log_build_progress__(rec_read,dataset.num_records,start_time)
+    self.status = 'built'  # Update index status
 
-      used_sec_str = auxiliary.time_string(time.time()-istart_time)
-      rec_time_str = auxiliary.time_string((time.time()-istart_time) / \
-                                           dataset.num_records)
-      logging.info('Read and indexed %d records in %s (%s per record)' % \
-                   (dataset.num_records, used_sec_str, rec_time_str))
-      logging.info('')
+  # ---------------------------------------------------------------------------
 
-    # Now remove unneeded entries in suffix array strings - - - - - - - - - - -
-    #
-    self.suffix_array_strings1 = []
-    self.suffix_array_strings2 = []
+  def __iter_substring_blocks__(self, suffix_array, rec_count1, rec_count2):
+    """Generator that returns the value number sets of all blocks for the
+       'allsubstr' suffix method.
+
+       A block contains all values that share a sub-string with at least
+       'min_suffix_len' characters. All sub-strings that appear in the same
+       values correspond to one interval in the suffix array (where the LCP
+       values are at least the length of the sub-string), and intervals of
+       longer sub-strings are nested within the intervals of their prefixes.
+       The LCP intervals are processed bottom-up with a stack, and only the
+       top-most intervals which contain at most 'max_block_size' records (from
+       each data set) are returned, as the record pairs of all nested blocks
+       are included in them. Values shorter than 'min_suffix_len' are not
+       returned.
+    """
 
-    logging.info('Removing unneeded suffix array strings:')
+    min_suffix_len = self.block_method[0]  # Shorthands
+    max_block_size = self.block_method[1]
 
-    for i in range(num_indices):
+    sa =        suffix_array.sa
+    lcp =       suffix_array.lcp
+    pos_value = suffix_array.pos_value
+    value_end = suffix_array.value_end
 
-      # For a deduplication, all suffix array string values that have only one
-      # record can be removed, as are all entries containing more than
-      # 'max_block_size' records)
-      #
-      this_index = self.index1[i]
+    text_len = len(sa)
 
-      num_original = len(this_index)
-      num_removed_1 =      0
-      num_removed_large =  0
+    # Empty suffixes (separators) come first in the suffix array
+    #
+    first_r = suffix_array.num_values
 
-      this_suff_array_strings = this_index.keys()
+    if (first_r >= text_len):
+      return
 
-      for s in this_suff_array_strings:
+    # Each stack entry is a list [LCP value of interval, set of value numbers
+    # (None if there are too many records), number of records from data set 1,
+    # number of records from data set 2, list of blocks in the interval not
+    # yet returned]
+    #
+    stack = [[0, set(), 0, 0, []]]
 
-        if (this_index[s] == -1):  # This entry was too frequent
-          del this_index[s]
-          num_removed_large += 1
-        else:
-          this_block_len = len(this_index[s])
+    for r in xrange(first_r+1, text_len+1):
 
-          # Check if length is 1 for a deduplication only
-          #
-          if (self.do_deduplication == True) and (this_block_len == 1):
-            del this_index[s]
-            num_removed_1 += 1
+      if (r < text_len):
+        this_lcp = lcp[r]
+      else:
+        this_lcp = 0
 
-      if (self.do_deduplication == True):
-        logging.info('  Removed %d (of %d) strings from suffix array 1 as ' % \
-                     (num_removed_1,num_original) + 'they only had one record')
-      logging.info('  Removed %d (of %d) strings from suffix array 1 as ' % \
-                   (num_removed_large, num_original) + 'they had more ' + \
-                   'than %d (maximum block size) records' % (max_block_size))
-
-      this_suff_array_strings = this_index.keys()
-      self.suffix_array_strings1.append(this_suff_array_strings)
-      logging.info('  Suffix array in index %d for data set 1 contains %d ' \
-                   % (i, len(this_suff_array_strings)) + 'strings')
-
-      # Linkage (only remove entries with too many records) - - - - - - - - - -
+      # Insert suffix r-1 into the deepest interval it belongs to - - - - - - -
       #
-      if (self.do_deduplication == False):
-        this_index = self.index2[i]
-
-        num_original = len(this_index)
-        num_removed_large = 0
+      if (this_lcp > stack[-1][0]):
+        stack.append([this_lcp, set(), 0, 0, []])
+      interval = stack[-1]
 
-        this_suff_array_strings = this_index.keys()
+      pos = sa[r-1]
+      val_num = pos_value[pos]
 
-        for s in this_suff_array_strings:
+      if ((rec_count1[val_num] > max_block_size) or \
+          (rec_count2[val_num] > max_block_size)):
+        interval[1] = None
 
-          if (this_index[s] == -1):  # This entry was too frequent
-            del this_index[s]
-            num_removed_large += 1
+      else:
 
-        logging.info('  Removed %d (of %d) strings from suffix array 2 as ' % \
-                     (num_removed_large, num_original) + 'they had more ' + \
-                     'than %d (maximum block size) records' % (max_block_size))
+        # Sub-strings longer than the interval LCP only appear in this value
+        #
+        suffix_len = value_end[val_num]-pos
+        if ((suffix_len > interval[0]) and (suffix_len >= min_suffix_len)):
+          interval[4].append(set([val_num]))
+
+        interval_val_set = interval[1]
+        if ((interval_val_set != None) and \
+            (val_num not in interval_val_set)):
+          interval_val_set.add(val_num)
+          interval[2] += rec_count1[val_num]
+          interval[3] += rec_count2[val_num]
+          if ((interval[2] > max_block_size) or \
+              (interval[3] > max_block_size)):
+            interval[1] = None
+
+      # Close all intervals which end at suffix r-1 - - - - - - - - - - - - - -
+      #
+      while (this_lcp < stack[-1][0]):
+        (interval_lcp, interval_val_set, rec_cnt1, rec_cnt2, block_list) = \
+          stack.pop()
 
-        this_suff_array_strings = this_index.keys()
-        self.suffix_array_strings2.append(this_suff_array_strings)
-        logging.info('  Suffix array in index %d for data set 2 contains %d ' \
-                     % (i, len(this_suff_array_strings)) + 'strings')
+        if ((interval_val_set != None) and (interval_lcp >= min_suffix_len)):
+          block_list = [interval_val_set]  # Contains all nested blocks
+        else:
+          for block_val_set in block_list:
+            yield block_val_set
+          block_list = []
 
-      logging.info('    Longest string in this suffix array is %d characters' \
-                   % (max_suff_str_len[i]) + ' long')
+        if (this_lcp > stack[-1][0]):
+          stack.append([this_lcp, set(), 0, 0, []])
+        parent = stack[-1]
 
-    logging.info('Built suffix array index in %s' % \
-                 (auxiliary.time_string(time.time()-start_time)))
+        parent[4] += block_list
 
-    memory_usage_str = auxiliary.get_memory_usage()
-    if (memory_usage_str != None):
-      logging.info('  '+memory_usage_str)
+        parent_val_set = parent[1]
+        if (parent_val_set != None):
+          if (interval_val_set == None):
+            parent[1] = None
+          else:
+            for val_num in interval_val_set.difference(parent_val_set):
+              parent[2] += rec_count1[val_num]
+              parent[3] += rec_count2[val_num]
+            parent_val_set.update(interval_val_set)
+            if ((parent[2] > max_block_size) or (parent[3] > max_block_size)):
+              parent[1] = None
 
-    self.status = 'built'  # Update index status
+    for block_val_set in stack[0][4]:  # Root interval has an LCP of 0
+      yield block_val_set
 
   # ---------------------------------------------------------------------------
 
   def compact(self):
     """Method to compact an index data structure.
 
-       Go through all entries in the sorted suffix array, and build blocks of
-       records according to the parameter 'max_block_size'. Put all resulting
-       record pairs into a dictionary.
+       Scan the LCP array of each suffix array to get the blocks of records
+       that share a suffix (or a sub-string), and remove all blocks with more
+       than 'max_block_size' records. Put all resulting record pairs into a
+       dictionary.
 
        Finally calculate the total number of record pairs.
     """
@@ -5753,6 +10606,8 @@ class SuffixArrayIndex(Indexing):
 
     dedup_rec_pair_funct = self.__dedup_rec_pairs__  # Shorthands
     link_rec_pair_funct =  self.__link_rec_pairs__
+    min_suffix_len =       self.block_method[0]
+    max_block_size =       self.block_method[1]
 
     num_indices = len(self.index_def)
 
@@ -5764,96 +10619,81 @@ class SuffixArrayIndex(Indexing):
 
       istart_time = time.time()
 
-      num_strings_done = 0
-      largest_block =    0
-
-      if (self.do_deduplication == True):  # A deduplication - - - - - - - - -
-
-        this_str_list = self.suffix_array_strings1[i]  # Shorthands
-        this_index =    self.index1[i]
-
-        this_str_list_len = len(this_str_list)
-
-        # Calculate a counter for the progress report
-        #
-        if (self.progress_report != None):
-          progress_report_cnt = max(1, int(this_str_list_len / \
-                                       (100.0 / self.progress_report)))
-        else:  # So no progress report is being logged
-          progress_report_cnt = this_str_list_len + 1
-
-        for s in this_str_list:
-
-          curr_str_val_records = this_index[s]  # Get records for this string
-          curr_block_size =      len(curr_str_val_records)
-          largest_block =        max(largest_block, curr_block_size)
-
-          dedup_rec_pair_funct(curr_str_val_records, rec_pair_dict)
-
-          num_strings_done += 1
-
-          if ((num_strings_done % progress_report_cnt) == 0):
-            perc_done = int(round(100.0*num_strings_done / this_str_list_len))
-            logging.info('    Processed %d of %d (%d%%) strings' % \
-                         (num_strings_done, this_str_list_len, perc_done))
-            memory_usage_str = auxiliary.get_memory_usage()
-            if (memory_usage_str != None):
-              logging.info('      '+memory_usage_str)
+      num_blocks =        0
+      num_removed_large = 0
+      largest_block =     0
 
-          del curr_str_val_records
+      suffix_array = self.suffix_array[i]  # Shorthands
+      value_list =   self.suffix_array_values[i]
+      this_index1 =  self.index1[i]
+      this_index2 =  self.index2[i]
 
-      else:  # A linkage - - - - - - - - - - - - - - - - - - - - - - - - - - -
+      # Record identifier lists and their lengths for all value numbers
+      #
+      rec_list1 = [this_index1.get(val, []) for val in value_list]
+      rec_list2 = [this_index2.get(val, []) for val in value_list]
 
-        this_str_list1 = self.suffix_array_strings1[i]  # Shorthands
-        this_str_list2 = self.suffix_array_strings2[i]
-        this_index1 =    self.index1[i]
-        this_index2 =    self.index2[i]
+      rec_count1 = [len(val_rec_list) for val_rec_list in rec_list1]
+      rec_count2 = [len(val_rec_list) for val_rec_list in rec_list2]
 
-        this_str_list_len = len(this_str_list1)
+      if (self.suffix_method == 'allsubstr'):
 
-        # Calculate a counter for the progress report
+        # Values shorter than the minimum length only form blocks on their own
         #
-        if (self.progress_report != None):
-          progress_report_cnt = max(1, int(this_str_list_len / \
-                                       (100.0 / self.progress_report)))
-        else:  # So no progress report is being logged
-          progress_report_cnt = this_str_list_len + 1
+        short_val_list = [[val_num] for val_num in xrange(len(value_list)) \
+                          if (suffix_array.value_end[val_num] - \
+                              suffix_array.value_start[val_num] < \
+                              min_suffix_len)]
 
-        for s in this_str_list1:
+        block_iter = itertools.chain(short_val_list,
+                                     self.__iter_substring_blocks__( \
+                                       suffix_array, rec_count1, rec_count2))
 
-          curr_str_val_records1 = this_index1[s] # Suffix array from data set 1
-          curr_block_size1 =      len(curr_str_val_records1)
+      else:  # Only true suffixes, each group of equal suffixes is a block
+        block_iter = itertools.imap(lambda group: group[1],
+                                    suffix_array.iter_suffix_groups( \
+                                      min_suffix_len))
 
-          if s in this_str_list2:  # String is in both suffix arrays
+      for block_val_nums in block_iter:
 
-            curr_str_val_records2 = this_index2[s]  # From data set 2
-            curr_block_size2 =      len(curr_str_val_records2)
-            largest_block =         max(largest_block, \
-                                        curr_block_size1 + curr_block_size2)
+        block_recs1 = []
+        block_recs2 = []
 
-            link_rec_pair_funct(curr_str_val_records1, curr_str_val_records2,
-                                rec_pair_dict)
+        for val_num in block_val_nums:
+          block_recs1 += rec_list1[val_num]
+          block_recs2 += rec_list2[val_num]
 
-            del curr_str_val_records2
+        if ((len(block_recs1) > max_block_size) or \
+            (len(block_recs2) > max_block_size)):
+          num_removed_large += 1
+          continue
 
-          num_strings_done += 1
+        if (self.do_deduplication == True):  # A deduplication - - - - - - - -
 
-          if ((num_strings_done % progress_report_cnt) == 0):
-            perc_done = int(round(100.0*num_strings_done / this_str_list_len))
-            logging.info('    Processed %d of %d (%d%%) strings' % \
-                         (num_strings_done, this_str_list_len, perc_done))
-            memory_usage_str = auxiliary.get_memory_usage()
-            if (memory_usage_str != None):
-              logging.info('      '+memory_usage_str)
+          if (len(block_recs1) > 1):
+            largest_block = max(largest_block, len(block_recs1))
+            dedup_rec_pair_funct(block_recs1, rec_pair_dict)
+            num_blocks += 1
+
+        else:  # A linkage - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-          del curr_str_val_records1
+          if ((len(block_recs1) > 0) and (len(block_recs2) > 0)):
+            largest_block = max(largest_block,
+                                len(block_recs1) + len(block_recs2))
+            link_rec_pair_funct(block_recs1, block_recs2, rec_pair_dict)
+            num_blocks += 1
 
       logging.info('  Compacted suffix array index %d in %s' % \
                    (i, auxiliary.time_string(time.time()-istart_time)))
+      logging.info('    Processed %d blocks, removed %d blocks as they had ' % \
+                   (num_blocks, num_removed_large) + 'more than %d ' % \
+                   (max_block_size) + '(maximum block size) records')
       logging.info('    Largest block contained %d records' % (largest_block))
 
       self.index1[i].clear()  # Not needed anymore
       self.index2[i].clear()
+      del self.suffix_array[i]
+      del self.suffix_array_values[i]
 
       logging.info('    Explicitly run garbage collection')
       gc.collect()
@@ -5877,7 +10717,8 @@ class SuffixArrayIndex(Indexing):
 
   # ---------------------------------------------------------------------------
 
-  def run(self, length_filter_perc = None, cut_off_threshold = None):
+  def run(self, length_filter_perc = None, cut_off_threshold = None,
+          num_workers = None):
     """Iterate over all blocks in the index.
 
        Compare the record pairs as produced by the suffix array indexing
@@ -5903,7 +10744,8 @@ class SuffixArrayIndex(Indexing):
     # Compare the records
     #
     return self.__compare_rec_pairs_from_dict__(length_filter_perc,
-                                                cut_off_threshold)
+                                                cut_off_threshold,
+                                                num_workers)
 
 
 # =============================================================================
@@ -6007,10 +10849,23 @@ class RobustSuffixArrayIndex(Indexing):
 
   # ---------------------------------------------------------------------------
 
+  def __get_param_fingerprint__(self):
+    """The block method, padding and the string comparison
+       function and threshold used to merge blocks.
+    """
+
+    return {'block_method':self.block_method, 'padded':self.padded,
+            'str_cmp_funct':self.str_cmp_funct.__name__,
+            'str_cmp_thres':self.str_cmp_thres}
+
+  # ---------------------------------------------------------------------------
+
   def build(self):
     """Method to build an index data structure.
 
-       This is the same as the build method for the SuffixArrayIndex.
+       Read the data set(s) from file(s) and build one suffix array (with the
+       integer offsets of all suffixes of the distinct index values) per index
+       definition.
     """
 
     logging.info('')
@@ -6018,226 +10873,81 @@ class RobustSuffixArrayIndex(Indexing):
 
     start_time = time.time()
 
-    num_indices = len(self.index_def)
-
-    # Index data structure for blocks is one dictionary per index - - - - - - -
-    # (a suffix array, with suffix strings as keys and record
-    # identifiers as lists)
-    #
-    for i in range(num_indices):
-      self.index1[i] = {}  # Index for data set 1
-      self.index2[i] = {}  # Index for data set 2
-
-    get_index_values_funct = self.__get_index_values__  # Shorthands
-    skip_missing =           self.skip_missing
-    start_char =             self.START_CHAR
-    end_char =               self.END_CHAR
-    padded =                 self.padded
-    min_suffix_len =         self.block_method[0]
-    max_block_size =         self.block_method[1]
-
-    max_suff_str_len = [0]*num_indices  # Record longest suffix strings
-
-    # A list of data structures needed for the build process:
-    # - the index data structure (dictionary)
-    # - the record cache
-    # - the data set to be read
-    # - the comparison fields which are used
-    # - a list index (0 for data set 1, 1 for data set 2)
-    #
-    build_list = [(self.index1, self.rec_cache1, self.dataset1,
-                   self.comp_field_used1, 0)] # For data set 1
-
-    if (self.do_deduplication == False):  # If linkage append data set 2
-      build_list.append((self.index2, self.rec_cache2, self.dataset2,
-                   self.comp_field_used2, 1))
-
-    # Reading loop over all records in one or both data set(s) - - - - - - - -
-    #
-    for (index,rec_cache,dataset,comp_field_used_list,ds_index) in build_list:
-
-      # Calculate a counter for the progress report
-      #
-      if (self.progress_report != None):
-        progress_report_cnt = max(1, int(dataset.num_records / \
-                                     (100.0 / self.progress_report)))
-      else:  # So no progress report is being logged
-        progress_report_cnt = dataset.num_records + 1
-
-      istart_time = time.time()
-
-      rec_read = 0  # Number of records read from data set
-
-      for (rec_ident, rec) in dataset.readall(): # Read all records in data set
-
-        # Extract record fields needed for comparisons (set all others to '')
-        #
-        comp_rec = []
-
-        field_ind = 0
-        for field in rec:
-          if (field_ind in comp_field_used_list):
-            comp_rec.append(field.lower())
-          else:
-            comp_rec.append('')
-          field_ind += 1
-
-        rec_cache[rec_ident] = comp_rec  # Put into record cache
-
-        # Now get the index variable values for this record - - - - - - - - - -
-        #
-        rec_index_val_list = get_index_values_funct(rec, ds_index)
-
-        for i in range(num_indices):  # Put record identifier into all indices
-
-          this_index = index[i]  # Shorthand
-
-          index_val = rec_index_val_list[i]
-
-          if ((index_val != '') or (skip_missing == False)):
-
-            if (padded == True):  # Add start and end characters
-              index_val = '%s%s%s' % (start_char, index_val, end_char)
-
-            index_val_len = len(index_val)
-
-            max_suff_str_len[i] = max(max_suff_str_len[i], index_val_len)
-
-            # Create all suffix strings (up to minimum length) and insert them
-            # into the index
+    self.__build_suffix_arrays__()
 
-            # A set of all suffix string values for this index value
-            #
-            this_suffix_str_set = set()
-            this_suffix_str_set.add(index_val)  # Even if shorter than min_len
-
-            # Create the true suffixes of the index value string
-            #
-            for s in range(index_val_len-min_suffix_len+1):
-              this_suffix_str = index_val[s:]
-              this_suffix_str_set.add(this_suffix_str)
-
-            # Now insert all suffix strings into index
-            #
-            for this_suffix_str in this_suffix_str_set:
-
-              suffix_str_rec_list = this_index.get(this_suffix_str, [])
-
-              if (suffix_str_rec_list != -1):  # Not too many records yet
-
-                # Check if max_block records had this string value before
-                #
-                if (len(suffix_str_rec_list) < max_block_size):
-                  suffix_str_rec_list.append(rec_ident)
-                  this_index[this_suffix_str] = suffix_str_rec_list
-                else:  # Too many records have this value
-                  this_index[this_suffix_str] = -1 # Mark as being too frequent
-
-            del this_suffix_str_set
+    logging.info('Built robust suffix array index in %s' % \
+                 (auxiliary.time_string(time.time()-start_time)))
 
-        rec_read += 1
+    memory_usage_str = auxiliary.get_memory_usage()
+    if (memory_usage_str != None):
+      logging.info('  '+memory_usage_str)
 
-        if ((rec_read % progress_report_cnt) == 0):
-          self.__log_build_progress__(rec_read,dataset.num_records,start_time)
+    self.status = 'built'  # Update index status
 
-      used_sec_str = auxiliary.time_string(time.time()-istart_time)
-      rec_time_str = auxiliary.time_string((time.time()-istart_time) / \
-                                           dataset.num_records)
-      logging.info('Read and indexed %d records in %s (%s per record)' % \
-                   (dataset.num_records, used_sec_str, rec_time_str))
-      logging.info('')
+  # ---------------------------------------------------------------------------
 
-    # Now remove unneeded entries in suffix array strings - - - - - - - - - - -
-    #
-    self.suffix_array_strings1 = []
-    self.suffix_array_strings2 = []
+  def __get_suffix_blocks__(self, i):
+    """Scan the LCP array of the suffix array for the given index and return
+       a list of all distinct suffix strings (in sorted order) together with
+       two dictionaries with these suffix strings as keys and the lists of
+       record identifiers from data set 1 and 2 as values.
 
-    logging.info('Removing unneeded suffix array strings:')
+       Suffixes which occur in more than 'max_block_size' records of a data
+       set are removed for this data set, and for a deduplication suffixes
+       with only one record are removed as well.
+    """
 
-    for i in range(num_indices):
+    min_suffix_len = self.block_method[0]  # Shorthands
+    max_block_size = self.block_method[1]
 
-      # For a deduplication, all suffix array string values that have only one
-      # record can be removed, as are all entries containing more than
-      # 'max_block_size' records)
-      #
-      this_index = self.index1[i]
+    suffix_array = self.suffix_array[i]
+    value_list =   self.suffix_array_values[i]
+    this_index1 =  self.index1[i]
+    this_index2 =  self.index2[i]
 
-      num_original = len(this_index)
-      num_removed_1 =      0
-      num_removed_large =  0
+    suffix_str_list =  []
+    suffix_rec_dict1 = {}
+    suffix_rec_dict2 = {}
 
-      this_suff_array_strings = this_index.keys()
+    for (pos, val_num_list) in suffix_array.iter_suffix_groups(min_suffix_len):
 
-      for s in this_suff_array_strings:
+      rec_list1 = []
+      rec_list2 = []
 
-        if (this_index[s] == -1):  # This entry was too frequent
-          del this_index[s]
-          num_removed_large += 1
-        else:
-          this_block_len = len(this_index[s])
+      for val_num in val_num_list:
+        val = value_list[val_num]
+        rec_list1 += this_index1.get(val, [])
+        rec_list2 += this_index2.get(val, [])
 
-          # Check if length is 1 for a deduplication only
-          #
-          if (self.do_deduplication == True) and (this_block_len == 1):
-            del this_index[s]
-            num_removed_1 += 1
+      if (len(rec_list1) > max_block_size):  # Too many records for suffix
+        rec_list1 = []
+      if (len(rec_list2) > max_block_size):
+        rec_list2 = []
 
       if (self.do_deduplication == True):
-        logging.info('  Removed %d (of %d) strings from suffix array 1 as ' % \
-                     (num_removed_1,num_original) + 'they only had one record')
-      logging.info('  Removed %d (of %d) strings from suffix array 1 as ' % \
-                   (num_removed_large, num_original) + 'they had more ' + \
-                   'than %d (maximum block size) records' % (max_block_size))
-
-      this_suff_array_strings = this_index.keys()
-      self.suffix_array_strings1.append(this_suff_array_strings)
-      logging.info('  Suffix array in index %d for data set 1 contains %d ' \
-                   % (i, len(this_suff_array_strings)) + 'strings')
-
-      # Linkage (only remove entries with too many records) - - - - - - - - - -
-      #
-      if (self.do_deduplication == False):
-        this_index = self.index2[i]
+        if (len(rec_list1) < 2):  # Not enough records to form a pair
+          continue
+      elif ((rec_list1 == []) and (rec_list2 == [])):
+        continue
 
-        num_original = len(this_index)
-        num_removed_large = 0
+      suffix_str = suffix_array.get_suffix(pos)
 
-        this_suff_array_strings = this_index.keys()
+      suffix_str_list.append(suffix_str)
+      if (rec_list1 != []):
+        suffix_rec_dict1[suffix_str] = rec_list1
+      if (rec_list2 != []):
+        suffix_rec_dict2[suffix_str] = rec_list2
 
-        for s in this_suff_array_strings:
-
-          if (this_index[s] == -1):  # This entry was too frequent
-            del this_index[s]
-            num_removed_large += 1
-
-        logging.info('  Removed %d (of %d) strings from suffix array 2 as ' % \
-                     (num_removed_large, num_original) + 'they had more ' + \
-                     'than %d (maximum block size) records' % (max_block_size))
-
-        this_suff_array_strings = this_index.keys()
-        self.suffix_array_strings2.append(this_suff_array_strings)
-        logging.info('  Suffix array in index %d for data set 2 contains %d ' \
-                     % (i, len(this_suff_array_strings)) + 'strings')
-
-      logging.info('    Longest string in this suffix array is %d characters' \
-                   % (max_suff_str_len[i]) + ' long')
-
-    logging.info('Built suffix array index in %s' % \
-                 (auxiliary.time_string(time.time()-start_time)))
-
-    memory_usage_str = auxiliary.get_memory_usage()
-    if (memory_usage_str != None):
-      logging.info('  '+memory_usage_str)
-
-    self.status = 'built'  # Update index status
+    return suffix_str_list, suffix_rec_dict1, suffix_rec_dict2
 
   # ---------------------------------------------------------------------------
 
   def compact(self):
     """Method to compact an index data structure.
 
-       Sort suffix array, then do approximate string comparisons and merge
-       lists if suffixarray values are similar.
+       Scan the suffix array to get the sorted distinct suffix strings, then
+       do approximate string comparisons and merge lists if suffix array
+       values are similar.
 
        Also remove resulting blocks that are larger than 'max_block_size'.
 
@@ -6281,11 +10991,12 @@ class RobustSuffixArrayIndex(Indexing):
 
       if (self.do_deduplication == True):  # A deduplication - - - - - - - - -
 
-        this_str_list = self.suffix_array_strings1[i]  # Shorthands
-        this_index =    self.index1[i]
+        # Suffix strings are already sorted alphabetically
+        #
+        (this_str_list, this_index, unused_index) = \
+                                                 self.__get_suffix_blocks__(i)
 
         this_str_list_len = len(this_str_list)
-        this_str_list.sort()  # Sort all suffixes alphabetically
 
         # Create a new index and a new string list where similar strings (and
         # their record lists) are merged
@@ -6356,17 +11067,12 @@ class RobustSuffixArrayIndex(Indexing):
 
       else:  # A linkage - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
-        this_str_list1 = self.suffix_array_strings1[i]  # Shorthands
-        this_str_list2 = self.suffix_array_strings2[i]
-        this_index1 =    self.index1[i]
-        this_index2 =    self.index2[i]
-
-        # Create a combined sorted string list
+        # A combined sorted string list of suffixes from both data sets
         #
-        comb_str_list = list(set(this_str_list1).union(set(this_str_list2)))
+        (comb_str_list, this_index1, this_index2) = \
+                                                 self.__get_suffix_blocks__(i)
 
         comb_str_list_len = len(comb_str_list)
-        comb_str_list.sort()
 
         # Create a new index and a new string list where similar strings (and
         # their record lists) are merged
@@ -6462,6 +11168,8 @@ class RobustSuffixArrayIndex(Indexing):
 
       self.index1[i].clear()  # Not needed anymore
       self.index2[i].clear()
+      del self.suffix_array[i]
+      del self.suffix_array_values[i]
 
       logging.info('    Explicitly run garbage collection')
       gc.collect()
@@ -6485,7 +11193,8 @@ class RobustSuffixArrayIndex(Indexing):
 
   # ---------------------------------------------------------------------------
 
-  def run(self, length_filter_perc = None, cut_off_threshold = None):
+  def run(self, length_filter_perc = None, cut_off_threshold = None,
+          num_workers = None):
     """Iterate over all blocks in the index.
 
        Compare the record pairs as produced by the suffix array indexing
@@ -6511,7 +11220,8 @@ class RobustSuffixArrayIndex(Indexing):
     # Compare the records
     #
     return self.__compare_rec_pairs_from_dict__(length_filter_perc,
-                                                cut_off_threshold)
+                                                cut_off_threshold,
+                                                num_workers)
 
 
 # =============================================================================
@@ -6535,6 +11245,12 @@ class BigMatchIndex(Indexing):
                        ('qgram',q,padded,threshold)
                      with parameters similar to the corresponding indexing
                      methods.
+
+     The block policy (if a maximum block size is set) is applied to the
+     records from the small data set each record from the large data set is
+     compared with. The block size histogram logged by compact() is of the
+     blocks of the small data set (with the number of record pairs per record
+     from the large data set).
   """
 
   # ---------------------------------------------------------------------------
@@ -6633,6 +11349,14 @@ class BigMatchIndex(Indexing):
 
   # ---------------------------------------------------------------------------
 
+  def __get_param_fingerprint__(self):
+    """The block method.
+    """
+
+    return {'block_method':self.block_method}
+
+  # ---------------------------------------------------------------------------
+
   def build(self):
     """Method to build an index data structure.
 
@@ -6671,6 +11395,12 @@ class BigMatchIndex(Indexing):
     this_index =             self.index1
     small_comp_field =       self.small_comp_field
 
+    if (self.block_policy == 'subblock'):
+      sub_block_vals = self.sub_block_vals1  # Used for the small data set
+      sub_block_val_funct_list = self.sub_block_val_funct_list
+    else:
+      sub_block_vals = None
+
     # Reading loop over all records in the small data set - - - - - - - - - - -
     #
     for (rec_ident, rec) in self.small_dataset.readall():
@@ -6694,6 +11424,11 @@ class BigMatchIndex(Indexing):
       #
       rec_index_val_list = get_index_values_funct(rec, small_data_set_no)
 
+      if (sub_block_vals != None):
+        sub_block_vals[rec_ident] = tuple(get_index_values_funct(rec,
+                                          small_data_set_no,
+                                          sub_block_val_funct_list))
+
       for i in range(num_indices):  # Put record identifier into all indices
 
         index_val = rec_index_val_list[i]
@@ -6792,12 +11527,12 @@ class BigMatchIndex(Indexing):
           for qgram_sublist in qgram_sublists:
 
             qgram_substr = ''.join(qgram_sublist)
-            qgram_rec_ident_list = qgram_index.get(qgram_substr, [])
+            qgram_rec_ident_set = qgram_index.get(qgram_substr)
 
-            for rec_ident in basic_rec_ident_list:
-              if (rec_ident not in qgram_rec_ident_list):
-                qgram_rec_ident_list.append(rec_ident)
-            qgram_index[qgram_substr] = qgram_rec_ident_list
+            if (qgram_rec_ident_set == None):
+              qgram_index[qgram_substr] = set(basic_rec_ident_list)
+            else:
+              qgram_rec_ident_set.update(basic_rec_ident_list)
 
         num_qgram_blocks += len(qgram_index)
 
@@ -6831,16 +11566,31 @@ class BigMatchIndex(Indexing):
 
   # ---------------------------------------------------------------------------
 
+  def __get_state_attr_names__(self):
+    """The sorted index values (for the 'sort' block method) and the sub-block
+       values of the small data set are also saved.
+    """
+
+    return Indexing.__get_state_attr_names__(self) + \
+           ['sorted_index_val_list', 'sub_block_vals1']
+
+  # ---------------------------------------------------------------------------
+
   def compact(self):
     """Method to compact an index data structure.
 
-       Nothing has to be done here.
+       Nothing has to be done here, except logging the block size histograms
+       of the small data set.
     """
 
     logging.info('')
     logging.info('Compact BigMatch index: "%s"' % (self.description))
     logging.info('  Nothing needs to be done.')
 
+    for i in range(len(self.index_def)):
+      self.__log_block_size_hist__(i, [(len(block_recs), len(block_recs)) \
+                                   for block_recs in self.index1[i].values()])
+
     self.status = 'compacted'  # Update index status
 
   # ---------------------------------------------------------------------------
@@ -6872,19 +11622,7 @@ class BigMatchIndex(Indexing):
     # Check if weight vector file should be written - - - - - - - - - - - - - -
     #
     if (self.weight_vec_file != None):
-      try:
-        weight_vec_fp = open(self.weight_vec_file, 'w')
-      except:
-        logging.exception('Cannot write weight vector file: %s' % \
-                          (self.weight_vec_file))
-        raise Exception
-      weight_vec_writer = csv.writer(weight_vec_fp)
-
-      # Write header line with descriptions of field comparisons
-      #
-      weight_vec_header_line = ['rec_id1', 'rec_id2'] + \
-                                self.__get_field_names_list__()
-      weight_vec_writer.writerow(weight_vec_header_line)
+      [weight_vec_fp, weight_vec_writer] = self.__open_weight_vec_file__()
 
     start_time = time.time()
 
@@ -6947,6 +11685,13 @@ class BigMatchIndex(Indexing):
     find_closest_funct =     self.__find_closest__
     small_rec_cache =        self.small_rec_cache
     small_data_set_no =      self.small_data_set_no
+    guard_rec_block_funct =  self.__guard_rec_block__
+    sub_block_vals =         self.sub_block_vals1
+    sub_block_val_funct_list = self.sub_block_val_funct_list
+
+    self.__reset_block_guard__()
+
+    rec_sub_block_vals = ()  # Only calculated for the 'subblock' block policy
 
     # Calculate a counter for the progress report
     #
@@ -6956,7 +11701,8 @@ class BigMatchIndex(Indexing):
     else:  # So no progress report is being logged
       progress_report_cnt = self.large_dataset.num_records + 1
 
-    weight_vec_dict = {}  # Dictionary with calculated weight vectors
+    weight_vec_dict = self.__new_weight_vec_dict__()  # Calculated weight
+                                                      # vectors
 
     rec_read =  0  # Number of records read from the large data set
     comp_done = 0  # Number of comparisons done
@@ -6988,6 +11734,11 @@ class BigMatchIndex(Indexing):
       #
       rec_index_val_list = get_index_values_funct(large_rec, large_data_set_no)
 
+      if (self.block_policy == 'subblock'):
+        rec_sub_block_vals = get_index_values_funct(large_rec,
+                                                    large_data_set_no,
+                                                    sub_block_val_funct_list)
+
       for i in range(num_indices):  # Put record identifier into all indices
 
         index_val = rec_index_val_list[i]
@@ -7013,14 +11764,11 @@ class BigMatchIndex(Indexing):
 
             win_index_val_list = sorted_index_val_list[i][win_start:win_end]
 
-            small_rec_ident_list = []
+            small_rec_ident_list = set()
 
             for sort_index_val in win_index_val_list:
-
-              for small_rec_ident in this_index[i].get(sort_index_val, []):
-
-                if (small_rec_ident not in small_rec_ident_list):
-                  small_rec_ident_list.append(small_rec_ident)
+              small_rec_ident_list.update(this_index[i].get(sort_index_val,
+                                                            []))
 
           elif (block_method == 'qgram'):  # Make q-gram sub-lists - - - - - -
 
@@ -7041,7 +11789,7 @@ class BigMatchIndex(Indexing):
 
             qgram_sublists = qgram_sublist_funct(qgram_list, min_num_qgrams)
 
-            small_rec_ident_list = []
+            small_rec_ident_list = set()
 
             # Convert q-gram sub-lists into strings and get record identifiers
             # from small data set
@@ -7049,16 +11797,19 @@ class BigMatchIndex(Indexing):
             for qgram_sublist in qgram_sublists:
 
               qgram_substr = ''.join(qgram_sublist)
-              for small_rec_ident in this_index[i].get(qgram_substr, []):
-
-                if (small_rec_ident not in small_rec_ident_list):
-                  small_rec_ident_list.append(small_rec_ident)
+              small_rec_ident_list.update(this_index[i].get(qgram_substr, []))
 
           else:
             logging.exception('Illegal blocking method given: %s' %
                               (str(self.block_method)))
             raise Exception
 
+          # Apply the block policy to the records from the small data set
+          #
+          small_rec_ident_list = guard_rec_block_funct(small_rec_ident_list,
+                                                       rec_sub_block_vals,
+                                                       sub_block_vals)
+
           # Now loop over all record identifiers from small data set - - - - -
           # with this index value
           #
@@ -7132,6 +11883,8 @@ class BigMatchIndex(Indexing):
 
     self.num_rec_pairs = comp_done
 
+    self.__log_block_guard_stats__()
+
     used_sec_str = auxiliary.time_string(time.time()-start_time)
     rec_read_time_str = auxiliary.time_string((time.time()-start_time) / \
                                               self.large_dataset.num_records)
@@ -7162,6 +11915,16 @@ class BigMatchIndex(Indexing):
       weight_vec_fp.close()
       return None
 
+  # ---------------------------------------------------------------------------
+
+  def iter_run(self, length_filter_perc = None, cut_off_threshold = None):
+    """A generator version of the run() method. As this index compares record
+       pairs while it reads the larger data set, the weight vector dictionary
+       returned by run() is iterated over (so memory usage is not reduced).
+    """
+
+    return self.__iter_run_from_dict__(length_filter_perc, cut_off_threshold)
+
 # =============================================================================
 
 class DedupIndex(Indexing):
@@ -7183,6 +11946,11 @@ class DedupIndex(Indexing):
                        ('qgram', q, padded, threshold)
                      with parameters similar to the corresponding indexing
                      methods.
+
+     The block policy (if a maximum block size is set) is applied to the
+     earlier read records each record is compared with. As the blocks are only
+     built while the records are compared, the block size histogram is logged
+     at the end of the run() method.
   """
 
   # ---------------------------------------------------------------------------
@@ -7256,6 +12024,14 @@ class DedupIndex(Indexing):
 
   # ---------------------------------------------------------------------------
 
+  def __get_param_fingerprint__(self):
+    """The block method.
+    """
+
+    return {'block_method':self.block_method}
+
+  # ---------------------------------------------------------------------------
+
   def build(self):
     """Method to build an index data structure.
 
@@ -7310,19 +12086,7 @@ class DedupIndex(Indexing):
     # Check if weight vector file should be written - - - - - - - - - - - - - -
     #
     if (self.weight_vec_file != None):
-      try:
-        weight_vec_fp = open(self.weight_vec_file, 'w')
-      except:
-        logging.exception('Cannot write weight vector file: %s' % \
-                          (self.weight_vec_file))
-        raise Exception
-      weight_vec_writer = csv.writer(weight_vec_fp)
-
-      # Write header line with descriptions of field comparisons
-      #
-      weight_vec_header_line = ['rec_id1', 'rec_id2'] + \
-                                self.__get_field_names_list__()
-      weight_vec_writer.writerow(weight_vec_header_line)
+      [weight_vec_fp, weight_vec_writer] = self.__open_weight_vec_file__()
 
     start_time = time.time()
 
@@ -7385,6 +12149,13 @@ class DedupIndex(Indexing):
     rec_cache =              self.rec_cache1
     rec_length_cache =       self.rec_length_cache
     comp_field_used_list =   self.comp_field_used1
+    guard_rec_block_funct =  self.__guard_rec_block__
+    sub_block_vals =         self.sub_block_vals1
+    sub_block_val_funct_list = self.sub_block_val_funct_list
+
+    self.__reset_block_guard__()
+
+    rec_sub_block_vals = ()  # Only calculated for the 'subblock' block policy
 
     # Calculate a counter for the progress report
     #
@@ -7394,7 +12165,8 @@ class DedupIndex(Indexing):
     else:  # So no progress report is being logged
       progress_report_cnt = self.dataset1.num_records + 1
 
-    weight_vec_dict = {}  # Dictionary with calculated weight vectors
+    weight_vec_dict = self.__new_weight_vec_dict__()  # Calculated weight
+                                                      # vectors
 
     rec_read =  0  # Number of records read from the data set
     comp_done = 0  # Number of comparisons done
@@ -7432,9 +12204,14 @@ class DedupIndex(Indexing):
       #
       rec_index_val_list = get_index_values_funct(rec1, 0)
 
-      # List of record identifiers for this record over all indices
+      if (self.block_policy == 'subblock'):
+        rec_sub_block_vals = tuple(get_index_values_funct(rec1, 0,
+                                                   sub_block_val_funct_list))
+        sub_block_vals[rec_ident1] = rec_sub_block_vals
+
+      # Set of record identifiers for this record over all indices
       #
-      this_rec_block_rec_list = []
+      this_rec_block_rec_list = set()
 
       for i in range(num_indices):  # Put record identifier into all indices
 
@@ -7449,9 +12226,8 @@ class DedupIndex(Indexing):
 
             block_rec_ident_list = index[i].get(index_val, [])
 
-            for rec_ident2 in block_rec_ident_list:
-              if (rec_ident2 not in this_rec_block_rec_list):
-                this_rec_block_rec_list.append(rec_ident2)
+            this_rec_block_rec_list.update(guard_rec_block_funct(
+                   block_rec_ident_list, rec_sub_block_vals, sub_block_vals))
 
             block_rec_ident_list.append(rec_ident1)  # Append this record
 
@@ -7475,11 +12251,13 @@ class DedupIndex(Indexing):
 
             # Get all record identifiers from index for the values in window
             #
+            win_rec_ident_set = set()
+
             for sort_index_val in win_index_val_list:
+              win_rec_ident_set.update(index[i][sort_index_val])
 
-              for rec_ident2 in index[i][sort_index_val]:
-                if (rec_ident2 not in this_rec_block_rec_list):
-                  this_rec_block_rec_list.append(rec_ident2)
+            this_rec_block_rec_list.update(guard_rec_block_funct(
+                      win_rec_ident_set, rec_sub_block_vals, sub_block_vals))
 
             # Get block for this record from index and put it into index
             #
@@ -7522,13 +12300,13 @@ class DedupIndex(Indexing):
 
               qgram_substr = ''.join(qgram_sublist)  # Make it a string
 
-              for rec_ident2 in index[i].get(qgram_substr, []):
-                if (rec_ident2 not in this_rec_block_rec_list):
-                  this_rec_block_rec_list.append(rec_ident2)
+              qgram_rec_ident_list = index[i].get(qgram_substr, [])
+
+              this_rec_block_rec_list.update(guard_rec_block_funct(
+                   qgram_rec_ident_list, rec_sub_block_vals, sub_block_vals))
 
               # Add this record to block for this q-gram and put it into index
               #
-              qgram_rec_ident_list = index[i].get(qgram_substr, [])
               qgram_rec_ident_list.append(rec_ident1)
 
               # Put it back into the inverted index (dictionary)
@@ -7594,6 +12372,15 @@ class DedupIndex(Indexing):
 
     self.num_rec_pairs = comp_done
 
+    for i in range(num_indices):
+      self.__log_block_size_hist__(i, [(len(block_recs),
+                                   len(block_recs)*(len(block_recs)-1)/2) \
+                                   for block_recs in index[i].itervalues()])
+
+    self.__log_block_guard_stats__()
+
+    sub_block_vals.clear()
+
     rec_cache.clear()
     rec_length_cache.clear()
 
@@ -7626,4 +12413,14 @@ class DedupIndex(Indexing):
       weight_vec_fp.close()
       return None
 
+  # ---------------------------------------------------------------------------
+
+  def iter_run(self, length_filter_perc = None, cut_off_threshold = None):
+    """A generator version of the run() method. As this index compares record
+       pairs while it reads the data set, the weight vector dictionary returned
+       by run() is iterated over (so memory usage is not reduced).
+    """
+
+    return self.__iter_run_from_dict__(length_filter_perc, cut_off_threshold)
+
 # =============================================================================
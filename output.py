@@ -64,6 +64,13 @@
     LoadWeightVectorFile  Load a CSV file assumed to contain record identifier
                           tuples and their corresponding weight vectors as
                           written with a run() method from indexing.py
+                          (or a binary weight vector file, see below).
+
+    SaveWeightVectorBinaryFile  Save weight vectors into a binary file made of
+                                a header, fixed-width rows of record numbers
+                                and weights, and a record identifier table.
+    LoadWeightVectorBinaryFile  Load such a binary file into a weight vector
+                                store, with the weights being memory mapped.
 """
 
 # =============================================================================
@@ -72,11 +79,17 @@
 import auxiliary
 import dataset
 
+import array
 import csv
 import gzip
+import heapq
 import logging
 import math
+import mmap
 import os
+import struct
+import sys
+import tempfile
 
 # =============================================================================
 
@@ -260,12 +273,33 @@ def SaveMatchStatusFile(w_vec_dict, match_set, file_name):
      - Summed matching weight from the corresponding weight vector
      - A unique match identifier (generated in the same way as the ones in the
        function SaveMatchDataSet below).
+
+     Instead of a weight vector dictionary an iterator can be given that
+     yields tuples (record identifier 1, record identifier 2, weight vector),
+     such as the one returned by the iter_run() method of an index. In this
+     case only the summed weights of the record pairs in the match set are
+     kept in memory.
   """
 
-  auxiliary.check_is_dictionary('w_vec_dict', w_vec_dict)
   auxiliary.check_is_set('match_set', match_set)
   auxiliary.check_is_string('file_name', file_name)
 
+  if (hasattr(w_vec_dict, 'iteritems')):  # A weight vector dictionary
+    match_w_sum_dict = None
+
+  elif (hasattr(w_vec_dict, '__iter__')):  # Get summed weights of matches
+    match_w_sum_dict = {}
+
+    for (rec_id1, rec_id2, w_vec) in w_vec_dict:
+      rec_id_tuple = (rec_id1, rec_id2)
+      if (rec_id_tuple in match_set):
+        match_w_sum_dict[rec_id_tuple] = sum(w_vec)
+
+  else:
+    logging.exception('Weight vectors are neither a dictionary nor an ' + \
+                      'iterator: %s' % (type(w_vec_dict)))
+    raise Exception
+
   match_rec_id_list = list(match_set)  # Make a list so it can be sorted
   match_rec_id_list.sort()
 
@@ -284,8 +318,10 @@ def SaveMatchStatusFile(w_vec_dict, match_set, file_name):
     raise IOError
 
   for rec_id_tuple in match_rec_id_list:
-    w_vec = w_vec_dict[rec_id_tuple]
-    w_sum = sum(w_vec)
+    if (match_w_sum_dict == None):
+      w_sum = sum(w_vec_dict[rec_id_tuple])
+    else:
+      w_sum = match_w_sum_dict[rec_id_tuple]
 
     mid_count_str = '%s' % (mid_count)
     this_mid = 'mid%s' % (mid_count_str.zfill(num_digit))
@@ -500,7 +536,7 @@ def SaveMatchDataSet(match_set, dataset1, id_field1, new_dataset_name1,
 
 # =============================================================================
 
-def LoadWeightVectorFile(file_name):
+def LoadWeightVectorFile(file_name, weight_vec_store = False):
   """Function to load a weight vector dictionary from a file, assumed to be of
      type CSV (comma separated values), with the first line being a header line
      containing the field comparison names.
@@ -515,11 +551,24 @@ def LoadWeightVectorFile(file_name):
      The function first checks if a gzipped version of the file is available
      (with file ending '.gz' or '.GZ').
 
+     If the file is a binary weight vector file (as written by the function
+     SaveWeightVectorBinaryFile) it is loaded using LoadWeightVectorBinaryFile,
+     and a weight vector store is returned.
+
+     If the argument 'weight_vec_store' is set to True the weight vectors are
+     loaded into a compact weight vector store (see auxiliary.WeightVectorStore)
+     instead of a dictionary. Duplicate record identifier tuples are then not
+     reported (the last weight vector in the file is kept for them).
+
      This function returns a list with the field comparison names and a weight
      vector dictionary.
   """
 
   auxiliary.check_is_string('file_name', file_name)
+  auxiliary.check_is_flag('weight_vec_store', weight_vec_store)
+
+  if (IsWeightVectorBinaryFile(file_name) == True):
+    return LoadWeightVectorBinaryFile(file_name)
 
   if (file_name[-3:] not in ['.gz','.GZ']):  # Check for gzipped versions
     if (os.access(file_name+'.gz', os.F_OK) == True):
@@ -553,12 +602,19 @@ def LoadWeightVectorFile(file_name):
   #
   field_names_list = header_line[2:]  # Remove record identifier names
 
-  weight_vec_dict = {}  # Fill weight vector dictionary with data from file
+  # Fill weight vector dictionary with data from file
+  #
+  if (weight_vec_store == True):
+    weight_vec_dict = auxiliary.WeightVectorStore(len(field_names_list))
+  else:
+    weight_vec_dict = {}
 
   for line in csv_parser:
     rec_id_tuple = (line[0], line[1])
 
-    if (rec_id_tuple in weight_vec_dict):  # Check for unique record ids
+    # Check for unique record ids (not done for a weight vector store)
+    #
+    if ((weight_vec_store == False) and (rec_id_tuple in weight_vec_dict)):
       logging.warn('Record identifier tuple %s already in weight vector ' % \
                    (str(rec_id_tuple))+'dictionary')
 
@@ -574,3 +630,513 @@ def LoadWeightVectorFile(file_name):
   return [field_names_list, weight_vec_dict]
 
 # =============================================================================
+
+# Binary weight vector files have the following layout (all numbers are stored
+# in little-endian byte order):
+#
+# - The 8 characters 'FEBRLWV1'.
+# - A 32 byte header with the number of field comparisons (unsigned 32-bit
+#   integer), the number of record identifiers (unsigned 32-bit integer), the
+#   number of record pairs (unsigned 64-bit integer), the offset of the record
+#   identifier table (unsigned 64-bit integer), and the weight type character
+#   ('d' for 64-bit or 'f' for 32-bit floating-point numbers).
+# - The field comparison names, each as an unsigned 32-bit length followed by
+#   the characters.
+# - Padding to a multiple of 8 bytes.
+# - The data block with one fixed-width row per record pair, made of the
+#   record numbers (signed 32-bit integers, indices into the record identifier
+#   table) of the two records followed by the weights.
+# - The record identifier table, each record identifier as an unsigned 32-bit
+#   length followed by the characters.
+#
+# Rows are sorted by their record numbers and unique. The record identifier
+# table comes after the data block so that files can be written as a stream
+# (see BinaryWeightVectorWriter), with the counts and the offset of the table
+# written into the header once all rows are written.
+
+BINARY_W_VEC_MAGIC =      'FEBRLWV1'
+BINARY_W_VEC_HEADER_FMT = '<IIQQc7x'
+BINARY_W_VEC_RUN_SIZE =   100000  # Maximum number of rows sorted or read in
+                                  # memory at once
+
+# -----------------------------------------------------------------------------
+
+def IsWeightVectorBinaryFile(file_name):
+  """Return True if the given file exists and is a binary weight vector file,
+     and False otherwise.
+  """
+
+  try:
+    f = open(file_name, 'rb')
+  except:
+    return False
+
+  magic_str = f.read(len(BINARY_W_VEC_MAGIC))
+  f.close()
+
+  return (magic_str == BINARY_W_VEC_MAGIC)
+
+# -----------------------------------------------------------------------------
+
+def WriteBinaryArray(data_array, f):
+  """Write the given array into the given file in little-endian byte order.
+  """
+
+  if (sys.byteorder == 'big'):
+    data_array = array.array(data_array.typecode, data_array)
+    data_array.byteswap()
+
+  data_array.tofile(f)
+
+# -----------------------------------------------------------------------------
+
+def SaveWeightVectorBinaryFile(w_vec_dict, field_names_list, file_name,
+                               weight_type = 'd'):
+  """Save the given weight vectors (a weight vector dictionary or store) with
+     the given field comparison names into a binary weight vector file.
+
+     The argument 'weight_type' can be set to 'd' (64-bit floating-point
+     weights, default) or 'f' (32-bit). It is ignored if a weight vector store
+     is given (the weight type of the store is used).
+  """
+
+  auxiliary.check_is_dictionary('w_vec_dict', w_vec_dict)
+  auxiliary.check_is_list('field_names_list', field_names_list)
+  auxiliary.check_is_string('file_name', file_name)
+
+  if (not isinstance(w_vec_dict, auxiliary.WeightVectorStore)):
+    w_vec_store = auxiliary.WeightVectorStore(len(field_names_list),
+                                              weight_type)
+    w_vec_store.update(w_vec_dict)
+  else:
+    w_vec_store = w_vec_dict
+
+  if (w_vec_store.num_weights != len(field_names_list)):
+    logging.exception('Number of field names (%d) differs from number of ' % \
+                      (len(field_names_list)) + 'weights (%d)' % \
+                      (w_vec_store.num_weights))
+    raise Exception
+
+  num_rec_pairs = len(w_vec_store)  # Makes sure record pairs are sorted
+
+  w_vec_writer = BinaryWeightVectorWriter(file_name, field_names_list,
+                                          w_vec_store.weight_type)
+
+  # Keep the record numbers of the store, so rows are written in sorted order
+  #
+  for rec_id in w_vec_store.rec_id_list:
+    w_vec_writer.__get_rec_num__(rec_id)
+
+  for row in xrange(num_rec_pairs):
+    w_vec_writer.__write_row__(w_vec_store.rec_num1[row],
+                               w_vec_store.rec_num2[row],
+                               w_vec_store.__get_row_w_vec__(row))
+  w_vec_writer.close()
+
+# -----------------------------------------------------------------------------
+
+def LoadWeightVectorBinaryFile(file_name):
+  """Load a binary weight vector file (as written by the function
+     SaveWeightVectorBinaryFile).
+
+     The record identifiers and record numbers are read into memory, while the
+     weights are memory mapped and only read from the file when they are
+     accessed (the weights are read into memory if the returned weight vector
+     store is modified).
+
+     This function returns a list with the field comparison names and a weight
+     vector store.
+  """
+
+  auxiliary.check_is_string('file_name', file_name)
+
+  try:
+    f = open(file_name, 'rb')
+  except:
+    logging.exception('Cannot open binary weight vector file "%s" for ' % \
+                      (file_name) + 'reading')
+    raise IOError
+
+  if (f.read(len(BINARY_W_VEC_MAGIC)) != BINARY_W_VEC_MAGIC):
+    logging.exception('File "%s" is not a binary weight vector file' % \
+                      (file_name))
+    raise IOError
+
+  (num_fields, num_rec_ids, num_rec_pairs, rec_id_offset, weight_type) = \
+        struct.unpack(BINARY_W_VEC_HEADER_FMT,
+                      f.read(struct.calcsize(BINARY_W_VEC_HEADER_FMT)))
+
+  field_names_list = []
+
+  for i in xrange(num_fields):
+    (str_len,) = struct.unpack('<I', f.read(4))
+    field_names_list.append(f.read(str_len))
+
+  data_offset = f.tell() + ((-f.tell()) % 8)  # Skip padding
+
+  w_vec_store = MappedWeightVectorStore(num_fields, weight_type)
+
+  f.seek(rec_id_offset)
+
+  for rec_num in xrange(num_rec_ids):
+    (str_len,) = struct.unpack('<I', f.read(4))
+    rec_id = f.read(str_len)
+    w_vec_store.rec_id_list.append(rec_id)
+    w_vec_store.rec_id_num_dict[rec_id] = rec_num
+
+  # Read the record numbers from the data block, one block of rows at a time
+  #
+  row_num_ints = w_vec_store.row_struct.size / 4  # Rows made of 32-bit units
+
+  f.seek(data_offset)
+  num_rows_left = num_rec_pairs
+
+  while (num_rows_left > 0):
+    num_block_rows = min(num_rows_left, BINARY_W_VEC_RUN_SIZE)
+
+    block_array = array.array('i')
+    block_array.fromfile(f, num_block_rows*row_num_ints)
+    if (sys.byteorder == 'big'):
+      block_array.byteswap()
+
+    w_vec_store.rec_num1.extend(block_array[0::row_num_ints])
+    w_vec_store.rec_num2.extend(block_array[1::row_num_ints])
+
+    num_rows_left -= num_block_rows
+
+  w_vec_store.num_sorted = num_rec_pairs
+
+  if (num_rec_pairs > 0):
+    w_vec_store.weight_map = mmap.mmap(f.fileno(), 0,
+                                       access = mmap.ACCESS_READ)
+  w_vec_store.weight_offset = data_offset
+
+  f.close()  # The memory map stays valid
+
+  logging.info('Loaded %d weight vectors from binary file: %s' % \
+               (num_rec_pairs, file_name))
+
+  return [field_names_list, w_vec_store]
+
+# -----------------------------------------------------------------------------
+
+class MappedWeightVectorStore(auxiliary.WeightVectorStore):
+  """A weight vector store as returned by LoadWeightVectorBinaryFile, with the
+     weights read from a memory mapped binary weight vector file when they are
+     accessed. Before the store is modified all weights are read into memory.
+  """
+
+  def __init__(self, num_weights, weight_type = 'd'):
+
+    auxiliary.WeightVectorStore.__init__(self, num_weights, weight_type)
+
+    self.weights =       None  # Weights stay in file until modified
+    self.weight_map =    None
+    self.weight_offset = 0     # Offset of the data block in the file
+
+    # Rows in the file start with the two record numbers
+    #
+    self.row_struct = struct.Struct('<8x%d%s' % (num_weights, weight_type))
+
+  # ---------------------------------------------------------------------------
+
+  def __load_weights__(self):
+    """Read all weights from the memory mapped file into memory.
+    """
+
+    if (self.weights != None):
+      return
+
+    weights = array.array(self.weight_type)
+
+    if (self.weight_map != None):
+      for row in xrange(len(self.rec_num1)):
+        weights.extend(self.row_struct.unpack_from(self.weight_map,
+                       self.weight_offset + row*self.row_struct.size))
+
+      self.weight_map.close()
+      self.weight_map = None
+
+    self.weights = weights
+
+  # ---------------------------------------------------------------------------
+
+  def __get_row_w_vec__(self, row):
+
+    if (self.weights != None):
+      return auxiliary.WeightVectorStore.__get_row_w_vec__(self, row)
+
+    return list(self.row_struct.unpack_from(self.weight_map,
+                self.weight_offset + row*self.row_struct.size))
+
+  # ---------------------------------------------------------------------------
+
+  def __setitem__(self, rec_id_tuple, w_vec):
+
+    self.__load_weights__()
+    auxiliary.WeightVectorStore.__setitem__(self, rec_id_tuple, w_vec)
+
+  def __delitem__(self, rec_id_tuple):
+
+    self.__load_weights__()
+    auxiliary.WeightVectorStore.__delitem__(self, rec_id_tuple)
+
+  def popitem(self):
+
+    self.__load_weights__()
+    return auxiliary.WeightVectorStore.popitem(self)
+
+  def copy(self):
+
+    new_store = auxiliary.WeightVectorStore(self.num_weights, self.weight_type)
+    new_store.update(self)
+
+    return new_store
+
+  # ---------------------------------------------------------------------------
+
+  def get_size(self):
+
+    if (self.weights != None):
+      return auxiliary.WeightVectorStore.get_size(self)
+
+    return (len(self.rec_num1) + len(self.rec_num2)) * self.rec_num1.itemsize
+
+# -----------------------------------------------------------------------------
+
+class BinaryWeightVectorWriter:
+  """A writer used by the run() method of indices (and by the function
+     SaveWeightVectorBinaryFile) to write weight vectors into a binary weight
+     vector file.
+
+     Each weight vector is written straight into the data block of the file,
+     so only the interned record identifiers are kept in memory. When close()
+     is called the record identifier table is written after the data block
+     and the counts and the table offset are written into the header.
+
+     If the record pairs were not written in sorted order (or some were written
+     more than once), close() first sorts the data block with an external merge
+     sort: runs of at most 'run_size' rows are sorted in memory and written
+     into a temporary file, and these runs are then merged back into the data
+     block (keeping the weight vector written last for a record pair).
+  """
+
+  def __init__(self, file_name, field_names_list, weight_type = 'd',
+               run_size = BINARY_W_VEC_RUN_SIZE):
+
+    auxiliary.check_is_string('file_name', file_name)
+    auxiliary.check_is_list('field_names_list', field_names_list)
+    auxiliary.check_is_integer('run_size', run_size)
+    auxiliary.check_is_positive('run_size', run_size)
+
+    if (weight_type not in ['d', 'f']):
+      logging.exception('Weight type must be either "d" or "f": "%s"' % \
+                        (str(weight_type)))
+      raise Exception
+
+    self.file_name =        file_name
+    self.field_names_list = field_names_list
+    self.weight_type =      weight_type
+    self.run_size =         run_size
+
+    self.rec_id_list =     []  # Interned record identifiers
+    self.rec_id_num_dict = {}  # Record identifiers to their numbers
+
+    self.row_struct = struct.Struct('<ii%d%s' % (len(field_names_list),
+                                                 weight_type))
+    self.num_rows =      0
+    self.last_rec_nums = None  # Record numbers of the row written last
+    self.is_sorted =     True  # Rows written so far are sorted and unique
+
+    try:
+      self.f = open(file_name, 'w+b')
+    except:
+      logging.exception('Cannot open file "%s" for writing' % (str(file_name)))
+      raise IOError
+
+    # The counts and table offset in the header are written in close()
+    #
+    self.f.write(BINARY_W_VEC_MAGIC)
+    self.f.write(struct.pack(BINARY_W_VEC_HEADER_FMT, len(field_names_list),
+                             0, 0, 0, weight_type))
+
+    for field_name in field_names_list:
+      self.__write_string__(str(field_name))
+
+    self.f.write('\0' * ((-self.f.tell()) % 8))  # Padding
+
+    self.data_offset = self.f.tell()
+
+  # ---------------------------------------------------------------------------
+
+  def __write_string__(self, str_val):
+    """Write a string as its length followed by its characters.
+    """
+
+    self.f.write(struct.pack('<I', len(str_val)))
+    self.f.write(str_val)
+
+  # ---------------------------------------------------------------------------
+
+  def __get_rec_num__(self, rec_id):
+    """Return the number of the given record identifier, and intern it if it
+       is not known yet.
+    """
+
+    rec_num = self.rec_id_num_dict.get(rec_id, None)
+
+    if (rec_num == None):
+      rec_num = len(self.rec_id_list)
+      self.rec_id_list.append(rec_id)
+      self.rec_id_num_dict[rec_id] = rec_num
+
+    return rec_num
+
+  # ---------------------------------------------------------------------------
+
+  def __write_row__(self, rec_num1, rec_num2, w_vec):
+    """Write a row with the given record numbers and weights into the data
+       block.
+    """
+
+    if (len(w_vec) != len(self.field_names_list)):
+      logging.exception('Weight vector has %d weights, but %d are ' % \
+                        (len(w_vec), len(self.field_names_list)) + \
+                        'expected')
+      raise Exception
+
+    rec_nums = (rec_num1, rec_num2)
+
+    if ((self.last_rec_nums != None) and (rec_nums <= self.last_rec_nums)):
+      self.is_sorted = False
+    self.last_rec_nums = rec_nums
+
+    self.f.write(self.row_struct.pack(rec_num1, rec_num2, *w_vec))
+    self.num_rows += 1
+
+  # ---------------------------------------------------------------------------
+
+  def __sort_rows__(self):
+    """Sort the rows of the data block by their record numbers and remove
+       duplicate record pairs with an external merge sort (see above).
+    """
+
+    f =        self.f  # Shorthands
+    row_size = self.row_struct.size
+    rec_nums_struct = struct.Struct('<ii')
+
+    run_file = tempfile.TemporaryFile()
+    run_list = []  # Pairs (offset in run file, number of rows) of all runs
+
+    f.seek(self.data_offset)
+    num_rows_left = self.num_rows
+
+    while (num_rows_left > 0):  # Write sorted runs into the temporary file
+      num_run_rows = min(num_rows_left, self.run_size)
+      run_data = f.read(num_run_rows*row_size)
+
+      row_list = [run_data[i*row_size:(i+1)*row_size] for i in \
+                  xrange(num_run_rows)]
+      row_list.sort(key = rec_nums_struct.unpack_from)  # Stable sort
+
+      run_list.append((run_file.tell(), num_run_rows))
+      run_file.write(''.join(row_list))
+
+      num_rows_left -= num_run_rows
+
+    # Rows are read from all runs at the same time, in blocks that together
+    # hold at most 'run_size' rows
+    #
+    num_block_rows = max(1, self.run_size / max(1, len(run_list)))
+
+    def run_iter(run_num, run_offset, num_run_rows):
+      row_num = 0
+
+      while (row_num < num_run_rows):
+        run_file.seek(run_offset + row_num*row_size)
+        block_data = run_file.read(min(num_block_rows, num_run_rows-row_num)*
+                                   row_size)
+
+        for i in xrange(len(block_data) / row_size):
+          row = block_data[i*row_size:(i+1)*row_size]
+          (rec_num1, rec_num2) = rec_nums_struct.unpack_from(row)
+
+          # Of duplicate record pairs the one written last is merged last
+          #
+          yield (rec_num1, rec_num2, run_num, row_num, row)
+          row_num += 1
+
+    run_iter_list = []
+    for run_num in xrange(len(run_list)):
+      (run_offset, num_run_rows) = run_list[run_num]
+      run_iter_list.append(run_iter(run_num, run_offset, num_run_rows))
+
+    f.seek(self.data_offset)
+    num_rows =      0
+    prev_rec_nums = None
+    prev_row =      None
+
+    for (rec_num1, rec_num2, run_num, row_num, row) in \
+        heapq.merge(*run_iter_list):
+
+      if ((prev_row != None) and (prev_rec_nums != (rec_num1, rec_num2))):
+        f.write(prev_row)
+        num_rows += 1
+
+      prev_rec_nums = (rec_num1, rec_num2)
+      prev_row =      row
+
+    if (prev_row != None):
+      f.write(prev_row)
+      num_rows += 1
+
+    run_file.close()
+
+    logging.info('Sorted %d weight vectors in %d runs (%d duplicates ' % \
+                 (self.num_rows, len(run_list), self.num_rows-num_rows) + \
+                 'removed)')
+
+    self.num_rows = num_rows
+
+  # ---------------------------------------------------------------------------
+
+  def writerow(self, row):
+    """Write a weight vector given as a list made of the two record identifiers
+       followed by the weights.
+    """
+
+    rec_num1 = self.__get_rec_num__(row[0])
+    rec_num2 = self.__get_rec_num__(row[1])
+
+    self.__write_row__(rec_num1, rec_num2, row[2:])
+
+  # ---------------------------------------------------------------------------
+
+  def close(self):
+    """Sort the data block if needed, write the record identifier table and
+       update the header, then close the file.
+    """
+
+    if (self.is_sorted == False):
+      self.__sort_rows__()
+
+    rec_id_offset = self.data_offset + self.num_rows*self.row_struct.size
+
+    self.f.seek(rec_id_offset)
+
+    for rec_id in self.rec_id_list:
+      self.__write_string__(str(rec_id))
+
+    self.f.truncate()  # Rows removed as duplicates could follow
+
+    self.f.seek(len(BINARY_W_VEC_MAGIC))
+    self.f.write(struct.pack(BINARY_W_VEC_HEADER_FMT,
+                             len(self.field_names_list),
+                             len(self.rec_id_list), self.num_rows,
+                             rec_id_offset, self.weight_type))
+    self.f.close()
+
+    logging.info('Saved %d weight vectors into binary file: %s' % \
+                 (self.num_rows, self.file_name))
+
+# =============================================================================
@@ -107,6 +107,12 @@ JARO_MARKER_CHAR = chr(1)
 QGRAM_START_CHAR = chr(1)
 QGRAM_END_CHAR =   chr(2)
 
+# =============================================================================
+# Maximum length of the shorter string for which the bit-parallel edit distance
+# kernels are used (longer strings are handled by the dynamic programming code)
+#
+BITPAR_MAX_LEN = 64
+
 # =============================================================================
 
 def do_stringcmp(cmp_method, str1, str2, min_threshold = None):
@@ -536,6 +542,129 @@ def winkler(str1, str2, min_threshold = None):
 
 # =============================================================================
 
+def jaro_positions(s):
+  """Return a dictionary with the characters of the given string as keys and
+     lists with the (ascending) positions of each character in the string as
+     values. Used by 'jaro_assign' to find common characters.
+  """
+
+  pos_dict = {}
+
+  for i in range(len(s)):
+    c = s[i]
+    if (c in pos_dict):
+      pos_dict[c].append(i)
+    else:
+      pos_dict[c] = [i]
+
+  return pos_dict
+
+# =============================================================================
+
+def jaro_assign(str1, str2, pos1 = None, pos2 = None):
+  """Find the common characters of two strings as used in the Jaro and
+     Winkler comparators.
+
+  USAGE:
+    (ass1, ass2, flag1, flag2) = jaro_assign(str1, str2, pos1, pos2)
+
+  ARGUMENTS:
+    str1  The first string
+    str2  The second string
+    pos1  The character positions of the first string as returned by
+          'jaro_positions', or None (default) in which case they are
+          calculated.
+    pos2  The character positions of the second string, or None (default).
+
+  DESCRIPTION:
+    Returns the characters assigned in the first and second string (as
+    lists, in the order in which they occur in the strings) and two lists of
+    flags (one per character) marking the characters of the first and second
+    string that have been assigned (1) or not (0).
+
+    As in 'jaro', the first string is analysed against the second and then
+    the second against the first, each time assigning the first not yet
+    assigned occurrence of a character within the search window. Instead of
+    searching the window in a copy of the string (and replacing assigned
+    characters with a marker), only the positions of the character in the
+    other string are looked at, which can be prepared once for each string
+    if it is compared with many other strings.
+  """
+
+  len1 = len(str1)
+  len2 = len(str2)
+
+  if (pos1 == None):
+    pos1 = jaro_positions(str1)
+  if (pos2 == None):
+    pos2 = jaro_positions(str2)
+
+  halflen = max(len1,len2) / 2 - 1  # Or + 1?? PC 12/03/2009
+
+  ass1 = []  # Characters assigned in str1
+  ass2 = []  # Characters assigned in str2
+
+  flag1 = [0]*len1  # Flags for characters assigned in str1
+  flag2 = [0]*len2
+
+  # Analyse the first string  - - - - - - - - - - - - - - - - - - - - - - - - -
+  #
+  for i in range(len1):
+    c = str1[i]
+    pos_list = pos2.get(c)
+    if (pos_list != None):
+      start = i-halflen
+      end =   i+halflen+1
+      for j in pos_list:
+        if (j >= end):
+          break
+        if (j >= start) and (flag2[j] == 0):  # Found common character
+          flag2[j] = 1
+          ass1.append(c)
+          break
+
+  # Analyse the second string - - - - - - - - - - - - - - - - - - - - - - - - -
+  #
+  for i in range(len2):
+    c = str2[i]
+    pos_list = pos1.get(c)
+    if (pos_list != None):
+      start = i-halflen
+      end =   i+halflen+1
+      for j in pos_list:
+        if (j >= end):
+          break
+        if (j >= start) and (flag1[j] == 0):  # Found common character
+          flag1[j] = 1
+          ass2.append(c)
+          break
+
+  return ass1, ass2, flag1, flag2
+
+# =============================================================================
+
+def jaro_max_common(pos1, pos2):
+  """Return an upper bound on the number of common characters 'jaro_assign'
+     can find for two strings, given their character positions as returned by
+     'jaro_positions'. This is the number of characters the two strings have
+     in common if the positions of the characters are not taken into account
+     (and it is never larger than the length of the shorter string).
+  """
+
+  if (len(pos1) > len(pos2)):  # Loop over the string with less characters
+    pos1, pos2 = pos2, pos1
+
+  max_common = 0
+
+  for (c, pos_list1) in pos1.iteritems():
+    pos_list2 = pos2.get(c)
+    if (pos_list2 != None):
+      max_common += min(len(pos_list1), len(pos_list2))
+
+  return max_common
+
+# =============================================================================
+
 def qgram(str1, str2, q=2, common_divisor = 'average', min_threshold = None,
           padded=True):
   """Return approximate string comparator measure (between 0.0 and 1.0)
@@ -949,6 +1078,129 @@ def sgram(str1, str2, gc, common_divisor = 'average', min_threshold = None,
 
 # =============================================================================
 
+def bitpar_editdist(str1, str2, max_dist = None, transpose = False):
+  """Return the edit (or Levenshtein) distance between two strings calculated
+     with the bit-parallel algorithm by Myers (1999) as formulated by Hyyro
+     (2003), or -1 if the distance is known to be larger than 'max_dist'.
+
+  USAGE:
+    dist = bitpar_editdist(str1, str2, max_dist, transpose)
+
+  ARGUMENTS:
+    str1       The first string
+    str2       The second string
+    max_dist   Maximum distance of interest, or None (default). If given the
+               calculation stops as soon as the minimum of a row of the
+               distance matrix is known to be larger than this value.
+    transpose  If set to True transpositions of two adjacent characters are
+               counted as one operation (as in 'mod_editdist').
+
+  DESCRIPTION:
+    The distance matrix is processed row by row (one row for each character
+    in the longer string), with the vertical and horizontal differences of a
+    row being stored as the bits of integers. Each row therefore only takes
+    a constant number of integer operations instead of a loop over the
+    characters of the shorter string.
+
+    The value returned is identical to the one calculated by the dynamic
+    programming loops in 'editdist' and 'mod_editdist', including the early
+    exit when the minimum of a row becomes larger than 'max_dist' (in which
+    case -1 is returned). While processing the rows a cheap band bound on the
+    row minimum is used to stop early, and the exact minimum of the final row
+    is only calculated if the final distance is larger than 'max_dist'.
+
+    The strings can be of any length, but the kernels are only faster than
+    the dynamic programming loops for strings of up to BITPAR_MAX_LEN
+    characters.
+
+    For more information see:
+    - G. Myers, A fast bit-vector algorithm for approximate string matching
+      based on dynamic programming, Journal of the ACM, 46(3), 1999.
+    - H. Hyyro, A bit-vector algorithm for computing Levenshtein and Damerau
+      edit distances, Nordic Journal of Computing, 10(1), 2003.
+  """
+
+  n = len(str1)
+  m = len(str2)
+
+  if (n > m):  # Make sure str1 is the shorter string (the bit vector one)
+    str1, str2 = str2, str1
+    n, m =       m, n
+
+  if (n == 0):
+    return m
+
+  # Bit masks of the positions of all characters in the shorter string
+  #
+  peq_dict = {}
+  bit = 1
+  for c in str1:
+    peq_dict[c] = peq_dict.get(c, 0) | bit
+    bit <<= 1
+
+  all_mask = (1 << n) - 1
+  top_bit =  1 << (n-1)
+
+  vp =    all_mask  # Vertical positive differences (first row is 0..n)
+  vn =    0         # Vertical negative differences
+  d0 =    0
+  peq_prev = 0
+  dist =  n
+
+  i = 0
+  for c in str2:
+    i += 1
+    peq = peq_dict.get(c, 0)
+    x = peq | vn
+
+    if (transpose == True):
+      d0 = ((((peq & vp) + vp) ^ vp) | x | \
+            ((((~d0) & peq) << 1) & peq_prev)) & all_mask
+      peq_prev = peq
+    else:
+      d0 = ((((peq & vp) + vp) ^ vp) | x) & all_mask
+
+    hp = vn | (~(d0 | vp) & all_mask)
+    hn = d0 & vp
+
+    if (hp & top_bit):
+      dist += 1
+    elif (hn & top_bit):
+      dist -= 1
+
+    hp = ((hp << 1) | 1) & all_mask  # First column increases by one per row
+    hn = (hn << 1) & all_mask
+
+    vp = hn | (~(d0 | hp) & all_mask)
+    vn = d0 & hp
+
+    # Band bound: A row value is at least its distance from the diagonal, and
+    # at least the last value of the row minus its distance to the row end
+    #
+    if (max_dist != None) and ((i+dist-n+1) // 2 > max_dist):
+      return -1
+
+  if (max_dist != None) and (dist > max_dist):  # Get exact final row minimum
+
+    row_val = m
+    row_min = m
+    bit = 1
+    while (bit <= top_bit):
+      if (vp & bit):
+        row_val += 1
+      elif (vn & bit):
+        row_val -= 1
+        if (row_val < row_min):
+          row_min = row_val
+      bit <<= 1
+
+    if (row_min > max_dist):
+      return -1
+
+  return dist
+
+# =============================================================================
+
 def editdist(str1, str2, min_threshold = None):
   """Return approximate string comparator measure (between 0.0 and 1.0)
      using the edit (or Levenshtein) distance.
@@ -998,31 +1250,44 @@ def editdist(str1, str2, min_threshold = None):
                         ' 0 and 1): %f' % (min_threshold))
       raise Exception
 
-  if (n > m):  # Make sure n <= m, to use O(min(n,m)) space
-    str1, str2 = str2, str1
-    n, m =       m, n
+  if (min(n,m) <= BITPAR_MAX_LEN):  # Use the bit-parallel kernel
 
-  current = range(n+1)
+    if (min_threshold != None):
+      dist = bitpar_editdist(str1, str2, max_dist)
+      if (dist < 0):  # Distance is larger than maximum distance
+        return 1.0 - float(max_dist+1) / float(max_len)
+    else:
+      dist = bitpar_editdist(str1, str2)
 
-  for i in range(1, m+1):
+  else:  # Long strings, use dynamic programming
 
-    previous = current
-    current =  [i]+n*[0]
-    str2char = str2[i-1]
+    if (n > m):  # Make sure n <= m, to use O(min(n,m)) space
+      str1, str2 = str2, str1
+      n, m =       m, n
 
-    for j in range(1,n+1):
-      substitute = previous[j-1]
-      if (str1[j-1] != str2char):
-        substitute += 1
+    current = range(n+1)
 
-      # Get minimum of insert, delete and substitute
-      #
-      current[j] = min(previous[j]+1, current[j-1]+1, substitute)
+    for i in range(1, m+1):
 
-    if (min_threshold != None) and (min(current) > max_dist):
-      return 1.0 - float(max_dist+1) / float(max_len)
+      previous = current
+      current =  [i]+n*[0]
+      str2char = str2[i-1]
 
-  w = 1.0 - float(current[n]) / float(max_len)
+      for j in range(1,n+1):
+        substitute = previous[j-1]
+        if (str1[j-1] != str2char):
+          substitute += 1
+
+        # Get minimum of insert, delete and substitute
+        #
+        current[j] = min(previous[j]+1, current[j-1]+1, substitute)
+
+      if (min_threshold != None) and (min(current) > max_dist):
+        return 1.0 - float(max_dist+1) / float(max_len)
+
+    dist = current[n]
+
+  w = 1.0 - float(dist) / float(max_len)
 
   assert (w >= 0.0) and (w <= 1.0), 'Similarity weight outside 0-1: %f' % (w)
 
@@ -1088,46 +1353,60 @@ def mod_editdist(str1, str2, min_threshold = None):
                         ' 0 and 1): %f' % (min_threshold))
       raise Exception
 
-  if (n > m):  # Make sure n <= m, to use O(min(n,m)) space
-    str1, str2 = str2, str1
-    n, m =       m, n
+  if (min(n,m) <= BITPAR_MAX_LEN):  # Use the bit-parallel kernel
 
-  d = []  # Table with the full distance matrix
+    if (min_threshold != None):
+      dist = bitpar_editdist(str1, str2, max_dist, True)
+      if (dist < 0):  # Distance is larger than maximum distance
+        return 1.0 - float(max_dist+1) / float(max_len)
+    else:
+      dist = bitpar_editdist(str1, str2, None, True)
 
-  current = range(n+1)
-  d.append(current)
+  else:  # Long strings, use dynamic programming
 
-  for i in range(1,m+1):
+    if (n > m):  # Make sure n <= m, to use O(min(n,m)) space
+      str1, str2 = str2, str1
+      n, m =       m, n
 
-    previous = current
-    current =  [i]+n*[0]
-    str2char = str2[i-1]
+    d = []  # Table with the full distance matrix
 
-    for j in range(1,n+1):
-      substitute = previous[j-1]
-      if (str1[j-1] != str2char):
-        substitute += 1
+    current = range(n+1)
+    d.append(current)
 
-      if (i == 1) or (j == 1):  # First characters, no transposition possible
+    for i in range(1,m+1):
 
-        # Get minimum of insert, delete and substitute
-        #
-        current[j] = min(previous[j]+1, current[j-1]+1, substitute)
+      previous = current
+      current =  [i]+n*[0]
+      str2char = str2[i-1]
+
+      for j in range(1,n+1):
+        substitute = previous[j-1]
+        if (str1[j-1] != str2char):
+          substitute += 1
+
+        if (i == 1) or (j == 1):  # First characters, no transposition possible
+
+          # Get minimum of insert, delete and substitute
+          #
+          current[j] = min(previous[j]+1, current[j-1]+1, substitute)
 
-      else:
-        if (str1[j-2] == str2[i-1]) and (str1[j-1] == str2[i-2]):
-          transpose = d[i-2][j-2] + 1
         else:
-          transpose = d[i-2][j-2] + 3
+          if (str1[j-2] == str2[i-1]) and (str1[j-1] == str2[i-2]):
+            transpose = d[i-2][j-2] + 1
+          else:
+            transpose = d[i-2][j-2] + 3
 
-        current[j] = min(previous[j]+1, current[j-1]+1, substitute, transpose)
+          current[j] = min(previous[j]+1, current[j-1]+1, substitute, \
+                           transpose)
 
-    d.append(current)
+      d.append(current)
+
+      if (min_threshold != None) and (min(current) > max_dist):
+        return 1.0 - float(max_dist+1) / float(max_len)
 
-    if (min_threshold != None) and (min(current) > max_dist):
-      return 1.0 - float(max_dist+1) / float(max_len)
+    dist = current[n]
 
-  w = 1.0 - float(current[n]) / float(max_len)
+  w = 1.0 - float(dist) / float(max_len)
 
   assert (w >= 0.0) and (w <= 1.0), 'Similarity weight outside 0-1: %f' % (w)
 
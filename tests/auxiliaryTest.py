@@ -276,6 +276,87 @@ class TestCase(unittest.TestCase):
     x = auxiliary.get_memory_usage()
     assert (x == None) or (isinstance(x,str) == True)
 
+  def testWeightVectorStore(self):  # - - - - - - - - - - - - - - - - - - - -
+    """Test 'WeightVectorStore' class."""
+
+    w_vec_dict = {}
+    w_vec_store = auxiliary.WeightVectorStore(3)
+
+    assert len(w_vec_store) == 0
+    assert w_vec_store == {}
+
+    for i in range(50):  # Insert in non-sorted order
+      rec_id_tuple = ('rec-%d' % ((i*7) % 50), 'rec-%d-dup' % (i % 5))
+      w_vec = [float(i), 0.5, -1.0*i]
+      w_vec_dict[rec_id_tuple] = w_vec
+      w_vec_store[rec_id_tuple] = w_vec
+
+    w_vec_dict[('rec-7', 'rec-1-dup')] = [1.0, 2.0, 3.0]  # Overwrite
+    w_vec_store[('rec-7', 'rec-1-dup')] = [1.0, 2.0, 3.0]
+
+    assert len(w_vec_store) == len(w_vec_dict)
+    assert w_vec_store == w_vec_dict
+    assert sorted(w_vec_store.keys()) == sorted(w_vec_dict.keys())
+    assert sorted(w_vec_store.items()) == sorted(w_vec_dict.items())
+    auxiliary.check_is_dictionary('w_vec_store', w_vec_store)
+
+    for (rec_id_tuple, w_vec) in w_vec_dict.iteritems():
+      assert rec_id_tuple in w_vec_store
+      assert w_vec_store[rec_id_tuple] == w_vec
+      assert w_vec_store.get(rec_id_tuple) == w_vec
+
+    assert ('rec-0', 'rec-x') not in w_vec_store
+    assert w_vec_store.get(('rec-x', 'rec-0')) == None
+
+    (rec_id_tuple, w_vec) = w_vec_store.popitem()
+    assert rec_id_tuple not in w_vec_store
+    assert w_vec_dict[rec_id_tuple] == w_vec
+    w_vec_store[rec_id_tuple] = w_vec  # Put back in
+    assert w_vec_store == w_vec_dict
+
+    del w_vec_store[rec_id_tuple]
+    assert len(w_vec_store) == len(w_vec_dict)-1
+
+    w_vec_store2 = w_vec_store.copy()
+    assert w_vec_store2 == w_vec_store
+    assert w_vec_store.get_size() > 0
+
+    float_store = auxiliary.WeightVectorStore(3, 'f')
+    float_store.update(w_vec_dict)
+    assert float_store == w_vec_dict  # All values can be exactly represented
+    assert float_store.get_size() < w_vec_store2.get_size()
+
+    # Sort in several runs, with duplicate record pairs in different runs
+    #
+    sort_run_size = auxiliary.WEIGHT_VECTOR_SORT_RUN_SIZE
+    auxiliary.WEIGHT_VECTOR_SORT_RUN_SIZE = 7
+
+    try:
+      w_vec_dict =  {}
+      w_vec_store = auxiliary.WeightVectorStore(3)
+
+      for num_dup in [3, 2]:  # Then append to the sorted record pairs
+
+        for j in range(num_dup):
+          for i in range(40):
+            rec_id_tuple = ('rec-%d' % (i % 10), 'rec-%d-dup' % \
+                            ((i+num_dup) % 4))
+            w_vec = [float(i), float(j), 0.5*num_dup]
+            w_vec_dict[rec_id_tuple] = w_vec
+            w_vec_store[rec_id_tuple] = w_vec
+
+        assert len(w_vec_store.rec_num1) > len(w_vec_dict)  # Not sorted yet
+        assert w_vec_store == w_vec_dict
+        assert len(w_vec_store.rec_num1) == len(w_vec_dict)
+
+        rec_num_dict = w_vec_store.rec_id_num_dict
+        rec_num_list = [(rec_num_dict[rec_id1], rec_num_dict[rec_id2]) for \
+                        (rec_id1, rec_id2) in w_vec_store.iterkeys()]
+        assert rec_num_list == sorted(set(rec_num_list))
+
+    finally:
+      auxiliary.WEIGHT_VECTOR_SORT_RUN_SIZE = sort_run_size
+
 
 # =============================================================================
 # Start tests when called from command line
@@ -198,6 +198,12 @@ class TestCase(unittest.TestCase):
       assert len(class_res[0]) + len(class_res[1]) + len(class_res[2]) == \
              len(self.test_w_vec_dict)
 
+      # Classify a stream of weight vectors (as yielded by index iter_run())
+      #
+      w_vec_iter = ((rec_id1, rec_id2, w_vec) for ((rec_id1, rec_id2), w_vec) \
+                    in self.test_w_vec_dict.iteritems())
+      assert fs_class.classify(w_vec_iter) == class_res
+
       # Train classifier when initialising it - - - - - - - - - - - - - - - - -
       #
       fs_class2 = classification.FellegiSunter(descr = 'fell-sunter',
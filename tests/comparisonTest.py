@@ -2016,6 +2016,72 @@ class TestCase(unittest.TestCase):
 
       jfc.get_cache_stats()
 
+  # ---------------------------------------------------------------------------
+  # Test cache eviction policies
+
+  def testCachePolicies(self):  # - - - - - - - - - - - - - - - - - - - - - - -
+
+    jfc = comparison.FieldComparatorJaro(threshold = 0.5,
+                                         desc = 'FieldComparatorJaro')
+
+    # Pairs of values: A few frequent pairs mixed with many rare pairs
+    #
+    val_pair_list = []
+    for i in range(200):
+      val_pair_list.append(('peter', 'pete%d' % (i % 3)))
+      val_pair_list.append(('paul%d' % (i), 'paula%d' % (i)))
+
+    for cache_policy in ['none', 'lru', 'lfu', '2q']:
+
+      cjfc = comparison.FieldComparatorJaro(threshold = 0.5,
+                                            desc = 'FieldComparatorJaro',
+                                            do_cache = True,
+                                            max_cache_size = 10,
+                                            cache_policy = cache_policy)
+
+      for clear_cache in [False, True]:
+
+        if (clear_cache == True):
+          cjfc.cache = {}  # Clear old cache entries
+
+        for (val1, val2) in val_pair_list:
+          w = cjfc.compare(val1, val2)
+
+          assert w == jfc.compare(val1, val2), \
+                 'Cached comparison gave a different weight with policy ' + \
+                 '"%s": %f' % (cache_policy, w)
+
+          assert len(cjfc.cache) <= 10, \
+                 'Cache is too large with policy "%s": %d' % \
+                 (cache_policy, len(cjfc.cache))
+
+      cache_counter_dict = cjfc.get_cache_stats()
+
+      assert cache_counter_dict['hits'] + cache_counter_dict['misses'] == \
+             2*len(val_pair_list), 'Wrong number of cache hits and misses ' + \
+             'with policy "%s": %s' % (cache_policy, str(cache_counter_dict))
+
+      assert cache_counter_dict['size'] == len(cjfc.cache)
+
+      if (cache_policy == 'none'):
+        assert cache_counter_dict['evictions'] == 0
+        assert cache_counter_dict['not_cached'] > 0
+      else:
+        assert cache_counter_dict['evictions'] > 0, \
+               'No evictions with policy "%s"' % (cache_policy)
+        assert cache_counter_dict['not_cached'] == 0
+
+        # The frequent pairs stay in the cache, even though they come after
+        # the first 10 pairs
+        #
+        assert cache_counter_dict['hits'] >= 2*(len(val_pair_list)/2 - 3) - \
+               10, 'Too few cache hits with policy "%s": %s' % \
+               (cache_policy, str(cache_counter_dict))
+
+    self.assertRaises(Exception, comparison.FieldComparatorJaro,
+                      threshold = 0.5, do_cache = True, max_cache_size = 10,
+                      cache_policy = 'fifo')
+
   # ---------------------------------------------------------------------------
   # Test record comparator
   #
@@ -2091,6 +2157,349 @@ class TestCase(unittest.TestCase):
 
       rc.get_cache_stats()
 
+  # ---------------------------------------------------------------------------
+  # Test batch comparisons
+
+  def testBatchComparison(self):  # - - - - - - - - - - - - - - - - - - - - - -
+
+    def check_batch(fc, val_pair_list):
+      val_pair_list = val_pair_list + val_pair_list  # Some repeated pairs
+      vals1 = [val_pair[0] for val_pair in val_pair_list]
+      vals2 = [val_pair[1] for val_pair in val_pair_list]
+
+      w_array = fc.compare_batch(vals1, vals2)
+
+      assert len(w_array) == len(val_pair_list), \
+             'Batch comparison returned wrong number of weights: %d' % \
+             (len(w_array))
+
+      for i in range(len(val_pair_list)):
+        w = fc.compare(vals1[i], vals2[i])
+        assert w_array[i] == w, \
+               'Batch comparison of "%s" and "%s" gave weight %f instead ' % \
+               (vals1[i], vals2[i], w_array[i])+'of %f' % (w)
+
+    string_pairs = self.exact_string_pairs + self.missing_string_pairs + \
+                   self.similar_string_pairs + self.different_string_pairs
+    number_pairs = self.exact_number_pairs + self.missing_number_pairs + \
+                   self.similar_number_pairs + \
+                   self.different_number_pairs + [('abc','1'),('1','x1')]
+    date_pairs =   self.exact_date_pairs + self.missing_date_pairs + \
+                   self.similar_date_pairs + self.different_date_pairs
+    age_pairs =    self.exact_age_pairs + self.missing_age_pairs + \
+                   self.similar_age_pairs + self.different_age_pairs
+    time_pairs =   self.exact_time_pairs + self.missing_time_pairs + \
+                   self.similar_time_pairs + self.different_time_pairs
+
+    for (mw, daw, aw) in self.weight_values:
+
+      for do_cache in [False, True]:
+
+        fc_list = [
+          (comparison.FieldComparatorExactString(missing_w = mw,
+                                        agree_w = aw, disagree_w = daw,
+                                        missing_v = self.missing_values_list,
+                                        do_cache = do_cache), string_pairs),
+          (comparison.FieldComparatorKeyDiff(max_key_di = 2, missing_w = mw,
+                                        agree_w = aw, disagree_w = daw,
+                                        missing_v = self.missing_values_list,
+                                        do_cache = do_cache), string_pairs),
+          (comparison.FieldComparatorNumericPerc(max_p = 10, missing_w = mw,
+                                        agree_w = aw, disagree_w = daw,
+                                        missing_v = self.missing_values_list,
+                                        do_cache = do_cache), number_pairs),
+          (comparison.FieldComparatorNumericAbs(max_a = 2, missing_w = mw,
+                                        agree_w = aw, disagree_w = daw,
+                                        missing_v = self.missing_values_list,
+                                        do_cache = do_cache), number_pairs),
+          (comparison.FieldComparatorDate(max_day1 = 5, max_day2 = 5,
+                                        date_format = 'ddmmyyyy',
+                                        missing_w = mw,
+                                        agree_w = aw, disagree_w = daw,
+                                        missing_v = self.missing_values_list,
+                                        do_cache = do_cache), date_pairs),
+          (comparison.FieldComparatorAge(max_p = 10,
+                                        date_format = 'ddmmyyyy',
+                                        fix_d = (10,11,2006),
+                                        missing_w = mw,
+                                        agree_w = aw, disagree_w = daw,
+                                        missing_v = self.missing_values_list,
+                                        do_cache = do_cache), age_pairs),
+          (comparison.FieldComparatorTime(max_time1 = 3, max_time2 = 3,
+                                        missing_w = mw,
+                                        agree_w = aw, disagree_w = daw,
+                                        missing_v = self.missing_values_list,
+                                        do_cache = do_cache), time_pairs),
+          (comparison.FieldComparatorJaro(threshold = 0.6, missing_w = mw,
+                                        agree_w = aw, disagree_w = daw,
+                                        missing_v = self.missing_values_list,
+                                        do_cache = do_cache), string_pairs)]
+
+        for thres in [0.0, 0.5, 0.8, 0.9]:
+          fc_list.append((comparison.FieldComparatorJaro(threshold = thres,
+                                        missing_w = mw,
+                                        agree_w = aw, disagree_w = daw,
+                                        missing_v = self.missing_values_list,
+                                        do_cache = do_cache), string_pairs))
+
+          for (check_sim, check_init, check_long, multi_word) in \
+              [(True, True, True, None), (False, True, False, None),
+               (True, False, True, None), (False, False, False, None),
+               (True, True, True, 'sort'), (True, True, True, 'perm')]:
+            fc_list.append((comparison.FieldComparatorWinkler(
+                                        threshold = thres,
+                                        check_sim = check_sim,
+                                        check_init = check_init,
+                                        check_long = check_long,
+                                        multi_word = multi_word,
+                                        missing_w = mw,
+                                        agree_w = aw, disagree_w = daw,
+                                        missing_v = self.missing_values_list,
+                                        do_cache = do_cache), string_pairs))
+
+        for (fc, val_pair_list) in fc_list:
+          check_batch(fc, val_pair_list)
+
+    # Batch comparisons use the cache as compare() does - - - - - - - - - - - -
+    #
+    vals1 = [val_pair[0] for val_pair in string_pairs+string_pairs]
+    vals2 = [val_pair[1] for val_pair in string_pairs+string_pairs]
+
+    for multi_word in [None, 'sort']:
+      fc_pair_list = [(comparison.FieldComparatorJaro(threshold = 0.8,
+                                        missing_v = self.missing_values_list,
+                                        do_cache = True),
+                       comparison.FieldComparatorJaro(threshold = 0.8,
+                                        missing_v = self.missing_values_list,
+                                        do_cache = True)),
+                      (comparison.FieldComparatorWinkler(threshold = 0.8,
+                                        multi_word = multi_word,
+                                        missing_v = self.missing_values_list,
+                                        do_cache = True),
+                       comparison.FieldComparatorWinkler(threshold = 0.8,
+                                        multi_word = multi_word,
+                                        missing_v = self.missing_values_list,
+                                        do_cache = True))]
+
+      for (fc, distinct_fc) in fc_pair_list:
+        for j in range(2):  # Second batch finds values pairs in the cache
+          w_array = fc.compare_batch(vals1, vals2)
+          assert w_array == distinct_fc.__compare_batch_distinct__(vals1,
+                                                                   vals2)
+          assert fc.cache == distinct_fc.cache
+          assert fc.cache_num_hits == distinct_fc.cache_num_hits
+          assert fc.cache_num_misses == distinct_fc.cache_num_misses
+          assert fc.num_pruned == distinct_fc.num_pruned
+
+        assert len(fc.cache) > 0
+        assert fc.cache_num_hits >= len(fc.cache)
+
+    # Test batch comparison of record pairs - - - - - - - - - - - - - - - - - -
+    #
+    gn_jfc = comparison.FieldComparatorJaro(threshold = 0.6,
+                                          missing_v = self.missing_values_list,
+                                          desc = 'Givenname Jaro')
+    sn_efc = comparison.FieldComparatorExactString(
+                                          missing_v = self.missing_values_list,
+                                          desc = 'Surname Exact')
+    pc_kfc = comparison.FieldComparatorKeyDiff(max_key_di = 2,
+                                          missing_v = self.missing_values_list,
+                                          desc = 'Postcode KeyDiff')
+    pc_nfc = comparison.FieldComparatorNumericAbs(max_a = 10,
+                                          missing_v = self.missing_values_list,
+                                          desc = 'Postcode NumericAbs')
+
+    field_comp_list = [(gn_jfc, 'gname', 'given_name'),
+                       (sn_efc, 'surname', 'sname'),
+                       (pc_kfc, 'postcode', 'zipcode'),
+                       (pc_nfc, 'postcode', 'zipcode')]
+
+    rc = comparison.RecordComparator(self.test_data_set1,self.test_data_set2,
+                                     field_comp_list, 'Test record comparator')
+
+    rec_pairs = []
+    for r1 in self.recs1:
+      for r2 in self.recs2:
+        rec_pairs.append((r1, r2))
+    rec_pairs.append((['rec-short'], ['rec-short']))  # Fields missing
+
+    w_vec_list = rc.compare_batch(rec_pairs)
+
+    assert len(w_vec_list) == len(rec_pairs)
+
+    for i in range(len(rec_pairs)):
+      (r1, r2) = rec_pairs[i]
+      assert w_vec_list[i] == rc.compare(r1, r2), \
+             'Batch weight vector differs from record comparator weight ' + \
+             'vector: %s / %s' % (str(w_vec_list[i]), str(rc.compare(r1, r2)))
+
+    # Each distinct values pair of a field is only compared once per batch
+    #
+    batch_stats = rc.get_batch_stats()
+    assert len(batch_stats) == len(field_comp_list)
+
+    for (num_val_pairs, num_distinct_val_pairs) in batch_stats:
+      assert num_val_pairs == len(rec_pairs)
+      assert 1 <= num_distinct_val_pairs <= num_val_pairs
+
+    assert rc.compare_batch(rec_pairs+rec_pairs) == w_vec_list+w_vec_list
+
+    for j in range(len(batch_stats)):
+      assert rc.batch_stats[j] == [3*batch_stats[j][0], 2*batch_stats[j][1]]
+
+  # ---------------------------------------------------------------------------
+  # Test prepared comparison profiles
+
+  def testPreparedProfiles(self):  # - - - - - - - - - - - - - - - - - - - - -
+
+    mv = self.missing_values_list
+
+    string_pairs = self.exact_string_pairs + self.missing_string_pairs + \
+                   self.similar_string_pairs + self.different_string_pairs
+
+    fc_list = [comparison.FieldComparatorQGram(threshold = 0.0, q = 2,
+                                          common_div = 'average',
+                                          missing_v = mv),
+               comparison.FieldComparatorQGram(threshold = 0.5, q = 3,
+                                          common_div = 'shortest',
+                                          padded = False,
+                                          missing_v = mv),
+               comparison.FieldComparatorPosQGram(threshold = 0.0, q = 2,
+                                          max_dist = 2,
+                                          common_div = 'longest',
+                                          missing_v = mv),
+               comparison.FieldComparatorTokenSet(threshold = 0.0,
+                                          common_div = 'average',
+                                          stop_word_list = ['the', 'of'],
+                                          missing_v = mv),
+               comparison.FieldComparatorCharHistogram(threshold = 0.0,
+                                          missing_v = mv),
+               comparison.FieldComparatorEncodeString(encode_method='nysiis',
+                                          reverse = True,
+                                          missing_v = mv),
+               comparison.FieldComparatorJaro(threshold = 0.0,
+                                          missing_v = mv),
+               comparison.FieldComparatorWinkler(threshold = 0.0,
+                                          missing_v = mv),
+               comparison.FieldComparatorEditDist(threshold = 0.5,
+                                          missing_v = mv),
+               comparison.FieldComparatorLCS(threshold = 0.5,
+                                          common_div = 'average',
+                                          missing_v = mv),
+               comparison.FieldComparatorSeqMatch(threshold = 0.0,
+                                          missing_v = mv)]
+
+    for fc in fc_list:
+
+      w_list = [fc.compare(val1, val2) for (val1, val2) in string_pairs]
+
+      fc.prepare([val_pair[0] for val_pair in string_pairs] + \
+                 [val_pair[1] for val_pair in string_pairs])
+
+      if (isinstance(fc, comparison.FieldComparatorSeqMatch)):
+        assert fc.profile_dict == {}  # Does not use profiles
+      else:
+        assert fc.profile_dict != {}
+        for missing_val in mv:
+          assert missing_val not in fc.profile_dict
+
+      prep_w_list = [fc.compare(val1, val2) for (val1, val2) in string_pairs]
+
+      assert w_list == prep_w_list, \
+             'Prepared comparison profiles give different weights: ' + \
+             '%s / %s' % (str(w_list), str(prep_w_list))
+
+      fc.clear_profiles()
+      assert fc.profile_dict == {}
+
+    # Prepare field comparators from records - - - - - - - - - - - - - - - - -
+    #
+    sn_qfc = comparison.FieldComparatorQGram(threshold = 0.0, q = 2,
+                                          common_div = 'average',
+                                          missing_v = mv)
+    pc_efc = comparison.FieldComparatorEncodeString(encode_method = None,
+                                          missing_v = mv)
+
+    field_comp_list = [(sn_qfc, 'surname', 'sname'),
+                       (pc_efc, 'postcode', 'zipcode')]
+
+    rc = comparison.RecordComparator(self.test_data_set1,self.test_data_set2,
+                                     field_comp_list, 'Test record comparator')
+
+    rc.prepare(self.recs1, self.recs2)
+
+    for (recs, field_index_pos) in [(self.recs1, 1), (self.recs2, 2)]:
+      for i in range(len(field_comp_list)):
+        field_index = rc.field_comparison_list[i][field_index_pos]
+        for rec in recs:
+          val = rec[field_index].lower()
+          if (val not in mv):
+            assert val in field_comp_list[i][0].profile_dict, (i, val)
+
+  # ---------------------------------------------------------------------------
+  # Test values pairs pruned with upper bounds of the similarity
+
+  def testPrunedComparison(self):  # - - - - - - - - - - - - - - - - - - - - -
+
+    mv = self.missing_values_list
+
+    string_pairs = self.exact_string_pairs + self.missing_string_pairs + \
+                   self.similar_string_pairs + self.different_string_pairs
+
+    fc_arg_list = [(comparison.FieldComparatorJaro, {}),
+                   (comparison.FieldComparatorWinkler, {}),
+                   (comparison.FieldComparatorQGram,
+                    {'q':2, 'common_div':'average'}),
+                   (comparison.FieldComparatorPosQGram,
+                    {'q':2, 'max_dist':1, 'common_div':'longest'}),
+                   (comparison.FieldComparatorSGram,
+                    {'gram_class':[(0,),(1,2)], 'common_div':'average'}),
+                   (comparison.FieldComparatorEditDist, {}),
+                   (comparison.FieldComparatorDaLeDist, {}),
+                   (comparison.FieldComparatorBagDist, {}),
+                   (comparison.FieldComparatorSWDist,
+                    {'common_div':'longest'}),
+                   (comparison.FieldComparatorLCS, {'common_div':'average'}),
+                   (comparison.FieldComparatorSeqMatch, {})]
+
+    def get_fc_list(thres, arg_dict):
+      fc_list = []
+      for (fc_class, fc_arg_dict) in fc_arg_list:
+        fc_arg_dict = fc_arg_dict.copy()
+        fc_arg_dict.update(arg_dict)
+        fc_list.append(fc_class(threshold = thres, **fc_arg_dict))
+      return fc_list
+
+    # Comparators with threshold 0.0 and weights 1.0 and 0.0 return the
+    # similarity values
+    #
+    sim_fc_list = get_fc_list(0.0, {'agree_w':1.0, 'disagree_w':0.0,
+                                    'missing_v':mv})
+
+    num_pruned = 0
+
+    for thres in [0.3, 0.6, 0.8, 0.9]:
+      fc_list = get_fc_list(thres, {'missing_v':mv})
+
+      for i in range(len(fc_list)):
+        fc = fc_list[i]
+
+        for (val1, val2) in string_pairs:
+          fc_num_pruned = fc.num_pruned
+          w = fc.compare(val1, val2)
+
+          if (fc.num_pruned > fc_num_pruned):  # Values pair was pruned
+            sim = sim_fc_list[i].compare(val1, val2)
+
+            assert w == fc.disagree_weight
+            assert sim < thres+1.0e-09, \
+                   '%s pruned "%s" and "%s" with similarity %f >= %f' % \
+                   (fc.__class__.__name__, val1, val2, sim, thres)
+
+        num_pruned += fc.num_pruned
+
+    assert num_pruned > 0
+
 # =============================================================================
 # Start tests when called from command line
 
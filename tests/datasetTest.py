@@ -1554,6 +1554,36 @@ class TestCase(unittest.TestCase):
       test_ds.finalise()
       test_ds = None
 
+  def testInternRecIdent(self):   # - - - - - - - - - - - - - - - - - - - - - -
+    """Test interning of record identifiers into record numbers"""
+
+    test_ds = dataset.DataSetMemory(description='A test Memory data set',
+                                    access_mode='readwrite',
+                                    field_list=[('rec-id',''),('gname','')],
+                                    rec_ident='rec-id')
+
+    assert test_ds.rec_ident_list == []
+
+    assert test_ds.intern_rec_ident('rec-5') == 0
+    assert test_ds.intern_rec_ident('rec-1') == 1
+    assert test_ds.intern_rec_ident('rec-5') == 0, \
+           'Interned record identifier got a new record number'
+    assert test_ds.intern_rec_ident('rec-3') == 2
+
+    assert test_ds.get_rec_ident(0) == 'rec-5'
+    assert test_ds.get_rec_ident(2) == 'rec-3'
+    assert len(test_ds.rec_ident_num_dict) == 3
+
+    # Only lists that extend the interned record identifiers can be set
+    #
+    assert test_ds.set_rec_ident_list(['rec-1','rec-5']) == False
+    assert test_ds.set_rec_ident_list(['rec-5','rec-1','rec-3',
+                                       'rec-2']) == True
+    assert test_ds.intern_rec_ident('rec-2') == 3
+    assert test_ds.intern_rec_ident('rec-4') == 4
+
+    test_ds.finalise()
+
 # =============================================================================
 # Start tests when called from command line
 
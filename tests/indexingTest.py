@@ -49,13 +49,17 @@
 # =============================================================================
 # Import necessary modules (Python standard modules first, then Febrl modules)
 
+import os
 import sets
 import sys
 import unittest
 sys.path.append('..')
 
+import auxiliary   # Assumed to have been tested successfully
 import comparison  # Assumed to have been tested successfully
 import dataset     # Assumed to have been tested successfully
+import encode      # Assumed to have been tested successfully
+import output      # Assumed to have been tested successfully
 import stringcmp
 
 import indexing
@@ -679,6 +683,1140 @@ class TestCase(unittest.TestCase):
 
   # ---------------------------------------------------------------------------
 
+  def testParallelComparison(self):  # - - - - - - - - - - - - - - - - - - - -
+    """Test parallel record pair comparison"""
+
+    index_def1 = [['surname','surname',False,False,None,[]]]
+    index_def2 = [['given_name','given_name',True,True,4,[]],
+                  ['postcode','postcode',True,False,2,[]]]
+
+    for (ds2, rec_comp) in [(self.dataset2, self.rec_comp_link),
+                            (self.dataset1, self.rec_comp_dedupl)]:
+
+      block_index = indexing.BlockingIndex(description = 'Test blocking index',
+                                           dataset1 = self.dataset1,
+                                           dataset2 = ds2,
+                                           rec_comparator = rec_comp,
+                                           progress=2,
+                                           index_def = [index_def1,index_def2])
+      block_index.build()
+      block_index.compact()
+
+      [field_names_list, serial_w_vec_dict] = block_index.run()
+
+      for num_workers in [1, 2, 3]:
+
+        [field_names_list, this_w_vec_dict] = \
+                                  block_index.run(num_workers = num_workers)
+
+        assert this_w_vec_dict == serial_w_vec_dict
+
+      for lf in [50, 10]:
+        [field_names_list, serial_w_vec_dict] = \
+                                  block_index.run(length_filter_perc = lf)
+        [field_names_list, this_w_vec_dict] = \
+                   block_index.run(length_filter_perc = lf, num_workers = 2)
+
+        assert this_w_vec_dict == serial_w_vec_dict
+
+      for cot in [0.5, 0.9]:
+        [field_names_list, serial_w_vec_dict] = \
+                                  block_index.run(cut_off_threshold = cot)
+        [field_names_list, this_w_vec_dict] = \
+                    block_index.run(cut_off_threshold = cot, num_workers = 2)
+
+        assert this_w_vec_dict == serial_w_vec_dict
+
+      # Weight vector files must not depend upon the number of workers
+      #
+      file_content_list = []
+
+      for num_workers in [2, 3]:
+        block_index.weight_vec_file = './test-weight-vecs.csv'
+        assert block_index.run(num_workers = num_workers) == None
+
+        f = open('./test-weight-vecs.csv')
+        file_content_list.append(f.read())
+        f.close()
+
+      block_index.weight_vec_file = None
+      os.remove('./test-weight-vecs.csv')
+
+      assert file_content_list[0] == file_content_list[1]
+      assert len(file_content_list[0].split('\n')) == \
+             block_index.num_rec_pairs + 2  # Header line and last new line
+
+  def testParallelBuild(self):  # - - - - - - - - - - - - - - - - - - - - - - -
+    """Test parallel calculation of index values when building indices"""
+
+    index_def1 = [['surname','surname',False,False,None,[encode.soundex]]]
+    index_def2 = [['given_name','given_name',True,True,4,[]],
+                  ['postcode','postcode',True,False,2,[]]]
+
+    build_chunk_size = indexing.BUILD_CHUNK_SIZE
+    indexing.BUILD_CHUNK_SIZE = 7  # Make sure several chunks are used
+
+    try:
+      for (ds2, rec_comp) in [(self.dataset2, self.rec_comp_link),
+                              (self.dataset1, self.rec_comp_dedupl)]:
+
+        for (index_class, index_args) in \
+            [(indexing.BlockingIndex, {}),
+             (indexing.SortingIndex, {'window_size':3}),
+             (indexing.SortingIndex, {'window_size':3, 'streaming':True}),
+             (indexing.QGramIndex, {'q':2, 'threshold':0.8}),
+             (indexing.SuffixArrayIndex, {'block_method':(3,10),
+                                          'suffix_method':'allsubstr'})]:
+
+          index_list = []
+
+          for num_workers in [None, 1, 3]:
+            test_index = index_class(description = 'Test index',
+                                     dataset1 = self.dataset1,
+                                     dataset2 = ds2,
+                                     rec_comparator = rec_comp,
+                                     progress=2,
+                                     build_workers = num_workers,
+                                     index_def = [index_def1,index_def2],
+                                     **index_args)
+            test_index.build()
+            test_index.compact()
+
+            index_list.append(test_index)
+
+          for test_index in index_list[1:]:
+            assert test_index.num_rec_pairs == index_list[0].num_rec_pairs
+            assert test_index.rec_pair_dict == index_list[0].rec_pair_dict
+            assert test_index.rec_cache1 == index_list[0].rec_cache1
+            assert test_index.run() == index_list[0].run()
+
+    finally:
+      indexing.BUILD_CHUNK_SIZE = build_chunk_size
+
+  def testIndexValueCache(self):  # - - - - - - - - - - - - - - - - - - - - -
+    """Test caching of index variable values"""
+
+    funct_calls = [0]
+
+    def count_funct(s):  # A function that is not declared pure
+      funct_calls[0] += 1
+      return s[:3]
+
+    index_def1 = [['surname','surname',False,False,None,[encode.dmetaphone]],
+                  ['postcode','postcode',False,False,None,[count_funct]]]
+    index_def2 = [['given_name','given_name',True,True,4,
+                   [encode.get_substring,0,3]],
+                  ['suburb','suburb',False,True,None,[count_funct],True]]
+
+    index_list = []
+
+    for cache_size in [0, 5, 100000]:
+      block_index = indexing.BlockingIndex(description = 'Test blocking index',
+                                           dataset1 = self.dataset1,
+                                           dataset2 = self.dataset2,
+                                           rec_comparator = self.rec_comp_link,
+                                           index_val_cache_size = cache_size,
+                                           index_def = [index_def1,index_def2])
+
+      assert block_index.index_def_proc[0][0][6] == True  # From encode module
+      assert block_index.index_def_proc[0][1][6] == False
+      assert block_index.index_def_proc[1][1][6] == True  # Declared pure
+
+      funct_calls[0] = 0
+
+      block_index.build()
+
+      cache_stats = block_index.index_val_cache_stats
+
+      if (cache_size == 0):
+        assert cache_stats == [[None, None], [None, None]]
+        num_funct_calls = funct_calls[0]
+      else:
+        assert cache_stats[0][1] == None  # Not pure, so not cached
+        assert cache_stats[0][0][0] > 0   # Some cache hits
+        assert cache_stats[1][1][0] > 0
+        assert funct_calls[0] < num_funct_calls  # Suburb values are cached
+
+      index_list.append((block_index.index1, block_index.index2))
+
+    assert index_list[0] == index_list[1]
+    assert index_list[0] == index_list[2]
+
+    # Cache hits and misses of build worker processes are added up
+    #
+    for build_workers in [2, 3]:
+      par_block_index = indexing.BlockingIndex(description = 'Test index',
+                                           dataset1 = self.dataset1,
+                                           dataset2 = self.dataset2,
+                                           rec_comparator = self.rec_comp_link,
+                                           index_val_cache_size = 100000,
+                                           build_workers = build_workers,
+                                           index_def = [index_def1,index_def2])
+      par_block_index.build()
+
+      par_cache_stats = par_block_index.index_val_cache_stats
+
+      assert par_cache_stats[0][1] == None
+      for (i, j) in [(0, 0), (1, 0), (1, 1)]:
+        assert par_cache_stats[i][j][0] > 0
+        assert sum(par_cache_stats[i][j]) == sum(cache_stats[i][j])
+
+      assert (par_block_index.index1, par_block_index.index2) == index_list[0]
+
+  def testIterRun(self):  # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    """Test iterative record pair comparison"""
+
+    index_def1 = [['surname','surname',False,False,None,[]]]
+    index_def2 = [['given_name','given_name',True,True,4,[]],
+                  ['postcode','postcode',True,False,2,[]]]
+
+    for (ds2, rec_comp) in [(self.dataset2, self.rec_comp_link),
+                            (self.dataset1, self.rec_comp_dedupl)]:
+
+      full_index = indexing.FullIndex(description = 'Test full index',
+                                      dataset1 = self.dataset1,
+                                      dataset2 = ds2,
+                                      rec_comparator = rec_comp,
+                                      progress=2,
+                                      index_def = [])
+      block_index = indexing.BlockingIndex(description = 'Test blocking index',
+                                           dataset1 = self.dataset1,
+                                           dataset2 = ds2,
+                                           rec_comparator = rec_comp,
+                                           progress=2,
+                                           index_def = [index_def1,index_def2])
+
+      for index in [full_index, block_index]:
+        index.build()
+        index.compact()
+
+        for (lf, cot) in [(None, None), (20, None), (None, 0.5)]:
+
+          [field_names_list, w_vec_dict] = index.run(lf, cot)
+
+          iter_w_vec_dict = {}
+          for (rec_ident1, rec_ident2, w_vec) in index.iter_run(lf, cot):
+            assert (rec_ident1, rec_ident2) not in iter_w_vec_dict
+            iter_w_vec_dict[(rec_ident1, rec_ident2)] = w_vec
+
+          assert iter_w_vec_dict == w_vec_dict
+
+          index.weight_vec_store = True
+          [field_names_list, w_vec_store] = index.run(lf, cot)
+          index.weight_vec_store = False
+
+          assert isinstance(w_vec_store, auxiliary.WeightVectorStore)
+          assert w_vec_store == w_vec_dict
+
+  def testPrepareComparators(self):  # - - - - - - - - - - - - - - - - - - - -
+    """Test preparing field comparators with the record caches"""
+
+    index_def1 = [['surname','surname',False,False,None,[]]]
+    index_def2 = [['given_name','given_name',True,True,4,[]],
+                  ['postcode','postcode',True,False,2,[]]]
+
+    def get_field_comp_list():
+      return [(comparison.FieldComparatorQGram(threshold = 0.5, q = 2,
+                                               common_div = 'average'),
+               'surname', 'surname'),
+              (comparison.FieldComparatorPosQGram(threshold = 0.5, q = 2,
+                                                  max_dist = 2,
+                                                  common_div = 'shortest'),
+               'suburb', 'suburb'),
+              (comparison.FieldComparatorTokenSet(threshold = 0.0,
+                                                  common_div = 'longest',
+                                                  stop_word_list = ['st']),
+               'address_1', 'address_1'),
+              (comparison.FieldComparatorCharHistogram(threshold = 0.0),
+               'given_name', 'given_name'),
+              (comparison.FieldComparatorEncodeString(encode_method = \
+                                                      'soundex'),
+               'surname', 'surname')]
+
+    for ds2 in [self.dataset2, self.dataset1]:
+
+      w_vec_dict_list = []
+
+      for prepare_comparators in [False, True]:
+
+        field_comp_list = get_field_comp_list()
+        rec_comp = comparison.RecordComparator(self.dataset1, ds2,
+                                               field_comp_list)
+
+        block_index = indexing.BlockingIndex(description = 'Test index',
+                                       dataset1 = self.dataset1,
+                                       dataset2 = ds2,
+                                       rec_comparator = rec_comp,
+                                       index_def = [index_def1, index_def2],
+                                       prepare_comparators = \
+                                                         prepare_comparators)
+        block_index.build()
+        block_index.compact()
+
+        [field_names_list, w_vec_dict] = block_index.run()
+        w_vec_dict_list.append(w_vec_dict)
+
+        iter_w_vec_dict = {}
+        for (rec_ident1, rec_ident2, w_vec) in block_index.iter_run():
+          iter_w_vec_dict[(rec_ident1, rec_ident2)] = w_vec
+        assert iter_w_vec_dict == w_vec_dict
+
+        for i in range(len(field_comp_list)):
+          field_comp = field_comp_list[i][0]
+          field_index1 = rec_comp.field_comparison_list[i][1]
+
+          assert (field_comp.profile_dict != {}) == prepare_comparators
+
+          # Profiles are calculated for all values in the record caches
+          #
+          if (prepare_comparators == True):
+            for rec in block_index.rec_cache1.itervalues():
+              if (rec[field_index1] != ''):
+                assert rec[field_index1] in field_comp.profile_dict
+
+          field_comp.clear_profiles()
+          assert field_comp.profile_dict == {}
+
+      assert w_vec_dict_list[0] == w_vec_dict_list[1]
+
+  def testBinaryWeightVectorFile(self):  # - - - - - - - - - - - - - - - - - -
+    """Test writing and loading of binary weight vector files"""
+
+    index_def1 = [['surname','surname',False,False,None,[]]]
+
+    bin_file_name = 'test-weight-vectors.bin'
+
+    for (ds2, rec_comp) in [(self.dataset2, self.rec_comp_link),
+                            (self.dataset1, self.rec_comp_dedupl)]:
+
+      block_index = indexing.BlockingIndex(description = 'Test blocking index',
+                                           dataset1 = self.dataset1,
+                                           dataset2 = ds2,
+                                           rec_comparator = rec_comp,
+                                           progress=2,
+                                           index_def = [index_def1])
+      block_index.build()
+      block_index.compact()
+
+      [field_names_list, w_vec_dict] = block_index.run()
+
+      block_index.weight_vec_file = bin_file_name
+      block_index.run()
+      block_index.weight_vec_file = None
+
+      assert output.IsWeightVectorBinaryFile(bin_file_name) == True
+
+      [bin_field_names_list, bin_w_vec_store] = \
+                                output.LoadWeightVectorFile(bin_file_name)
+
+      assert bin_field_names_list == field_names_list
+      assert len(bin_w_vec_store) == len(w_vec_dict)
+      assert bin_w_vec_store == w_vec_dict
+      for (rec_id_tuple, w_vec) in w_vec_dict.iteritems():
+        assert bin_w_vec_store[rec_id_tuple] == w_vec
+
+      # Modifying a loaded store reads the weights into memory
+      #
+      bin_w_vec_copy = bin_w_vec_store.copy()
+      rec_id_tuple = bin_w_vec_store.keys()[0]
+      del bin_w_vec_store[rec_id_tuple]
+      assert rec_id_tuple not in bin_w_vec_store
+      assert len(bin_w_vec_store) == len(w_vec_dict) - 1
+      assert bin_w_vec_copy == w_vec_dict
+
+      output.SaveWeightVectorBinaryFile(w_vec_dict, field_names_list,
+                                        bin_file_name, 'f')
+      [bin_field_names_list, bin_w_vec_store] = \
+                              output.LoadWeightVectorBinaryFile(bin_file_name)
+      assert bin_w_vec_store.weight_type == 'f'
+      assert len(bin_w_vec_store) == len(w_vec_dict)
+      for (rec_id_tuple, w_vec) in bin_w_vec_store.iteritems():
+        for i in range(len(w_vec)):
+          assert abs(w_vec[i] - w_vec_dict[rec_id_tuple][i]) < 0.0001
+
+      os.remove(bin_file_name)
+
+    # Unsorted and duplicate record pairs are sorted with runs of few rows
+    #
+    for (weight_type, run_size) in [('d', 1), ('d', 3), ('f', 4), ('d', 100)]:
+
+      w_vec_writer = output.BinaryWeightVectorWriter(bin_file_name,
+                                                     ['f1', 'f2'],
+                                                     weight_type, run_size)
+      test_w_vec_dict = {}
+
+      for i in range(60):
+        rec_id_tuple = ('a%d' % ((i*3) % 7), 'b%d' % ((i*2) % 5))
+        w_vec = [float(i), -0.5*i]
+
+        w_vec_writer.writerow(list(rec_id_tuple)+w_vec)
+        test_w_vec_dict[rec_id_tuple] = w_vec  # Last one written is kept
+
+      w_vec_writer.close()
+
+      [bin_field_names_list, bin_w_vec_store] = \
+                              output.LoadWeightVectorBinaryFile(bin_file_name)
+      assert bin_field_names_list == ['f1', 'f2']
+      assert bin_w_vec_store.weight_type == weight_type
+      assert len(bin_w_vec_store) == len(test_w_vec_dict)
+      assert bin_w_vec_store == test_w_vec_dict
+      assert bin_w_vec_store.copy() == test_w_vec_dict
+
+      os.remove(bin_file_name)
+
+    w_vec_writer = output.BinaryWeightVectorWriter(bin_file_name, ['f1'])
+    w_vec_writer.close()
+    [bin_field_names_list, bin_w_vec_store] = \
+                              output.LoadWeightVectorBinaryFile(bin_file_name)
+    assert bin_field_names_list == ['f1']
+    assert len(bin_w_vec_store) == 0
+
+    os.remove(bin_file_name)
+
+  def testSaveLoad(self):  # - - - - - - - - - - - - - - - - - - - - - - - - -
+    """Test saving and loading of indices"""
+
+    index_def1 = [['surname','surname',False,False,None,[]]]
+    index_def2 = [['given_name','given_name',True,True,4,[]],
+                  ['postcode','postcode',True,False,2,[]]]
+
+    index_file_name = 'test-index.idx'
+
+    for (ds2, rec_comp) in [(self.dataset2, self.rec_comp_link),
+                            (self.dataset1, self.rec_comp_dedupl)]:
+
+      for index_class in [indexing.FullIndex, indexing.BlockingIndex]:
+
+        if (index_class == indexing.FullIndex):
+          index_def = []
+        else:
+          index_def = [index_def1,index_def2]
+
+        index = index_class(description = 'Test index',
+                            dataset1 = self.dataset1,
+                            dataset2 = ds2,
+                            rec_comparator = rec_comp,
+                            progress=2,
+                            index_def = index_def)
+        index.build()
+        index.compact()
+        index.save(index_file_name)
+
+        [field_names_list, w_vec_dict] = index.run()
+
+        loaded_index = index_class(description = 'Test loaded index',
+                                   dataset1 = self.dataset1,
+                                   dataset2 = ds2,
+                                   rec_comparator = rec_comp,
+                                   progress=2,
+                                   index_def = index_def)
+
+        assert loaded_index.load(index_file_name) == True
+        assert loaded_index.status == 'compacted'
+        assert loaded_index.num_rec_pairs == index.num_rec_pairs
+
+        [loaded_field_names_list, loaded_w_vec_dict] = loaded_index.run()
+
+        assert loaded_field_names_list == field_names_list
+        assert loaded_w_vec_dict == w_vec_dict
+
+        # A modification time change without content change is accepted
+        #
+        os.utime(self.dataset1.file_name, None)
+        assert loaded_index.load(index_file_name) == True
+
+        # New data set objects get the interned record identifiers restored
+        #
+        new_ds1 = dataset.DataSetCSV(description='First test CSV data set',
+                                     access_mode='read',
+                                     rec_ident='rec_id',
+                                     header_line=True,
+                                     file_name='./test-data.csv')
+        if (ds2 == self.dataset1):
+          new_ds2 = new_ds1
+        else:
+          new_ds2 = dataset.DataSetCSV(description='Second test CSV data set',
+                                       access_mode='read',
+                                       rec_ident='rec_id',
+                                       header_line=True,
+                                       file_name='./test-data.csv')
+        new_rec_comp = comparison.RecordComparator(new_ds1, new_ds2,
+                                             rec_comp.field_comparator_list)
+
+        loaded_index = index_class(description = 'Test loaded index',
+                                   dataset1 = new_ds1,
+                                   dataset2 = new_ds2,
+                                   rec_comparator = new_rec_comp,
+                                   progress=2,
+                                   index_def = index_def)
+
+        assert loaded_index.load(index_file_name) == True
+        assert new_ds1.rec_ident_list == self.dataset1.rec_ident_list
+        assert loaded_index.run()[1] == w_vec_dict
+
+      # Different index definitions or index class do not match saved index
+      #
+      other_index = indexing.BlockingIndex(description = 'Test other index',
+                                           dataset1 = self.dataset1,
+                                           dataset2 = ds2,
+                                           rec_comparator = rec_comp,
+                                           progress=2,
+                                           index_def = [index_def1])
+      assert other_index.load(index_file_name) == False
+
+      other_index = indexing.SortingIndex(description = 'Test other index',
+                                          dataset1 = self.dataset1,
+                                          dataset2 = ds2,
+                                          rec_comparator = rec_comp,
+                                          progress=2,
+                                          window_size = 3,
+                                          index_def = [index_def1,index_def2])
+      assert other_index.load(index_file_name) == False
+
+      # Different arguments of the index class do not match the saved index
+      #
+      for (index_class, saved_kwargs, other_kwargs) in \
+          [(indexing.SortingIndex, {'window_size':2}, {'window_size':9}),
+           (indexing.QGramIndex, {'q':2, 'threshold':0.9},
+                                 {'q':3, 'threshold':0.5})]:
+
+        index = index_class(description = 'Test index',
+                            dataset1 = self.dataset1,
+                            dataset2 = ds2,
+                            rec_comparator = rec_comp,
+                            index_def = [index_def1,index_def2],
+                            **saved_kwargs)
+        index.build()
+        index.compact()
+        index.save(index_file_name)
+
+        same_index = index_class(description = 'Test same index',
+                                 dataset1 = self.dataset1,
+                                 dataset2 = ds2,
+                                 rec_comparator = rec_comp,
+                                 index_def = [index_def1,index_def2],
+                                 **saved_kwargs)
+        assert same_index.load(index_file_name) == True
+
+        other_index = index_class(description = 'Test other index',
+                                  dataset1 = self.dataset1,
+                                  dataset2 = ds2,
+                                  rec_comparator = rec_comp,
+                                  index_def = [index_def1,index_def2],
+                                  **other_kwargs)
+        assert other_index.load(index_file_name) == False
+
+      os.remove(index_file_name)
+
+      assert other_index.load(index_file_name) == False
+
+  def testDiskInvertedIndex(self):  # - - - - - - - - - - - - - - - - - - -
+    """Test disk based inverted indices and record caches"""
+
+    disk_index = indexing.DiskInvertedIndex('test-disk-index.db', 3)
+
+    for (block_val, rec_num) in [('b', 1), ('a', 2), ('b', 3), ('', 4),
+                                 ('c'+chr(0)+'x', 5), ('a', 6), ('b', 7)]:
+      disk_index.append(block_val, rec_num)
+
+    assert len(disk_index) == 4
+    assert disk_index.keys() == ['', 'a', 'b', 'c'+chr(0)+'x']
+    assert disk_index['b'] == [1, 3, 7]
+    assert disk_index.get('d', []) == []
+    assert ('a' in disk_index) == True
+    assert ('d' in disk_index) == False
+    assert disk_index.items() == [('', [4]), ('a', [2, 6]), ('b', [1, 3, 7]),
+                                  ('c'+chr(0)+'x', [5])]
+
+    disk_index['a'] = [2, 6, 8]
+    assert disk_index.pop('b') == [1, 3, 7]
+    assert disk_index.pop('b', None) == None
+    del disk_index['']
+    assert dict(disk_index.iteritems()) == {'a':[2, 6, 8],
+                                            'c'+chr(0)+'x':[5]}
+
+    disk_index.clear()
+    assert len(disk_index) == 0
+    disk_index.close()
+
+    rec_cache = indexing.DiskRecordCache('test-disk-cache.db', 2)
+    for rec_num in range(5):
+      rec_cache[rec_num] = ['rec', str(rec_num)]
+    assert len(rec_cache) == 5
+    assert rec_cache[4] == ['rec', '4']
+    assert rec_cache.keys() == range(5)
+    assert (5 in rec_cache) == False
+    rec_cache.close()
+
+    # Disk based indices give the same record pairs as dictionaries
+    #
+    index_def1 = [['surname','surname',False,False,None,[]]]
+    index_def2 = [['given_name','given_name',True,True,4,[]],
+                  ['postcode','postcode',True,False,2,[]]]
+
+    for (ds2, rec_comp) in [(self.dataset2, self.rec_comp_link),
+                            (self.dataset1, self.rec_comp_dedupl)]:
+
+      for (index_class, index_args) in [(indexing.BlockingIndex, {}),
+                                        (indexing.SortingIndex,
+                                         {'window_size':3}),
+                                        (indexing.QGramIndex,
+                                         {'q':2, 'threshold':0.8})]:
+
+        mem_index = index_class(description = 'Test index',
+                                dataset1 = self.dataset1,
+                                dataset2 = ds2,
+                                rec_comparator = rec_comp,
+                                index_def = [index_def1, index_def2],
+                                **index_args)
+        mem_index.build()
+        mem_index.compact()
+        mem_w_vec_dict = mem_index.run()[1]
+
+        disk_index = index_class(description = 'Test disk index',
+                                 dataset1 = self.dataset1,
+                                 dataset2 = ds2,
+                                 rec_comparator = rec_comp,
+                                 index1_file_name = 'test-disk-index1',
+                                 index2_file_name = 'test-disk-index2',
+                                 rec_cache1_file_name = 'test-disk-cache1.db',
+                                 rec_cache2_file_name = 'test-disk-cache2.db',
+                                 index_def = [index_def1, index_def2],
+                                 **index_args)
+        disk_index.build()
+        assert isinstance(disk_index.index1[0], indexing.DiskInvertedIndex)
+        assert isinstance(disk_index.rec_cache1, indexing.DiskRecordCache)
+
+        disk_index.compact()
+        assert disk_index.num_rec_pairs == mem_index.num_rec_pairs
+        assert disk_index.run()[1] == mem_w_vec_dict
+        assert disk_index.run(None, None, 2)[1] == mem_w_vec_dict
+
+        disk_index.build()  # Building again clears the disk based indices
+        disk_index.compact()
+        assert disk_index.run()[1] == mem_w_vec_dict
+
+        for this_index in disk_index.index1.values() + \
+                          disk_index.index2.values():
+          this_index.close()
+        disk_index.rec_cache1.close()
+        disk_index.rec_cache2.close()
+
+    for file_name in ['test-disk-index.db', 'test-disk-cache.db',
+                      'test-disk-cache1.db', 'test-disk-cache2.db'] + \
+                     ['test-disk-index%d-%d' % (j, i) for j in [1, 2] \
+                      for i in [0, 1]]:
+      if (os.path.exists(file_name)):
+        os.remove(file_name)
+
+  def testBlockingIndexLazyPairs(self):  # - - - - - - - - - - - - - - - - - -
+    """Test BlockingIndex with lazy record pair generation"""
+
+    index_def1 = [['surname','surname',False,False,None,[]]]
+    index_def2 = [['given_name','given_name',True,True,4,[]],
+                  ['postcode','postcode',True,False,2,[]]]
+    index_def3 = [['postcode','postcode',False,False,None,[]]]
+    index_def4 = [['surname','surname',False,False,2,[]]]
+
+    for (ds2, rec_comp) in [(self.dataset2, self.rec_comp_link),
+                            (self.dataset1, self.rec_comp_dedupl)]:
+
+      for index_def in [[index_def1], [index_def1, index_def2],
+                        [index_def4, index_def1, index_def3]]:
+
+        block_index = indexing.BlockingIndex(description = 'Test blocking',
+                                             dataset1 = self.dataset1,
+                                             dataset2 = ds2,
+                                             rec_comparator = rec_comp,
+                                             progress=2,
+                                             index_def = index_def)
+        block_index.build()
+        block_index.compact()
+
+        [field_names_list, w_vec_dict] = block_index.run()
+
+        lazy_index = indexing.BlockingIndex(description = 'Test lazy blocking',
+                                            dataset1 = self.dataset1,
+                                            dataset2 = ds2,
+                                            rec_comparator = rec_comp,
+                                            progress=2,
+                                            lazy_pairs = True,
+                                            index_def = index_def)
+        assert lazy_index.lazy_pairs == True
+        lazy_index.build()
+        lazy_index.compact()
+
+        assert lazy_index.rec_pair_dict == None
+        assert lazy_index.num_rec_pairs == block_index.num_rec_pairs, \
+               (lazy_index.num_rec_pairs, block_index.num_rec_pairs)
+
+        [lazy_field_names_list, lazy_w_vec_dict] = lazy_index.run()
+        assert lazy_field_names_list == field_names_list
+        assert lazy_w_vec_dict == w_vec_dict
+
+        iter_w_vec_dict = {}
+        for (rec_ident1, rec_ident2, w_vec) in lazy_index.iter_run():
+          assert (rec_ident1, rec_ident2) not in iter_w_vec_dict
+          iter_w_vec_dict[(rec_ident1, rec_ident2)] = w_vec
+        assert iter_w_vec_dict == w_vec_dict
+
+        assert lazy_index.run(None, None, 2)[1] == w_vec_dict
+
+  def testBlockGuard(self):  # - - - - - - - - - - - - - - - - - - - - - - - -
+    """Test the maximum block size and block policies"""
+
+    index_def = [['postcode','postcode',False,False,2,[]]]
+    sub_block_def1 = [['surname','surname',False,False,1,[]]]
+    sub_block_def2 = [['given_name','given_name',False,False,1,[]]]
+
+    for (ds2, rec_comp) in [(self.dataset2, self.rec_comp_link),
+                            (self.dataset1, self.rec_comp_dedupl)]:
+
+      for (index_class, index_args) in [(indexing.BlockingIndex, {}),
+                                        (indexing.SortingIndex,
+                                         {'window_size':2}),
+                                        (indexing.QGramIndex,
+                                         {'q':2, 'threshold':0.8})]:
+
+        all_index = index_class(description = 'Test index',
+                                dataset1 = self.dataset1,
+                                dataset2 = ds2,
+                                rec_comparator = rec_comp,
+                                index_def = [index_def], **index_args)
+        all_index.build()
+        all_index.compact()
+        all_w_vec_dict = all_index.run()[1]
+
+        assert len(all_index.block_size_hist) == 1
+        assert all_index.block_size_hist[0] != {}
+
+        num_hist_pairs = 0
+        for (num_blocks, num_pairs) in all_index.block_size_hist[0].values():
+          assert num_blocks > 0
+          num_hist_pairs += num_pairs
+        if (index_class != indexing.SortingIndex):  # Windows span blocks
+          assert num_hist_pairs >= all_index.num_rec_pairs
+
+        for (block_policy, sub_block_def) in [('cap', []), ('sample', []),
+                           ('subblock', [sub_block_def1]),
+                           ('subblock', [sub_block_def1, sub_block_def2])]:
+
+          guard_index = index_class(description = 'Test guarded index',
+                                    dataset1 = self.dataset1,
+                                    dataset2 = ds2,
+                                    rec_comparator = rec_comp,
+                                    max_block_size = 3,
+                                    block_policy = block_policy,
+                                    sub_block_def = sub_block_def,
+                                    index_def = [index_def], **index_args)
+          assert guard_index.max_block_size == 3
+          assert guard_index.block_policy == block_policy
+          guard_index.build()
+          guard_index.compact()
+
+          assert guard_index.block_guard_stats[0] > 0
+          assert guard_index.num_rec_pairs < all_index.num_rec_pairs
+
+          guard_w_vec_dict = guard_index.run()[1]
+          assert len(guard_w_vec_dict) == guard_index.num_rec_pairs
+
+          for (rec_id_tuple, w_vec) in guard_w_vec_dict.items():
+            assert all_w_vec_dict[rec_id_tuple] == w_vec
+
+          if (index_class == indexing.BlockingIndex):
+            for this_index in [guard_index.index1[0], guard_index.index2[0]]:
+              for block_recs in this_index.values():
+                assert len(block_recs) <= 3
+
+          # A second index gives the same record pairs (fixed sampling seed)
+          #
+          guard_index.build()
+          guard_index.compact()
+          assert guard_index.run()[1] == guard_w_vec_dict
+
+    # Blocks that are small enough are not changed
+    #
+    for max_block_size in [None, 1000]:
+      guard_index = indexing.BlockingIndex(description = 'Test guarded index',
+                                           dataset1 = self.dataset1,
+                                           dataset2 = self.dataset2,
+                                           rec_comparator = self.rec_comp_link,
+                                           max_block_size = max_block_size,
+                                           index_def = [index_def])
+      guard_index.build()
+      guard_index.compact()
+      assert guard_index.block_guard_stats == [0, 0]
+
+      if (max_block_size == None):
+        all_w_vec_dict = guard_index.run()[1]
+      else:
+        assert guard_index.run()[1] == all_w_vec_dict
+
+    # BigMatch and Dedup indices
+    #
+    for (index_class, ds2, rec_comp) in \
+        [(indexing.BigMatchIndex, self.dataset2, self.rec_comp_link),
+         (indexing.DedupIndex, self.dataset1, self.rec_comp_dedupl)]:
+
+      for block_method in [('block',), ('sort',2), ('qgram',2,True,0.8)]:
+
+        all_index = index_class(description = 'Test index',
+                                dataset1 = self.dataset1,
+                                dataset2 = ds2,
+                                rec_comparator = rec_comp,
+                                block_method = block_method,
+                                index_def = [index_def])
+        all_index.build()
+        all_index.compact()
+        all_w_vec_dict = all_index.run()[1]
+
+        for (block_policy, sub_block_def) in [('cap', []), ('sample', []),
+                                             ('subblock', [sub_block_def1])]:
+
+          guard_index = index_class(description = 'Test guarded index',
+                                    dataset1 = self.dataset1,
+                                    dataset2 = ds2,
+                                    rec_comparator = rec_comp,
+                                    block_method = block_method,
+                                    max_block_size = 3,
+                                    block_policy = block_policy,
+                                    sub_block_def = sub_block_def,
+                                    index_def = [index_def])
+          guard_index.build()
+          guard_index.compact()
+          guard_w_vec_dict = guard_index.run()[1]
+
+          assert guard_index.block_guard_stats[0] > 0
+          assert len(guard_w_vec_dict) < len(all_w_vec_dict)
+          assert guard_index.block_size_hist[0] != {}
+
+          for (rec_id_tuple, w_vec) in guard_w_vec_dict.items():
+            assert all_w_vec_dict[rec_id_tuple] == w_vec
+
+    # Illegal arguments
+    #
+    for (max_block_size, block_policy, sub_block_def) in \
+        [(0, 'cap', []), (3, 'split', []), (3, 'subblock', [])]:
+
+      try:
+        guard_index = indexing.BlockingIndex(description = 'Test',
+                                            dataset1 = self.dataset1,
+                                            dataset2 = self.dataset2,
+                                            rec_comparator = self.rec_comp_link,
+                                            max_block_size = max_block_size,
+                                            block_policy = block_policy,
+                                            sub_block_def = sub_block_def,
+                                            index_def = [index_def])
+      except:
+        pass
+      else:
+        raise AssertionError
+
+  def testEstimate(self):  # - - - - - - - - - - - - - - - - - - - - - - - - -
+    """Test estimating the cost of indices before compacting"""
+
+    index_def1 = [['surname','surname',False,False,None,[]]]
+    index_def2 = [['postcode','postcode',False,False,2,[]]]
+    sub_block_def = [['given_name','given_name',False,False,1,[]]]
+
+    for (ds2, rec_comp) in [(self.dataset2, self.rec_comp_link),
+                            (self.dataset1, self.rec_comp_dedupl)]:
+
+      for (index_class, index_args) in [(indexing.FullIndex, {}),
+                                        (indexing.BlockingIndex, {}),
+                                        (indexing.BlockingIndex,
+                                         {'max_block_size':3,
+                                          'block_policy':'subblock',
+                                          'sub_block_def':[sub_block_def]}),
+                                        (indexing.SortingIndex,
+                                         {'window_size':3}),
+                                        (indexing.SortingIndex,
+                                         {'window_size':2, 'streaming':True,
+                                          'run_size':5}),
+                                        (indexing.SortingIndex,
+                                         {'window_size':2, 'max_block_size':2,
+                                          'block_policy':'sample'}),
+                                        (indexing.QGramIndex,
+                                         {'q':2, 'threshold':0.8}),
+                                        (indexing.QGramIndex,
+                                         {'q':1, 'threshold':0.6,
+                                          'max_block_size':4})]:
+
+        test_index = index_class(description = 'Test index',
+                                 dataset1 = self.dataset1,
+                                 dataset2 = ds2,
+                                 rec_comparator = rec_comp,
+                                 index_def = [index_def1, index_def2],
+                                 **index_args)
+        test_index.build()
+
+        exact_est = test_index.estimate(None)
+        assert exact_est['exact'] == True
+        assert exact_est['num_rec_pairs'] > 0
+        assert exact_est['rec_pair_memory'] >= 0
+        assert exact_est['weight_vec_memory'] > 0
+        assert exact_est['comp_time'] > 0.0
+        assert len(exact_est['field_comp_time']) == \
+               len(rec_comp.field_comparison_list)
+
+        if (index_class != indexing.FullIndex):
+          assert len(exact_est['block_size_hist']) == 2
+
+        sample_est = test_index.estimate(5, 10)
+        assert sample_est['exact'] == (index_class == indexing.FullIndex)
+        assert sample_est['num_rec_pairs'] >= 0
+
+        test_index.compact()
+
+        # The record pairs actually compared (a streaming index compares a
+        # record pair from several indices more than once)
+        #
+        num_comp_rec_pairs = len(list(test_index.iter_run()))
+
+        assert exact_est['num_rec_pairs'] == num_comp_rec_pairs
+        assert exact_est['num_rec_pairs'] == test_index.num_rec_pairs
+        if (index_args.get('streaming', False) == True):
+          assert num_comp_rec_pairs > len(test_index.run()[1])
+          assert exact_est['rec_pair_memory'] == 0
+
+        try:  # Index has been compacted already
+          test_index.estimate()
+        except:
+          pass
+        else:
+          raise AssertionError
+
+    # The record pairs of a string map index are only known after compact()
+    #
+    test_index = indexing.StringMapIndex(description = 'Test index',
+                                         dataset1 = self.dataset1,
+                                         dataset2 = self.dataset2,
+                                         rec_comparator = self.rec_comp_link,
+                                         index_def = [index_def1],
+                                         canopy_method = ('nearest', 2, 2),
+                                         dim = 10,
+                                         sub_dim = 2,
+                                         grid_resolution = 10,
+                                         sim_funct = stringcmp.editdist)
+    test_index.build()
+
+    unknown_est = test_index.estimate()
+    assert unknown_est['num_rec_pairs'] == None
+    assert unknown_est['comp_time'] == None
+    assert unknown_est['field_comp_time'][0] > 0.0
+
+  def testParallelComparisonCounters(self):  # - - - - - - - - - - - - - - -
+    """Test counters of comparators in parallel record pair comparison"""
+
+    index_def1 = [['surname','surname',False,False,None,[]]]
+    index_def2 = [['postcode','postcode',True,False,2,[]]]
+
+    counter_list_list = []
+    w_vec_dict_list =   []
+
+    # Small batches so that there are several batches per shard
+    #
+    comparison_batch_size = indexing.COMPARISON_BATCH_SIZE
+    indexing.COMPARISON_BATCH_SIZE = 10
+
+    try:
+      for num_workers in [None, 2, 3]:
+
+        gn_jfc = comparison.FieldComparatorJaro(threshold = 0.75,
+                                                desc = 'Givenname Jaro')
+        sn_wfcc = comparison.FieldComparatorWinkler(threshold = 0.5,
+                                                    desc = 'Surname Winkler')
+        sub_qfc = comparison.FieldComparatorQGram(threshold = 0.8, q = 2,
+                                                  common_div = 'average',
+                                                  desc = 'Suburb QGram')
+        gn_qfcc = comparison.FieldComparatorQGram(threshold = 0.0, q = 2,
+                                                  common_div = 'average',
+                                                  desc = 'Givenname QGram',
+                                                  do_cache=True)
+
+        field_comp_list = [(gn_jfc,  'given_name', 'given_name'),
+                           (sn_wfcc, 'surname', 'surname'),
+                           (sub_qfc, 'suburb', 'suburb'),
+                           (gn_qfcc, 'given_name', 'given_name')]
+
+        rec_comp = comparison.RecordComparator(self.dataset1, self.dataset2,
+                                               field_comp_list)
+
+        block_index = indexing.BlockingIndex(description = 'Test index',
+                                             dataset1 = self.dataset1,
+                                             dataset2 = self.dataset2,
+                                             rec_comparator = rec_comp,
+                                             index_def = [index_def1,
+                                                          index_def2])
+        block_index.build()
+        block_index.compact()
+        [field_names_list, w_vec_dict] = \
+                                     block_index.run(num_workers = num_workers)
+
+        counter_list_list.append(rec_comp.get_counters())
+        w_vec_dict_list.append(w_vec_dict)
+
+    finally:
+      indexing.COMPARISON_BATCH_SIZE = comparison_batch_size
+
+    serial_counter_list = counter_list_list[0]
+
+    assert serial_counter_list[0][0] > 0  # Values pairs compared in batches
+    assert serial_counter_list[2][2] > 0  # Pruned values pairs
+    assert serial_counter_list[3][3] > 0  # Cache hits
+
+    for i in range(1, len(counter_list_list)):
+      counter_list = counter_list_list[i]
+
+      assert w_vec_dict_list[i] == w_vec_dict_list[0]
+
+      for j in range(len(counter_list)):
+
+        # Batch statistics and pruned values pairs are the same, while every
+        # worker has its own cache (so there can be fewer cache hits)
+        #
+        assert counter_list[j][:3] == serial_counter_list[j][:3]
+        assert sum(counter_list[j][3:5]) == sum(serial_counter_list[j][3:5])
+
+      assert counter_list[3][3] > 0
+
+  # ---------------------------------------------------------------------------
+
+  def testBigMatchDedupRun(self):  # - - - - - - - - - - - - - - - - - - - - -
+    """Test run() of the BigMatch and Dedup indices"""
+
+    index_def = [['surname','surname',False,False,None,[]]]
+
+    for (index_class, ds2, rec_comp) in \
+        [(indexing.BigMatchIndex, self.dataset2, self.rec_comp_link),
+         (indexing.DedupIndex, self.dataset1, self.rec_comp_dedupl)]:
+
+      for block_method in [('block',), ('sort',2), ('qgram',2,True,0.8)]:
+
+        test_index = index_class(description = 'Test index',
+                                 dataset1 = self.dataset1,
+                                 dataset2 = ds2,
+                                 rec_comparator = rec_comp,
+                                 block_method = block_method,
+                                 index_def = [index_def])
+        test_index.build()
+        test_index.compact()
+
+        [field_names_list, w_vec_dict] = test_index.run()
+
+        assert len(w_vec_dict) > 0
+        assert len(w_vec_dict) == test_index.num_rec_pairs
+
+        [field_names_list, w_vec_dict] = \
+                                  test_index.run(length_filter_perc = 50,
+                                                 cut_off_threshold = 0.5)
+        assert len(w_vec_dict) <= test_index.num_rec_pairs
+
+  # ---------------------------------------------------------------------------
+
+  def testRecordCacheFile(self):  # - - - - - - - - - - - - - - - - - - - - - -
+    """Test indices with file based record caches"""
+
+    index_def = [['surname','surname',False,False,None,[]]]
+
+    for (ds2, rec_comp) in [(self.dataset2, self.rec_comp_link),
+                            (self.dataset1, self.rec_comp_dedupl)]:
+
+      mem_index = indexing.BlockingIndex(description = 'Test memory index',
+                                         dataset1 = self.dataset1,
+                                         dataset2 = ds2,
+                                         rec_comparator = rec_comp,
+                                         index_def = [index_def])
+      mem_index.build()
+      mem_index.compact()
+      mem_w_vec_dict = mem_index.run()[1]
+
+      file_index = indexing.BlockingIndex(description = 'Test file index',
+                                    dataset1 = self.dataset1,
+                                    dataset2 = ds2,
+                                    rec_comparator = rec_comp,
+                                    rec_cache1_file_name = 'test-rec-cache1',
+                                    rec_cache2_file_name = 'test-rec-cache2',
+                                    index_def = [index_def])
+      file_index.build()
+
+      assert isinstance(file_index.rec_cache1, indexing.DiskRecordCache)
+      assert isinstance(file_index.rec_cache2, indexing.DiskRecordCache)
+      assert sorted(file_index.rec_cache1.keys()) == \
+             sorted(mem_index.rec_cache1.keys())
+      for (rec_num, rec) in mem_index.rec_cache1.items():
+        assert file_index.rec_cache1[rec_num] == rec
+        assert rec_num in file_index.rec_cache1
+
+      file_index.compact()
+      assert file_index.run()[1] == mem_w_vec_dict
+
+      file_index.rec_cache1.close()
+      file_index.rec_cache2.close()
+
+    for file_name in os.listdir('.'):
+      if (file_name.startswith('test-rec-cache')):
+        os.remove(file_name)
+
+  # ---------------------------------------------------------------------------
+
+  def testInternOrder(self):  # - - - - - - - - - - - - - - - - - - - - - - - -
+    """Test record pairs do not depend upon the order of record numbers"""
+
+    index_def1 = [['surname','surname',False,False,None,[]]]
+    index_def2 = [['given_name','given_name',False,False,None,[]]]
+
+    for (index_class, index_kwargs) in \
+        [(indexing.SortingArrayIndex, {'window_size':3}),
+         (indexing.CanopyIndex, {'canopy_method':('jaccard','nearest',2,3),
+                                 'q':2, 'padded':True, 'delete_perc':80}),
+         (indexing.CanopyIndex, {'canopy_method':('tfidf','threshold',0.8,
+                                                  0.6),
+                                 'q':2, 'padded':True, 'delete_perc':80})]:
+
+      for do_dedup in [False, True]:
+
+        w_vec_dict_list = []
+
+        for reverse_order in [False, True]:
+
+          ds_list = []
+          for ds_num in [1, 2]:
+            ds = dataset.DataSetCSV(description='Test CSV data set',
+                                    access_mode='read',
+                                    rec_ident='rec_id',
+                                    header_line=True,
+                                    file_name='./test-data.csv')
+            if (reverse_order == True):  # Intern in reverse order
+              for rec_ident in reversed(self.rec_ident1):
+                ds.intern_rec_ident(rec_ident)
+            ds_list.append(ds)
+
+          ds1 = ds_list[0]
+          if (do_dedup == True):
+            ds2 = ds1
+          else:
+            ds2 = ds_list[1]
+
+          rec_comp = comparison.RecordComparator(ds1, ds2,
+                                   self.rec_comp_link.field_comparator_list)
+
+          test_index = index_class(description = 'Test intern order index',
+                                   dataset1 = ds1,
+                                   dataset2 = ds2,
+                                   rec_comparator = rec_comp,
+                                   index_def = [index_def1, index_def2],
+                                   **index_kwargs)
+          test_index.build()
+          test_index.compact()
+
+          w_vec_dict_list.append(test_index.run()[1])
+
+        assert len(w_vec_dict_list[0]) > 0
+        assert w_vec_dict_list[0] == w_vec_dict_list[1]
+
+  # ---------------------------------------------------------------------------
+
   def testSortingIndexLinkage(self):  # - - - - - - - - - - - - - - - - - - - -
     """Test SortingIndex linkage"""
 
@@ -1794,6 +2932,66 @@ class TestCase(unittest.TestCase):
 
   # ---------------------------------------------------------------------------
 
+  def testSortingIndexStreaming(self):  # - - - - - - - - - - - - - - - - - - -
+    """Test streaming SortingIndex and SortingArrayIndex"""
+
+    index_def1 = [['surname','surname',False,False,None,[]]]
+    index_def2 = [['given_name','given_name',True,True,4,[]],
+                  ['postcode','postcode',True,False,2,[]]]
+
+    for (dataset2, rec_comp) in [(self.dataset1, self.rec_comp_dedupl),
+                                 (self.dataset2, self.rec_comp_link)]:
+
+      for index_class in [indexing.SortingIndex, indexing.SortingArrayIndex]:
+
+        for w in [2,3,5,20]:
+
+          rec_pair_sets = []
+          w_vec_dicts =   []
+
+          for streaming in [False, True]:
+
+            sort_index = index_class(description = 'Test sorting index',
+                                     dataset1 = self.dataset1,
+                                     dataset2 = dataset2,
+                                     rec_comparator = rec_comp,
+                                     progress=2,
+                                     window_s = w,
+                                     streaming = streaming,
+                                     run_size = 7,
+                                     index_def = [index_def1,index_def2])
+            sort_index.build()
+            sort_index.compact()
+
+            if (streaming == True):
+              assert sort_index.rec_pair_dict == None
+              assert len(sort_index.sorted_run_files) == 2
+              assert len(sort_index.sorted_run_files[0]) > 1
+
+            rec_pair_set = set()
+            num_rec_pairs = 0
+            for (rec_ident1, rec_ident2_list) in \
+                sort_index.__iter_rec_pair_rows__():
+              for rec_ident2 in rec_ident2_list:
+                if (dataset2 == self.dataset1):
+                  rec_pair_set.add((min(rec_ident1, rec_ident2),
+                                    max(rec_ident1, rec_ident2)))
+                else:
+                  rec_pair_set.add((rec_ident1, rec_ident2))
+                num_rec_pairs += 1
+
+            assert num_rec_pairs == sort_index.num_rec_pairs
+            rec_pair_sets.append(rec_pair_set)
+
+            [field_names_list, w_vec_dict] = sort_index.run()
+            w_vec_dicts.append(w_vec_dict)
+
+          assert rec_pair_sets[0] == rec_pair_sets[1], \
+                 (index_class, w, len(rec_pair_sets[0]), len(rec_pair_sets[1]))
+          assert w_vec_dicts[0] == w_vec_dicts[1]
+
+  # ---------------------------------------------------------------------------
+
   def testQGramIndexLinkage(self):  # - - - - - - - - - - - - - - - - - - - -
     """Test QGramIndex linkage"""
 
@@ -2514,6 +3712,145 @@ class TestCase(unittest.TestCase):
 
       prev_w_vec_dict = this_w_vec_dict
 
+  def testCanopyIndexSparseEngine(self):  # - - - - - - - - - - - - - - - - - -
+    """Test CanopyIndex with the sparse matrix engine"""
+
+    index_def1 = [['surname','surname',False,False,None,[]]]
+    index_def2 = [['given_name','given_name',True,False,4,[]],
+                  ['postcode','postcode',True,True,2,[]]]
+
+    for (ds2, rec_comp) in [(self.dataset2, self.rec_comp_link),
+                            (self.dataset1, self.rec_comp_dedupl)]:
+
+      for canopy_method in [('tfidf', 'threshold', 0.9, 0.7),
+                            ('tfidf', 'threshold', 0.7, 0.5),
+                            ('tfidf', 'nearest', 1, 3),
+                            ('tfidf', 'nearest', 2, 5),
+                            ('jaccard', 'threshold', 0.9, 0.5),
+                            ('jaccard', 'threshold', 0.7, 0.4),
+                            ('jaccard', 'nearest', 1, 3),
+                            ('jaccard', 'nearest', 4, 6)]:
+
+        w_vec_dict_list = []
+
+        for canopy_engine in ['dict', 'sparse']:
+
+          canopy_index = indexing.CanopyIndex(description = 'Test canopy',
+                                              dataset1 = self.dataset1,
+                                              dataset2 = ds2,
+                                              rec_compar = rec_comp,
+                                              progress=2,
+                                              canopy_me = canopy_method,
+                                              canopy_engine = canopy_engine,
+                                              delete_perc = 80,
+                                              index_def = [index_def1,
+                                                           index_def2])
+          assert canopy_index.canopy_engine == canopy_engine
+
+          canopy_index.build()
+
+          if (canopy_engine == 'sparse'):
+            assert len(canopy_index.qgram_matrix) == 2
+            assert canopy_index.index1[0] == {}
+
+          canopy_index.compact()
+
+          assert canopy_index.num_rec_pairs > 0
+          assert canopy_index.qgram_matrix == {}
+
+          [field_names_list, weight_vec_dict] = canopy_index.run()
+
+          assert len(weight_vec_dict) == canopy_index.num_rec_pairs
+
+          w_vec_dict_list.append(weight_vec_dict)
+
+        # Both engines must produce the same canopies and record pairs
+        #
+        assert w_vec_dict_list[0] == w_vec_dict_list[1], canopy_method
+
+    self.assertRaises(Exception, indexing.CanopyIndex,
+                      description = 'Test canopy', dataset1 = self.dataset1,
+                      dataset2 = self.dataset2, rec_compar = self.rec_comp_link,
+                      canopy_me = ('tfidf', 'threshold', 0.9, 0.7),
+                      canopy_engine = 'csr', index_def = [index_def1])
+
+  # ---------------------------------------------------------------------------
+
+  def testLSHIndex(self):  # - - - - - - - - - - - - - - - - - - - - - - - - - -
+    """Test LSHIndex linkage and deduplication"""
+
+    index_def1 = [['surname','surname',False,False,None,[]]]
+    index_def2 = [['given_name','given_name',True,False,4,[]],
+                  ['postcode','postcode',True,True,2,[]]]
+
+    for (ds2, rec_comp) in [(self.dataset2, self.rec_comp_link),
+                            (self.dataset1, self.rec_comp_dedupl)]:
+
+      # Records with the same index values must always become candidate pairs
+      #
+      block_index = indexing.BlockingIndex(description = 'Test blocking',
+                                           dataset1 = self.dataset1,
+                                           dataset2 = ds2,
+                                           rec_comparator = rec_comp,
+                                           index_def = [index_def1,index_def2])
+      block_index.build()
+      block_index.compact()
+      [field_names_list, block_w_vec_dict] = block_index.run()
+
+      prev_num_rec_pairs = None
+
+      for (num_bands, num_rows) in [(1,8), (5,4), (20,2)]:
+
+        lsh_index = indexing.LSHIndex(description = 'Test LSH index',
+                                      dataset1 = self.dataset1,
+                                      dataset2 = ds2,
+                                      rec_comparator = rec_comp,
+                                      progress=2,
+                                      q = 2,
+                                      num_bands = num_bands,
+                                      num_rows = num_rows,
+                                      index_def = [index_def1,index_def2])
+
+        assert lsh_index.num_bands == num_bands
+        assert lsh_index.num_rows == num_rows
+        assert len(lsh_index.minhash_param_list) == num_bands*num_rows
+        assert lsh_index.status == 'initialised'
+
+        lsh_index.build()
+        assert lsh_index.status == 'built'
+
+        lsh_index.compact()
+        assert lsh_index.status == 'compacted'
+        assert lsh_index.band_index1[0] == {}
+
+        [field_names_list, lsh_w_vec_dict] = lsh_index.run()
+
+        assert len(lsh_w_vec_dict) == lsh_index.num_rec_pairs
+
+        for (rec_ident1, rec_ident2) in block_w_vec_dict:
+          assert ((rec_ident1, rec_ident2) in lsh_w_vec_dict) or \
+                 ((rec_ident2, rec_ident1) in lsh_w_vec_dict)
+
+        # Lower similarity thresholds result in more record pairs
+        #
+        if (prev_num_rec_pairs != None):
+          assert lsh_index.num_rec_pairs >= prev_num_rec_pairs
+        prev_num_rec_pairs = lsh_index.num_rec_pairs
+
+    assert lsh_index.get_estimated_pairs_completeness(1.0) == 1.0
+    assert lsh_index.get_estimated_pairs_completeness(0.0) == 0.0
+    assert lsh_index.get_estimated_pairs_completeness(0.8) > \
+           lsh_index.get_estimated_pairs_completeness(0.4)
+    assert abs(lsh_index.get_similarity_threshold() - (1/20.0)**0.5) < 0.0001
+
+    self.assertRaises(Exception, indexing.LSHIndex,
+                      description = 'Test LSH index', dataset1 = self.dataset1,
+                      dataset2 = self.dataset2,
+                      rec_comparator = self.rec_comp_link, num_bands = 0,
+                      index_def = [index_def1])
+
+  # ---------------------------------------------------------------------------
+
   def testCanopyIndexDedupl(self):  # - - - - - - - - - - - - - - - - - - - - -
     """Test CanopyIndex deduplication"""
 
@@ -3318,6 +4655,104 @@ class TestCase(unittest.TestCase):
 
   # ---------------------------------------------------------------------------
 
+  def testStringMapIndexVPTree(self):  # - - - - - - - - - - - - - - - - - - -
+    """Test StringMapIndex with the VP-tree engine"""
+
+    index_def1 = [['surname','surname',False,False,None,[]]]
+    index_def2 = [['given_name','given_name',True,False,4,[]],
+                  ['postcode','postcode',True,True,2,[]]]
+
+    def ed_sim(str1, str2):  # Edit distance based similarity that is a metric
+      prev_row = range(len(str2)+1)
+      for i in range(len(str1)):
+        curr_row = [i+1]
+        for j in range(len(str2)):
+          curr_row.append(min(prev_row[j+1]+1, curr_row[j]+1,
+                              prev_row[j]+(str1[i] != str2[j])))
+        prev_row = curr_row
+      return 1.0 - prev_row[-1] / 50.0
+
+    for (ds2, rec_comp) in [(self.dataset2, self.rec_comp_link),
+                            (self.dataset1, self.rec_comp_dedupl)]:
+
+      # With thresholds of 1.0 canopies contain records with the same values
+      #
+      block_index = indexing.BlockingIndex(description = 'Test blocking',
+                                           dataset1 = self.dataset1,
+                                           dataset2 = ds2,
+                                           rec_comparator = rec_comp,
+                                           index_def = [index_def1,index_def2])
+      block_index.build()
+      block_index.compact()
+      [field_names_list, block_w_vec_dict] = block_index.run()
+
+      strmap_index = indexing.StringMapIndex(descri = 'Test str-map index',
+                                             dataset1 = self.dataset1,
+                                             dataset2 = ds2,
+                                             rec_comp = rec_comp,
+                                             canopy_me = ('threshold',1.0,1.0),
+                                             canopy_eng = 'vptree',
+                                             sim_funct = ed_sim,
+                                             index_def = [index_def1,
+                                                          index_def2])
+      assert strmap_index.canopy_engine == 'vptree'
+
+      strmap_index.build()
+      strmap_index.compact()
+
+      [field_names_list, vp_w_vec_dict] = strmap_index.run()
+
+      for (rec_ident1, rec_ident2) in block_w_vec_dict:
+        assert ((rec_ident1, rec_ident2) in vp_w_vec_dict) or \
+               ((rec_ident2, rec_ident1) in vp_w_vec_dict)
+      assert len(vp_w_vec_dict) == len(block_w_vec_dict)
+
+      assert sorted(strmap_index.dist_calc_stats.keys()) == [0,1]
+      for dist_stats in strmap_index.dist_calc_stats.itervalues():
+        assert dist_stats['num_saved'] == dist_stats['num_brute_force'] - \
+                                          dist_stats['num_dist_calc']
+
+      for canopy_method in [('threshold', 0.9, 0.8), ('nearest', 2, 4)]:
+        strmap_index = indexing.StringMapIndex(descri = 'Test str-map index',
+                                               dataset1 = self.dataset1,
+                                               dataset2 = ds2,
+                                               rec_comp = rec_comp,
+                                               canopy_me = canopy_method,
+                                               canopy_eng = 'vptree',
+                                               sim_funct = ed_sim,
+                                               dist_cache_size = 10,
+                                               index_def = [index_def1,
+                                                            index_def2])
+        strmap_index.build()
+        strmap_index.compact()
+        assert strmap_index.num_rec_pairs >= len(block_w_vec_dict)
+
+    # Nearest neighbour search must return all strings in increasing distance
+    #
+    string_list = ['peter', 'pete', 'petra', 'paul', 'christen', 'christine',
+                   'chris', 'miller', 'muller', 'mueller', 'smith', 'smyth']
+    dist_cache = {}
+    dist_stats = [0,0,0]
+
+    vp_tree = strmap_index.__build_vp_tree__(string_list, dist_cache,
+                                             dist_stats)
+    for query_ind in range(len(string_list)):
+      nearest_list = list(strmap_index.__iter_vp_tree_nearest__(string_list,
+                            vp_tree, dist_cache, dist_stats, query_ind))
+      assert [dist for (dist, j) in nearest_list] == \
+             sorted([1.0-ed_sim(string_list[query_ind], str_val) \
+                     for str_val in string_list])
+      assert sorted([j for (dist, j) in nearest_list]) == \
+             range(len(string_list))
+
+    self.assertRaises(Exception, indexing.StringMapIndex,
+                      descri = 'Test str-map index', dataset1 = self.dataset1,
+                      dataset2 = self.dataset2, rec_comp = self.rec_comp_link,
+                      canopy_me = ('threshold',1.0,1.0), canopy_eng = 'rtree',
+                      sim_funct = ed_sim, index_def = [index_def1])
+
+  # ---------------------------------------------------------------------------
+
   def testBigMatchIndexLinkage(self):  # - - - - - - - - - - - - - - - - - - -
     """Test BigMatchIndex linkage"""
 
@@ -4776,6 +6211,99 @@ class TestCase(unittest.TestCase):
 
       prev_w_vec_dict = this_w_vec_dict
 
+  # ---------------------------------------------------------------------------
+
+  def testSuffixArray(self):  # - - - - - - - - - - - - - - - - - - - - - - - -
+    """Test SuffixArray class and the suffix array indices built upon it"""
+
+    value_list = ['', 'a', 'peter', 'pete', 'eter', 'petra', 'ter', 'tatata',
+                  'bbbbbbbb', 'abba', 'aab', 'peterpeter']
+
+    sarray = indexing.SuffixArray(value_list)
+
+    assert sarray.num_values == len(value_list)
+    assert len(sarray.sa) == len(sarray.text)
+    assert len(sarray.lcp) == len(sarray.text)
+
+    for val_num in range(len(value_list)):
+      assert sarray.get_value(val_num) == value_list[val_num]
+
+    # Suffixes must be sorted as strings (up to the end of their value), with
+    # the correct longest common prefix with the previous suffix
+    #
+    prev_suffix = None
+    for r in range(len(sarray.sa)):
+      this_suffix = sarray.get_suffix(sarray.sa[r])
+
+      if (prev_suffix != None):
+        assert prev_suffix <= this_suffix
+
+        lcp = 0
+        while ((lcp < min(len(prev_suffix), len(this_suffix))) and \
+               (prev_suffix[lcp] == this_suffix[lcp])):
+          lcp += 1
+        assert sarray.lcp[r] == lcp, (r, prev_suffix, this_suffix)
+
+      prev_suffix = this_suffix
+
+    # Groups must contain all values that have a suffix of at least the
+    # minimum length (or are shorter) in common
+    #
+    for min_len in [1, 2, 3, 5]:
+      suffix_dict = {}
+      for val_num in range(len(value_list)):
+        val = value_list[val_num]
+        suffix_set = set([val])
+        for s in range(len(val)-min_len+1):
+          suffix_set.add(val[s:])
+        for suffix in suffix_set:
+          suffix_val_list = suffix_dict.get(suffix, [])
+          suffix_val_list.append(val_num)
+          suffix_dict[suffix] = suffix_val_list
+
+      group_dict = {}
+      prev_suffix = None
+      for (pos, val_num_list) in sarray.iter_suffix_groups(min_len):
+        suffix = sarray.get_suffix(pos)
+        assert suffix not in group_dict
+        assert (prev_suffix == None) or (prev_suffix < suffix)
+        group_dict[suffix] = sorted(val_num_list)
+        prev_suffix = suffix
+
+      assert group_dict == suffix_dict
+
+    # All record pairs from true suffixes must also be in the pairs from all
+    # sub-strings
+    #
+    index_def1 = [['surname','surname',False,False,None,[]]]
+
+    for (min_suffix_len, max_block_size) in [(2,5), (3,10), (4,100)]:
+      rec_pair_dict_list = []
+
+      for suff_method in ['suffixonly', 'allsubstr']:
+        sarray_index = indexing.SuffixArrayIndex(desc='Test suff-arr index',
+                                                 dataset1 = self.dataset1,
+                                                 dataset2 = self.dataset1,
+                                                 rec_compar = \
+                                                   self.rec_comp_dedupl,
+                                                 progress=4,
+                                                 suffix_m = suff_method,
+                                                 block_method =(min_suffix_len,
+                                                               max_block_size),
+                                                 index_def = [index_def1])
+        sarray_index.build()
+        assert sarray_index.status == 'built'
+        assert len(sarray_index.suffix_array) == 1
+
+        sarray_index.compact()
+        assert sarray_index.status == 'compacted'
+        assert sarray_index.suffix_array == {}
+
+        rec_pair_dict_list.append(sarray_index.rec_pair_dict)
+
+      for (rec_ident1, rec_ident2_set) in rec_pair_dict_list[0].iteritems():
+        assert rec_ident2_set.issubset(rec_pair_dict_list[1][rec_ident1])
+
 
 # =============================================================================
 # Start tests when called from command line
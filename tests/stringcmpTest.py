@@ -174,6 +174,45 @@ class TestCase(unittest.TestCase):
              '"Winkler" value smaller than "Jaro" value for:'+str(pair)
 
 
+  def testJaroAssign(self):  # - - - - - - - - - - - - - - - - - - - - - - - -
+    """Test common characters found with character positions give the same
+       Jaro values as 'Jaro'"""
+
+    for pair in self.string_pairs:
+
+      (ass1, ass2, flag1, flag2) = stringcmp.jaro_assign(pair[0],pair[1])
+
+      assert (len(ass1) == len(ass2) == sum(flag1) == sum(flag2)), \
+             '"jaro_assign" returns different numbers of common ' + \
+             'characters for: '+str(pair)
+
+      pos1 = stringcmp.jaro_positions(pair[0])
+      pos2 = stringcmp.jaro_positions(pair[1])
+
+      assert (stringcmp.jaro_assign(pair[0],pair[1],pos1,pos2) == \
+              (ass1, ass2, flag1, flag2)), \
+             '"jaro_assign" returns different values with positions for: '+ \
+             str(pair)
+
+      max_common = stringcmp.jaro_max_common(pos1, pos2)
+
+      assert (len(ass1) <= max_common <= min(len(pair[0]),len(pair[1]))), \
+             '"jaro_max_common" returns a wrong bound for: '+str(pair)
+
+      if (pair[0] != '') and (pair[1] != '') and (pair[0] != pair[1]):
+
+        if (ass1 == []):
+          jaro_value = 0.0
+        else:
+          common = float(len(ass1))
+          transp = len([i for i in range(len(ass1)) if ass1[i] != ass2[i]])
+          jaro_value = 1./3.*(common / float(len(pair[0])) + common / \
+                       float(len(pair[1])) + (common-transp/2.0) / common)
+
+        assert (jaro_value == stringcmp.jaro(pair[0],pair[1])), \
+               '"jaro_assign" gives Jaro value %f instead of %f for: ' % \
+               (jaro_value, stringcmp.jaro(pair[0],pair[1]))+str(pair)
+
   def testBigram(self):   # - - - - - - - - - - - - - - - - - - - - - - - - - -
     """Test 'Bigram' approximate string comparator"""
 
@@ -280,6 +319,38 @@ class TestCase(unittest.TestCase):
                str(pair)
 
 
+  def testBitParEditDist(self):   # - - - - - - - - - - - - - - - - - - - - -
+    """Test bit-parallel edit distance kernels give the same values as the
+       dynamic programming code"""
+
+    bitpar_max_len = stringcmp.BITPAR_MAX_LEN
+
+    for pair in self.string_pairs + [['christensen', 'kristensen'],
+                                     ['sydney', 'sydeny'],
+                                     ['ab'*40, 'ba'*40],
+                                     ['a'*64, 'a'*63+'b']]:
+      for min_threshold in [None, 0.3, 0.5, 0.75, 0.9]:
+        for funct in [stringcmp.editdist, stringcmp.mod_editdist]:
+
+          stringcmp.BITPAR_MAX_LEN = -1  # Force dynamic programming
+          dp_value = funct(pair[0], pair[1], min_threshold)
+
+          stringcmp.BITPAR_MAX_LEN = 1000  # Force bit-parallel kernel
+          bp_value = funct(pair[0], pair[1], min_threshold)
+
+          stringcmp.BITPAR_MAX_LEN = bitpar_max_len
+
+          assert (dp_value == bp_value), \
+                 '"%s" bit-parallel value %f differs from dynamic ' % \
+                 (funct.__name__, bp_value) + 'programming value %f for: ' % \
+                 (dp_value) + str(pair) + ' (threshold: %s)' % \
+                 (str(min_threshold))
+
+    assert (stringcmp.bitpar_editdist('sydney', 'sydeny') == 2)
+    assert (stringcmp.bitpar_editdist('sydney', 'sydeny', None, True) == 1)
+    assert (stringcmp.bitpar_editdist('', 'peter') == 5)
+    assert (stringcmp.bitpar_editdist('peter', 'xanthalope', 2) == -1)
+
   def testSeqMatch(self):   # - - - - - - - - - - - - - - - - - - - - - - - - -
     """Test 'SeqMatch' approximate string comparator"""
 